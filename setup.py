@@ -401,7 +401,8 @@ ext_modules = [
                       get_build_include('libmseed')],
         extra_compile_args=extra_compile_args + (
             ['-D_CRT_SECURE_NO_WARNINGS', '-DWIN32'] if
-            is_windows else ['-fno-strict-aliasing']),
+            is_windows else ['-fno-strict-aliasing']) + omp_arg,
+        extra_link_args=[] + omp_lib,
         sources=[
             op.join('src', 'io', 'ext', 'mseed_ext.c')] + libmseed_sources),
 
@@ -441,6 +442,13 @@ ext_modules = [
         extra_link_args=[] + omp_lib,
         sources=[op.join('src', 'ext', 'parstack_ext.c')]),
 
+    Extension(
+        'spit_ext',
+        include_dirs=[get_numpy_include()],
+        extra_compile_args=extra_compile_args + omp_arg,
+        extra_link_args=[] + omp_lib,
+        sources=[op.join('src', 'ext', 'spit_ext.c')]),
+
     Extension(
         'autopick_ext',
         include_dirs=[get_numpy_include()],
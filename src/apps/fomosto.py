@@ -33,6 +33,7 @@ subcommand_descriptions = {
     'stats':         'print information about a GF store',
     'check':         'check for problems in GF store',
     'decimate':      'build decimated variant of a GF store',
+    'compress':      'convert GF store to compressed format',
     'redeploy':      'copy traces from one GF store into another',
     'view':          'view selected traces',
     'extract':       'extract selected traces',
@@ -62,6 +63,7 @@ subcommand_usages = {
     'stats':         'stats [store-dir] [options]',
     'check':         'check [store-dir] [options]',
     'decimate':      'decimate [store-dir] <factor> [options]',
+    'compress':      'compress [store-dir] <destination> [options]',
     'redeploy':      'redeploy <source> <destination> [options]',
     'view':          'view [store-dir] ... [options]',
     'extract':       'extract [store-dir] <selection>',
@@ -97,6 +99,7 @@ Subcommands:
     stats         %(stats)s
     check         %(check)s
     decimate      %(decimate)s
+    compress      %(compress)s
     redeploy      %(redeploy)s
     view          %(view)s
     extract       %(extract)s
@@ -320,6 +323,22 @@ def command_build(args):
             '--block', dest='iblock', type='int', metavar='I',
             help='process block number IBLOCK')
 
+        parser.add_option(
+            '--queue', dest='queue', action='store_true',
+            help='distribute the build through a queue in the store '
+                 'directory. Run this command on several hosts sharing the '
+                 'file system to build in parallel. Joins an existing queue.')
+
+        parser.add_option(
+            '--lease-timeout', dest='lease_timeout', type='float',
+            metavar='SECONDS', default=300.,
+            help='with --queue: hand blocks of workers not reporting for '
+                 'SECONDS to other workers (default: %default)')
+
+        parser.add_option(
+            '--queue-status', dest='queue_status', action='store_true',
+            help='show progress of a queued build and exit')
+
     parser, options, args = cl_parse('build', args, setup=setup)
 
     store_dir = get_store_dir(args)
@@ -334,6 +353,23 @@ def command_build(args):
         else:
             iblock = None
 
+        if options.queue or options.queue_status:
+            queue = gf.BuildQueue(
+                store_dir, lease_timeout=options.lease_timeout)
+        else:
+            queue = None
+
+        if options.queue_status:
+            if not queue.exists():
+                die('no build queue in %s' % store_dir)
+
+            print(queue)
+            return
+
+        kwargs = {}
+        if queue is not None:
+            kwargs['queue'] = queue
+
         store = gf.Store(store_dir)
         module, _ = fomo_wrapper_module(store.config.modelling_code_id)
         module.build(
@@ -341,7 +377,8 @@ def command_build(args):
             force=options.force,
             nworkers=options.nworkers, continue_=options.continue_,
             step=step,
-            iblock=iblock)
+            iblock=iblock,
+            **kwargs)
 
     except gf.StoreError as e:
         die(e)
@@ -421,6 +458,61 @@ def command_decimate(args):
         die(e)
 
 
+def command_compress(args):
+
+    def setup(parser):
+        parser.add_option(
+            '--lossy', dest='lossy', action='store_true',
+            help='quantize samples instead of storing them bit-exactly')
+
+        parser.add_option(
+            '--max-error', dest='max_error', type=float, metavar='FLOAT',
+            help='maximum quantization error for lossy compression, relative '
+                 'to the peak amplitude of each GF trace (default: %g)'
+                 % gf.store.gf_compression_max_error_default)
+
+        parser.add_option(
+            '--decompress', dest='decompress', action='store_true',
+            help='convert to uncompressed format')
+
+        parser.add_option(
+            '--force', dest='force', action='store_true',
+            help='overwrite existing files')
+
+    parser, options, args = cl_parse('compress', args, setup=setup)
+    try:
+        dest_store_dir = args.pop()
+    except Exception:
+        parser.error('cannot get <destination> argument')
+
+    if options.lossy and options.decompress:
+        parser.error('--lossy and --decompress are mutually exclusive')
+
+    if options.max_error is not None and not options.lossy:
+        parser.error('--max-error can only be used with --lossy')
+
+    store_dir = get_store_dir(args)
+
+    if options.decompress:
+        compression = None
+    elif options.lossy:
+        compression = 'lossy'
+    else:
+        compression = 'lossless'
+
+    try:
+        store = gf.Store(store_dir)
+        store.make_compressed(
+            dest_store_dir,
+            compression=compression,
+            max_error=options.max_error,
+            force=options.force,
+            show_progress=True)
+
+    except gf.StoreError as e:
+        die(e)
+
+
 def sindex(args):
     return '(%s)' % ', '.join('%g' % x for x in args)
 
@@ -969,12 +1061,18 @@ def command_ttt(args):
             '--force', dest='force', action='store_true',
             help='overwrite existing files')
 
+        parser.add_option(
+            '--nworkers', dest='nworkers', type='int', metavar='N',
+            help='run N worker processes in parallel (default: number of '
+                 'CPUs)')
+
     parser, options, args = cl_parse('ttt', args, setup=setup)
 
     store_dir = get_store_dir(args)
     try:
         store = gf.Store(store_dir)
-        store.make_travel_time_tables(force=options.force)
+        store.make_travel_time_tables(
+            force=options.force, nprocs=options.nworkers)
 
     except gf.StoreError as e:
         die(e)
@@ -1009,6 +1107,11 @@ def command_sat(args):
             '--force', dest='force', action='store_true',
             help='overwrite existing files')
 
+        parser.add_option(
+            '--nworkers', dest='nworkers', type='int', metavar='N',
+            help='run N worker processes in parallel (default: number of '
+                 'CPUs)')
+
         parser.add_option(
             '--attribute',
             action='store',
@@ -1023,7 +1126,9 @@ def command_sat(args):
     store_dir = get_store_dir(args)
     try:
         store = gf.Store(store_dir)
-        store.make_stored_table(options.attribute, force=options.force)
+        store.make_stored_table(
+            options.attribute, force=options.force,
+            nprocs=options.nworkers)
 
     except gf.StoreError as e:
         die(e)
@@ -1174,10 +1279,24 @@ def command_server(args):
             '--ip', dest='ip', metavar='IP', default='',
             help='serve on ip address IP')
 
+        parser.add_option(
+            '--nworkers', dest='nworkers', type='int', metavar='N',
+            help='process up to N seismosizer requests in parallel '
+                 '(default: number of CPUs)')
+
+        parser.add_option(
+            '--max-queued', dest='max_queued', type='int', metavar='N',
+            default=16,
+            help='reject seismosizer requests when more than N are waiting '
+                 'for a free worker (default: %default)')
+
     parser, options, args = cl_parse('server', args, setup=setup)
 
     engine = gf.LocalEngine(store_superdirs=args)
-    server.run(options.ip, options.port, engine)
+    server.run(
+        options.ip, options.port, engine,
+        nworkers=options.nworkers,
+        max_queued=options.max_queued)
 
 
 def command_download(args):
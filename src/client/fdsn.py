@@ -216,12 +216,24 @@ class Timeout(DownloadError):
     pass
 
 
+class ServerUnavailable(DownloadError):
+    '''
+    Raised when the server cannot be reached or is temporarily unable to
+    handle the request (HTTP status 429, 500, 502, 503 or 504).
+    '''
+    pass
+
+
+g_http_codes_unavailable = {429, 500, 502, 503, 504}
+
+
 def _request(
         url,
         post=False,
         user=None,
         passwd=None,
         timeout=None,
+        session=None,
         **kwargs):
 
     if timeout is None:
@@ -232,6 +244,9 @@ def _request(
         url += '?' + url_values
 
     logger.debug('Accessing URL %s' % url)
+
+    if session is not None:
+        return _request_session(session, url, post, user, passwd, timeout)
     url_args = {
         'timeout': timeout
     }
@@ -293,6 +308,11 @@ def _request(
                         'url "%s". Original error was: %s' % (
                             realm, url, str(e)))
 
+            elif e.code in g_http_codes_unavailable:
+                raise ServerUnavailable(
+                    'Server temporarily unavailable when accessing url "%s". '
+                    'Original error was: %s' % (url, str(e)))
+
             else:
                 raise DownloadError(
                     'Error content returned by server (HTML stripped):\n%s\n'
@@ -313,6 +333,74 @@ def _request(
         break
 
 
+def _request_session(session, url, post, user, passwd, timeout):
+    # Same as _request but using a requests.Session, so that connections are
+    # kept alive and reused for subsequent requests to the same server.
+
+    import requests
+    from requests.auth import HTTPDigestAuth
+
+    kwargs = dict(timeout=timeout, stream=True, headers={'Accept': '*/*'})
+
+    if user is not None:
+        kwargs['auth'] = HTTPDigestAuth(user, passwd or '')
+
+    try:
+        if post:
+            if isinstance(post, str):
+                post = post.encode('utf8')
+            logger.debug('POST data: \n%s' % post.decode('utf8'))
+            resp = session.post(url, data=post, **kwargs)
+        else:
+            resp = session.get(url, **kwargs)
+
+    except requests.exceptions.Timeout:
+        raise Timeout(
+            'Timeout error. No response received within %i s. You '
+            'may want to retry with a longer timeout setting. The global '
+            'timeout can be set with the variable `fdsn_timeout` in '
+            '`~/.pyrocko/config.pf`, but this value may be overriden by '
+            'the script/application for a specific request.' % timeout)
+
+    except requests.exceptions.ConnectionError as e:
+        raise ServerUnavailable(
+            'Cannot connect to server when accessing url "%s". Original '
+            'error was: %s' % (url, str(e)))
+
+    logger.debug('Response: %s' % resp.status_code)
+
+    if resp.status_code == 204:
+        resp.close()
+        raise EmptyResult(url)
+
+    elif resp.status_code == 413:
+        resp.close()
+        raise RequestEntityTooLarge(url)
+
+    elif resp.status_code == 401:
+        resp.close()
+        raise DownloadError(
+            'Authentication failed when accessing url "%s".' % url)
+
+    elif resp.status_code in g_http_codes_unavailable:
+        resp.close()
+        raise ServerUnavailable(
+            'Server temporarily unavailable when accessing url "%s". '
+            'HTTP status: %i' % (url, resp.status_code))
+
+    elif resp.status_code >= 400:
+        raise DownloadError(
+            'Error content returned by server (HTML stripped):\n%s\n'
+            '  Original error was: HTTP Error %i: %s' % (
+                indent(
+                    strip_html(resp.content),
+                    '  !  '),
+                resp.status_code, resp.reason))
+
+    resp.raw.decode_content = True
+    return resp.raw
+
+
 def fillurl(service, site, url, majorversion, method):
     return url % dict(
         site=g_site_abbr.get(site, site),
@@ -493,6 +581,7 @@ def dataselect(
         passwd=None,
         token=None,
         selection=None,
+        session=None,
         **kwargs):
 
     '''
@@ -528,6 +617,10 @@ def dataselect(
         If given, selection to be queried as a list of tuples
         ``(network, station, location, channel, tmin, tmax)``.
     :type selection: :py:class:`list` of :py:class:`tuple`
+    :param session:
+        If given, the request is made through this session, reusing its open
+        connections to the server (HTTP keep-alive).
+    :type session: :py:class:`requests.Session`
     :param \\*\\*kwargs:
         Parameters passed to the server (see `FDSN web services specification
         <https://www.fdsn.org/webservices>`_).
@@ -568,10 +661,12 @@ def dataselect(
 
         post = '\n'.join(lst)
         return _request(
-            url, user=user, passwd=passwd, post=post.encode(), timeout=timeout)
+            url, user=user, passwd=passwd, post=post.encode(), timeout=timeout,
+            session=session)
     else:
         return _request(
-            url, user=user, passwd=passwd, timeout=timeout, **params)
+            url, user=user, passwd=passwd, timeout=timeout, session=session,
+            **params)
 
 
 def event(
@@ -14,7 +14,7 @@ import logging
 
 from . import util
 from .guts import Object, Float, String, load, dump, List, Dict, TBase, \
-    Tuple, StringChoice, Bool
+    Tuple, StringChoice, Bool, Int
 
 
 logger = logging.getLogger('pyrocko.config')
@@ -124,6 +124,7 @@ class PyrockoConfig(ConfigBase):
         choices=['auto', 'qt4', 'qt5'],
         default='auto')
     use_high_precision_time = Bool.T(default=False)
+    mseed_decode_nthreads = Int.T(default=1)
 
 
 config_cls = {
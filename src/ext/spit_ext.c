@@ -0,0 +1,474 @@
+#define NPY_NO_DEPRECATED_API 7
+
+#include "Python.h"
+#include "numpy/arrayobject.h"
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#ifdef _WIN32
+    typedef SSIZE_T ssize_t;
+#endif
+#include <math.h>
+
+#if defined(_OPENMP)
+    # include <omp.h>
+#endif
+
+#define SPIT_NDIM_MAX 16
+
+struct module_state {
+    PyObject *error;
+};
+
+#define GETSTATE(m) ((struct module_state*)PyModule_GetState(m))
+
+typedef npy_float64 float64_t;
+
+typedef enum {
+    SUCCESS = 0,
+    INVALID_TREE,
+} spit_error_t;
+
+const char* spit_error_names[] = {
+    "SUCCESS",
+    "INVALID_TREE",
+};
+
+/*
+ * Flattened SPTree:
+ *
+ *   xmin, xmax     [ncells, ndim]     cell bounds
+ *   f              [ncells, 2**ndim]  function values at the cell corners,
+ *                                     in C order of a [2]*ndim array
+ *   child_offsets  [ncells+1]         children of cell i are
+ *   child_indices  [nchildren]          child_indices[child_offsets[i]:
+ *                                                     child_offsets[i+1]]
+ *
+ * Cell 0 is the root cell.
+ */
+
+static int contains(
+        const float64_t *xmin,
+        const float64_t *xmax,
+        const float64_t *x,
+        size_t ndim) {
+
+    size_t idim;
+    for (idim=0; idim<ndim; idim++) {
+        if (!(xmin[idim] <= x[idim] && x[idim] <= xmax[idim])) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static float64_t interpolate_cell(
+        const float64_t *xmin,
+        const float64_t *xmax,
+        const float64_t *f,
+        const float64_t *x,
+        size_t ndim) {
+
+    float64_t w[SPIT_NDIM_MAX][2];
+    float64_t width, wn, result;
+    size_t idim, icorner, ncorners;
+
+    ncorners = (size_t)1 << ndim;
+
+    for (icorner=0; icorner<ncorners; icorner++) {
+        if (!isfinite(f[icorner])) {
+            return NAN;
+        }
+    }
+
+    for (idim=0; idim<ndim; idim++) {
+        width = xmax[idim] - xmin[idim];
+        if (width == 0.0) {
+            w[idim][0] = (x[idim] - (xmax[idim] + 0.5)) / -1.0;
+            w[idim][1] = (x[idim] - (xmin[idim] - 0.5)) / 1.0;
+        } else {
+            w[idim][0] = (x[idim] - xmax[idim]) / -width;
+            w[idim][1] = (x[idim] - xmin[idim]) / width;
+        }
+    }
+
+    result = 0.0;
+    for (icorner=0; icorner<ncorners; icorner++) {
+        wn = 1.0;
+        for (idim=0; idim<ndim; idim++) {
+            wn *= w[idim][(icorner >> (ndim - 1 - idim)) & 1];
+        }
+        result += f[icorner] * wn;
+    }
+
+    return result;
+}
+
+static float64_t interpolate_point(
+        const float64_t *xmin,
+        const float64_t *xmax,
+        const float64_t *f,
+        const int64_t *child_offsets,
+        const int64_t *child_indices,
+        size_t ndim,
+        const float64_t *x) {
+
+    int64_t icell, ichild, ic;
+    size_t ncorners;
+
+    ncorners = (size_t)1 << ndim;
+
+    if (!contains(xmin, xmax, x, ndim)) {
+        return NAN;
+    }
+
+    icell = 0;
+    while (1) {
+        ichild = -1;
+        for (ic=child_offsets[icell]; ic<child_offsets[icell+1]; ic++) {
+            if (contains(
+                    xmin + child_indices[ic]*ndim,
+                    xmax + child_indices[ic]*ndim, x, ndim)) {
+
+                ichild = child_indices[ic];
+                break;
+            }
+        }
+
+        if (ichild == -1) {
+            break;
+        }
+
+        icell = ichild;
+    }
+
+    return interpolate_cell(
+        xmin + icell*ndim, xmax + icell*ndim, f + icell*ncorners, x, ndim);
+}
+
+static void interpolate_many(
+        const float64_t *xmin,
+        const float64_t *xmax,
+        const float64_t *f,
+        const int64_t *child_offsets,
+        const int64_t *child_indices,
+        size_t ndim,
+        const float64_t *x,
+        size_t npoints,
+        float64_t *result,
+        int nthreads) {
+
+    ssize_t ipoint;
+
+    (void) nthreads;
+
+#if defined(_OPENMP)
+    if (nthreads == 0)
+        nthreads = omp_get_num_procs();
+    else if (nthreads > omp_get_num_procs())
+        nthreads = omp_get_num_procs();
+
+    #pragma omp parallel for schedule(static) num_threads(nthreads)
+#endif
+    for (ipoint=0; ipoint<(ssize_t)npoints; ipoint++) {
+        result[ipoint] = interpolate_point(
+            xmin, xmax, f, child_offsets, child_indices, ndim,
+            x + ipoint*ndim);
+    }
+}
+
+static spit_error_t find_parents(
+        const int32_t *index,
+        size_t ncells,
+        size_t ndim,
+        int64_t *parents) {
+
+    /* Reconstruct tree structure from cells stored in depth-first order.
+     * The parent of a cell is the nearest cell on the current path, which
+     * has the cell's index shifted by one in at least one dimension. */
+
+    int64_t *path;
+    size_t npath, icell, idim;
+    int found;
+
+    if (ncells == 0) {
+        return SUCCESS;
+    }
+
+    path = (int64_t*)malloc(sizeof(int64_t) * ncells);
+    if (path == NULL) {
+        return INVALID_TREE;
+    }
+
+    parents[0] = -1;
+    path[0] = 0;
+    npath = 1;
+
+    for (icell=1; icell<ncells; icell++) {
+        while (npath > 0) {
+            found = 0;
+            for (idim=0; idim<ndim; idim++) {
+                if (index[path[npath-1]*ndim + idim] ==
+                        (index[icell*ndim + idim] >> 1)) {
+                    found = 1;
+                    break;
+                }
+            }
+            if (found) {
+                break;
+            }
+            npath--;
+        }
+
+        if (npath == 0) {
+            free(path);
+            return INVALID_TREE;
+        }
+
+        parents[icell] = path[npath-1];
+        path[npath++] = icell;
+    }
+
+    free(path);
+    return SUCCESS;
+}
+
+int good_array(
+        PyObject* o,
+        int typenum,
+        npy_intp size_want,
+        int ndim_want,
+        npy_intp* shape_want) {
+
+    int i;
+
+    if (!PyArray_Check(o)) {
+        PyErr_SetString(PyExc_AttributeError, "not a NumPy array");
+        return 0;
+    }
+
+    if (PyArray_TYPE((PyArrayObject*)o) != typenum) {
+        PyErr_SetString(PyExc_AttributeError, "array of unexpected type");
+        return 0;
+    }
+
+    if (!PyArray_ISCARRAY((PyArrayObject*)o)) {
+        PyErr_SetString(PyExc_AttributeError, "array is not contiguous or not well behaved");
+        return 0;
+    }
+
+    if (size_want != -1 && size_want != PyArray_SIZE((PyArrayObject*)o)) {
+        PyErr_SetString(PyExc_AttributeError, "array is of unexpected size");
+        return 0;
+    }
+
+    if (ndim_want != -1 && ndim_want != PyArray_NDIM((PyArrayObject*)o)) {
+        PyErr_SetString(PyExc_AttributeError, "array is of unexpected ndim");
+        return 0;
+    }
+
+    if (ndim_want != -1 && shape_want != NULL) {
+        for (i=0; i<ndim_want; i++) {
+            if (shape_want[i] != -1 && shape_want[i] != PyArray_DIMS((PyArrayObject*)o)[i]) {
+                PyErr_SetString(PyExc_AttributeError, "array is of unexpected shape");
+                return 0;
+            }
+        }
+    }
+    return 1;
+}
+
+static PyObject* w_interpolate_many(PyObject *m, PyObject *args) {
+    PyObject *xmin_arr, *xmax_arr, *f_arr, *child_offsets_arr;
+    PyObject *child_indices_arr, *x_arr;
+    PyArrayObject *result_arr;
+    npy_intp shape_want[2], size[1];
+    size_t ncells, ndim, npoints;
+    int nthreads;
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(
+            args, "OOOOOOi", &xmin_arr, &xmax_arr, &f_arr,
+            &child_offsets_arr, &child_indices_arr, &x_arr, &nthreads)) {
+
+        PyErr_SetString(
+            st->error,
+            "usage: interpolate_many(xmin, xmax, f, child_offsets, "
+            "child_indices, x, nthreads)");
+
+        return NULL;
+    }
+
+    shape_want[0] = -1;
+    shape_want[1] = -1;
+    if (!good_array(xmin_arr, NPY_FLOAT64, -1, 2, shape_want)) {
+        return NULL;
+    }
+
+    ncells = PyArray_DIMS((PyArrayObject*)xmin_arr)[0];
+    ndim = PyArray_DIMS((PyArrayObject*)xmin_arr)[1];
+
+    if (ncells < 1 || ndim < 1 || ndim > SPIT_NDIM_MAX) {
+        PyErr_SetString(st->error, "invalid number of cells or dimensions");
+        return NULL;
+    }
+
+    shape_want[0] = ncells;
+    shape_want[1] = ndim;
+    if (!good_array(xmax_arr, NPY_FLOAT64, -1, 2, shape_want)) {
+        return NULL;
+    }
+
+    shape_want[1] = (npy_intp)1 << ndim;
+    if (!good_array(f_arr, NPY_FLOAT64, -1, 2, shape_want)) {
+        return NULL;
+    }
+
+    if (!good_array(child_offsets_arr, NPY_INT64, ncells+1, 1, NULL)) {
+        return NULL;
+    }
+
+    if (!good_array(child_indices_arr, NPY_INT64, -1, 1, NULL)) {
+        return NULL;
+    }
+
+    shape_want[0] = -1;
+    shape_want[1] = ndim;
+    if (!good_array(x_arr, NPY_FLOAT64, -1, 2, shape_want)) {
+        return NULL;
+    }
+
+    npoints = PyArray_DIMS((PyArrayObject*)x_arr)[0];
+
+    size[0] = npoints;
+    result_arr = (PyArrayObject*)PyArray_EMPTY(1, size, NPY_FLOAT64, 0);
+    if (result_arr == NULL) {
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    interpolate_many(
+        PyArray_DATA((PyArrayObject*)xmin_arr),
+        PyArray_DATA((PyArrayObject*)xmax_arr),
+        PyArray_DATA((PyArrayObject*)f_arr),
+        PyArray_DATA((PyArrayObject*)child_offsets_arr),
+        PyArray_DATA((PyArrayObject*)child_indices_arr),
+        ndim,
+        PyArray_DATA((PyArrayObject*)x_arr),
+        npoints,
+        PyArray_DATA(result_arr),
+        nthreads);
+    Py_END_ALLOW_THREADS
+
+    return (PyObject*)result_arr;
+}
+
+static PyObject* w_find_parents(PyObject *m, PyObject *args) {
+    PyObject *index_arr;
+    PyArrayObject *parents_arr;
+    npy_intp shape_want[2], size[1];
+    size_t ncells, ndim;
+    spit_error_t err;
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(args, "O", &index_arr)) {
+        PyErr_SetString(st->error, "usage: find_parents(index)");
+        return NULL;
+    }
+
+    shape_want[0] = -1;
+    shape_want[1] = -1;
+    if (!good_array(index_arr, NPY_INT32, -1, 2, shape_want)) {
+        return NULL;
+    }
+
+    ncells = PyArray_DIMS((PyArrayObject*)index_arr)[0];
+    ndim = PyArray_DIMS((PyArrayObject*)index_arr)[1];
+
+    size[0] = ncells;
+    parents_arr = (PyArrayObject*)PyArray_EMPTY(1, size, NPY_INT64, 0);
+    if (parents_arr == NULL) {
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    err = find_parents(
+        PyArray_DATA((PyArrayObject*)index_arr), ncells, ndim,
+        PyArray_DATA(parents_arr));
+    Py_END_ALLOW_THREADS
+
+    if (err != SUCCESS) {
+        Py_DECREF(parents_arr);
+        PyErr_SetString(st->error, spit_error_names[err]);
+        return NULL;
+    }
+
+    return (PyObject*)parents_arr;
+}
+
+static PyMethodDef spit_ext_methods[] = {
+    {"interpolate_many", (PyCFunction) w_interpolate_many, METH_VARARGS,
+"Multi-linear interpolation in a flattened space partitioning tree.\n\n\
+:param xmin: Lower cell bounds, shape ``(ncells, ndim)``\n\
+:param xmax: Upper cell bounds, shape ``(ncells, ndim)``\n\
+:param f: Function values at cell corners, shape ``(ncells, 2**ndim)``\n\
+:param child_offsets: Offsets into ``child_indices``, shape ``(ncells+1,)``\n\
+:param child_indices: Indices of child cells\n\
+:param x: Points, shape ``(npoints, ndim)``\n\
+:param nthreads: Number of threads to use, 0 for all\n\
+:returns: Interpolated values, NaN outside of the defined region." },
+
+    {"find_parents", (PyCFunction) w_find_parents, METH_VARARGS,
+"Get parent cells of a space partitioning tree stored in depth-first order.\n\n\
+:param index: Cell indices, shape ``(ncells, ndim)``, ``int32``\n\
+:returns: Index of the parent cell for each cell, -1 for the root." },
+
+    {NULL, NULL, 0, NULL}        /* Sentinel */
+};
+
+static int spit_ext_traverse(PyObject *m, visitproc visit, void *arg) {
+    Py_VISIT(GETSTATE(m)->error);
+    return 0;
+}
+
+static int spit_ext_clear(PyObject *m) {
+    Py_CLEAR(GETSTATE(m)->error);
+    return 0;
+}
+
+static struct PyModuleDef moduledef = {
+        PyModuleDef_HEAD_INIT,
+        "spit_ext",
+        "C-extension supporting :py:mod:`pyrocko.spit`.",
+        sizeof(struct module_state),
+        spit_ext_methods,
+        NULL,
+        spit_ext_traverse,
+        spit_ext_clear,
+        NULL
+};
+
+#define INITERROR return NULL
+
+PyMODINIT_FUNC
+PyInit_spit_ext(void)
+{
+    PyObject *module = PyModule_Create(&moduledef);
+    import_array();
+
+    if (module == NULL)
+        INITERROR;
+    struct module_state *st = GETSTATE(module);
+
+    st->error = PyErr_NewException("pyrocko.spit_ext.SpitExtError", NULL, NULL);
+    if (st->error == NULL) {
+        Py_DECREF(module);
+        INITERROR;
+    }
+
+    Py_INCREF(st->error);
+    PyModule_AddObject(module, "SpitExtError", st->error);
+
+    return module;
+}
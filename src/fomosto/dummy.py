@@ -107,8 +107,9 @@ def build(
         nworkers=None,
         continue_=False,
         step=None,
-        iblock=None):
+        iblock=None,
+        queue=None):
 
     return DummyGFBuilder.build(
         store_dir, force=force, nworkers=nworkers, continue_=continue_,
-        step=step, iblock=iblock)
+        step=step, iblock=iblock, queue=queue)
@@ -586,7 +586,8 @@ def build(
         nworkers=None,
         continue_=False,
         step=None,
-        iblock=None):
+        iblock=None,
+        queue=None):
 
     return PoelGFBuilder.build(
         store_dir,
@@ -594,4 +595,5 @@ def build(
         nworkers=nworkers,
         continue_=continue_,
         step=step,
-        iblock=iblock)
+        iblock=iblock,
+        queue=queue)
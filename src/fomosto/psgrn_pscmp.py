@@ -1720,8 +1720,9 @@ def build(store_dir,
           nworkers=None,
           continue_=False,
           step=None,
-          iblock=None):
+          iblock=None,
+          queue=None):
 
     return PsGrnCmpGFBuilder.build(
         store_dir, force=force, nworkers=nworkers, continue_=continue_,
-        step=step, iblock=iblock)
+        step=step, iblock=iblock, queue=queue)
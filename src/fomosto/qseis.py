@@ -1134,8 +1134,8 @@ def init(store_dir, variant, config_params=None):
 
 
 def build(store_dir, force=False, nworkers=None, continue_=False, step=None,
-          iblock=None):
+          iblock=None, queue=None):
 
     return QSeisGFBuilder.build(
         store_dir, force=force, nworkers=nworkers, continue_=continue_,
-        step=step, iblock=iblock)
+        step=step, iblock=iblock, queue=queue)
@@ -10,6 +10,12 @@ Common base for Green's function store builders (:py:mod:`~pyrocko.fomosto`).
 import os
 import signal
 import errno
+import time
+import socket
+import shutil
+import logging
+import threading
+import uuid
 from os.path import join as pjoin
 import numpy as num
 
@@ -18,6 +24,8 @@ from pyrocko.parimap import parimap
 from pyrocko import util
 from . import store
 
+logger = logging.getLogger('pyrocko.gf.builder')
+
 
 def int_arr(*args):
     return num.array(args, dtype=int)
@@ -59,6 +67,420 @@ def cleanup():
         del g_builders[k]
 
 
+class BuildQueue(object):
+    '''
+    File-backed queue of build tasks, shared by several build processes.
+
+    :param store_dir:
+        GF store directory. The queue is kept in the subdirectory
+        ``.build_queue``.
+    :type store_dir:
+        str
+
+    :param lease_timeout:
+        Time in seconds after which a claimed block, whose lease has not been
+        renewed, is considered abandoned and may be claimed by another
+        worker.
+    :type lease_timeout:
+        float
+
+    :param poll_interval:
+        Time in seconds to wait between checks for blocks becoming available
+        or complete.
+    :type poll_interval:
+        float
+
+    Each block of each build step is a task. A worker claims a task by
+    exclusively creating a lease file for it. The lease is renewed by a
+    background thread while the block is computed. Completed tasks are
+    marked with a file in ``done/``. Only file creation, renaming and removal
+    are used for coordination, so the queue can be shared by processes on
+    several hosts through a common file system. The clocks of these hosts
+    should be synchronized to well below ``lease_timeout``.
+
+    Workers start claiming at different positions in the list of blocks and
+    continue cyclically, so that they take over the remaining blocks of
+    slower workers at the end of each step. Blocks of a step are only handed
+    out after all blocks of the previous step are complete.
+    '''
+
+    def __init__(self, store_dir, lease_timeout=300., poll_interval=10.):
+        self.store_dir = store_dir
+        self.queue_dir = pjoin(store_dir, '.build_queue')
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self.worker_id = '%s-%i-%s' % (
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+        self._held = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._heartbeat_stop = threading.Event()
+
+    def _path(self, *args):
+        return pjoin(self.queue_dir, *args)
+
+    def _task_name(self, step, iblock):
+        return '%i-%i' % (step, iblock)
+
+    def _lease_path(self, step, iblock):
+        return self._path('leases', self._task_name(step, iblock))
+
+    def _done_path(self, step, iblock):
+        return self._path('done', self._task_name(step, iblock))
+
+    def exists(self):
+        '''
+        Check if the queue has been set up.
+        '''
+        return os.path.exists(self._path('ready'))
+
+    def create(self):
+        '''
+        Try to become the creator of the queue.
+
+        Returns ``True`` if the calling process must set up the queue with
+        :py:meth:`setup`, ``False`` if the queue is being or has been created
+        by another process.
+        '''
+        util.ensuredir(self.queue_dir)
+        try:
+            fd = os.open(
+                self._path('init'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        os.write(fd, self.worker_id.encode('ascii'))
+        os.close(fd)
+        return True
+
+    def setup(self, nblocks, done=()):
+        '''
+        Set up the queue, after :py:meth:`create` returned ``True``.
+
+        :param nblocks:
+            Number of blocks in each build step.
+        :type nblocks:
+            :py:class:`list` of :py:class:`int`
+
+        :param done:
+            Tasks already completed, as ``(step, iblock)`` tuples, e.g. from
+            the status file of a suspended build.
+        '''
+        for dn in ('leases', 'done'):
+            util.ensuredir(self._path(dn))
+
+        with open(self._path('steps'), 'w') as f:
+            for step, n in enumerate(nblocks):
+                f.write('%i %i\n' % (step, n))
+
+        for step, iblock in done:
+            self._touch(self._done_path(step, iblock))
+
+        self._touch(self._path('ready'))
+
+    def wait_ready(self, timeout=600.):
+        '''
+        Wait until the creator of the queue has finished setting it up.
+        '''
+        tstart = time.time()
+        while not self.exists():
+            if not os.path.exists(self.queue_dir):
+                raise store.StoreError(
+                    'build queue has been removed: %s' % self.queue_dir)
+
+            if time.time() - tstart > timeout:
+                raise store.StoreError(
+                    'build queue is not ready. If its creator has died, '
+                    'remove the directory %s' % self.queue_dir)
+
+            time.sleep(min(1.0, self.poll_interval))
+
+    def remove(self):
+        '''
+        Remove the queue directory.
+        '''
+        shutil.rmtree(self.queue_dir, ignore_errors=True)
+
+    def get_nblocks(self):
+        '''
+        Get number of blocks per build step.
+        '''
+        nblocks = []
+        with open(self._path('steps'), 'r') as f:
+            for line in f:
+                nblocks.append(int(line.split()[1]))
+
+        return nblocks
+
+    def _touch(self, path):
+        with open(path, 'a'):
+            pass
+
+    def _list(self, dn, step):
+        prefix = '%i-' % step
+        iblocks = set()
+        try:
+            fns = os.listdir(self._path(dn))
+        except FileNotFoundError:
+            return iblocks
+
+        for fn in fns:
+            if fn.startswith(prefix):
+                try:
+                    iblocks.add(int(fn[len(prefix):]))
+                except ValueError:
+                    pass
+
+        return iblocks
+
+    def get_done(self, step):
+        '''
+        Get indices of completed blocks of a build step.
+        '''
+        return self._list('done', step)
+
+    def get_leases(self, step):
+        '''
+        Get leases of a build step.
+
+        Returns a dict mapping block indices to ``(worker_id, age)`` tuples,
+        where ``age`` is the time in seconds since the lease was last renewed.
+        '''
+        leases = {}
+        now = time.time()
+        for iblock in self._list('leases', step):
+            path = self._lease_path(step, iblock)
+            try:
+                age = now - os.stat(path).st_mtime
+                with open(path, 'r') as f:
+                    worker_id = f.read().strip()
+            except FileNotFoundError:
+                continue
+
+            leases[iblock] = (worker_id, age)
+
+        return leases
+
+    def _is_stale(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def _break_lease(self, step, iblock):
+        path = self._lease_path(step, iblock)
+        stale_path = '%s.stale.%s' % (path, self.worker_id)
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+
+        if not self._is_stale(stale_path):
+            # lease has been renewed in the meantime, put it back
+            try:
+                os.rename(stale_path, path)
+                return False
+            except OSError:
+                pass
+
+        logger.warning(
+            'Taking over abandoned block %i of step %i.' % (
+                iblock+1, step+1))
+
+        os.unlink(stale_path)
+        return True
+
+    def _claim(self, step, iblock):
+        path = self._lease_path(step, iblock)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileNotFoundError:
+            return False
+        except FileExistsError:
+            if not (self._is_stale(path) and self._break_lease(step, iblock)):
+                return False
+
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except (FileExistsError, FileNotFoundError):
+                return False
+
+        os.write(fd, self.worker_id.encode('ascii'))
+        os.close(fd)
+
+        if os.path.exists(self._done_path(step, iblock)):
+            os.unlink(path)
+            return False
+
+        with self._lock:
+            self._held.add((step, iblock))
+
+        return True
+
+    def iter_claims(self, step, nblocks):
+        '''
+        Claim blocks of a build step, one at a time.
+
+        Yields block indices until no more blocks can be claimed. Each claimed
+        block must be passed to :py:meth:`complete` or :py:meth:`release`.
+        '''
+        offset = hash(self.worker_id) % nblocks
+        order = (num.arange(nblocks) + offset) % nblocks
+        while True:
+            done = self.get_done(step)
+            leased = self._list('leases', step)
+            nclaimed = 0
+            for iblock in order:
+                iblock = int(iblock)
+                if iblock in done:
+                    continue
+
+                if iblock in leased \
+                        and not self._is_stale(self._lease_path(step, iblock)):
+                    continue
+
+                if self._claim(step, iblock):
+                    nclaimed += 1
+                    yield iblock
+
+            if nclaimed == 0:
+                return
+
+    def complete(self, step, iblock):
+        '''
+        Mark a claimed block as completed and give up its lease.
+        '''
+        try:
+            self._touch(self._done_path(step, iblock))
+        except FileNotFoundError:
+            # queue has been removed after completion of the build
+            pass
+
+        self.release(step, iblock)
+
+    def release(self, step, iblock):
+        '''
+        Give up the lease on a claimed block without completing it.
+        '''
+        with self._lock:
+            self._held.discard((step, iblock))
+
+        # Move the lease out of the way before checking its owner. It may
+        # have been taken over by another worker, if it was considered stale.
+        path = self._lease_path(step, iblock)
+        private_path = '%s.release.%s' % (path, self.worker_id)
+        try:
+            os.rename(path, private_path)
+        except FileNotFoundError:
+            return
+
+        try:
+            with open(private_path, 'r') as f:
+                worker_id = f.read().strip()
+
+            if worker_id != self.worker_id:
+                logger.warning(
+                    'Lease on block %i of step %i has been taken over by '
+                    'another worker.' % (iblock+1, step+1))
+
+                try:
+                    # fails if yet another lease has been created meanwhile
+                    os.link(private_path, path)
+                except OSError:
+                    pass
+
+        finally:
+            os.unlink(private_path)
+
+    def release_all(self):
+        with self._lock:
+            held = list(self._held)
+
+        for step, iblock in held:
+            self.release(step, iblock)
+
+    def is_finished(self):
+        '''
+        Check if the queue has been removed after completion of the build.
+        '''
+        return not os.path.isdir(self.queue_dir)
+
+    def is_step_done(self, step, nblocks):
+        return self.is_finished() or len(self.get_done(step)) >= nblocks
+
+    def _renew_leases(self):
+        while not self._heartbeat_stop.wait(self.lease_timeout / 5.):
+            with self._lock:
+                held = list(self._held)
+
+            for step, iblock in held:
+                try:
+                    os.utime(self._lease_path(step, iblock))
+                except FileNotFoundError:
+                    logger.warning(
+                        'Lost lease on block %i of step %i.' % (
+                            iblock+1, step+1))
+
+    def start_heartbeat(self):
+        '''
+        Start a background thread renewing the leases of claimed blocks.
+        '''
+        if self._heartbeat is None:
+            self._heartbeat_stop.clear()
+            self._heartbeat = threading.Thread(
+                target=self._renew_leases, daemon=True)
+            self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def get_progress(self):
+        '''
+        Get build progress.
+
+        Returns a list with a dict for each build step with the entries
+        ``nblocks``, ``ndone``, ``nleased`` (active leases), ``nstale``
+        (abandoned leases) and ``workers`` (ids of workers holding active
+        leases).
+        '''
+        progress = []
+        for step, nblocks in enumerate(self.get_nblocks()):
+            done = self.get_done(step)
+            leases = self.get_leases(step)
+            active = dict(
+                (iblock, worker_id)
+                for (iblock, (worker_id, age)) in leases.items()
+                if age <= self.lease_timeout)
+
+            progress.append(dict(
+                nblocks=nblocks,
+                ndone=len(done),
+                nleased=len(active),
+                nstale=len(leases) - len(active),
+                workers=sorted(set(active.values()))))
+
+        return progress
+
+    def __str__(self):
+        lines = []
+        for step, p in enumerate(self.get_progress()):
+            lines.append(
+                'step %i: %i / %i blocks done (%.1f%%), %i in progress, '
+                '%i abandoned' % (
+                    step+1, p['ndone'], p['nblocks'],
+                    100. * p['ndone'] / max(1, p['nblocks']),
+                    p['nleased'], p['nstale']))
+
+            for worker_id in p['workers']:
+                lines.append('  worker: %s' % worker_id)
+
+        return '\n'.join(lines)
+
+
 class Builder(object):
     nsteps = 1
 
@@ -116,12 +538,24 @@ class Builder(object):
 
     @classmethod
     def build(cls, store_dir, force=False, nworkers=None, continue_=False,
-              step=None, iblock=None):
+              step=None, iblock=None, queue=None):
         if step is None:
             steps = list(range(cls.nsteps))
         else:
             steps = [step]
 
+        if queue:
+            if iblock is not None:
+                raise store.StoreError(
+                    '--block option cannot be used with a build queue')
+
+            if not isinstance(queue, BuildQueue):
+                queue = BuildQueue(store_dir)
+
+            return cls._build_queued(
+                store_dir, queue, steps, force=force, nworkers=nworkers,
+                continue_=continue_)
+
         if iblock is not None and step is None and cls.nsteps != 1:
             raise store.StoreError('--step option must be given')
 
@@ -199,5 +633,108 @@ class Builder(object):
 
         os.remove(status_fn)
 
+    @classmethod
+    def _build_queued(cls, store_dir, queue, steps, force=False,
+                      nworkers=None, continue_=False):
+
+        status_fn = pjoin(store_dir, '.status')
+
+        if queue.create():
+            try:
+                done = set()
+                if not continue_:
+                    store.Store.create_dependants(store_dir, force)
+                elif os.path.exists(status_fn):
+                    with open(status_fn, 'r') as status:
+                        for line in status:
+                            done.add(tuple(int(x) for x in line.split()))
+
+                shared = {}
+                nblocks = []
+                for step in range(cls.nsteps):
+                    builder = cls(store_dir, step, shared, force=force)
+                    nblocks.append(int(builder.nblocks))
+                    builder.cleanup()
+                    del builder
+
+                queue.setup(nblocks, done)
+
+            except BaseException:
+                queue.remove()
+                raise
+
+            logger.info('Created build queue in %s' % queue.queue_dir)
+
+        else:
+            queue.wait_ready()
+            logger.info('Joining build queue in %s' % queue.queue_dir)
+
+        nblocks = queue.get_nblocks()
+        shared = {}
+        startup_args = util.subprocess_setup_logging_args()
+        queue.start_heartbeat()
+        try:
+            for step in steps:
+                if not (0 <= step < len(nblocks)):
+                    raise store.StoreError('invalid step: %i' % (step+1))
+
+                for step_before in range(step):
+                    while not queue.is_step_done(
+                            step_before, nblocks[step_before]):
+
+                        logger.info(
+                            'Waiting for step %i to complete.'
+                            % (step_before+1))
+                        time.sleep(queue.poll_interval)
+
+                tstart = time.time()
+                ndone_start = len(queue.get_done(step))
+                while not queue.is_step_done(step, nblocks[step]):
+                    original = signal.signal(signal.SIGINT, signal.SIG_IGN)
+                    try:
+                        for x in parimap(
+                                work_block,
+                                ((cls, store_dir, step, i, shared, force)
+                                 for i in queue.iter_claims(
+                                     step, nblocks[step])),
+                                nprocs=nworkers,
+                                eprintignore=(Interrupted, store.StoreError),
+                                startup=util.setup_logging,
+                                startup_args=startup_args,
+                                cleanup=cleanup):
+
+                            _, _, i = x
+                            queue.complete(step, i)
+
+                            ndone = len(queue.get_done(step))
+                            rate = (ndone - ndone_start) \
+                                / max(time.time() - tstart, 1e-6)
+                            logger.info(
+                                'Step %i: %i / %i blocks done (%.1f%%), '
+                                'remaining time estimate: %s' % (
+                                    step+1, ndone, nblocks[step],
+                                    100. * ndone / nblocks[step],
+                                    '%.0f s' % (
+                                        (nblocks[step] - ndone) / rate)
+                                    if rate > 0. else '?'))
+
+                    finally:
+                        signal.signal(signal.SIGINT, original)
+
+                    if not queue.is_step_done(step, nblocks[step]):
+                        time.sleep(queue.poll_interval)
+
+        finally:
+            queue.stop_heartbeat()
+            queue.release_all()
+
+        if all(queue.is_step_done(step, n)
+               for (step, n) in enumerate(nblocks)):
+            queue.remove()
+            try:
+                os.remove(status_fn)
+            except FileNotFoundError:
+                pass
+
 
-__all__ = ['Builder']
+__all__ = ['Builder', 'BuildQueue']
@@ -2,6 +2,16 @@
 
 #define GF_STORE_HEADER_SIZE (8+4)
 
+/* header of the traces file, starts with magic if the store is compressed */
+#define GF_TRACES_HEADER_SIZE 32
+#define GF_TRACES_COMPRESSED_MAGIC "PYRGFZ01"
+
+/* header of compressed records: nbytes, coding, delta order, quantization step */
+#define GF_BLOCK_HEADER_SIZE 12
+
+/* max size of a varint encoded 64-bit integer */
+#define VARINT_NBYTES_MAX 10
+
 /* security limit for length of traces, shifts and offsets (samples) */
 #define SLIMIT 1000000
 
@@ -184,6 +194,7 @@ typedef enum {
     MMAP_TRACES_FAILED,
     INDEX_OUT_OF_BOUNDS,
     NTARGETS_OUT_OF_BOUNDS,
+    DECODE_FAILED,
 } store_error_t;
 
 const char* store_error_names[] = {
@@ -203,6 +214,7 @@ const char* store_error_names[] = {
     "MMAP_TRACES_FAILED",
     "INDEX_OUT_OF_BOUNDS",
     "NTARGETS_OUT_OF_BOUNDS",
+    "DECODE_FAILED",
 };
 
 #define NDIMS_CONTINUOUS_MAX 4
@@ -275,6 +287,12 @@ const mapping_scheme_t mapping_schemes[] = {
 #define REC_ZERO 1
 #define REC_SHORT 2
 
+/* codings of compressed records */
+
+#define CODING_RAW 0
+#define CODING_QUANTIZED 1
+#define CODING_FLOATBITS 2
+
 typedef struct {
     uint64_t data_offset;
     int32_t itmin;
@@ -283,6 +301,31 @@ typedef struct {
     gf_dtype end_value;
 } record_t;
 
+/* record cache defs (used when traces file is not memory mapped) */
+
+typedef struct {
+    uint64_t irecord;
+    size_t nbytes;
+    int32_t refcount;
+    int32_t referenced;
+} cache_entry_t;
+
+typedef struct {
+    cache_entry_t **entries;
+    cache_entry_t **slots;
+    uint64_t nslots;
+    uint64_t capacity;
+    uint64_t hand;
+    size_t nbytes;
+    size_t nbytes_max;
+    uint64_t nhits;
+    uint64_t nmisses;
+    uint64_t nevictions;
+    PyThread_type_lock lock;
+} record_cache_t;
+
+#define cache_entry_data(entry) ((gf_dtype*)((cache_entry_t*)(entry) + 1))
+
 typedef struct {
     int f_index;
     int f_data;
@@ -291,9 +334,10 @@ typedef struct {
     float64_t deltat;
     record_t *records;
     gf_dtype *data;
-    gf_dtype **memdata;
+    record_cache_t *cache;
     const mapping_scheme_t *mapping_scheme;
     mapping_t *mapping;
+    int compressed;
 } store_t;
 
 typedef struct {
@@ -303,6 +347,7 @@ typedef struct {
     gf_dtype begin_value;
     gf_dtype end_value;
     gf_dtype *data;
+    cache_entry_t *entry;
 } trace_t;
 
 /* result trace sheme defs */
@@ -486,8 +531,8 @@ int good_array(PyObject* o, int typenum_want, npy_intp size_want, int ndim_want,
     return 1;
 }
 
-static const trace_t ZERO_TRACE = { 1, 0, 0, 0.0, 0.0, NULL };
-static const store_t ZERO_STORE = { 0, 0, 0, 0, 0.0, NULL, NULL, NULL, NULL, NULL };
+static const trace_t ZERO_TRACE = { 1, 0, 0, 0.0, 0.0, NULL, NULL };
+static const store_t ZERO_STORE = { 0, 0, 0, 0, 0.0, NULL, NULL, NULL, NULL, NULL, 0 };
 
 static store_error_t store_get_span(const store_t *store, uint64_t irecord,
                                     int32_t *itmin, int32_t *nsamples, int *is_zero) {
@@ -519,8 +564,8 @@ static store_error_t store_read(
 
     nhave = 0;
     while (nhave < nbytes) {
-        nread = pread(store->f_data, data, nbytes-nhave, data_offset+nhave);
-        if (-1 == nread) {
+        nread = pread(store->f_data, (char*)data+nhave, nbytes-nhave, data_offset+nhave);
+        if (-1 == nread || 0 == nread) {
             return READ_DATA_FAILED;
         }
         nhave += nread;
@@ -529,15 +574,383 @@ static store_error_t store_read(
     return SUCCESS;
 }
 
+static store_error_t record_decode(
+        const uint8_t *block,
+        size_t nbytes,
+        int32_t nsamples,
+        gf_dtype *out) {
+
+    /* Decode compressed record. Samples are delta-encoded (order 0-2)
+     * zigzag varints, representing either quantized values (value * step) or
+     * order-preserving integer mappings of the float bit patterns. Output is
+     * in store byte order, like uncompressed data. */
+
+    uint8_t coding, order, b;
+    uint32_t bits, step_bits;
+    uint64_t u, x1, x2;
+    int64_t r, x;
+    float32_t step;
+    gf_dtype value;
+    const uint8_t *p, *end;
+    int32_t i;
+    int shift;
+
+    if (nbytes < GF_BLOCK_HEADER_SIZE) {
+        return DECODE_FAILED;
+    }
+
+    coding = block[4];
+    order = block[5];
+    memcpy(&step_bits, block+8, 4);
+    step_bits = xe32toh(step_bits);
+    memcpy(&step, &step_bits, 4);
+
+    p = block + GF_BLOCK_HEADER_SIZE;
+    end = block + nbytes;
+
+    if (CODING_RAW == coding) {
+        if ((size_t)(end - p) != nsamples * sizeof(gf_dtype)) {
+            return DECODE_FAILED;
+        }
+        memcpy(out, p, nsamples * sizeof(gf_dtype));
+        return SUCCESS;
+    }
+
+    if (order > 2 || (CODING_QUANTIZED != coding && CODING_FLOATBITS != coding)) {
+        return DECODE_FAILED;
+    }
+
+    x1 = x2 = 0;
+    for (i=0; i<nsamples; i++) {
+        u = 0;
+        shift = 0;
+        do {
+            if (p >= end || shift > 63) {
+                return DECODE_FAILED;
+            }
+            b = *p++;
+            u |= (uint64_t)(b & 0x7f) << shift;
+            shift += 7;
+        } while (b & 0x80);
+
+        r = (int64_t)(u >> 1) ^ -(int64_t)(u & 1);
+
+        /* integrate with wrap-around arithmetic */
+        if (0 == order) {
+            x = r;
+        } else if (1 == order) {
+            x1 += (uint64_t)r;
+            x = (int64_t)x1;
+        } else {
+            x1 += (uint64_t)r;
+            x2 += x1;
+            x = (int64_t)x2;
+        }
+
+        if (CODING_QUANTIZED == coding) {
+            value = (gf_dtype)((float64_t)x * step);
+        } else {
+            if (x >= 0) {
+                bits = (uint32_t)x;
+            } else {
+                bits = ((uint32_t)(-1 - x)) | 0x80000000u;
+            }
+            memcpy(&value, &bits, 4);
+        }
+
+        out[i] = fe32toh(value);
+    }
+
+    if (p != end) {
+        return DECODE_FAILED;
+    }
+
+    return SUCCESS;
+}
+
+static store_error_t store_read_compressed(
+        const store_t *store,
+        uint64_t data_offset,
+        int32_t nsamples,
+        gf_dtype *data) {
+
+    uint8_t header[GF_BLOCK_HEADER_SIZE];
+    uint8_t *buf;
+    uint32_t nbytes;
+    store_error_t err;
+
+    if (data_offset + GF_BLOCK_HEADER_SIZE > store->data_size) {
+        return BAD_DATA_OFFSET;
+    }
+
+    if (NULL != store->data) {
+        memcpy(header, (char*)store->data + data_offset, GF_BLOCK_HEADER_SIZE);
+    } else {
+        err = store_read(store, data_offset, GF_BLOCK_HEADER_SIZE, header);
+        if (SUCCESS != err) {
+            return err;
+        }
+    }
+
+    memcpy(&nbytes, header, 4);
+    nbytes = xe32toh(nbytes);
+
+    if (nbytes < GF_BLOCK_HEADER_SIZE ||
+            nbytes > GF_BLOCK_HEADER_SIZE + (uint64_t)nsamples * VARINT_NBYTES_MAX ||
+            data_offset + nbytes > store->data_size) {
+        return BAD_DATA_OFFSET;
+    }
+
+    if (NULL != store->data) {
+        return record_decode(
+            (uint8_t*)store->data + data_offset, nbytes, nsamples, data);
+    }
+
+    buf = (uint8_t*)malloc(nbytes);
+    if (NULL == buf) {
+        return ALLOC_FAILED;
+    }
+
+    err = store_read(store, data_offset, nbytes, buf);
+    if (SUCCESS == err) {
+        err = record_decode(buf, nbytes, nsamples, data);
+    }
+
+    free(buf);
+    return err;
+}
+
+static store_error_t record_cache_init(
+        record_cache_t *cache,
+        uint64_t nrecords,
+        size_t nbytes_max) {
+
+    if (nrecords > SIZE_MAX / sizeof(cache_entry_t*)) {
+        return ALLOC_FAILED;
+    }
+
+    cache->entries = (cache_entry_t**)calloc(nrecords, sizeof(cache_entry_t*));
+    if (NULL == cache->entries) {
+        return ALLOC_FAILED;
+    }
+
+    cache->lock = PyThread_allocate_lock();
+    if (NULL == cache->lock) {
+        free(cache->entries);
+        cache->entries = NULL;
+        return ALLOC_FAILED;
+    }
+
+    cache->slots = NULL;
+    cache->nslots = 0;
+    cache->capacity = 0;
+    cache->hand = 0;
+    cache->nbytes = 0;
+    cache->nbytes_max = nbytes_max;
+    cache->nhits = 0;
+    cache->nmisses = 0;
+    cache->nevictions = 0;
+
+    return SUCCESS;
+}
+
+static void record_cache_deinit(record_cache_t *cache) {
+    uint64_t islot;
+
+    for (islot=0; islot<cache->nslots; islot++) {
+        free(cache->slots[islot]);
+    }
+
+    free(cache->slots);
+    free(cache->entries);
+
+    if (NULL != cache->lock) {
+        PyThread_free_lock(cache->lock);
+    }
+
+    cache->slots = NULL;
+    cache->entries = NULL;
+    cache->lock = NULL;
+    cache->nslots = 0;
+    cache->nbytes = 0;
+}
+
+static void record_cache_shrink(record_cache_t *cache) {
+    /* CLOCK eviction, caller must hold the lock. Records in use by other
+     * threads (refcount > 0) are skipped, so the budget may temporarily be
+     * exceeded. */
+
+    cache_entry_t *entry;
+    uint64_t nsteps, nsteps_max;
+
+    if (0 == cache->nbytes_max) {
+        return;
+    }
+
+    nsteps_max = 2 * cache->nslots;
+    for (nsteps=0; nsteps<nsteps_max; nsteps++) {
+        if (cache->nbytes <= cache->nbytes_max || 0 == cache->nslots) {
+            break;
+        }
+
+        if (cache->hand >= cache->nslots) {
+            cache->hand = 0;
+        }
+
+        entry = cache->slots[cache->hand];
+        if (entry->refcount > 0) {
+            cache->hand++;
+            continue;
+        }
+
+        if (entry->referenced) {
+            entry->referenced = 0;
+            cache->hand++;
+            continue;
+        }
+
+        cache->entries[entry->irecord] = NULL;
+        cache->nbytes -= entry->nbytes;
+        cache->nslots--;
+        cache->slots[cache->hand] = cache->slots[cache->nslots];
+        cache->nevictions++;
+        free(entry);
+    }
+}
+
+static store_error_t record_cache_insert(
+        record_cache_t *cache,
+        cache_entry_t *entry) {
+
+    /* caller must hold the lock */
+
+    cache_entry_t **slots;
+    uint64_t capacity;
+
+    if (cache->nslots == cache->capacity) {
+        capacity = max(cache->capacity * 2, (uint64_t)1024);
+        if (capacity > SIZE_MAX / sizeof(cache_entry_t*)) {
+            return ALLOC_FAILED;
+        }
+
+        slots = (cache_entry_t**)realloc(
+            cache->slots, capacity * sizeof(cache_entry_t*));
+
+        if (NULL == slots) {
+            return ALLOC_FAILED;
+        }
+
+        cache->slots = slots;
+        cache->capacity = capacity;
+    }
+
+    cache->slots[cache->nslots] = entry;
+    cache->nslots++;
+    cache->nbytes += entry->nbytes;
+    cache->entries[entry->irecord] = entry;
+
+    record_cache_shrink(cache);
+
+    return SUCCESS;
+}
+
+static store_error_t store_get_cached(
+        const store_t *store,
+        uint64_t irecord,
+        uint64_t data_offset,
+        int32_t nsamples,
+        cache_entry_t **entry_out) {
+
+    /* Get record data from cache or read it from the traces file. The
+     * returned entry is pinned and must be released with store_release. */
+
+    record_cache_t *cache = store->cache;
+    cache_entry_t *entry, *entry_new;
+    store_error_t err;
+    size_t nbytes;
+
+    nbytes = nsamples * sizeof(gf_dtype);
+
+    PyThread_acquire_lock(cache->lock, WAIT_LOCK);
+    entry = cache->entries[irecord];
+    if (NULL != entry) {
+        entry->refcount++;
+        entry->referenced = 1;
+        cache->nhits++;
+        PyThread_release_lock(cache->lock);
+        *entry_out = entry;
+        return SUCCESS;
+    }
+    cache->nmisses++;
+    PyThread_release_lock(cache->lock);
+
+    entry_new = (cache_entry_t*)malloc(sizeof(cache_entry_t) + nbytes);
+    if (NULL == entry_new) {
+        return ALLOC_FAILED;
+    }
+
+    if (store->compressed) {
+        err = store_read_compressed(
+            store, data_offset, nsamples, cache_entry_data(entry_new));
+    } else {
+        err = store_read(store, data_offset, nbytes, cache_entry_data(entry_new));
+    }
+
+    if (SUCCESS != err) {
+        free(entry_new);
+        return err;
+    }
+
+    entry_new->irecord = irecord;
+    entry_new->nbytes = nbytes;
+    entry_new->refcount = 1;
+    entry_new->referenced = 1;
+
+    PyThread_acquire_lock(cache->lock, WAIT_LOCK);
+    entry = cache->entries[irecord];
+    if (NULL != entry) {
+        /* another thread has been faster */
+        entry->refcount++;
+        entry->referenced = 1;
+        PyThread_release_lock(cache->lock);
+        free(entry_new);
+        *entry_out = entry;
+        return SUCCESS;
+    }
+
+    err = record_cache_insert(cache, entry_new);
+    PyThread_release_lock(cache->lock);
+
+    if (SUCCESS != err) {
+        free(entry_new);
+        return err;
+    }
+
+    *entry_out = entry_new;
+    return SUCCESS;
+}
+
+static void store_release(const store_t *store, trace_t *trace) {
+    if (NULL != trace->entry) {
+        PyThread_acquire_lock(store->cache->lock, WAIT_LOCK);
+        trace->entry->refcount--;
+        PyThread_release_lock(store->cache->lock);
+        trace->entry = NULL;
+    }
+}
+
 static store_error_t store_get(
         const store_t *store,
         uint64_t irecord,
         trace_t *trace) {
 
+    /* If the returned trace's data is served from the record cache, the
+     * trace must be released with store_release after use. */
+
     record_t *record;
     uint64_t data_offset;
     store_error_t err;
-    size_t nbytes;
+    cache_entry_t *entry;
 
     if (irecord >= store->nrecords) {
         *trace = ZERO_TRACE;
@@ -550,6 +963,7 @@ static store_error_t store_get(
     trace->nsamples = xe32toh(record->nsamples);
     trace->begin_value = fe32toh(record->begin_value);
     trace->end_value = fe32toh(record->end_value);
+    trace->entry = NULL;
 
     if (!inlimits(trace->itmin) || !inposlimits(trace->nsamples) ||
             data_offset >= UINT64_MAX - SLIMIT * sizeof(gf_dtype)) {
@@ -569,7 +983,8 @@ static store_error_t store_get(
 
     trace->is_zero = 0;
 
-    if (data_offset + trace->nsamples*sizeof(gf_dtype) > store->data_size) {
+    if (!store->compressed &&
+            data_offset + trace->nsamples*sizeof(gf_dtype) > store->data_size) {
         *trace = ZERO_TRACE;
         return BAD_DATA_OFFSET;
     }
@@ -577,25 +992,16 @@ static store_error_t store_get(
     if (REC_SHORT == data_offset) {
         trace->data = &record->begin_value;
     } else {
-        if (NULL != store->data) {
+        if (NULL != store->data && !store->compressed) {
             trace->data = &store->data[data_offset/sizeof(gf_dtype)];
         } else {
-            if (NULL == store->memdata[irecord]) {
-                nbytes = trace->nsamples * sizeof(gf_dtype);
-                store->memdata[irecord] = (gf_dtype*)malloc(nbytes);
-                if (NULL == store->memdata[irecord]) {
-                    *trace = ZERO_TRACE;
-                    return ALLOC_FAILED;
-                }
-                err = store_read(store, data_offset, nbytes, store->memdata[irecord]);
-                if (SUCCESS != err) {
-                    free(store->memdata[irecord]);
-                    store->memdata[irecord] = NULL;
-                    *trace = ZERO_TRACE;
-                    return err;
-                }
+            err = store_get_cached(store, irecord, data_offset, trace->nsamples, &entry);
+            if (SUCCESS != err) {
+                *trace = ZERO_TRACE;
+                return err;
             }
-            trace->data = store->memdata[irecord];
+            trace->data = cache_entry_data(entry);
+            trace->entry = entry;
         }
     }
 
@@ -784,6 +1190,8 @@ static store_error_t store_sum(
 
         result->begin_value += trace.begin_value * weight;
         result->end_value += trace.end_value * weight;
+
+        store_release(store, &trace);
     }
 
     result->is_zero = 0;
@@ -870,6 +1278,8 @@ static store_error_t store_sum_static(
                         fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * w1
                         + fe32toh(trace.data[max(0, min(idx-1, trace.nsamples-1))]) * w2) * weight;
                 }
+
+                store_release(store, &trace);
             }
         }
     #if defined(_OPENMP)
@@ -1069,7 +1479,8 @@ static store_error_t store_calc_timeseries(
         const float64_t *ms,
         const float64_t *delays,
         const float64_t *receiver_coords,
-        size_t nsources,
+        const uint64_t *source_offsets,
+        size_t ngroups,
         size_t nreceivers,
         const component_scheme_t *cscheme,
         const mapping_scheme_t *mscheme,
@@ -1087,7 +1498,7 @@ static store_error_t store_calc_timeseries(
     uint64_t irecord;
     store_error_t err = SUCCESS;
 
-    size_t ireceiver, isource, iip, nip, icomponent, isummand, nsummands_max, nsummands;
+    size_t ipair, igroup, ireceiver, isource, iip, nip, icomponent, isummand, nsummands_max, nsummands;
     float64_t ws_this[NCOMPONENTS_MAX*NSUMMANDS_MAX];
     uint64_t irecord_bases[VICINITY_NIP_MAX];
     float64_t weights_ip[VICINITY_NIP_MAX];
@@ -1107,16 +1518,20 @@ static store_error_t store_calc_timeseries(
 
         #pragma omp parallel \
             shared (store, source_coords, ms, delays, receiver_coords, \
-                    cscheme, mscheme, mapping, interpolation, nip, results, nsources, nsummands_max) \
-            private (isource, iip, icomponent, isummand, nsummands, irecord_bases, weights_ip, ws_this, \
+                    cscheme, mscheme, mapping, interpolation, nip, results, source_offsets, \
+                    ngroups, nreceivers, nsummands_max) \
+            private (igroup, ireceiver, isource, iip, icomponent, isummand, nsummands, irecord_bases, weights_ip, ws_this, \
                      delay, weight, idelay_floor, idelay_ceil, irecord, trace, result, err) \
             num_threads (nthreads)
         {
         #pragma omp for schedule (dynamic)
     #endif
 
-    for (ireceiver=0; ireceiver<nreceivers; ireceiver++) {
-        for (isource=0; isource<nsources; isource++) {
+    for (ipair=0; ipair<ngroups*nreceivers; ipair++) {
+        igroup = ipair / nreceivers;
+        ireceiver = ipair % nreceivers;
+
+        for (isource=source_offsets[igroup]; isource<source_offsets[igroup+1]; isource++) {
 
             cscheme->make_weights(
                 &source_coords[isource*5],
@@ -1130,7 +1545,7 @@ static store_error_t store_calc_timeseries(
 
             if (!inlimits(idelay_floor) || !inlimits(idelay_ceil)) {
                 for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
-                    result = &(results[icomponent+ireceiver*cscheme->ncomponents]);
+                    result = &(results[icomponent+ipair*cscheme->ncomponents]);
                     result->err = BAD_REQUEST;
                 }
                 continue;
@@ -1146,7 +1561,7 @@ static store_error_t store_calc_timeseries(
 
                 if (err != SUCCESS) {
                     for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
-                        result = &(results[icomponent+ireceiver*cscheme->ncomponents]);
+                        result = &(results[icomponent+ipair*cscheme->ncomponents]);
                         result->err = err;
                     }
                     continue;
@@ -1154,7 +1569,7 @@ static store_error_t store_calc_timeseries(
 
                 for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
 
-                    result = &(results[icomponent+ireceiver*cscheme->ncomponents]);
+                    result = &(results[icomponent+ipair*cscheme->ncomponents]);
 
                     nsummands = cscheme->nsummands[icomponent];
 
@@ -1193,6 +1608,8 @@ static store_error_t store_calc_timeseries(
 
                             result->begin_value += trace.begin_value * weight;
                             result->end_value += trace.end_value * weight;
+
+                            store_release(store, &trace);
                         }
                     }
 
@@ -1207,7 +1624,7 @@ static store_error_t store_calc_timeseries(
 
                 if (err != SUCCESS) {
                     for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
-                        result = &(results[icomponent+ireceiver*cscheme->ncomponents]);
+                        result = &(results[icomponent+ipair*cscheme->ncomponents]);
                         result->err = err;
                     }
                     continue;
@@ -1215,7 +1632,7 @@ static store_error_t store_calc_timeseries(
 
                 for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
 
-                    result = &(results[icomponent+ireceiver*cscheme->ncomponents]);
+                    result = &(results[icomponent+ipair*cscheme->ncomponents]);
 
                     nsummands = cscheme->nsummands[icomponent];
 
@@ -1254,6 +1671,7 @@ static store_error_t store_calc_timeseries(
                         result->begin_value += trace.begin_value * weight;
                         result->end_value += trace.end_value * weight;
 
+                        store_release(store, &trace);
                     }
 
                     result->is_zero = 0;
@@ -1275,7 +1693,8 @@ static store_error_t store_calc_static(
         const float64_t *ms,
         const float64_t *delays,
         const float64_t *receiver_coords,
-        const size_t nsources,
+        const uint64_t *source_offsets,
+        const size_t ngroups,
         const size_t nreceivers,
         const component_scheme_t *cscheme,
         const mapping_scheme_t *mscheme,
@@ -1297,7 +1716,7 @@ static store_error_t store_calc_static(
 
     (void) nthreads;
 
-    size_t ireceiver, isource, iip, nip, icomponent, isummand, nsummands_max, nsummands;
+    size_t ipair, igroup, ireceiver, isource, iip, nip, icomponent, isummand, nsummands_max, nsummands;
     float64_t ws_this[NCOMPONENTS_MAX*NSUMMANDS_MAX];
     uint64_t irecord_bases[VICINITY_NIP_MAX];
     float64_t weights_ip[VICINITY_NIP_MAX];
@@ -1326,8 +1745,9 @@ static store_error_t store_calc_static(
 
         #pragma omp parallel \
             shared (store, source_coords, ms, delays, receiver_coords, \
-                    cscheme, mscheme, mapping, interpolation, it, nip, result) \
-            private (isource, iip, icomponent, isummand, nsummands, irecord_bases, weights_ip, ws_this, \
+                    cscheme, mscheme, mapping, interpolation, it, nip, result, \
+                    source_offsets, ngroups, nreceivers) \
+            private (igroup, ireceiver, isource, iip, icomponent, isummand, nsummands, irecord_bases, weights_ip, ws_this, \
                      delay, weight, idelay_floor, idelay_ceil, idx, irecord, trace, w1, w2, weights_sum) \
             reduction (+: err) \
             num_threads (nthreads)
@@ -1335,8 +1755,11 @@ static store_error_t store_calc_static(
         #pragma omp for schedule (guided)
     #endif
 
-    for (ireceiver=0; ireceiver<nreceivers; ireceiver++) {
-        for (isource=0; isource<nsources; isource++) {
+    for (ipair=0; ipair<ngroups*nreceivers; ipair++) {
+        igroup = ipair / nreceivers;
+        ireceiver = ipair % nreceivers;
+
+        for (isource=source_offsets[igroup]; isource<source_offsets[igroup+1]; isource++) {
 
             cscheme->make_weights(
                 &source_coords[isource*5],
@@ -1380,14 +1803,16 @@ static store_error_t store_calc_static(
 
                             idx = it - idelay_floor - trace.itmin;
                             if (idelay_floor == idelay_ceil) {
-                                result[icomponent][ireceiver] += fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * weight;
+                                result[icomponent][ipair] += fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * weight;
                             } else {
                                 w1 = (idelay_ceil - delay/deltat);
                                 w2 = (1.0-w1);
-                                result[icomponent][ireceiver] += (
+                                result[icomponent][ipair] += (
                                     fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * w1
                                     + fe32toh(trace.data[max(0, min(idx-1, trace.nsamples-1))]) * w2) * weight;
                             }
+
+                            store_release(store, &trace);
                         }
                     }
                 }
@@ -1412,14 +1837,16 @@ static store_error_t store_calc_static(
 
                         idx = it - idelay_floor - trace.itmin;
                         if (idelay_floor == idelay_ceil) {
-                            result[icomponent][ireceiver] += fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * weight;
+                            result[icomponent][ipair] += fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * weight;
                         } else {
                             w1 = (idelay_ceil - delay/deltat);
                             w2 = (1.0-w1);
-                            result[icomponent][ireceiver] += (
+                            result[icomponent][ipair] += (
                                 fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * w1
                                 + fe32toh(trace.data[max(0, min(idx-1, trace.nsamples-1))]) * w2) * weight;
                         }
+
+                        store_release(store, &trace);
                     }
                 }
             }
@@ -1435,8 +1862,17 @@ static store_error_t store_calc_static(
     return SUCCESS;
 }
 
-static store_error_t store_init(int f_index, int f_data, store_t *store, float64_t patch_deltat) {
+static store_error_t store_init(
+        int f_index,
+        int f_data,
+        store_t *store,
+        float64_t patch_deltat,
+        int allow_mmap,
+        size_t cache_nbytes_max) {
+
     void *p;
+    store_error_t err;
+    char magic[8];
     struct stat st;
     size_t index_size;
 #ifdef _WIN32
@@ -1483,6 +1919,14 @@ static store_error_t store_init(int f_index, int f_data, store_t *store, float64
         return BAD_STORE;
     }
 
+    store->compressed = 0;
+    if (store->data_size >= GF_TRACES_HEADER_SIZE) {
+        if (8 != pread(store->f_data, magic, 8, 0)) {
+            return READ_DATA_FAILED;
+        }
+        store->compressed = 0 == memcmp(magic, GF_TRACES_COMPRESSED_MAGIC, 8);
+    }
+
     index_size = sizeof(record_t) * store->nrecords + GF_STORE_HEADER_SIZE;
     if (index_size >= SIZE_MAX) {
         return MMAP_INDEX_FAILED;
@@ -1516,8 +1960,9 @@ static store_error_t store_init(int f_index, int f_data, store_t *store, float64
      * than address space */
 
 #ifndef _WIN32
-    use_mmap = store->data_size < SIZE_MAX / 8;
+    use_mmap = allow_mmap && store->data_size < SIZE_MAX / 8;
 #else
+    (void)allow_mmap;
     use_mmap = 0;
 #endif
 
@@ -1533,14 +1978,22 @@ static store_error_t store_init(int f_index, int f_data, store_t *store, float64
 
         store->data = (gf_dtype*)p;
 #endif
-    } else {
+    }
+
+    if (!use_mmap || store->compressed) {
         if (store->nrecords > SIZE_MAX) {
             return ALLOC_FAILED;
         }
-        store->memdata = (gf_dtype**)calloc(store->nrecords, sizeof(gf_dtype*));
-        if (NULL == store->memdata) {
+        store->cache = (record_cache_t*)calloc(1, sizeof(record_cache_t));
+        if (NULL == store->cache) {
             return ALLOC_FAILED;
         }
+        err = record_cache_init(store->cache, store->nrecords, cache_nbytes_max);
+        if (SUCCESS != err) {
+            free(store->cache);
+            store->cache = NULL;
+            return err;
+        }
     }
 
     return SUCCESS;
@@ -1584,7 +2037,6 @@ static void store_mapping_deinit(mapping_t *mapping) {
 
 void store_deinit(store_t *store) {
     size_t index_size;
-    uint64_t irecord;
 
     index_size = sizeof(record_t) * store->nrecords + GF_STORE_HEADER_SIZE;
     if (store->records != NULL) {
@@ -1601,14 +2053,9 @@ void store_deinit(store_t *store) {
 #endif
     }
 
-    if (store->memdata != NULL) {
-        for (irecord=0; irecord<store->nrecords; irecord++) {
-            if (NULL != store->memdata[irecord]) {
-                free(store->memdata[irecord]);
-                store->memdata[irecord] = NULL;
-            }
-        }
-        free(store->memdata);
+    if (store->cache != NULL) {
+        record_cache_deinit(store->cache);
+        free(store->cache);
     }
 
     if (store->mapping != NULL) {
@@ -1640,11 +2087,22 @@ static PyObject* w_store_init(PyObject *m, PyObject *args) {
     store_t *store;
     store_error_t err;
     float64_t patch_deltat;
+    int allow_mmap;
+    unsigned long long int cache_nbytes_max;
 
     struct module_state *st = GETSTATE(m);
 
-    if (!PyArg_ParseTuple(args, "iid", &f_index, &f_data, &patch_deltat)) {
-        PyErr_SetString(st->error, "usage store_init(f_index, f_data, patch_deltat)" );
+    allow_mmap = 1;
+    cache_nbytes_max = 0;
+
+    if (!PyArg_ParseTuple(args, "iid|iK", &f_index, &f_data, &patch_deltat,
+                          &allow_mmap, &cache_nbytes_max)) {
+        PyErr_SetString(st->error, "usage store_init(f_index, f_data, patch_deltat[, allow_mmap, cache_nbytes_max])" );
+        return NULL;
+    }
+
+    if (cache_nbytes_max > SIZE_MAX) {
+        PyErr_SetString(st->error, "store_init: invalid cache_nbytes_max argument");
         return NULL;
     }
 
@@ -1654,7 +2112,8 @@ static PyObject* w_store_init(PyObject *m, PyObject *args) {
         return NULL;
     }
 
-    err = store_init(f_index, f_data, store, patch_deltat);
+    err = store_init(f_index, f_data, store, patch_deltat, allow_mmap,
+                     (size_t)cache_nbytes_max);
     if (SUCCESS != err) {
         PyErr_SetString(st->error, store_error_names[err]);
         store_deinit(store);
@@ -1825,10 +2284,82 @@ static PyObject* w_store_get(PyObject *m, PyObject *args) {
         adata[i] = fe32toh(trace.data[i]);
     }
 
+    store_release(store, &trace);
+
     return Py_BuildValue("Nidiff", array, trace.itmin, store->deltat,
                          trace.is_zero, trace.begin_value, trace.end_value);
 }
 
+static PyObject* w_store_cache_stats(PyObject *m, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    record_cache_t *cache;
+    unsigned long long int nhits, nmisses, nevictions, nentries, nbytes, nbytes_max;
+
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(st->error, "usage: store_cache_stats(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    cache = store->cache;
+    if (cache == NULL) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
+    PyThread_acquire_lock(cache->lock, WAIT_LOCK);
+    nhits = cache->nhits;
+    nmisses = cache->nmisses;
+    nevictions = cache->nevictions;
+    nentries = cache->nslots;
+    nbytes = cache->nbytes;
+    nbytes_max = cache->nbytes_max;
+    PyThread_release_lock(cache->lock);
+
+    return Py_BuildValue("KKKKKK", nhits, nmisses, nevictions, nentries,
+                         nbytes, nbytes_max);
+}
+
+static PyObject* w_store_cache_set_nbytes_max(PyObject *m, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    record_cache_t *cache;
+    unsigned long long int nbytes_max;
+
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(args, "OK", &capsule, &nbytes_max)) {
+        PyErr_SetString(st->error, "usage: store_cache_set_nbytes_max(cstore, nbytes_max)");
+        return NULL;
+    }
+
+    if (nbytes_max > SIZE_MAX) {
+        PyErr_SetString(st->error, "store_cache_set_nbytes_max: invalid nbytes_max argument");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    cache = store->cache;
+    if (cache != NULL) {
+        PyThread_acquire_lock(cache->lock, WAIT_LOCK);
+        cache->nbytes_max = (size_t)nbytes_max;
+        record_cache_shrink(cache);
+        PyThread_release_lock(cache->lock);
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static float64_t clip(float64_t x, float64_t mi, float64_t ma) {
     return x < mi ? mi : (x > ma ? ma : x);
 }
@@ -2901,8 +3432,63 @@ static void free_results(result_trace_t *results, size_t nresults) {
 }
 
 
+static int get_source_offsets(
+        struct module_state *st,
+        const char *funcname,
+        PyObject *source_offsets_arr,
+        size_t nsources,
+        uint64_t *source_offsets_single,
+        uint64_t **source_offsets,
+        size_t *ngroups) {
+
+    /* Partitioning of source points into groups, each group to be treated
+     * as a separate source. `None` means a single group with all points.
+     * Sets an exception and returns 0 on invalid input. */
+
+    size_t igroup;
+    uint64_t *offsets;
+
+    if (source_offsets_arr == Py_None) {
+        source_offsets_single[0] = 0;
+        source_offsets_single[1] = nsources;
+        *source_offsets = source_offsets_single;
+        *ngroups = 1;
+        return 1;
+    }
+
+    if (!good_array(source_offsets_arr, NPY_UINT64, -1, 1, NULL)) {
+        PyErr_Format(st->error, "%s: unhealthy source_offsets array", funcname);
+        return 0;
+    }
+
+    if (PyArray_SIZE((PyArrayObject*) source_offsets_arr) < 1) {
+        PyErr_Format(st->error, "%s: source_offsets array must not be empty", funcname);
+        return 0;
+    }
+
+    offsets = PyArray_DATA((PyArrayObject*) source_offsets_arr);
+    *ngroups = PyArray_SIZE((PyArrayObject*) source_offsets_arr) - 1;
+
+    if (offsets[0] != 0 || offsets[*ngroups] != nsources) {
+        PyErr_Format(st->error, "%s: source_offsets must start with 0 and end with the number of sources", funcname);
+        return 0;
+    }
+
+    for (igroup=0; igroup<*ngroups; igroup++) {
+        if (offsets[igroup] > offsets[igroup+1]) {
+            PyErr_Format(st->error, "%s: source_offsets must be non-decreasing", funcname);
+            return 0;
+        }
+    }
+
+    *source_offsets = offsets;
+    return 1;
+}
+
+
 static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
     PyObject *capsule, *source_coords_arr, *ms_arr, *delays_arr, *receiver_coords_arr, *itmin_arr, *nsamples_arr, *out_list, *out_tuple;
+    PyObject *source_offsets_arr = Py_None;
     PyObject *array = NULL;
     store_t *store;
     npy_intp array_dims[1] = {0};
@@ -2916,6 +3502,8 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
     float64_t *source_coords, *receiver_coords, *ms, *delays;
     int32_t *itmin, *nsamples, nsamples_want, itmin_want;
     int nsources, nreceivers;
+    uint64_t *source_offsets, source_offsets_single[2];
+    size_t ngroups;
     int32_t nthreads;
     store_error_t err;
 
@@ -2929,11 +3517,12 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
     struct module_state *st = GETSTATE(m);
 
     if (!PyArg_ParseTuple(
-            args, "OOOOOssOOI", &capsule, &source_coords_arr, &ms_arr, &delays_arr,
+            args, "OOOOOssOOI|O", &capsule, &source_coords_arr, &ms_arr, &delays_arr,
             &receiver_coords_arr, &component_scheme_name,
-            &interpolation_scheme_name, &itmin_arr, &nsamples_arr, &nthreads)) {
+            &interpolation_scheme_name, &itmin_arr, &nsamples_arr, &nthreads,
+            &source_offsets_arr)) {
         PyErr_SetString(st->error,
-            "usage: store_calc_timeseries(cstore, source_coords, moment_tensors, delays, receiver_coords, component_scheme, interpolation_name, itmin_arr, nsamples_arr, nthreads)");
+            "usage: store_calc_timeseries(cstore, source_coords, moment_tensors, delays, receiver_coords, component_scheme, interpolation_name, itmin_arr, nsamples_arr, nthreads, source_offsets=None)");
         return NULL;
     }
 
@@ -2984,12 +3573,18 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
         return NULL;
     }
 
-    if (!good_array((PyObject*)itmin_arr, NPY_INT32, nreceivers, 1, NULL)) {
+    if (!get_source_offsets(
+            st, "w_store_calc_timeseries", source_offsets_arr, nsources,
+            source_offsets_single, &source_offsets, &ngroups)) {
+        return NULL;
+    }
+
+    if (!good_array((PyObject*)itmin_arr, NPY_INT32, ngroups*nreceivers, 1, NULL)) {
         PyErr_SetString(st->error, "w_store_calc_timeseries: unhealthy itmin array");
         return NULL;
     }
 
-    if (!good_array((PyObject*)nsamples_arr, NPY_INT32, nreceivers, 1, NULL)) {
+    if (!good_array((PyObject*)nsamples_arr, NPY_INT32, ngroups*nreceivers, 1, NULL)) {
         PyErr_SetString(st->error, "w_store_calc_timeseries: unhealthy nsamples array");
         return NULL;
     }
@@ -3002,7 +3597,7 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
     itmin = PyArray_DATA((PyArrayObject*) itmin_arr);
     nsamples = PyArray_DATA((PyArrayObject*) nsamples_arr);
 
-    nresults = nreceivers*cscheme->ncomponents;
+    nresults = ngroups*nreceivers*cscheme->ncomponents;
     // Initialize empty traces
     results = (result_trace_t*)calloc(nresults, sizeof(result_trace_t));
     if (results == NULL) {
@@ -3051,7 +3646,8 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
         ms,
         delays,
         receiver_coords,
-        nsources,
+        source_offsets,
+        ngroups,
         nreceivers,
         cscheme,
         mscheme,
@@ -3067,7 +3663,7 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
     }
 
     out_list = Py_BuildValue("[]");
-    for (ires=0; ires < nreceivers*cscheme->ncomponents; ires++) {
+    for (ires=0; ires < nresults; ires++) {
         result = &(results[ires]);
 
         data = malloc(result->nsamples * sizeof(gf_dtype));
@@ -3095,11 +3691,13 @@ static PyObject* w_store_calc_timeseries(PyObject *m, PyObject *args) {
 
 static PyObject* w_store_calc_static(PyObject *m, PyObject *args) {
     PyObject *capsule, *source_coords_arr, *receiver_coords_arr, *ms_arr, *delays_arr;
+    PyObject *source_offsets_arr = Py_None;
+    uint64_t *source_offsets, source_offsets_single[2];
     PyArrayObject *results_arr;
     float64_t *source_coords, *receiver_coords, *ms, *delays;
     gf_dtype *results[NCOMPONENTS_MAX];
     int32_t it, nthreads;
-    size_t icomponent, nsources, nreceivers;
+    size_t icomponent, nsources, nreceivers, ngroups;
 
     char *component_scheme_name, *interpolation_scheme_name;
     const component_scheme_t *cscheme;
@@ -3109,7 +3707,7 @@ static PyObject* w_store_calc_static(PyObject *m, PyObject *args) {
     store_t *store;
     PyObject *out_list;
 
-    npy_intp array_dims[1];
+    npy_intp array_dims[2];
     npy_intp shape_want_coords[2] = {-1, 5};
     npy_intp shape_want_ms[2] = {-1, 6};
 
@@ -3117,11 +3715,11 @@ static PyObject* w_store_calc_static(PyObject *m, PyObject *args) {
 
 
     if (!PyArg_ParseTuple(
-            args, "OOOOOssII", &capsule, &source_coords_arr, &ms_arr, &delays_arr, &receiver_coords_arr,
+            args, "OOOOOssII|O", &capsule, &source_coords_arr, &ms_arr, &delays_arr, &receiver_coords_arr,
             &component_scheme_name, &interpolation_scheme_name,
-            &it, &nthreads)) {
+            &it, &nthreads, &source_offsets_arr)) {
         PyErr_SetString(st->error,
-            "usage: calc_static(cstore, source_coords, moment_tensors, delays, receiver_coords, component_scheme, interpolation_name, it, nthreads)");
+            "usage: calc_static(cstore, source_coords, moment_tensors, delays, receiver_coords, component_scheme, interpolation_name, it, nthreads, source_offsets=None)");
         return NULL;
     }
 
@@ -3183,11 +3781,23 @@ static PyObject* w_store_calc_static(PyObject *m, PyObject *args) {
     nsources = PyArray_DIMS((PyArrayObject*)source_coords_arr)[0];
     nreceivers = PyArray_DIMS((PyArrayObject*)receiver_coords_arr)[0];
 
+    if (!get_source_offsets(
+            st, "w_store_calc_static", source_offsets_arr, nsources,
+            source_offsets_single, &source_offsets, &ngroups)) {
+        return NULL;
+    }
+
+    /* with source groups, results are 2D arrays (ngroups, nreceivers) */
     out_list = Py_BuildValue("[]");
-    array_dims[0] = (npy_intp) nreceivers;
+    array_dims[0] = (npy_intp) ngroups;
+    array_dims[1] = (npy_intp) nreceivers;
 
     for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
-        results_arr = (PyArrayObject*) PyArray_ZEROS(1, array_dims, NPY_GFDTYPE, 0);
+        if (source_offsets_arr == Py_None)
+            results_arr = (PyArrayObject*) PyArray_ZEROS(1, &array_dims[1], NPY_GFDTYPE, 0);
+        else
+            results_arr = (PyArrayObject*) PyArray_ZEROS(2, array_dims, NPY_GFDTYPE, 0);
+
         results[icomponent] = PyArray_DATA(results_arr);
 
         PyList_Append(out_list, (PyObject*)results_arr);
@@ -3200,7 +3810,8 @@ static PyObject* w_store_calc_static(PyObject *m, PyObject *args) {
         ms,
         delays,
         receiver_coords,
-        nsources,
+        source_offsets,
+        ngroups,
         nreceivers,
         cscheme,
         mscheme,
@@ -3230,6 +3841,12 @@ static PyMethodDef store_ext_methods[] = {
     {"store_get", w_store_get, METH_VARARGS,
         "Get a GF trace." },
 
+    {"store_cache_stats", w_store_cache_stats, METH_VARARGS,
+        "Get hit/miss statistics of the record cache." },
+
+    {"store_cache_set_nbytes_max", w_store_cache_set_nbytes_max, METH_VARARGS,
+        "Set memory budget of the record cache." },
+
     {"store_sum", w_store_sum, METH_VARARGS,
         "Get weight-and-delay-sum of GF traces." },
 
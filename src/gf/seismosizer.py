@@ -24,8 +24,9 @@ Name               Description
 =================  ============================================
 '''
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from functools import cmp_to_key
+import threading
 import time
 import math
 import os
@@ -39,6 +40,7 @@ from hashlib import sha1
 
 import numpy as num
 from scipy.interpolate import RegularGridInterpolator
+from scipy.signal import fftconvolve
 
 from pyrocko.guts import (Object, Float, String, StringChoice, List,
                           Timestamp, Int, SObject, ArgumentError, Dict,
@@ -809,6 +811,53 @@ def sshift(times, amplitudes, tshift, deltat):
     return times2, amplitudes2
 
 
+def convolve_stf(amplitudes, data, method='auto'):
+    '''
+    Convolve a seismogram with a discretized source time function.
+
+    The end of ``data`` is padded with its last value to prevent boundary
+    effects. The result has ``data.size + amplitudes.size - 1`` samples.
+
+    :param amplitudes: discretized STF as returned by
+        :py:meth:`STF.discretize_t`
+    :type amplitudes: :py:class:`numpy.ndarray`
+    :param data: seismogram samples
+    :type data: :py:class:`numpy.ndarray`
+    :param method: ``'direct'`` for convolution in the time domain,
+        ``'fft'`` for convolution in the frequency domain or ``'auto'`` to
+        choose the cheaper of the two, based on the lengths of the inputs.
+    :type method: str
+    '''
+
+    namp = amplitudes.size
+    ndata = data.size
+
+    if namp == 1:
+        return data * amplitudes[0]
+
+    if method == 'auto':
+        # Cost model fitted to timings of numpy.convolve and
+        # scipy.signal.fftconvolve, see test_gf_benchmark.
+        n = ndata + 2*namp - 1
+        if ndata * namp > 10. * n * math.log2(n) + 3e5:
+            method = 'fft'
+        else:
+            method = 'direct'
+
+    padded_data = num.empty(ndata + namp, dtype=float)
+    padded_data[:ndata] = data
+    padded_data[ndata:] = data[-1]
+
+    if method == 'fft':
+        data = fftconvolve(amplitudes, padded_data)
+    elif method == 'direct':
+        data = num.convolve(amplitudes, padded_data)
+    else:
+        raise ValueError('Invalid convolution method: %s' % method)
+
+    return data[:-namp]
+
+
 class BoxcarSTF(STF):
 
     '''
@@ -2626,6 +2675,9 @@ class PseudoDynamicRupture(SourceWithDerivedMagnitude):
 
     discretized_source_class = meta.DiscretizedMTSource
 
+    # derived or runtime attributes, not identifying the source
+    _params_hash_exclude = frozenset(['patches', 'coef_mat', 'nthreads'])
+
     strike = Float.T(
         default=0.0,
         help='Strike direction in [deg], measured clockwise from north.')
@@ -5138,6 +5190,9 @@ class ProcessingStats(Object):
     n_subrequests = Int.T(default=0)
     n_stores = Int.T(default=0)
     n_records_stacked = Int.T(default=0)
+    t_discretize_source = Float.T(default=0.)
+    n_discretize_source = Int.T(default=0)
+    n_discretize_source_cached = Int.T(default=0)
 
 
 class Response(Object):
@@ -5385,8 +5440,186 @@ class OutOfBoundsContext(Object):
     components = List.T(String.T())
 
 
-def process_dynamic_timeseries(work, psources, ptargets, engine, nthreads=0):
-    dsource_cache = {}
+def _update_params_hash(sha, obj):
+    if isinstance(obj, Object):
+        sha.update(type(obj).__name__.encode())
+        exclude = getattr(obj, '_params_hash_exclude', ())
+        for name, value in obj.T.inamevals(obj):
+            if name in exclude:
+                continue
+
+            sha.update(name.encode())
+            _update_params_hash(sha, value)
+
+    elif isinstance(obj, num.ndarray):
+        sha.update(str((obj.dtype.str, obj.shape)).encode())
+        sha.update(num.ascontiguousarray(obj).tobytes())
+
+    elif isinstance(obj, (list, tuple)):
+        sha.update(b'[')
+        for value in obj:
+            _update_params_hash(sha, value)
+        sha.update(b']')
+
+    else:
+        sha.update(repr(obj).encode())
+
+
+def _dsource_nbytes(dsource):
+    return sum(
+        value.nbytes for (_, value) in dsource.T.inamevals(dsource)
+        if isinstance(value, num.ndarray))
+
+
+class DiscretizedSourceCache(object):
+    '''
+    Cache for discretized sources, shared between requests.
+
+    Entries are identified by a hash over the source parameters, the GF
+    store ID and the interpolation method. Attributes derived from the
+    parameters during discretization (listed in the source class's
+    ``_params_hash_exclude``) are not included in the hash. When the memory
+    used by the cached discretized sources exceeds ``max_bytes``, the least
+    recently used entries are evicted.
+
+    Cached discretized sources are shared and must not be modified.
+
+    :param max_bytes:
+        Memory budget [bytes], ``None`` for no limit, ``0`` to disable
+        caching.
+    :type max_bytes:
+        int
+    '''
+
+    def __init__(self, max_bytes=None):
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._nhits = 0
+        self._nmisses = 0
+        self._nevictions = 0
+
+    def _evict(self):
+        if self._max_bytes is None:
+            return
+
+        # the most recently used entry is always kept, unless disabled
+        nkeep = 1 if self._max_bytes > 0 else 0
+        while self._nbytes > self._max_bytes \
+                and len(self._entries) > nkeep:
+
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+            self._nevictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def key(self, source, store_, target):
+        sha = sha1()
+        _update_params_hash(sha, source)
+        return (
+            sha.digest(),
+            store_.config.id,
+            target.interpolation if target is not None else None)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                dsource, _ = self._entries[key]
+                self._entries.move_to_end(key)
+                self._nhits += 1
+                return dsource
+
+            except KeyError:
+                self._nmisses += 1
+                return None
+
+    def put(self, key, dsource):
+        if self._max_bytes == 0:
+            return
+
+        nbytes = _dsource_nbytes(dsource)
+        with self._lock:
+            if key in self._entries:
+                return
+
+            self._entries[key] = dsource, nbytes
+            self._nbytes += nbytes
+            self._evict()
+
+    def get_stats(self):
+        '''
+        Get cache statistics.
+
+        :returns:
+            ``dict`` with keys ``'entries'``, ``'size'``, ``'size_max'``,
+            ``'hits'``, ``'misses'`` and ``'evictions'``.
+        '''
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                size=self._nbytes,
+                size_max=self._max_bytes,
+                hits=self._nhits,
+                misses=self._nmisses,
+                evictions=self._nevictions)
+
+
+class DiscretizedSourceRequestCache(object):
+    '''
+    Per-request cache of discretized sources with timing instrumentation.
+
+    Sources are looked up by object identity first, then in the shared
+    :py:class:`DiscretizedSourceCache`, if any.
+    '''
+
+    def __init__(self, shared=None):
+        self._entries = {}
+        self._shared = shared
+        self.t_discretize = 0.0
+        self.n_discretize = 0
+        self.n_discretize_cached = 0
+
+    def get(self, source, store_, target):
+        k_local = (source, store_)
+        if k_local in self._entries:
+            return self._entries[k_local]
+
+        if self._shared is not None:
+            k_shared = self._shared.key(source, store_, target)
+            dsource = self._shared.get(k_shared)
+        else:
+            dsource = None
+
+        if dsource is None:
+            t0 = time.time()
+            dsource = source.discretize_basesource(store_, target)
+            self.t_discretize += time.time() - t0
+            self.n_discretize += 1
+            if self._shared is not None:
+                self._shared.put(k_shared, dsource)
+        else:
+            self.n_discretize_cached += 1
+
+        self._entries[k_local] = dsource
+        return dsource
+
+
+def process_dynamic_timeseries(
+        work, psources, ptargets, engine, nthreads=0, dsource_cache=None):
+
+    if dsource_cache is None:
+        dsource_cache = {}
+
     tcounters = list(range(6))
 
     store_ids = set()
@@ -5404,67 +5637,63 @@ def process_dynamic_timeseries(work, psources, ptargets, engine, nthreads=0):
 
     store_ids = set([t.store_id for t in targets])
 
-    for isource, source in enumerate(psources):
-
-        components = set()
-        for itarget, target in enumerate(targets):
-            rule = engine.get_rule(source, target)
-            components.update(rule.required_components(target))
+    if not psources:
+        return
 
-        for store_id in store_ids:
-            store_targets = [t for t in targets if t.store_id == store_id]
-
-            sample_rates = set([t.sample_rate for t in store_targets])
-            interpolations = set([t.interpolation for t in store_targets])
-
-            base_seismograms = []
-            store_targets_out = []
-
-            for samp_rate in sample_rates:
-                for interp in interpolations:
-                    engine_targets = [
-                        t for t in store_targets if t.sample_rate == samp_rate
-                        and t.interpolation == interp]
-
-                    if not engine_targets:
-                        continue
-
-                    store_targets_out += engine_targets
-
-                    base_seismograms += engine.base_seismograms(
-                        source,
-                        engine_targets,
-                        components,
-                        dsource_cache,
-                        nthreads)
-
-            for iseis, seismogram in enumerate(base_seismograms):
-                for tr in seismogram.values():
-                    if tr.err != store.SeismosizerErrorEnum.SUCCESS:
-                        e = SeismosizerError(
-                            'Seismosizer failed with return code %i\n%s' % (
-                                tr.err, str(
+    components = set()
+    for target in targets:
+        rule = engine.get_rule(psources[0], target)
+        components.update(rule.required_components(target))
+
+    for store_id in store_ids:
+        store_targets = [t for t in targets if t.store_id == store_id]
+
+        groups = defaultdict(list)
+        for t in store_targets:
+            groups[t.sample_rate, t.interpolation].append(t)
+
+        for engine_targets in groups.values():
+            base_seismograms_many = engine.base_seismograms_many(
+                psources,
+                engine_targets,
+                components,
+                dsource_cache,
+                nthreads)
+
+            for isource, (source, base_seismograms) in enumerate(
+                    zip(psources, base_seismograms_many)):
+
+                for iseis, seismogram in enumerate(base_seismograms):
+                    for tr in seismogram.values():
+                        if tr.err != store.SeismosizerErrorEnum.SUCCESS:
+                            e = SeismosizerError(
+                                'Seismosizer failed with return code %i\n%s'
+                                % (tr.err, str(
                                     OutOfBoundsContext(
                                         source=source,
-                                        target=store_targets[iseis],
+                                        target=engine_targets[iseis],
                                         distance=source.distance_to(
-                                            store_targets[iseis]),
+                                            engine_targets[iseis]),
                                         components=components))))
-                        raise e
+                            raise e
 
-            for seismogram, target in zip(base_seismograms, store_targets_out):
+                for seismogram, target in zip(
+                        base_seismograms, engine_targets):
 
-                try:
-                    result = engine._post_process_dynamic(
-                        seismogram, source, target)
-                except SeismosizerError as e:
-                    result = e
+                    try:
+                        result = engine._post_process_dynamic(
+                            seismogram, source, target)
+                    except SeismosizerError as e:
+                        result = e
+
+                    yield (isource, target._id, result), tcounters
 
-                yield (isource, target._id, result), tcounters
 
+def process_dynamic(
+        work, psources, ptargets, engine, nthreads=0, dsource_cache=None):
 
-def process_dynamic(work, psources, ptargets, engine, nthreads=0):
-    dsource_cache = {}
+    if dsource_cache is None:
+        dsource_cache = {}
 
     for w in work:
         _, _, isources, itargets = w
@@ -5515,7 +5744,12 @@ def process_dynamic(work, psources, ptargets, engine, nthreads=0):
                 yield (isource, itarget, result), tcounters
 
 
-def process_static(work, psources, ptargets, engine, nthreads=0):
+def process_static(
+        work, psources, ptargets, engine, nthreads=0, dsource_cache=None):
+
+    if dsource_cache is None:
+        dsource_cache = {}
+
     for w in work:
         _, _, isources, itargets = w
 
@@ -5529,7 +5763,8 @@ def process_static(work, psources, ptargets, engine, nthreads=0):
 
                 try:
                     base_statics, tcounters = engine.base_statics(
-                        source, target, components, nthreads)
+                        source, target, components, nthreads,
+                        dsource_cache)
                 except meta.OutOfBounds as e:
                     e.context = OutOfBoundsContext(
                         source=sources[0],
@@ -5579,10 +5814,19 @@ class LocalEngine(Engine):
         default=1,
         help='default number of threads to utilize')
 
+    dsource_cache_max_bytes = Int.T(
+        optional=True,
+        default=100*1024**2,
+        help='memory budget [bytes] of the cache for discretized sources, '
+             'which is shared between requests. Set to ``0`` to disable '
+             'the cache or to ``None`` for no limit.')
+
     def __init__(self, **kwargs):
         use_env = kwargs.pop('use_env', False)
         use_config = kwargs.pop('use_config', False)
         Engine.__init__(self, **kwargs)
+        self._dsource_cache = DiscretizedSourceCache(
+            self.dsource_cache_max_bytes)
         if use_env:
             env_store_superdirs = os.environ.get('GF_STORE_SUPERDIRS', '')
             env_store_dirs = os.environ.get('GF_STORE_DIRS', '')
@@ -5602,6 +5846,21 @@ class LocalEngine(Engine):
         self._open_stores = {}
         self._effective_default_store_id = None
 
+    def get_dsource_cache_stats(self):
+        '''
+        Get statistics of the cache for discretized sources.
+
+        :returns:
+            ``dict``, see :py:meth:`DiscretizedSourceCache.get_stats`.
+        '''
+        return self._dsource_cache.get_stats()
+
+    def clear_dsource_cache(self):
+        '''
+        Remove all entries from the cache for discretized sources.
+        '''
+        self._dsource_cache.clear()
+
     def _check_store_dirs_type(self):
         for sdir in ['store_dirs', 'store_superdirs']:
             if not isinstance(self.__getattribute__(sdir), list):
@@ -5755,6 +6014,9 @@ class LocalEngine(Engine):
                 source.__class__.__name__))
 
     def _cached_discretize_basesource(self, source, store, cache, target):
+        if isinstance(cache, DiscretizedSourceRequestCache):
+            return cache.get(source, store, target)
+
         if (source, store) not in cache:
             cache[source, store] = source.discretize_basesource(store, target)
 
@@ -5763,6 +6025,25 @@ class LocalEngine(Engine):
     def base_seismograms(self, source, targets, components, dsource_cache,
                          nthreads=None):
 
+        return self.base_seismograms_many(
+            [source], targets, components, dsource_cache, nthreads)[0]
+
+    def base_seismograms_many(self, sources, targets, components,
+                              dsource_cache, nthreads=None):
+
+        '''
+        Compute base seismograms for several sources and a common target set.
+
+        The targets must share store, sample rate and interpolation scheme.
+        All sources are discretized (using ``dsource_cache``) and the
+        seismograms for all source-target combinations are computed in a
+        single call to :py:meth:`pyrocko.gf.store.Store.calc_many_seismograms`.
+
+        :returns: For each source a list with, for each target, a ``dict``
+            mapping component names to :py:class:`~pyrocko.gf.store.GFTrace`
+            objects.
+        '''
+
         target = targets[0]
 
         interp = set([t.interpolation for t in targets])
@@ -5799,21 +6080,24 @@ class LocalEngine(Engine):
         nsamples = itmax - itmin + 1
         nsamples[num.logical_not(mask)] = -1
 
-        base_source = self._cached_discretize_basesource(
-            source, store_, dsource_cache, target)
+        base_sources = [
+            self._cached_discretize_basesource(
+                source, store_, dsource_cache, target)
+            for source in sources]
 
-        base_seismograms = store_.calc_seismograms(
-            base_source, receivers, components,
+        base_seismograms_many = store_.calc_many_seismograms(
+            base_sources, receivers, components,
             deltat=deltat,
             itmin=itmin, nsamples=nsamples,
             interpolation=target.interpolation,
             optimization=target.optimization,
             nthreads=nthreads if nthreads is not None else 1)
 
-        for i, base_seismogram in enumerate(base_seismograms):
-            base_seismograms[i] = store.make_same_span(base_seismogram)
+        for base_seismograms in base_seismograms_many:
+            for i, base_seismogram in enumerate(base_seismograms):
+                base_seismograms[i] = store.make_same_span(base_seismogram)
 
-        return base_seismograms
+        return base_seismograms_many
 
     def base_seismogram(self, source, target, components, dsource_cache,
                         nthreads):
@@ -5859,7 +6143,8 @@ class LocalEngine(Engine):
 
         return base_seismogram, tcounters
 
-    def base_statics(self, source, target, components, nthreads):
+    def base_statics(self, source, target, components, nthreads,
+                     dsource_cache=None):
         tcounters = [xtime()]
         store_ = self.get_store(target.store_id)
 
@@ -5870,7 +6155,11 @@ class LocalEngine(Engine):
             itsnapshot = None
         tcounters.append(xtime())
 
-        base_source = source.discretize_basesource(store_, target=target)
+        if dsource_cache is None:
+            dsource_cache = {}
+
+        base_source = self._cached_discretize_basesource(
+            source, store_, dsource_cache, target)
 
         tcounters.append(xtime())
 
@@ -5886,6 +6175,144 @@ class LocalEngine(Engine):
 
         return base_statics, tcounters
 
+    def make_static_gf_matrix(
+            self, patches, targets, slip_components=('strike', 'dip'),
+            nthreads=None, filename=None):
+
+        '''
+        Assemble Green's function matrix for a linear static slip inversion.
+
+        For each patch and slip component, a unit slip source is discretized
+        and its static displacements at all targets are computed. All patch
+        sources for a target are evaluated in a single call to
+        :py:meth:`pyrocko.gf.store.Store.calc_many_statics`.
+
+        Columns are ordered by slip component, then by patch, i.e. column
+        ``icomponent * npatches + ipatch``. Rows are given by
+        :py:meth:`~pyrocko.gf.targets.StaticTarget.get_gf_matrix_rows` for
+        each target, stacked in the order of ``targets``.
+
+        :param patches:
+            Fault patches, e.g. as created by
+            :py:meth:`PseudoDynamicRupture.discretize_patches`.
+        :type patches:
+            list of :py:class:`~pyrocko.modelling.okada.OkadaSource`
+
+        :param targets:
+            Static targets.
+        :type targets:
+            list of :py:class:`~pyrocko.gf.targets.StaticTarget`
+
+        :param slip_components:
+            Slip components to be used for the matrix columns. Choose from
+            ``'strike'`` (rake 0), ``'dip'`` (rake 90) and ``'tensile'``
+            (opening).
+        :type slip_components:
+            tuple of str
+
+        :param nthreads:
+            Number of threads to use, ``0`` for all available cores. Defaults
+            to :py:attr:`nthreads`.
+        :type nthreads:
+            int
+
+        :param filename:
+            If given, the matrix is written to a memory mapped ``.npy`` file
+            at this path.
+        :type filename:
+            str
+
+        :returns:
+            Green's function matrix, with displacements in [m] per [m] of
+            slip.
+        :rtype:
+            :py:class:`numpy.ndarray` (or :py:class:`numpy.memmap` if
+            ``filename`` is given)
+        '''
+
+        slip_params = {
+            'strike': dict(rake=0., opening_fraction=0.),
+            'dip': dict(rake=90., opening_fraction=0.),
+            'tensile': dict(rake=0., opening_fraction=1.)}
+
+        for slip_component in slip_components:
+            if slip_component not in slip_params:
+                raise BadRequest(
+                    'Invalid slip component: %s' % slip_component)
+
+        if nthreads is None:
+            nthreads = self.nthreads
+
+        unit_sources = []
+        for slip_component in slip_components:
+            for patch in patches:
+                rotmat = pmt.euler_to_matrix(
+                    patch.dip*d2r, patch.strike*d2r, 0.0)
+                center = num.dot(rotmat.T, num.array([
+                    0.5*(patch.al1 + patch.al2),
+                    -0.5*(patch.aw1 + patch.aw2),
+                    0.]))
+
+                unit_sources.append(RectangularSource(
+                    lat=patch.lat,
+                    lon=patch.lon,
+                    north_shift=patch.north_shift + center[0],
+                    east_shift=patch.east_shift + center[1],
+                    depth=patch.depth + center[2],
+                    strike=patch.strike,
+                    dip=patch.dip,
+                    length=patch.al2 - patch.al1,
+                    width=patch.aw2 - patch.aw1,
+                    anchor='center',
+                    slip=1.0,
+                    **slip_params[slip_component]))
+
+        nrows = sum(target.get_gf_matrix_nrows() for target in targets)
+        shape = (nrows, len(unit_sources))
+        if filename is not None:
+            gf_matrix = num.lib.format.open_memmap(
+                filename, mode='w+', dtype=float, shape=shape)
+        else:
+            gf_matrix = num.zeros(shape, dtype=float)
+
+        base_sources_cache = {}
+        irow = 0
+        for target in targets:
+            store_ = self.get_store(target.store_id)
+            rule = self.get_rule(unit_sources[0], target)
+            components = rule.required_components(target)
+
+            if target.tsnapshot is not None:
+                itsnapshot = int(num.floor(
+                    target.tsnapshot * store_.config.sample_rate))
+            else:
+                itsnapshot = None
+
+            k = (store_, target.interpolation)
+            if k not in base_sources_cache:
+                base_sources_cache[k] = [
+                    source.discretize_basesource(store_, target=target)
+                    for source in unit_sources]
+
+            base_statics = store_.calc_many_statics(
+                base_sources_cache[k],
+                target,
+                itsnapshot,
+                components,
+                target.interpolation,
+                nthreads)
+
+            base_statics = rule.apply_(target, base_statics)
+
+            rows = target.get_gf_matrix_rows(base_statics)
+            gf_matrix[irow:irow+rows.shape[0], :] = rows
+            irow += rows.shape[0]
+
+        if filename is not None:
+            gf_matrix.flush()
+
+        return gf_matrix
+
     def _post_process_dynamic(self, base_seismogram, source, target):
         base_any = next(iter(base_seismogram.values()))
         deltat = base_any.deltat
@@ -5903,17 +6330,13 @@ class LocalEngine(Engine):
         times, amplitudes = stf.discretize_t(
             deltat, 0.0)
 
-        # repeat end point to prevent boundary effects
-        padded_data = num.empty(data.size + amplitudes.size, dtype=float)
-        padded_data[:data.size] = data
-        padded_data[data.size:] = data[-1]
-        data = num.convolve(amplitudes, padded_data)
+        data = convolve_stf(amplitudes, data)
 
         tmin = itmin * deltat + times[0]
 
         tr = meta.SeismosizerTrace(
             codes=target.codes,
-            data=data[:-amplitudes.size],
+            data=data,
             deltat=deltat,
             tmin=tmin)
 
@@ -5980,6 +6403,9 @@ class LocalEngine(Engine):
         for store_id in store_ids:
             self.get_store(store_id)
 
+        self._dsource_cache.set_max_bytes(self.dsource_cache_max_bytes)
+        dsource_cache = DiscretizedSourceRequestCache(self._dsource_cache)
+
         source_index = dict((x, i) for (i, x) in
                             enumerate(request.sources))
         target_index = dict((x, i) for (i, x) in
@@ -6016,7 +6442,7 @@ class LocalEngine(Engine):
 
             for ii_results, tcounters_dyn in _process_dynamic(
                     work_dynamic, request.sources, request.targets, self,
-                    nthreads):
+                    nthreads, dsource_cache):
 
                 tcounters_dyn_list.append(num.diff(tcounters_dyn))
                 isource, itarget, result = ii_results
@@ -6038,7 +6464,7 @@ class LocalEngine(Engine):
 
             for ii_results, tcounters_static in process_static(
                     work_static, request.sources, request.targets, self,
-                    nthreads=nthreads):
+                    nthreads=nthreads, dsource_cache=dsource_cache):
 
                 tcounters_static_list.append(num.diff(tcounters_static))
                 isource, itarget, result = ii_results
@@ -6080,6 +6506,10 @@ class LocalEngine(Engine):
              s.t_perc_static_sum_statics,
              s.t_perc_static_post_process) = perc_static
 
+        s.t_discretize_source = dsource_cache.t_discretize
+        s.n_discretize_source = dsource_cache.n_discretize
+        s.n_discretize_source_cached = dsource_cache.n_discretize_cached
+
         s.t_wallclock = tt1 - tt0
         if resource:
             s.t_cpu = (
@@ -3,39 +3,35 @@
 # The Pyrocko Developers, 21st Century
 # ---|P------/S----------~Lg----------
 '''
-Simple async HTTP server
-
-Based on this recipe:
-
-    http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/440665
-
-which is based on this one:
-
-    http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/259148
+Asynchronous HTTP server for the GF web service (:app:`fomosto server`).
+
+The server is built on :py:mod:`asyncio`. Store files and listings are served
+directly from the event loop. Seismosizer requests are handed to a pool of
+worker threads, so that a heavy request does not block other clients. The
+number of seismosizer requests being processed or waiting for a free worker is
+bounded; excess requests are rejected with ``503 Service Unavailable``. The
+YAML response of the seismosizer is streamed to the client with chunked
+transfer encoding while it is being serialized.
 '''
 
-import asynchat
-import asyncore
-import socket
-try:
-    from http.server import SimpleHTTPRequestHandler as SHRH
-    from html import escape
-except ImportError:
-    from SimpleHTTPServer import SimpleHTTPRequestHandler as SHRH
-    from cgi import escape
-
 import sys
-
-import json
-import cgi
-from io import BytesIO
 import io
 import os
-import traceback
-import posixpath
 import re
-from collections import deque
+import json
+import socket
 import logging
+import asyncio
+import threading
+import posixpath
+import mimetypes
+import email.utils
+import email.parser
+import http.client
+from http import HTTPStatus
+from html import escape
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib
 matplotlib.use('Agg')  # noqa
@@ -47,7 +43,7 @@ from pyrocko.util import quote, unquote  # noqa
 
 logger = logging.getLogger('pyrocko.gf.server')
 
-__version__ = '1.0'
+__version__ = '2.0'
 
 store_id_pattern = gf.StringID.pattern[1:-1]
 
@@ -59,276 +55,384 @@ def enc(s):
         return s
 
 
-def popall(self):
-    # Preallocate the list to save memory resizing.
-    r = len(self)*[None]
-    for i in range(len(r)):
-        r[i] = self.popleft()
-    return r
+class HTTPError(Exception):
+    '''
+    Raised by request handlers to respond with an HTTP error status.
+    '''
+
+    def __init__(self, code, message=None):
+        Exception.__init__(self, code, message)
+        self.code = code
+        self.message = message
 
 
-class writewrapper(object):
-    def __init__(self, d, blocksize=4096):
-        self.blocksize = blocksize
-        self.d = d
+class StreamAborted(Exception):
+    pass
+
+
+class ResponseStream(object):
+    '''
+    Pipe between a worker thread and the event loop.
+
+    The worker thread writes to this object like to a file. Data is collected
+    into chunks of ``chunksize`` bytes which are passed to the event loop. At
+    most ``maxchunks`` chunks are in flight; if the client reads slower than
+    the response is produced, the writing thread is blocked.
+    '''
+
+    def __init__(self, loop, chunksize=65536, maxchunks=8):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._space = threading.Semaphore(maxchunks)
+        self._chunksize = chunksize
+        self._buffer = []
+        self._nbuffer = 0
+        self._aborted = False
+
+    # called from the worker thread
+
+    def _put(self, item):
+        while not self._space.acquire(timeout=1.0):
+            if self._aborted:
+                raise StreamAborted()
+
+        if self._aborted:
+            raise StreamAborted()
+
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # event loop has been closed
+            self._aborted = True
+            raise StreamAborted()
+
+    def _put_buffer(self):
+        if self._buffer:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._nbuffer = 0
+            self._put(('data', data))
 
     def write(self, data):
-        if self.blocksize in (None, -1):
-            self.d.append(data)
-        else:
-            BS = self.blocksize
-            xtra = 0
-            if len(data) % BS:
-                xtra = len(data) % BS + BS
-            buf = self.d
-            for i in range(0, len(data)-xtra, BS):
-                buf.append(data[i:i+BS])
-            if xtra:
-                buf.append(data[-xtra:])
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self._buffer.append(data)
+        self._nbuffer += len(data)
+        if self._nbuffer >= self._chunksize:
+            self._put_buffer()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._put_buffer()
+        self._put(('end', None))
+
+    def fail(self, exception):
+        self._buffer = []
+        self._put(('error', exception))
+
+    # called from the event loop
+
+    async def get(self):
+        item = await self._queue.get()
+        self._space.release()
+        return item
+
+    async def __aiter__(self):
+        while True:
+            kind, value = await self.get()
+            if kind == 'data':
+                yield value
+            elif kind == 'end':
+                return
+            else:
+                raise value
 
+    def abort(self):
+        self._aborted = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._space.release()
 
-class RequestHandler(asynchat.async_chat, SHRH):
+
+class RequestHandler(object):
+    '''
+    Minimal asynchronous HTTP/1.1 request handler.
+
+    One handler instance is created per client connection. Requests on a
+    persistent connection are handled one after another. Subclasses implement
+    :py:meth:`send_head`, which sends the response status and headers and
+    returns the response body. The body may be ``None``, a :py:class:`bytes`
+    object, an open file (sent with :py:meth:`asyncio.loop.sendfile`) or an
+    asynchronous iterator of :py:class:`bytes` chunks (sent with chunked
+    transfer encoding).
+    '''
 
     server_version = 'Seismosizer/'+__version__
     protocol_version = 'HTTP/1.1'
-    blocksize = 4096
+    keepalive_timeout = 15.
+    max_body_size = 100*1024**2
 
-    # In enabling the use of buffer objects by setting use_buffer to True,
-    # any data block sent will remain in memory until it has actually been
-    # sent.
-    use_buffer = False
-
-    def __init__(self, conn, addr, server):
-        asynchat.async_chat.__init__(self, conn)
-        self.client_address = addr
-        self.connection = conn
+    def __init__(self, server, reader, writer):
         self.server = server
-        self.opened = []
-        # set the terminator : when it is received, this means that the
-        # http request is complete ; control will be passed to
-        # self.found_terminator
-        self.set_terminator(b'\r\n\r\n')
-        self.incoming = deque()
-        self.outgoing = deque()
-        self.rfile = None
-        self.wfile = writewrapper(
-            self.outgoing,
-            -self.use_buffer or self.blocksize)
-        self.found_terminator = self.handle_request_line
-        self.request_version = 'HTTP/1.1'
+        self.reader = reader
+        self.writer = writer
+        self.client_address = writer.get_extra_info('peername')
+        self.close_connection = True
+        self.reset()
+
+    def reset(self):
+        self.requestline = ''
+        self.command = None
+        self.path = None
+        self.request_version = self.protocol_version
+        self.headers = http.client.HTTPMessage()
+        self.body = {}
         self.code = None
-        # buffer the response and headers to avoid several calls to select()
-
-    def update_b(self, fsize):
-        if fsize > 1048576:
-            self.use_buffer = True
-            self.blocksize = 131072
-
-    def collect_incoming_data(self, data):
-        '''Collect the data arriving on the connexion'''
-        if not data:
-            self.ac_in_buffer = ''
-            return
-        self.incoming.append(data)
-
-    def prepare_POST(self):
-        '''Prepare to read the request body'''
+        self.headers_sent = False
+
+    async def handle(self):
         try:
-            bytesToRead = int(self.headers.getheader('Content-length'))
-        except AttributeError:
-            bytesToRead = int(self.headers['Content-length'])
-        # set terminator to length (will read bytesToRead bytes)
-        self.set_terminator(bytesToRead)
-        self.incoming.clear()
-        # control will be passed to a new found_terminator
-        self.found_terminator = self.handle_post_data
-
-    def handle_post_data(self):
-        '''Called when a POST request body has been read'''
-        self.rfile = BytesIO(b''.join(popall(self.incoming)))
-        self.rfile.seek(0)
-        self.do_POST()
-
-    def parse_request_url(self):
-        # Check for query string in URL
-        qspos = self.path.find('?')
-        if qspos >= 0:
-            self.body = cgi.parse_qs(self.path[qspos+1:], keep_blank_values=1)
-            self.path = self.path[:qspos]
-        else:
-            self.body = {}
-
-    def do_HEAD(self):
-        '''Begins serving a HEAD request'''
-        self.parse_request_url()
-        f = self.send_head()
-        if f:
-            f.close()
-        self.log_request(self.code)
+            while True:
+                self.reset()
+                if not await self.handle_one_request():
+                    break
+
+                await self.writer.drain()
+                if self.close_connection:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError):
+            pass
+
+        except Exception:
+            logger.exception('Unhandled error in request handler.')
+
+        finally:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def handle_one_request(self):
+        try:
+            data = await asyncio.wait_for(
+                self.reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return False
+
+        except asyncio.LimitOverrunError:
+            self.send_error(431)
+            return False
+
+        requestline, _, header_data = data.partition(b'\r\n')
+        self.requestline = requestline.decode('latin-1')
+        words = self.requestline.split()
+        if len(words) != 3:
+            self.send_error(400, 'Bad request syntax (%r)' % self.requestline)
+            return False
+
+        self.command, path, self.request_version = words
+
+        if not self.request_version.startswith('HTTP/1.'):
+            self.send_error(505)
+            return False
+
+        self.headers = http.client.parse_headers(io.BytesIO(header_data))
+        conntype = self.headers.get('Connection', '').lower()
+        self.close_connection = not (
+            (self.request_version == 'HTTP/1.1' and conntype != 'close')
+            or conntype == 'keep-alive')
+
+        self.path, _, query = path.partition('?')
+        self.body = parse_qs(query, keep_blank_values=True)
+
+        method = getattr(self, 'do_' + self.command, None)
+        if method is None:
+            self.send_error(501, 'Unsupported method (%s)' % self.command)
+            return False
 
-    def do_GET(self):
-        '''Begins serving a GET request'''
-        self.parse_request_url()
-        self.handle_data()
+        try:
+            await method()
+
+        except HTTPError as e:
+            if self.headers_sent:
+                self.close_connection = True
+            else:
+                self.send_error(e.code, e.message)
+
+        return True
+
+    async def read_body(self):
+        '''Read and parse the request body of a POST request.'''
+
+        if 'Content-Length' not in self.headers:
+            self.close_connection = True
+            raise HTTPError(411)
 
-    def do_POST(self):
-        '''Begins serving a POST request. The request data must be readable
-        on a file-like object called self.rfile'''
         try:
-            data = cgi.parse_header(self.headers.getheader('content-type'))
-            length = int(self.headers.getheader('content-length', 0))
-        except AttributeError:
-            data = cgi.parse_header(self.headers.get('content-type'))
-            length = int(self.headers.get('content-length', 0))
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            self.close_connection = True
+            raise HTTPError(400, 'Invalid Content-Length')
+
+        if length > self.max_body_size:
+            self.close_connection = True
+            raise HTTPError(413)
 
-        ctype, pdict = data if data else (None, None)
+        data = await self.reader.readexactly(length)
 
+        ctype = self.headers.get_content_type()
         if ctype == 'multipart/form-data':
-            self.body = cgi.parse_multipart(self.rfile, pdict)
+            msg = email.parser.BytesParser().parsebytes(
+                b'Content-Type: '
+                + self.headers['Content-Type'].encode('latin-1')
+                + b'\r\n\r\n' + data)
+
+            if msg.is_multipart():
+                for part in msg.get_payload():
+                    name = part.get_param(
+                        'name', header='content-disposition')
+                    if name is not None:
+                        self.body.setdefault(name, []).append(
+                            part.get_payload(decode=True).decode('utf-8'))
+
         elif ctype == 'application/x-www-form-urlencoded':
-            qs = self.rfile.read(length)
-            self.body = cgi.parse_qs(qs, keep_blank_values=1)
+            for k, v in parse_qs(
+                    data.decode('latin-1'), keep_blank_values=True).items():
+                self.body.setdefault(k, []).extend(v)
+
+    async def do_HEAD(self):
+        '''Serve a HEAD request.'''
+        body = await self.send_head()
+        if hasattr(body, 'close'):
+            body.close()
+
+        self.log_request(self.code)
+
+    async def do_GET(self):
+        '''Serve a GET request.'''
+        body = await self.send_head()
+        await self.send_body(body)
+
+    async def do_POST(self):
+        '''Serve a POST request.'''
+        await self.read_body()
+        body = await self.send_head()
+        await self.send_body(body)
+
+    async def send_body(self, body):
+        size = '-'
+        if body is None:
+            pass
+
+        elif isinstance(body, bytes):
+            self.writer.write(body)
+            size = len(body)
+
+        elif hasattr(body, 'read'):
+            try:
+                await self.writer.drain()
+                loop = asyncio.get_running_loop()
+                size = await loop.sendfile(self.writer.transport, body)
+            finally:
+                body.close()
+
         else:
-            self.body = {}
-        # self.handle_post_body()
-        self.handle_data()
+            size = 0
+            try:
+                async for chunk in body:
+                    self.writer.write(
+                        b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+                    size += len(chunk)
+                    await self.writer.drain()
 
-    def handle_close(self):
-        for f in self.opened:
-            if not f.closed:
-                f.close()
-        asynchat.async_chat.handle_close(self)
+                self.writer.write(b'0\r\n\r\n')
 
-    def handle_data(self):
+            except Exception:
+                self.close_connection = True
+                raise
+
+            finally:
+                if hasattr(body, 'abort'):
+                    body.abort()
+
+        await self.writer.drain()
+        self.log_request(self.code, size)
+
+    async def send_head(self):
         '''Class to override'''
+        raise HTTPError(404, 'File not found')
 
-        f = self.send_head()
-        if f:
-            # do some special things with file objects so that we don't have
-            # to read them all into memory at the same time...may leave a
-            # file handle open for longer than is really desired, but it does
-            # make it able to handle files of unlimited size.
+    def send_response(self, code, message=None):
+        self.code = code
+        if message is None:
             try:
-                size = sys.getsizeof(f)
-            except (AttributeError, io.UnsupportedOperation):
-                size = len(f.getvalue())
+                message = HTTPStatus(code).phrase
+            except ValueError:
+                message = ''
 
-            self.update_b(size)
-            self.log_request(self.code, size)
-            self.outgoing.append(f)
-        else:
-            self.log_request(self.code)
-            # signal the end of this request
-            self.outgoing.append(None)
-
-    def handle_request_line(self):
-        '''Called when the http request line and headers have been received'''
-        # prepare attributes needed in parse_request()
-        self.rfile = BytesIO(b''.join(popall(self.incoming)))
-        self.rfile.seek(0)
-        self.raw_requestline = self.rfile.readline()
-        self.parse_request()
-
-        if self.command in ['GET', 'HEAD']:
-            # if method is GET or HEAD, call do_GET or do_HEAD and finish
-            method = 'do_'+self.command
-            if hasattr(self, method):
-                getattr(self, method)()
-        elif self.command == 'POST':
-            # if method is POST, call prepare_POST, don't finish yet
-            self.prepare_POST()
-        else:
-            self.send_error(501, 'Unsupported method (%s)' % self.command)
+        self._header_lines = [
+            '%s %d %s' % (self.protocol_version, code, message)]
+        self.send_header('Server', self.server_version)
+        self.send_header('Date', email.utils.formatdate(usegmt=True))
 
-    def handle_error(self):
-        try:
-            traceback.print_exc(sys.stderr)
-        except Exception:
-            logger.error(
-                'An error occurred and another one while printing the '
-                'traceback. Please debug me...')
-
-        self.close()
-
-    def writable(self):
-        return len(self.outgoing) and self.connected
-
-    def handle_write(self):
-        out = self.outgoing
-        while len(out):
-            a = out.popleft()
-
-            a = enc(a)
-            # handle end of request disconnection
-            if a is None:
-                # Some clients have issues with keep-alive connections, or
-                # perhaps I implemented them wrong.
-
-                # If the user is running a Python version < 2.4.1, there is a
-                # bug with SimpleHTTPServer:
-                #     http://python.org/sf/1097597
-                # So we should be closing anyways, even though the client will
-                # claim a partial download, so as to prevent hung-connections.
-                # if self.close_connection:
-                self.close()
-                return
+    def send_header(self, keyword, value):
+        self._header_lines.append('%s: %s' % (keyword, value))
+        if keyword.lower() == 'connection' and value.lower() == 'close':
+            self.close_connection = True
 
-            # handle file objects
-            elif hasattr(a, 'read'):
-                _a, a = a, a.read(self.blocksize)
-                if not len(a):
-                    _a.close()
-                    del _a
-                    continue
-                else:
-                    out.appendleft(_a)  # noqa
-                    break
+    def end_headers(self):
+        if self.close_connection:
+            self.send_header('Connection', 'close')
 
-            # handle string/buffer objects
-            elif len(a):
-                break
-        else:
-            # if we get here, the outgoing deque is empty
-            return
+        self._header_lines.append('\r\n')
+        self.writer.write('\r\n'.join(self._header_lines).encode('latin-1'))
+        self.headers_sent = True
 
-        # if we get here, 'a' is a string or buffer object of length > 0
+    def send_error(self, code, message=None):
         try:
-            num_sent = self.send(a)
-            if num_sent < len(a):
-                if not num_sent:
-                    # this is probably overkill, but it can save the
-                    # allocations of buffers when they are enabled
-                    out.appendleft(a)
-                elif self.use_buffer:
-                    out.appendleft(buffer(a, num_sent))  # noqa
-                else:
-                    out.appendleft(a[num_sent:])
+            phrase = HTTPStatus(code).phrase
+        except ValueError:
+            phrase = ''
 
-        except socket.error as why:
-            if isinstance(why, str):
-                self.log_error(why)
-            elif isinstance(why, tuple) and isinstance(why[-1], str):
-                self.log_error(why[-1])
-            else:
-                self.log_error(str(why))
-            self.handle_error()
-
-    def log(self, message):
-        self.log_info(message)
-
-    def log_info(self, message, type='info'):
-        {
-            'debug': logger.debug,
-            'info': logger.info,
-            'warning': logger.warning,
-            'error': logger.error
-        }.get(type, logger.info)(str(message))
-
-    def log_message(self, format, *args):
-        self.log_info('%s - - [%s] %s \"%s\" \"%s\"\n' % (
+        s = enc(
+            '<html>\n<title>Error %d</title>\n<body>\n<h1>Error %d: %s</h1>\n'
+            '<p>%s</p>\n</body>\n</html>\n' % (
+                code, code, escape(phrase),
+                escape(message or phrase)))
+
+        self.send_response(code, phrase)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(s)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.writer.write(s)
+
+        self.log_request(code)
+
+    def redirect(self, path):
+        self.send_response(301)
+        self.send_header('Location', path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        else:
+            return str(self.client_address)
+
+    def log_request(self, code='-', size='-'):
+        logger.info('%s - - "%s" %s %s "%s" "%s"' % (
             self.address_string(),
-            self.log_date_time_string(),
-            format % args,
+            self.requestline,
+            code, size,
             self.headers.get('referer', ''),
             self.headers.get('user-agent', '')))
 
@@ -336,12 +440,11 @@ class RequestHandler(asynchat.async_chat, SHRH):
         return os.listdir(path)
 
     def list_directory(self, path):
-        '''Helper to produce a directory listing (absent index.html).
-
-        Return value is either a file object, or None (indicating an
-        error).  In either case, the headers are sent, making the
-        interface the same as for send_head().
+        '''
+        Helper to produce a directory listing (absent index.html).
 
+        Sends the response headers and returns the listing as
+        :py:class:`bytes` or ``None`` in case of an error.
         '''
         try:
             list = self.listdir(path)
@@ -350,7 +453,7 @@ class RequestHandler(asynchat.async_chat, SHRH):
             return None
 
         list.sort(key=lambda a: a.lower())
-        f = BytesIO()
+        f = io.BytesIO()
         displaypath = escape(unquote(self.path))
         f.write(enc('<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">'))
         f.write(enc('<html>\n<title>Directory listing for %s</title>\n'
@@ -372,39 +475,27 @@ class RequestHandler(asynchat.async_chat, SHRH):
                         (quote(linkname),
                          escape(displayname))))
         f.write(enc('</ul>\n<hr>\n</body>\n</html>\n'))
-        length = f.tell()
-        f.seek(0)
+        s = f.getvalue()
         encoding = sys.getfilesystemencoding()
 
         self.send_response(200, 'OK')
-        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Length', str(len(s)))
         self.send_header('Content-Type', 'text/html; charset=%s' % encoding)
         self.end_headers()
 
-        return f
-
-    def redirect(self, path):
-        self.send_response(301)
-        self.send_header('Location', path)
-        self.end_headers()
-
-    def send_head(self):
-        '''Common code for GET and HEAD commands.
-
-        This sends the response code and MIME headers.
+        return s
 
-        Return value is either a file object (which has to be copied
-        to the outputfile by the caller unless the command was HEAD,
-        and must be closed by the caller under all circumstances), or
-        None, in which case the caller has nothing further to do.
+    def send_file(self):
+        '''
+        Send headers for the file or directory referenced by the request path.
 
+        Returns the opened file, a directory listing or ``None``.
         '''
         path = self.translate_path(self.path)
         if path is None:
             self.send_error(404, 'File not found')
             return None
 
-        f = None
         if os.path.isdir(path):
             if not self.path.endswith('/'):
                 # redirect browser - doing basically what apache does
@@ -418,19 +509,27 @@ class RequestHandler(asynchat.async_chat, SHRH):
             # newline translations, making the actual size of the content
             # transmitted *less* than the content-length!
             f = open(path, 'rb')
-            self.opened.append(f)
         except IOError:
             self.send_error(404, 'File not found')
             return None
+
         fs = os.fstat(f.fileno())
         self.send_response(200, 'OK')
-        self.send_header('Last-Modified', self.date_time_string(fs.st_mtime))
-        self.send_header('Content-Length', str(fs[6]))
+        self.send_header(
+            'Last-Modified', email.utils.formatdate(fs.st_mtime, usegmt=True))
+        self.send_header('Content-Length', str(fs.st_size))
         self.send_header('Content-Type', ctype)
         self.send_header('Content-Disposition', 'attachment')
         self.end_headers()
         return f
 
+    def translate_path(self, path):
+        return None
+
+    def guess_type(self, path):
+        ctype, _ = mimetypes.guess_type(path)
+        return ctype or 'application/octet-stream'
+
 
 class SeismosizerHandler(RequestHandler):
 
@@ -438,7 +537,7 @@ class SeismosizerHandler(RequestHandler):
     api_path = '/gfws/api/'
     process_path = '/gfws/seismosizer/1/query'
 
-    def send_head(self):
+    async def send_head(self):
         S = self.stores_path
         P = self.process_path
         A = self.api_path
@@ -447,7 +546,7 @@ class SeismosizerHandler(RequestHandler):
                 return self.redirect(x)
 
         if re.match(r'^' + S + store_id_pattern, self.path):
-            return RequestHandler.send_head(self)
+            return self.send_file()
 
         elif re.match(r'^' + S + '$', self.path):
             return self.list_stores()
@@ -462,11 +561,10 @@ class SeismosizerHandler(RequestHandler):
             return self.get_store_velocity_profile()
 
         elif re.match(r'^' + P + '$', self.path):
-            return self.process()
+            return await self.process()
 
         else:
             self.send_error(404, 'File not found')
-            self.end_headers()
             return None
 
     def translate_path(self, path):
@@ -558,13 +656,11 @@ class SeismosizerHandler(RequestHandler):
 
         title = "Green's function stores listing"
         s = templates[format].render(stores=stores, title=title).encode('utf8')
-        length = len(s)
-        f = BytesIO(s)
         self.send_response(200, 'OK')
         self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Length', str(len(s)))
         self.end_headers()
-        return f
+        return s
 
     def list_stores_json(self):
         engine = self.server.engine
@@ -596,23 +692,18 @@ class SeismosizerHandler(RequestHandler):
                        for store_id in store_ids]
         }
 
-        s = json.dumps(stores)
-        length = len(s)
-        f = BytesIO(s.encode('ascii'))
+        s = json.dumps(stores).encode('ascii')
         self.send_response(200, 'OK')
         self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Length', str(len(s)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
 
-        return f
+        return s
 
     def get_store_config(self):
         engine = self.server.engine
 
-        store_ids = list(engine.get_store_ids())
-        store_ids.sort(key=lambda x: x.lower())
-
         for match in re.finditer(r'/gfws/api/(' + store_id_pattern + ')',
                                  self.path):
             store_id = match.groups()[0]
@@ -621,33 +712,24 @@ class SeismosizerHandler(RequestHandler):
             store = engine.get_store(store_id)
         except Exception:
             self.send_error(404)
-            self.end_headers()
-            return
+            return None
 
         data = {}
         data['id'] = store_id
         data['config'] = str(store.config)
 
-        s = json.dumps(data)
-        length = len(s)
-        f = BytesIO(s.encode('ascii'))
+        s = json.dumps(data).encode('ascii')
         self.send_response(200, 'OK')
         self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Length', str(len(s)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
 
-        return f
+        return s
 
     def get_store_velocity_profile(self):
         engine = self.server.engine
 
-        fig = plt.figure()
-        axes = fig.gca()
-
-        store_ids = list(engine.get_store_ids())
-        store_ids.sort(key=lambda x: x.lower())
-
         for match in re.finditer(
                 r'/gfws/api/(' + store_id_pattern + ')/profile', self.path):
             store_id = match.groups()[0]
@@ -656,49 +738,71 @@ class SeismosizerHandler(RequestHandler):
             store = engine.get_store(store_id)
         except Exception:
             self.send_error(404)
-            self.end_headers()
-            return
+            return None
 
         if store.config.earthmodel_1d is None:
             self.send_error(404)
-            self.end_headers()
-            return
+            return None
 
+        fig = plt.figure()
+        axes = fig.gca()
         cake_plot.my_model_plot(store.config.earthmodel_1d, axes=axes)
 
-        f = BytesIO()
+        f = io.BytesIO()
         fig.savefig(f, format='png')
+        plt.close(fig)
 
-        length = f.tell()
+        s = f.getvalue()
         self.send_response(200, 'OK')
         self.send_header('Content-Type', 'image/png;')
-        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Length', str(len(s)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
 
-        f.seek(0)
-        return f.read()
+        return s
+
+    async def process(self):
+        try:
+            request = gf.load(string=self.body['request'][0])
+        except KeyError:
+            raise HTTPError(400, 'Missing "request" parameter.')
+        except Exception as e:
+            raise HTTPError(400, 'Cannot load request: %s' % e)
 
-    def process(self):
+        if not isinstance(request, gf.Request):
+            raise HTTPError(400, 'Invalid request.')
+
+        stream = self.server.submit(request)
 
-        request = gf.load(string=self.body['request'][0])
         try:
-            resp = self.server.engine.process(request=request)
-        except (gf.BadRequest, gf.StoreError) as e:
-            self.send_error(400, str(e))
-            return
+            kind, value = await stream.get()
+            if kind == 'error':
+                if isinstance(value, (
+                        gf.SeismosizerError, gf.StoreError, gf.OutOfBounds)):
+                    raise HTTPError(400, str(value))
+                else:
+                    logger.error(
+                        'Processing of request failed: %s' % value)
+                    raise HTTPError(500)
+
+        except BaseException:
+            stream.abort()
+            raise
 
-        f = BytesIO()
-        resp.dump(stream=f)
-        length = f.tell()
+        async def chunks():
+            if kind == 'data':
+                yield value
 
-        f.seek(0)
+            if kind != 'end':
+                async for chunk in stream:
+                    yield chunk
 
         self.send_response(200, 'OK')
         self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.send_header('Content-Length', str(length))
+        self.send_header('Transfer-Encoding', 'chunked')
         self.end_headers()
-        return f
+
+        return _Chunks(chunks(), stream)
 
     def guess_type(self, path):
         bn = os.path.basename
@@ -710,33 +814,86 @@ class SeismosizerHandler(RequestHandler):
             return 'text/plain'
 
         else:
-            return RequestHandler.guess_type(self, path) \
-                or 'application/x-octet'
+            ctype, _ = mimetypes.guess_type(path)
+            return ctype or 'application/x-octet'
+
+
+class _Chunks(object):
+    def __init__(self, chunks, stream):
+        self._chunks = chunks
+        self._stream = stream
+
+    def __aiter__(self):
+        return self._chunks.__aiter__()
+
+    def abort(self):
+        self._stream.abort()
+
+
+class Server(object):
+    '''
+    Asynchronous GF web service.
+
+    :param ip:
+        IP address to listen on. Empty string means all interfaces.
+    :type ip:
+        str
+
+    :param port:
+        Port to listen on. Use 0 to pick a free port; the actual port is
+        available as :py:attr:`port` after construction.
+    :type port:
+        int
+
+    :param handler:
+        Request handler class, usually :py:class:`SeismosizerHandler`.
+
+    :param engine:
+        Engine used to serve stores and to process seismosizer requests.
+    :type engine:
+        :py:class:`~pyrocko.gf.seismosizer.LocalEngine`
 
+    :param nworkers:
+        Number of worker threads processing seismosizer requests
+        concurrently. Default is the number of CPUs.
+    :type nworkers:
+        int
+
+    :param max_queued:
+        Maximum number of seismosizer requests waiting for a free worker.
+        Further requests are answered with ``503 Service Unavailable``.
+    :type max_queued:
+        int
+
+    The listening socket is created in the constructor. :py:meth:`run` serves
+    requests until :py:meth:`close` is called, which may be done from another
+    thread.
+    '''
+
+    def __init__(self, ip, port, handler, engine, nworkers=None,
+                 max_queued=16):
 
-class Server(asyncore.dispatcher):
-    def __init__(self, ip, port, handler, engine):
         self.ensure_uuids(engine)
-        logger.info('starting Server at http://%s:%d', ip, port)
+        self.open_stores(engine)
 
-        asyncore.dispatcher.__init__(self)
         self.ip = ip
-        self.port = port
         self.handler = handler
-        asyncore.dispatcher.__init__(self)
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        self.set_reuse_addr()
-        self.bind((ip, port))
         self.engine = engine
+        self.nworkers = nworkers or os.cpu_count() or 1
+        self.max_queued = max_queued
 
-        # Quoting the socket module documentation...
-        # listen(backlog)
-        #     Listen for connections made to the socket. The backlog argument
-        #     specifies the maximum number of queued connections and should
-        #     be at least 1; the maximum value is system-dependent (usually
-        #     5).
-        self.listen(5)
+        self._sock = socket.create_server(
+            (ip, port), family=socket.AF_INET)
+        self.port = self._sock.getsockname()[1]
+
+        logger.info('starting Server at http://%s:%d', ip, self.port)
+
+        self._loop = None
+        self._stop = None
+        self._closed = False
+        self._executor = None
+        self._npending = 0
+        self._connections = set()
 
     @staticmethod
     def ensure_uuids(engine):
@@ -746,39 +903,127 @@ class Server(asyncore.dispatcher):
             store = engine.get_store(store_id)
             store.ensure_reference()
 
-    def handle_accept(self):
+    @staticmethod
+    def open_stores(engine):
+        '''
+        Open all stores, so that worker threads do not race on opening them.
+        '''
+        for store_id in engine.get_store_ids():
+            store = engine.get_store(store_id)
+            store.open()
+            for decimate in list(store._decimated.keys()):
+                store._decimated_store(decimate)[0].open()
+
+    def submit(self, request):
+        '''
+        Queue a seismosizer request for processing by the worker pool.
+
+        Must be called from the event loop. Returns a
+        :py:class:`ResponseStream` yielding the serialized response.
+        '''
+
+        if self._npending >= self.nworkers + self.max_queued:
+            raise HTTPError(503, 'Too many requests, try again later.')
+
+        self._npending += 1
+        stream = ResponseStream(self._loop)
+        fut = self._loop.run_in_executor(
+            self._executor, self._process, request, stream)
+
+        fut.add_done_callback(self._release)
+        return stream
+
+    def _release(self, fut):
+        self._npending -= 1
+
+    def _process(self, request, stream):
         try:
-            conn, addr = self.accept()
-        except socket.error:
-            self.log_info('warning: server accept() threw an exception',
-                          'warning')
-            return
-        except TypeError:
-            self.log_info('warning: server accept() threw EWOULDBLOCK',
-                          'warning')
-            return
-
-        self.handler(conn, addr, self)
-
-    def log(self, message):
-        self.log_info(message)
-
-    def handle_close(self):
-        self.close()
-
-    def log_info(self, message, type='info'):
-        {
-            'debug': logger.debug,
-            'info': logger.info,
-            'warning': logger.warning,
-            'error': logger.error
-        }.get(type, 'info')(str(message))
-
-
-def run(ip, port, engine):
-    s = Server(ip, port, SeismosizerHandler, engine)
-    asyncore.loop()
-    del s
+            try:
+                resp = self.engine.process(request=request)
+            except Exception as e:
+                stream.fail(e)
+                return
+
+            try:
+                resp.dump(stream=stream)
+            except StreamAborted:
+                raise
+            except Exception as e:
+                stream.fail(e)
+                return
+
+            stream.close()
+
+        except StreamAborted:
+            logger.debug('Client disconnected before response was sent.')
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            await self.handler(self, reader, writer).handle()
+        finally:
+            self._connections.discard(task)
+
+    async def serve(self):
+        '''
+        Serve requests until :py:meth:`close` is called.
+        '''
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._closed:
+            self._stop.set()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.nworkers,
+            thread_name_prefix='pyrocko.gf.server')
+
+        aserver = await asyncio.start_server(
+            self._handle_connection, sock=self._sock)
+
+        try:
+            await self._stop.wait()
+
+        finally:
+            aserver.close()
+            connections = list(self._connections)
+            for task in connections:
+                task.cancel()
+
+            await asyncio.gather(*connections, return_exceptions=True)
+            await aserver.wait_closed()
+            self._executor.shutdown(wait=False)
+
+    def run(self):
+        '''
+        Run the server's event loop in the calling thread.
+        '''
+        asyncio.run(self.serve())
+
+    def close(self):
+        '''
+        Stop serving. Thread-safe.
+        '''
+        self._closed = True
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass
+        else:
+            self._sock.close()
+
+
+def run(ip, port, engine, nworkers=None, max_queued=16):
+    s = Server(
+        ip, port, SeismosizerHandler, engine,
+        nworkers=nworkers,
+        max_queued=max_queued)
+
+    try:
+        s.run()
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == '__main__':
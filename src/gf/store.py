@@ -61,6 +61,33 @@ gf_record_dtype = num.dtype([
     ('end_value', E + 'f4'),
 ])
 
+# header of the traces file, all zero for uncompressed stores
+gf_traces_header_fmt = E + '8sB7xd8x'
+gf_traces_header_size = struct.calcsize(gf_traces_header_fmt)
+gf_traces_compressed_magic = b'PYRGFZ01'
+
+gf_compressions = {
+    None: 0,
+    'lossy': 1,
+    'lossless': 2,
+}
+
+gf_compression_max_error_default = 1e-5
+
+# record cache budget of compressed stores unless set explicitly, decoded
+# records would otherwise accumulate until the whole store is held in memory
+gf_compressed_cache_max_bytes_default = 512 * 1024**2
+
+# header of compressed records: nbytes, coding, delta order, quantization step
+gf_block_header_fmt = E + 'IBB2xf'
+gf_block_header_size = struct.calcsize(gf_block_header_fmt)
+
+GF_CODING_RAW = 0
+GF_CODING_QUANTIZED = 1
+GF_CODING_FLOATBITS = 2
+
+VARINT_NBYTES_MAX = 10
+
 available_stored_tables = ['phase', 'takeoff_angle', 'incidence_angle']
 
 km = 1000.
@@ -293,6 +320,166 @@ class NoSuchPhase(StoreError):
                % self.value
 
 
+def _varint_encode(values):
+    values = num.asarray(values, dtype=num.uint64)
+    if values.size == 0:
+        return b''
+
+    nbytes = num.ones(values.size, dtype=num.int64)
+    for k in range(1, VARINT_NBYTES_MAX):
+        nbytes += values >= num.uint64(1 << (7*k))
+
+    nmax = int(num.max(nbytes))
+    shifts = num.arange(nmax, dtype=num.uint64) * num.uint64(7)
+    groups = ((values[:, num.newaxis] >> shifts[num.newaxis, :])
+              & num.uint64(0x7f)).astype(num.uint8)
+
+    ks = num.arange(nmax)[num.newaxis, :]
+    groups[ks < nbytes[:, num.newaxis] - 1] |= 0x80
+    return groups[ks < nbytes[:, num.newaxis]].tobytes()
+
+
+def _varint_decode(buf):
+    b = num.frombuffer(buf, dtype=num.uint8)
+    if b.size == 0:
+        return num.zeros(0, dtype=num.uint64)
+
+    iends = num.nonzero(b < 0x80)[0]
+    if iends.size == 0 or iends[-1] != b.size - 1:
+        raise StoreError('corrupt compressed record')
+
+    istarts = num.empty_like(iends)
+    istarts[0] = 0
+    istarts[1:] = iends[:-1] + 1
+    ivalues = num.repeat(num.arange(iends.size), iends - istarts + 1)
+    shifts = (7 * (num.arange(b.size) - istarts[ivalues])).astype(num.uint64)
+    return num.add.reduceat(
+        (b & 0x7f).astype(num.uint64) << shifts, istarts)
+
+
+def _float_to_ordered(data):
+    i = num.asarray(data, dtype=gf_dtype_store).view(E + 'i4') \
+        .astype(num.int64)
+
+    return num.where(i >= 0, i, -1 - (i & 0x7fffffff))
+
+
+def _ordered_to_float(values):
+    bits = num.where(values >= 0, values, (-1 - values) | 0x80000000)
+    return bits.astype(E + 'u4').view(gf_dtype_store).astype(gf_dtype)
+
+
+def encode_record(data, compression='lossless', max_error=None):
+    '''
+    Encode GF trace samples for storage in a compressed GF store.
+
+    Integer representations of the samples are delta-encoded (first or second
+    order, whichever is smaller) and stored as variable-length integers.
+
+    :param data:
+        Samples to be encoded.
+    :type data:
+        :py:class:`numpy.ndarray`
+
+    :param compression:
+        ``'lossless'``: use bit patterns of the floating point samples.
+        ``'lossy'``: quantize samples with a step size such that the error is
+        at most ``max_error`` times the absolute peak value of the record.
+    :type compression:
+        str
+
+    :param max_error:
+        Maximum error for lossy compression, relative to the peak value of the
+        record.
+    :type max_error:
+        float
+
+    :returns:
+        Encoded record as :py:class:`bytes`.
+    '''
+
+    data = num.asarray(data, dtype=gf_dtype)
+
+    candidates = [
+        (GF_CODING_RAW, 0, 0.0, data.astype(gf_dtype_store).tobytes())]
+
+    if compression == 'lossless':
+        coding = GF_CODING_FLOATBITS
+        step = 0.0
+        values = _float_to_ordered(data)
+
+    elif compression == 'lossy':
+        if not num.all(num.isfinite(data)):
+            return encode_record(data, 'lossless')
+
+        if max_error is None:
+            max_error = gf_compression_max_error_default
+
+        coding = GF_CODING_QUANTIZED
+        amax = float(num.max(num.abs(data), initial=0.0))
+        step = float(num.float32(2.0 * max_error * amax)) or 1.0
+        values = num.round(data.astype(num.float64) / step).astype(num.int64)
+
+    else:
+        raise StoreError('invalid compression: %s' % compression)
+
+    for order in (1, 2):
+        residuals = values
+        for _ in range(order):
+            residuals = num.diff(residuals, prepend=0)
+
+        zigzag = (residuals << 1) ^ (residuals >> 63)
+        candidates.append((
+            coding, order, step, _varint_encode(zigzag.view(num.uint64))))
+
+    coding, order, step, payload = min(
+        candidates, key=lambda candidate: len(candidate[3]))
+
+    return struct.pack(
+        gf_block_header_fmt,
+        gf_block_header_size + len(payload), coding, order, step) + payload
+
+
+def decode_record(buf):
+    '''
+    Decode compressed GF trace samples.
+
+    Inverse of :py:func:`encode_record`.
+
+    :param buf:
+        Encoded record.
+    :type buf:
+        :py:class:`bytes`
+
+    :returns:
+        Samples as :py:class:`numpy.ndarray`.
+    '''
+
+    nbytes, coding, order, step = struct.unpack_from(gf_block_header_fmt, buf)
+    if len(buf) < nbytes or nbytes < gf_block_header_size:
+        raise StoreError('corrupt compressed record')
+
+    payload = buf[gf_block_header_size:nbytes]
+    if coding == GF_CODING_RAW:
+        return num.frombuffer(payload, dtype=gf_dtype_store).astype(gf_dtype)
+
+    zigzag = _varint_decode(payload)
+    values = (zigzag >> num.uint64(1)).view(num.int64) \
+        ^ -(zigzag & num.uint64(1)).view(num.int64)
+
+    for _ in range(order):
+        values = num.cumsum(values)
+
+    if coding == GF_CODING_QUANTIZED:
+        return (values * step).astype(gf_dtype)
+
+    elif coding == GF_CODING_FLOATBITS:
+        return _ordered_to_float(values)
+
+    else:
+        raise StoreError('corrupt compressed record')
+
+
 def remove_if_exists(fn, force=False):
     if os.path.exists(fn):
         if force:
@@ -330,7 +517,11 @@ class BaseStore(object):
         return os.path.join(store_dir, 'config')
 
     @staticmethod
-    def create(store_dir, deltat, nrecords, force=False):
+    def create(store_dir, deltat, nrecords, force=False, compression=None,
+               max_error=None):
+
+        if compression not in gf_compressions:
+            raise StoreError('invalid compression: %s' % compression)
 
         try:
             util.ensuredir(store_dir)
@@ -349,18 +540,32 @@ class BaseStore(object):
             records.tofile(f)
 
         with open(data_fn, 'wb') as f:
-            f.write(b'\0' * 32)
+            if compression is None:
+                f.write(b'\0' * gf_traces_header_size)
+            else:
+                if max_error is None:
+                    max_error = gf_compression_max_error_default
+
+                f.write(struct.pack(
+                    gf_traces_header_fmt,
+                    gf_traces_compressed_magic,
+                    gf_compressions[compression],
+                    max_error))
 
-    def __init__(self, store_dir, mode='r', use_memmap=True):
+    def __init__(self, store_dir, mode='r', use_memmap=True,
+                 cache_max_bytes=None):
         assert mode in 'rw'
         self.store_dir = store_dir
         self.mode = mode
         self._use_memmap = use_memmap
+        self._cache_max_bytes = cache_max_bytes
         self._nrecords = None
         self._deltat = None
         self._f_index = None
         self._f_data = None
         self._records = None
+        self._compression = None
+        self._max_error = None
         self.cstore = None
 
     def open(self):
@@ -387,7 +592,9 @@ class BaseStore(object):
             # precision value from the config, if available
             self.cstore = store_ext.store_init(
                 self._f_index.fileno(), self._f_data.fileno(),
-                self.get_deltat() or 0.0)
+                self.get_deltat() or 0.0,
+                int(bool(self._use_memmap)),
+                int(self._cache_max_bytes or 0))
 
         except store_ext.StoreExtError as e:
             raise StoreError(str(e))
@@ -409,6 +616,11 @@ class BaseStore(object):
         self._deltat = deltat
 
         self._load_index()
+        self._load_traces_header()
+
+        if self._cache_max_bytes is None and self._compression is not None:
+            store_ext.store_cache_set_nbytes_max(
+                self.cstore, gf_compressed_cache_max_bytes_default)
 
     def __del__(self):
         if self.mode != '':
@@ -461,6 +673,51 @@ class BaseStore(object):
         return self._sum(irecords, delays, weights, itmin, nsamples, decimate,
                          implementation, optimization)
 
+    def set_cache_max_bytes(self, cache_max_bytes):
+        '''
+        Set memory budget of the record cache.
+
+        The record cache is used when the traces file is not memory mapped
+        (``use_memmap=False``) and for compressed stores. When the budget is
+        exceeded, least recently used records are evicted.
+
+        :param cache_max_bytes:
+            Maximum number of bytes to use for cached records. ``0`` means
+            unlimited. ``None`` selects the default: unlimited for
+            uncompressed stores, 512 MiB for compressed stores.
+        :type cache_max_bytes:
+            int
+        '''
+
+        self._cache_max_bytes = cache_max_bytes
+        if self.cstore is not None:
+            if cache_max_bytes is None and self._compression is not None:
+                cache_max_bytes = gf_compressed_cache_max_bytes_default
+
+            store_ext.store_cache_set_nbytes_max(
+                self.cstore, int(cache_max_bytes or 0))
+
+    def get_cache_stats(self):
+        '''
+        Get statistics of the record cache.
+
+        :returns:
+            ``dict`` with keys ``'hits'``, ``'misses'``, ``'evictions'``,
+            ``'entries'``, ``'size'`` and ``'size_max'`` or ``None`` if the
+            store is not open or memory mapped.
+        '''
+
+        if self.cstore is None:
+            return None
+
+        stats = store_ext.store_cache_stats(self.cstore)
+        if stats is None:
+            return None
+
+        return dict(zip(
+            ['hits', 'misses', 'evictions', 'entries', 'size', 'size_max'],
+            stats))
+
     def irecord_format(self):
         return util.zfmt(self._nrecords)
 
@@ -650,15 +907,24 @@ class BaseStore(object):
 
         ndata = trace.data.size
 
+        data = trace.data
         if ndata > 2:
             self._f_data.seek(0, 2)
             ipos = self._f_data.tell()
-            trace.data.astype(gf_dtype_store).tofile(self._f_data)
+            if self._compression is None:
+                data.astype(gf_dtype_store).tofile(self._f_data)
+            else:
+                buf = encode_record(
+                    data, self._compression, self._max_error)
+
+                self._f_data.write(buf)
+                if self._compression == 'lossy':
+                    data = decode_record(buf)
         else:
             ipos = 2
 
         self._records[irecord] = (ipos, trace.itmin, ndata,
-                                  trace.data[0], trace.data[-1])
+                                  data[0], data[-1])
 
     def _sum_impl_alternative(self, irecords, delays, weights, itmin, nsamples,
                               decimate):
@@ -943,6 +1209,42 @@ class BaseStore(object):
 
         self._records = records
 
+    def _load_traces_header(self):
+        self._f_data.seek(0)
+        header = self._f_data.read(gf_traces_header_size)
+        if len(header) == gf_traces_header_size \
+                and header.startswith(gf_traces_compressed_magic):
+
+            _, icompression, max_error = struct.unpack(
+                gf_traces_header_fmt, header)
+
+            compressions = dict(
+                (v, k) for (k, v) in gf_compressions.items())
+
+            if icompression not in compressions:
+                raise StoreError(
+                    'unsupported compression in gf store: %s'
+                    % self.store_dir)
+
+            self._compression = compressions[icompression]
+            self._max_error = max_error
+
+        else:
+            self._compression = None
+            self._max_error = None
+
+    @property
+    def compression(self):
+        '''
+        Compression of the traces file (``None``, ``'lossless'`` or
+        ``'lossy'``).
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        return self._compression
+
     def _save_index(self):
         self._f_index.seek(0)
         self._f_index.write(struct.pack(gf_store_header_fmt, self._nrecords,
@@ -962,6 +1264,19 @@ class BaseStore(object):
                 data_orig[0] = begin_value
                 data_orig[1] = end_value
                 return data_orig[ilo:ihi]
+            elif self._compression is not None:
+                self._f_data.seek(int(ipos))
+                header = self._f_data.read(gf_block_header_size)
+                if len(header) != gf_block_header_size:
+                    raise ShortRead()
+
+                nbytes = struct.unpack_from(gf_block_header_fmt, header)[0]
+                payload = self._f_data.read(nbytes - gf_block_header_size)
+                if len(payload) != nbytes - gf_block_header_size:
+                    raise ShortRead()
+
+                return decode_record(header + payload)[ilo:ihi]
+
             else:
                 self._f_data.seek(
                     int(ipos + ilo*gf_dtype_nbytes_per_sample))
@@ -1021,11 +1336,14 @@ class BaseStore(object):
             zero=counter[1],
             size_data=self.size_data,
             size_index=self.size_index,
+            compression=self._compression or 'none',
+            cache=self.get_cache_stats(),
         )
 
         return stats
 
-    stats_keys = 'total inserted empty short zero size_data size_index'.split()
+    stats_keys = 'total inserted empty short zero size_data size_index ' \
+        'compression'.split()
 
 
 def remake_dir(dpath, force):
@@ -1038,6 +1356,64 @@ def remake_dir(dpath, force):
     os.mkdir(dpath)
 
 
+class RayAttributeEvaluator(object):
+    '''
+    Picklable function to evaluate a ray attribute at a GF node.
+
+    Used as the function to be tabulated by :py:class:`pyrocko.spit.SPTree`
+    in :py:meth:`Store.make_stored_table`.
+    '''
+
+    def __init__(self, mod, phases, horvels, attribute, receiver_depth):
+        self.mod = mod
+        self.phases = phases
+        self.horvels = horvels
+        self.attribute = attribute
+        self.receiver_depth = receiver_depth
+
+    def __call__(self, args):
+        from pyrocko import cake
+
+        nargs = len(args)
+        if nargs == 2:
+            receiver_depth, source_depth, distance = (
+                self.receiver_depth,) + args
+        elif nargs == 3:
+            receiver_depth, source_depth, distance = args
+        else:
+            raise ValueError(
+                'Number of input arguments %i is not supported!'
+                'Supported number of arguments: 2 or 3' % nargs)
+
+        ray_attribute_values = []
+        arrival_times = []
+        if self.phases:
+            rays = self.mod.arrivals(
+                phases=self.phases,
+                distances=[distance * cake.m2d],
+                zstart=source_depth,
+                zstop=receiver_depth)
+
+            for ray in rays:
+                arrival_times.append(ray.t)
+                if self.attribute != 'phase':
+                    ray_attribute_values.append(
+                        getattr(ray, self.attribute)())
+
+        if self.attribute == 'phase':
+            for v in self.horvels:
+                arrival_times.append(distance / (v * km))
+
+        if arrival_times:
+            if self.attribute == 'phase':
+                return min(arrival_times)
+            else:
+                earliest_idx = num.argmin(arrival_times)
+                return ray_attribute_values[earliest_idx]
+        else:
+            return None
+
+
 class MakeTimingParamsFailed(StoreError):
     pass
 
@@ -1074,6 +1450,20 @@ class Store(BaseStore):
     can be created with the :py:meth:`make_travel_time_tables` and evaluated
     with the :py:func:`t` methods.
 
+    By default, the store's data file is memory mapped. With
+    ``use_memmap=False`` (e.g. on network file systems where memory mapping is
+    slow or unreliable), records are read on demand and kept in a record
+    cache. Its memory budget can be limited with ``cache_max_bytes``, in
+    which case least recently used records are evicted. Cache statistics are
+    available through :py:meth:`stats`.
+
+    Stores may be compressed (see :py:meth:`make_compressed` and ``fomosto
+    compress``). Traces of compressed stores are decoded on the fly and the
+    decoded records are held in the record cache. Unless ``cache_max_bytes``
+    is given, the cache of a compressed store is limited to 512 MiB
+    (``cache_max_bytes=0`` removes the limit). For uncompressed stores, the
+    cache is unlimited by default.
+
     .. attribute:: config
 
         The :py:class:`pyrocko.gf.meta.Config` derived object associated with
@@ -1091,7 +1481,8 @@ class Store(BaseStore):
     '''
 
     @classmethod
-    def create(cls, store_dir, config, force=False, extra=None):
+    def create(cls, store_dir, config, force=False, extra=None,
+               compression=None, max_error=None):
         '''
         Create new GF store.
 
@@ -1113,10 +1504,18 @@ class Store(BaseStore):
         :type force: bool
         :param extra: Extra information
         :type extra: dict or None
+        :param compression: Compression of the traces file: ``None``,
+            ``'lossless'``, or ``'lossy'`` (see :py:meth:`make_compressed`)
+        :type compression: str or None
+        :param max_error: Maximum error of lossy compression, relative to the
+            peak value of each trace
+        :type max_error: float or None
         '''
 
         cls.create_editables(store_dir, config, force=force, extra=extra)
-        cls.create_dependants(store_dir, force=force)
+        cls.create_dependants(
+            store_dir, force=force, compression=compression,
+            max_error=max_error)
 
         return cls(store_dir)
 
@@ -1150,19 +1549,24 @@ class Store(BaseStore):
         return fns
 
     @staticmethod
-    def create_dependants(store_dir, force=False):
+    def create_dependants(store_dir, force=False, compression=None,
+                          max_error=None):
         config_fn = os.path.join(store_dir, 'config')
         config = meta.load(filename=config_fn)
 
         BaseStore.create(store_dir, config.deltat, config.nrecords,
-                         force=force)
+                         force=force, compression=compression,
+                         max_error=max_error)
 
         for sub_dir in ['decimated']:
             dpath = os.path.join(store_dir, sub_dir)
             remake_dir(dpath, force)
 
-    def __init__(self, store_dir, mode='r', use_memmap=True):
-        BaseStore.__init__(self, store_dir, mode=mode, use_memmap=use_memmap)
+    def __init__(self, store_dir, mode='r', use_memmap=True,
+                 cache_max_bytes=None):
+        BaseStore.__init__(
+            self, store_dir, mode=mode, use_memmap=use_memmap,
+            cache_max_bytes=cache_max_bytes)
         config_fn = self.config_fn()
         if not os.path.isfile(config_fn):
             raise StoreError(
@@ -1503,6 +1907,114 @@ class Store(BaseStore):
 
         self._decimated[decimate] = None
 
+    def make_compressed(self, store_dir, compression='lossless',
+                        max_error=None, force=False, show_progress=False):
+        '''
+        Create a copy of the GF store with compressed traces file.
+
+        Each GF trace is encoded individually and is decoded on the fly when
+        the store is used, so that compressed stores can be used just like
+        uncompressed ones. Decoded traces are kept in the store's record
+        cache, which is limited to 512 MiB by default when the compressed
+        store is opened (see ``cache_max_bytes`` of :py:class:`Store`).
+        Decimated sub-stores are converted as well.
+
+        :param store_dir: Path of the new GF store
+        :type store_dir: str
+        :param compression: ``'lossless'`` for exact copies, ``'lossy'`` for
+            quantization with bounded error or ``None`` to create an
+            uncompressed copy, e.g. to decompress a store
+        :type compression: str or None
+        :param max_error: Maximum error of lossy compression, relative to the
+            peak value of each trace, defaults to ``1e-5``
+        :type max_error: float or None
+        :param force: Force overwrite, defaults to ``False``
+        :type force: bool
+        :param show_progress: Show progress, defaults to ``False``
+        :type show_progress: bool
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        assert self.mode == 'r'
+
+        if compression not in gf_compressions:
+            raise StoreError('invalid compression: %s' % compression)
+
+        if op.realpath(store_dir) == op.realpath(self.store_dir):
+            raise CannotCreate('cannot convert store into itself')
+
+        if os.path.exists(store_dir):
+            if force:
+                shutil.rmtree(store_dir)
+            else:
+                raise CannotCreate('store already exists at %s' % store_dir)
+
+        store_dir_incomplete = store_dir + '-incomplete'
+        if os.path.exists(store_dir_incomplete):
+            shutil.rmtree(store_dir_incomplete)
+
+        def ignore(dirpath, names):
+            if op.realpath(dirpath) == op.realpath(self.store_dir):
+                return [name for name in names
+                        if name in ('index', 'traces', 'lock', 'decimated')]
+
+            return []
+
+        shutil.copytree(self.store_dir, store_dir_incomplete, ignore=ignore)
+
+        BaseStore.create(
+            store_dir_incomplete, self.get_deltat(), self._nrecords,
+            compression=compression, max_error=max_error)
+
+        os.mkdir(os.path.join(store_dir_incomplete, 'decimated'))
+
+        dest = BaseStore(store_dir_incomplete, 'w')
+        dest.open()
+        deltat = dest.get_deltat()
+        try:
+            if show_progress:
+                pbar = util.progressbar(
+                    'converting store', self._nrecords)
+
+            # read in order of location in the traces file
+            irecords = num.argsort(
+                self._records['data_offset'], kind='stable')
+
+            for i, irecord in enumerate(irecords):
+                ipos, itmin, nsamples, begin_value, end_value = \
+                    self._records[irecord]
+
+                if ipos in (1, 2):
+                    dest._records[irecord] = self._records[irecord]
+
+                elif ipos != 0:
+                    data = self._get_data(
+                        ipos, begin_value, end_value, 0, nsamples)
+
+                    dest._put(
+                        irecord,
+                        GFTrace(data=data, itmin=itmin, deltat=deltat))
+
+                if show_progress:
+                    pbar.update(i+1)
+
+        finally:
+            if show_progress:
+                pbar.finish()
+
+        dest.close()
+
+        for decimate in sorted(self._decimated.keys()):
+            Store(self._decimated_store_dir(decimate)).make_compressed(
+                os.path.join(store_dir_incomplete, 'decimated', str(decimate)),
+                compression=compression,
+                max_error=max_error,
+                show_progress=show_progress)
+
+        shutil.move(store_dir_incomplete, store_dir)
+
     def stats(self):
         stats = BaseStore.stats(self)
         stats['decimated'] = sorted(self._decimated.keys())
@@ -1572,7 +2084,10 @@ class Store(BaseStore):
         else:
             store = self._decimated[decimate]
             if store is None:
-                store = Store(self._decimated_store_dir(decimate), 'r')
+                store = Store(
+                    self._decimated_store_dir(decimate), 'r',
+                    use_memmap=self._use_memmap,
+                    cache_max_bytes=self._cache_max_bytes)
                 self._decimated[decimate] = store
 
             return store, 1
@@ -1582,6 +2097,41 @@ class Store(BaseStore):
         return os.path.join(
             self.store_dir, 'phases', phase_id + '.%s' % attribute)
 
+    def phase_digest_filename(self, phase_id, attribute='phase'):
+        check_string_id(phase_id)
+        return os.path.join(
+            self.store_dir, 'phases', '.%s.%s.digest' % (phase_id, attribute))
+
+    def get_stored_table_digest(self, pdef, attribute='phase'):
+        '''
+        Get digest of the inputs to a stored table.
+
+        The digest covers everything a table computed with
+        :py:meth:`make_stored_table` depends on: the phase definition, the
+        earth models and the extent and sampling of the store.
+
+        :param pdef: phase definition
+        :type pdef: :py:class:`~pyrocko.gf.meta.TPDef`
+        :returns: hex digest
+        :rtype: str
+        '''
+        from pyrocko import cake
+
+        config = self.config
+        m = hashlib.sha1()
+        for x in (attribute, pdef.definition, config.deltat,
+                  getattr(config, 'receiver_depth', None)):
+            m.update(repr(x).encode('utf-8'))
+
+        for arr in (config.mins, config.maxs, config.deltas):
+            m.update(num.asarray(arr, dtype='<f8').tobytes())
+
+        for mod in (config.earthmodel_1d, config.earthmodel_receiver_1d):
+            if mod is not None:
+                m.update(cake.write_nd_model_str(mod).encode('utf-8'))
+
+        return m.hexdigest()
+
     def get_phase_identifier(self, phase_id, attribute):
         return '{}.{}'.format(phase_id, attribute)
 
@@ -1776,7 +2326,8 @@ class Store(BaseStore):
                     attribute, phase_def,
                     self.get_available_interpolation_tables()))
 
-    def get_many_stored_attributes(self, phase_def, attribute, coords):
+    def get_many_stored_attributes(self, phase_def, attribute, coords,
+                                   nthreads=1):
         '''
         Return interpolated store attribute
 
@@ -1786,10 +2337,13 @@ class Store(BaseStore):
             ``(source_depth, distance, component)`` as in
             :py:class:`~pyrocko.gf.meta.ConfigTypeA`.
         :type \\coords: :py:class:`numpy.ndarray`
+        :param nthreads: number of threads to use, 0 for all available
+        :type nthreads: int
         '''
         try:
             return self.get_stored_phase(
-                phase_def, attribute).interpolate_many(coords)
+                phase_def, attribute).interpolate_many(
+                    coords, nthreads=nthreads)
         except NoSuchPhase:
             raise StoreError(
                 'Interpolation table for {} of {} does not exist! '
@@ -1797,16 +2351,26 @@ class Store(BaseStore):
                     attribute, phase_def,
                     self.get_available_interpolation_tables()))
 
-    def make_stored_table(self, attribute, force=False):
+    def make_stored_table(self, attribute, force=False, nprocs=1):
         '''
         Compute tables for selected ray attributes.
 
         :param attribute: phase / takeoff_angle [deg]/ incidence_angle [deg]
         :type attribute: str
+        :param force: recompute tables which are up to date
+        :type force: bool
+        :param nprocs: number of processes to use for ray tracing, ``None``
+            for all available CPUs
+        :type nprocs: int
 
         Tables are computed using the 1D earth model defined in
         :py:attr:`~pyrocko.gf.meta.Config.earthmodel_1d` for each defined phase
         in :py:attr:`~pyrocko.gf.meta.Config.tabulated_phases`.
+
+        Existing tables are only recomputed if their phase definition, the
+        earth model or the extent of the store has changed since they were
+        made, so that adding a phase definition to the config only computes
+        the table of the new phase.
         '''
 
         if attribute not in available_stored_tables:
@@ -1815,7 +2379,6 @@ class Store(BaseStore):
                 'Supported attribute tables: {}'.format(
                     attribute, available_stored_tables))
 
-        from pyrocko import cake
         config = self.config
 
         if not config.tabulated_phases:
@@ -1832,72 +2395,53 @@ class Store(BaseStore):
         for pdef in config.tabulated_phases:
 
             phase_id = pdef.id
-            phases = pdef.phases
 
             if attribute == 'phase':
                 ftol = config.deltat * 0.5
                 horvels = pdef.horizontal_velocities
             else:
                 ftol = config.deltat * 0.01
+                horvels = []
 
             fn = self.phase_filename(phase_id, attribute)
+            fn_digest = self.phase_digest_filename(phase_id, attribute)
+            digest = self.get_stored_table_digest(pdef, attribute)
 
             if os.path.exists(fn) and not force:
-                logger.info('file already exists: %s' % fn)
-                continue
+                if not os.path.exists(fn_digest):
+                    logger.info('file already exists: %s' % fn)
+                    continue
 
-            def evaluate(args):
+                with open(fn_digest, 'r') as f:
+                    if f.read().strip() == digest:
+                        logger.info('file already exists: %s' % fn)
+                        continue
 
-                nargs = len(args)
-                if nargs == 2:
-                    receiver_depth, source_depth, distance = (
-                        config.receiver_depth,) + args
-                elif nargs == 3:
-                    receiver_depth, source_depth, distance = args
-                else:
-                    raise ValueError(
-                        'Number of input arguments %i is not supported!'
-                        'Supported number of arguments: 2 or 3' % nargs)
-
-                ray_attribute_values = []
-                arrival_times = []
-                if phases:
-                    rays = mod.arrivals(
-                        phases=phases,
-                        distances=[distance * cake.m2d],
-                        zstart=source_depth,
-                        zstop=receiver_depth)
-
-                    for ray in rays:
-                        arrival_times.append(ray.t)
-                        if attribute != 'phase':
-                            ray_attribute_values.append(
-                                getattr(ray, attribute)())
-
-                if attribute == 'phase':
-                    for v in horvels:
-                        arrival_times.append(distance / (v * km))
-
-                if arrival_times:
-                    if attribute == 'phase':
-                        return min(arrival_times)
-                    else:
-                        earliest_idx = num.argmin(arrival_times)
-                        return ray_attribute_values[earliest_idx]
-                else:
-                    return None
+                logger.info(
+                    'definition of "%s" table for phasegroup "%s" has '
+                    'changed, recomputing', attribute, phase_id)
 
             logger.info(
                 'making "%s" table for phasegroup "%s"', attribute, phase_id)
 
+            evaluate = RayAttributeEvaluator(
+                mod, pdef.phases, horvels, attribute,
+                getattr(config, 'receiver_depth', None))
+
             ip = spit.SPTree(
                 f=evaluate,
                 ftol=ftol,
                 xbounds=num.transpose((config.mins, config.maxs)),
-                xtols=config.deltas)
+                xtols=config.deltas,
+                nprocs=nprocs)
 
             util.ensuredirs(fn)
             ip.dump(fn)
+            with open(fn_digest, 'w') as f:
+                f.write(digest + '\n')
+
+            self._phases.pop(
+                self.get_phase_identifier(phase_id, attribute), None)
 
     def make_timing_params(self, begin, end, snap_vred=True, force=False):
         '''
@@ -1982,7 +2526,7 @@ use `fomosto tttlsd` to fix holes.''' % w
             tlenmax_vred=tlenmax_vred,
             vred=vred)
 
-    def make_travel_time_tables(self, force=False):
+    def make_travel_time_tables(self, force=False, nprocs=1):
         '''
         Compute travel time tables.
 
@@ -1991,12 +2535,12 @@ use `fomosto tttlsd` to fix holes.''' % w
         in :py:attr:`~pyrocko.gf.meta.Config.tabulated_phases`. The accuracy of
         the tablulated times is adjusted to the sampling rate of the store.
         '''
-        self.make_stored_table(attribute='phase', force=force)
+        self.make_stored_table(attribute='phase', force=force, nprocs=nprocs)
 
-    def make_ttt(self, force=False):
-        self.make_travel_time_tables(force=force)
+    def make_ttt(self, force=False, nprocs=1):
+        self.make_travel_time_tables(force=force, nprocs=nprocs)
 
-    def make_takeoff_angle_tables(self, force=False):
+    def make_takeoff_angle_tables(self, force=False, nprocs=1):
         '''
         Compute takeoff-angle tables.
 
@@ -2006,9 +2550,10 @@ use `fomosto tttlsd` to fix holes.''' % w
         The accuracy of the tablulated times is adjusted to 0.01 times the
         sampling rate of the store.
         '''
-        self.make_stored_table(attribute='takeoff_angle', force=force)
+        self.make_stored_table(
+            attribute='takeoff_angle', force=force, nprocs=nprocs)
 
-    def make_incidence_angle_tables(self, force=False):
+    def make_incidence_angle_tables(self, force=False, nprocs=1):
         '''
         Compute incidence-angle tables.
 
@@ -2018,7 +2563,8 @@ use `fomosto tttlsd` to fix holes.''' % w
         The accuracy of the tablulated times is adjusted to 0.01 times the
         sampling rate of the store.
         '''
-        self.make_stored_table(attribute='incidence_angle', force=force)
+        self.make_stored_table(
+            attribute='incidence_angle', force=force, nprocs=nprocs)
 
     def get_provided_components(self):
 
@@ -2067,7 +2613,7 @@ use `fomosto tttlsd` to fix holes.''' % w
         # TODO: deal with delays for snapshots > 1 sample
 
         if itsnapshot is not None:
-            delays = source.times
+            delays = source.times.copy()
 
             # Fringe case where we sample at sample 0 and sample 1
             tsnapshot = itsnapshot * self.config.deltat
@@ -2101,10 +2647,128 @@ use `fomosto tttlsd` to fix holes.''' % w
 
         return out
 
+    def calc_many_statics(self, sources, multi_location, itsnapshot,
+                          components, interpolation='nearest_neighbor',
+                          nthreads=0):
+
+        '''
+        Calculate static displacements for several discretized sources.
+
+        All sources are evaluated at all locations of ``multi_location`` in a
+        single call to the C extension.
+
+        :param sources: Discretized sources.
+        :type sources: list of :py:class:`DiscretizedSource`
+        :param multi_location: Receiver locations.
+        :type multi_location: :py:class:`~pyrocko.gf.meta.MultiLocation`
+        :param itsnapshot: Index of the snapshot sample, ``None`` to use the
+            first sample.
+        :type itsnapshot: int
+        :param components: Names of the components to be returned.
+        :type components: list of str
+
+        :returns: ``dict`` mapping component names to arrays of shape
+            ``(len(sources), multi_location.ntargets)``.
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        ntargets = multi_location.ntargets
+        if ntargets == 0:
+            raise StoreError('MultiLocation.coords5 is empty')
+
+        scheme = self.config.component_scheme
+
+        source_offsets = num.zeros(len(sources) + 1, dtype=num.uint64)
+        delays = []
+        for isource, source in enumerate(sources):
+            if itsnapshot is not None:
+                delays_source = source.times.copy()
+
+                # Fringe case where we sample at sample 0 and sample 1
+                tsnapshot = itsnapshot * self.config.deltat
+                if delays_source.max() == tsnapshot \
+                        and delays_source.min() != tsnapshot:
+                    delays_source[delays_source == delays_source.max()] -= \
+                        self.config.deltat
+            else:
+                delays_source = source.times * 0
+
+            delays.append(delays_source)
+            source_offsets[isource+1] = \
+                source_offsets[isource] + delays_source.size
+
+        if not sources:
+            return dict(
+                (comp, num.zeros((0, ntargets), dtype=gf_dtype))
+                for comp in components)
+
+        res = store_ext.store_calc_static(
+            self.cstore,
+            num.vstack([source.coords5() for source in sources]),
+            num.vstack([
+                source.get_source_terms(scheme) for source in sources]),
+            num.concatenate(delays),
+            multi_location.coords5,
+            scheme,
+            interpolation,
+            itsnapshot if itsnapshot is not None else 1,
+            nthreads,
+            source_offsets)
+
+        out = {}
+        for comp, comp_res in zip(self.get_provided_components(), res):
+            if comp in components:
+                out[comp] = comp_res
+
+        return out
+
     def calc_seismograms(self, source, receivers, components, deltat=None,
                          itmin=None, nsamples=None,
                          interpolation='nearest_neighbor',
                          optimization='enable', nthreads=1):
+
+        return self.calc_many_seismograms(
+            [source], receivers, components,
+            deltat=deltat,
+            itmin=itmin,
+            nsamples=nsamples,
+            interpolation=interpolation,
+            optimization=optimization,
+            nthreads=nthreads)[0]
+
+    def calc_many_seismograms(
+            self, sources, receivers, components, deltat=None,
+            itmin=None, nsamples=None,
+            interpolation='nearest_neighbor',
+            optimization='enable', nthreads=1):
+
+        '''
+        Calculate seismograms for several discretized sources at once.
+
+        All combinations of sources and receivers are computed in a single
+        call to the C extension, so that the per-source overhead is small
+        when many sources are to be evaluated for the same set of receivers.
+
+        :param sources: Discretized sources.
+        :type sources: list of :py:class:`DiscretizedSource`
+        :param receivers: Receivers, shared by all sources.
+        :type receivers: list of :py:class:`~pyrocko.gf.meta.Receiver`
+        :param components: Names of the components to be returned.
+        :type components: list of str
+        :param itmin: Index of first sample wanted, for each receiver.
+        :type itmin: :py:class:`numpy.ndarray` of int
+        :param nsamples: Number of samples wanted for each receiver, ``-1``
+            for the full extent.
+        :type nsamples: :py:class:`numpy.ndarray` of int
+
+        Other arguments are as in :py:meth:`calc_seismograms`.
+
+        :returns: For each source a list with, for each receiver, a
+            ``dict`` mapping component names to :py:class:`GFTrace` objects.
+        '''
+
         config = self.config
 
         assert interpolation in ['nearest_neighbor', 'multilinear'], \
@@ -2129,51 +2793,70 @@ use `fomosto tttlsd` to fix holes.''' % w
 
         scheme = config.component_scheme
 
-        source_coords_arr = source.coords5()
-        source_terms = source.get_source_terms(scheme)
-        delays = source.times.ravel()
+        nsource = len(sources)
+        if nsource == 0:
+            return []
 
         nreceiver = len(receivers)
+        dt = self.get_deltat()
+
+        source_offsets = num.zeros(nsource + 1, dtype=num.uint64)
+        itoffsets = num.zeros(nsource, dtype=num.int64)
+        delays = []
+        for isource, source in enumerate(sources):
+            delays_source = source.times.ravel()
+            if delays_source.size != 0:
+                itoffsets[isource] = int(num.floor(delays_source.min()/dt))
+
+            delays.append(delays_source - itoffsets[isource]*dt)
+            source_offsets[isource+1] = \
+                source_offsets[isource] + delays_source.size
+
+        source_coords_arr = num.vstack(
+            [source.coords5() for source in sources])
+        source_terms = num.vstack(
+            [source.get_source_terms(scheme) for source in sources])
+        delays = num.concatenate(delays)
+
         receiver_coords_arr = num.empty((nreceiver, 5))
         for irec, rec in enumerate(receivers):
             receiver_coords_arr[irec, :] = rec.coords5
 
-        dt = self.get_deltat()
-
-        itoffset = int(num.floor(delays.min()/dt)) if delays.size != 0 else 0
-
         if itmin is None:
-            itmin = num.zeros(nreceiver, dtype=num.int32)
+            itmin = num.zeros(nsource * nreceiver, dtype=num.int32)
         else:
-            itmin = (itmin-itoffset).astype(num.int32)
+            itmin = (num.asarray(itmin)[num.newaxis, :]
+                     - itoffsets[:, num.newaxis]).astype(num.int32).ravel()
 
         if nsamples is None:
-            nsamples = num.zeros(nreceiver, dtype=num.int32) - 1
+            nsamples = num.zeros(nsource * nreceiver, dtype=num.int32) - 1
         else:
-            nsamples = nsamples.astype(num.int32)
+            nsamples = num.tile(
+                num.asarray(nsamples).astype(num.int32), nsource)
 
-        try:
-            results = store_ext.store_calc_timeseries(
-                store.cstore,
-                source_coords_arr,
-                source_terms,
-                (delays - itoffset*dt),
-                receiver_coords_arr,
-                scheme,
-                interpolation,
-                itmin,
-                nsamples,
-                nthreads)
-        except Exception as e:
-            raise e
+        results = store_ext.store_calc_timeseries(
+            store.cstore,
+            source_coords_arr,
+            source_terms,
+            delays,
+            receiver_coords_arr,
+            scheme,
+            interpolation,
+            itmin,
+            nsamples,
+            nthreads,
+            source_offsets)
 
         provided_components = self.get_provided_components()
         ncomponents = len(provided_components)
 
-        seismograms = [dict() for _ in range(nreceiver)]
-        for ires in range(len(results)):
-            res = results.pop(0)
-            ireceiver = ires // ncomponents
+        seismograms = [
+            [dict() for _ in range(nreceiver)] for _ in range(nsource)]
+
+        for ires, res in enumerate(results):
+            ipair = ires // ncomponents
+            isource = ipair // nreceiver
+            ireceiver = ipair % nreceiver
 
             comp = provided_components[res[-2]]
 
@@ -2182,14 +2865,14 @@ use `fomosto tttlsd` to fix holes.''' % w
 
             tr = GFTrace(*res[:-2])
             tr.deltat = config.deltat * decimate
-            tr.itmin += itoffset
+            tr.itmin += int(itoffsets[isource])
 
             tr.n_records_stacked = 0
             tr.t_optimize = 0.
             tr.t_stack = 0.
             tr.err = res[-1]
 
-            seismograms[ireceiver][comp] = tr
+            seismograms[isource][ireceiver][comp] = tr
 
         return seismograms
 
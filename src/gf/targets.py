@@ -280,6 +280,32 @@ class StaticTarget(meta.MultiLocation):
     def post_process(self, engine, source, statics):
         return meta.StaticResult(result=statics)
 
+    def get_gf_matrix_nrows(self):
+        '''
+        Number of rows contributed to a Green's function matrix.
+        '''
+        return 3 * self.ntargets
+
+    def get_gf_matrix_rows(self, statics):
+        '''
+        Arrange static displacements as rows of a Green's function matrix.
+
+        :param statics:
+            Static displacement components as returned by
+            :py:meth:`pyrocko.gf.store.Store.calc_many_statics`, each of
+            shape ``(ncolumns, ntargets)``.
+        :type statics:
+            dict
+
+        :returns:
+            Array of shape ``(3*ntargets, ncolumns)`` with blocks of north,
+            east and down displacements.
+        :rtype:
+            :py:class:`numpy.ndarray`
+        '''
+        return num.vstack([
+            statics['displacement.%s' % c].T for c in 'ned'])
+
 
 class SatelliteTarget(StaticTarget):
     '''
@@ -328,6 +354,19 @@ class SatelliteTarget(StaticTarget):
             result=statics,
             theta=self.theta, phi=self.phi)
 
+    def get_gf_matrix_nrows(self):
+        return self.ntargets
+
+    def get_gf_matrix_rows(self, statics):
+        '''
+        Arrange line of sight displacements as rows of a Green's function
+        matrix.
+
+        :returns:
+            Array of shape ``(ntargets, ncolumns)``.
+        '''
+        return statics['displacement.los'].T
+
 
 class KiteSceneTarget(SatelliteTarget):
 
@@ -371,6 +410,19 @@ class KiteSceneTarget(SatelliteTarget):
 
 class GNSSCampaignTarget(StaticTarget):
 
+    def get_gf_matrix_rows(self, statics):
+        '''
+        Arrange GNSS displacements as rows of a Green's function matrix.
+
+        :returns:
+            Array of shape ``(3*ntargets, ncolumns)`` with blocks of north,
+            east and up displacements.
+        '''
+        return num.vstack([
+            statics['displacement.n'].T,
+            statics['displacement.e'].T,
+            -statics['displacement.d'].T])
+
     def post_process(self, engine, source, statics):
         campaign = gnss.GNSSCampaign()
 
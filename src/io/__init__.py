@@ -231,7 +231,7 @@ def iload(filename, format='mseed', getdata=True, substitutions=None):
 
 def save(traces, filename_template, format='mseed', additional={},
          stations=None, overwrite=True, append=False, check_append=False,
-         check_append_merge=False, check_append_hook=None,
+         check_append_merge=False, check_append_hook=None, writer=None,
          **kwargs):
     '''
     Save traces to file(s).
@@ -262,6 +262,10 @@ def save(traces, filename_template, format='mseed', additional={},
             will either fail (if overwrite is ``False``) or truncate the file
             (if overwrite is True). If the hook returns ``True`` or if no hook
             is installed, appending is allowed.
+    :param writer: :py:class:`~pyrocko.io.mseed.MSeedWriter` object to be
+            used for saving in MiniSEED format. The writer keeps output files
+            open and buffers records between calls. It must be closed by the
+            caller.
     :returns: list of generated filenames
 
     .. note::
@@ -280,8 +284,13 @@ def save(traces, filename_template, format='mseed', additional={},
             '`pyrocko.io.save` has been called with `append=True` but the '
             'file format `%s` does not support appending.' % format)
 
+    if writer is not None and format != 'mseed':
+        raise FileSaveError(
+            '`pyrocko.io.save` has been called with a writer but the file '
+            'format `%s` does not support it.' % format)
+
     if format == 'mseed':
-        return mseed.save(
+        return (mseed.save if writer is None else writer.save)(
             traces, filename_template, additional,
             overwrite=overwrite,
             append=append,
@@ -14,6 +14,14 @@
 #include <libmseed.h>
 #include <assert.h>
 
+#if defined(_OPENMP)
+    # include <omp.h>
+#endif
+
+/* number of records per thread decoded in one batch by the parallel
+ * buffer parser */
+#define NRECORDS_BATCH 256
+
 struct module_state
 {
     PyObject *error;
@@ -84,82 +92,206 @@ pyrocko_ms_readtraces(MSTraceGroup **ppmstg, const char *msfile, flag dataflag,
     return retcode;
 }
 
-static PyObject *
-mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
+/*********************************************************************
+ * parse_next_record:
+ *
+ * Find and parse the next record in a memory buffer, starting at *pos.
+ * Non-data chunks are skipped in steps of MINRECLEN, as in the file
+ * reader. The length of a record without blockette 1000 at the end of the
+ * buffer is implied by the end of the buffer. Record length hints larger
+ * than MAXRECLEN are treated like non-data.
+ *
+ * Returns MS_NOERROR if a record has been found, *pos is then the start
+ * of the record. Returns MS_ENDOFFILE if there are no more records; a
+ * truncated record at the end of the buffer is ignored.
+ *********************************************************************/
+static int
+parse_next_record(char *buffer, off_t buflen, off_t *pos, MSRecord **ppmsr, flag dataflag)
 {
-    char *filename;
-    MSTraceGroup *mstg = NULL;
-    MSTrace *mst = NULL;
+    off_t nremain;
+    int reclen;
     int retcode;
-    npy_intp array_dims[1] = {0};
-    npy_intp size_bytes;
-    PyObject *array = NULL;
-    PyObject *out_traces = NULL;
-    PyObject *out_trace = NULL;
-    int numpytype;
-    PyObject *unpackdata = NULL;
 
-    off_t offset = 0;
-    off_t segment_size = 0;
-    long long offset_temp = 0;
-    long long segment_size_temp = 0;
+    while ((nremain = buflen - *pos) >= MINRECLEN)
+    {
+        if (nremain > MAXRECLEN)
+            nremain = MAXRECLEN;
 
-    struct module_state *st = GETSTATE(m);
-    (void)m;
+        retcode = msr_parse(buffer + *pos, (int)nremain, ppmsr, -1, dataflag, 0);
+        if (retcode > 0 && buflen - *pos <= MAXRECLEN)
+        {
+            /* record length implied by the end of the buffer */
+            reclen = (int)(buflen - *pos);
+            if ((reclen & (reclen - 1)) == 0)
+                retcode = msr_parse(buffer + *pos, reclen, ppmsr, reclen, dataflag, 0);
+        }
 
-    static char *kwlist[] = {"filename", "dataflag", "offset", "segment_size", NULL};
+        if (retcode == MS_NOERROR)
+            return MS_NOERROR;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s|OLi", kwlist, &filename, &unpackdata, &offset_temp, &segment_size_temp))
-        return NULL;
+        if (retcode > 0 && buflen - *pos <= MAXRECLEN)
+        {
+            /* truncated record */
+            *pos = buflen;
+            return MS_ENDOFFILE;
+        }
 
-    if (offset_temp > OFF_MAX || offset_temp < OFF_MIN)
-    {
-        PyErr_SetString(st->error, "invalid value: offset_temp");
-        return NULL;
+        /* skip non-data */
+        *pos += MINRECLEN;
     }
 
-    offset = (off_t)offset_temp;
+    return MS_ENDOFFILE;
+}
 
-    if (segment_size_temp > OFF_MAX || segment_size_temp < OFF_MIN)
+/*********************************************************************
+ * pyrocko_ms_parsetraces:
+ *
+ * Like pyrocko_ms_readtraces() but parses records from a memory buffer.
+ *
+ * With nthreads != 1, records are located sequentially, with headers only,
+ * and then decoded in batches by a pool of threads. The decoded records
+ * are added to the trace group in their original order, so that the
+ * result does not depend on nthreads. If nthreads is 0, all available
+ * processors are used.
+ *
+ * On return, *offset is the position in the buffer after the last record
+ * parsed and *last is set if the end of the buffer has been reached.
+ *********************************************************************/
+static int
+pyrocko_ms_parsetraces(MSTraceGroup **ppmstg, char *buffer, off_t buflen, flag dataflag, off_t *offset, off_t segment_size, int *last, int nthreads)
+{
+    MSRecord *msr = NULL;
+    MSRecord **msrs = NULL;
+    off_t *recpos = NULL;
+    int *reclens = NULL;
+    off_t pos = *offset;
+    int retcode = MS_NOERROR;
+    int nrecords = 0;
+    int nbatch, ibatch, nbatch_max;
+    ssize_t irec;
+    int done = 0;
+    int parallel;
+
+    if (!ppmstg)
+        return MS_GENERROR;
+
+    if (!*ppmstg)
     {
-        PyErr_SetString(st->error, "invalid value: segment_size");
-        return NULL;
+        *ppmstg = mst_initgroup(*ppmstg);
+
+        if (!*ppmstg)
+        {
+            return MS_GENERROR;
+        }
     }
 
-    segment_size = (off_t)segment_size_temp;
+    parallel = dataflag && nthreads != 1;
 
-    if (!PyBool_Check(unpackdata))
+#if defined(_OPENMP)
+    if (nthreads == 0)
+        nthreads = omp_get_num_procs();
+    else if (nthreads > omp_get_num_procs())
+        nthreads = omp_get_num_procs();
+#else
+    nthreads = 1;
+#endif
+
+    *last = 0;
+
+    if (!parallel)
     {
-        PyErr_SetString(st->error, "dataflag argument must be a boolean");
-        return NULL;
+        while (!done && parse_next_record(buffer, buflen, &pos, &msr, dataflag) == MS_NOERROR)
+        {
+            mst_addmsrtogroup(*ppmstg, msr, 0, -1., -1.);
+            pos += msr->reclen;
+            nrecords++;
+            done = (segment_size > 0) && ((pos - *offset) >= segment_size);
+        }
     }
-    if (segment_size < 0)
+    else
     {
-        PyErr_SetString(st->error, "segment_size must be positive");
-        return NULL;
-    }
+        nbatch_max = NRECORDS_BATCH * nthreads;
+        msrs = (MSRecord **)calloc(nbatch_max, sizeof(MSRecord *));
+        recpos = (off_t *)calloc(nbatch_max, sizeof(off_t));
+        reclens = (int *)calloc(nbatch_max, sizeof(int));
+        if (msrs == NULL || recpos == NULL || reclens == NULL)
+        {
+            free(msrs);
+            free(recpos);
+            free(reclens);
+            return MS_GENERROR;
+        }
 
-    /* get data from mseed file */
-    Py_BEGIN_ALLOW_THREADS
-    retcode = pyrocko_ms_readtraces(&mstg, filename, (unpackdata == Py_True), &offset, segment_size);
-    Py_END_ALLOW_THREADS
+        while (!done)
+        {
+            /* locate records of next batch, headers only */
+            nbatch = 0;
+            while (nbatch < nbatch_max && !done)
+            {
+                if (parse_next_record(buffer, buflen, &pos, &msr, 0) != MS_NOERROR)
+                {
+                    done = 1;
+                    break;
+                }
+                recpos[nbatch] = pos;
+                reclens[nbatch] = msr->reclen;
+                nbatch++;
+                pos += msr->reclen;
+                done = (segment_size > 0) && ((pos - *offset) >= segment_size);
+            }
 
-        if (retcode < 0)
-    {
-        PyErr_Format(st->error, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
-        if (mstg != NULL)
-            mst_freegroup(&mstg);
-        return NULL;
+            /* decode */
+            #pragma omp parallel for schedule(dynamic, 16) num_threads(nthreads)
+            for (irec = 0; irec < nbatch; irec++)
+            {
+                msrs[irec] = NULL;
+                if (msr_parse(buffer + recpos[irec], reclens[irec], &msrs[irec], reclens[irec], 1, 0) != MS_NOERROR)
+                    msr_free(&msrs[irec]);
+            }
+
+            /* stitch, in order */
+            for (ibatch = 0; ibatch < nbatch; ibatch++)
+            {
+                if (msrs[ibatch] != NULL)
+                {
+                    mst_addmsrtogroup(*ppmstg, msrs[ibatch], 0, -1., -1.);
+                    msr_free(&msrs[ibatch]);
+                    nrecords++;
+                }
+            }
+        }
+
+        free(msrs);
+        free(recpos);
+        free(reclens);
     }
 
-    if (mstg == NULL)
+    msr_free(&msr);
+
+    if (buflen - pos < MINRECLEN)
     {
-        PyErr_SetString(st->error, "Error reading file");
-        return NULL;
+        *last = 1;
+        if (nrecords == 0 && *offset == 0 && buflen > 0)
+            retcode = MS_NOTSEED;
     }
 
+    *offset = pos;
+    return retcode;
+}
+
+static PyObject *
+traces_to_list(struct module_state *st, MSTraceGroup *mstg, int unpackdata, off_t offset, int last)
+{
+    MSTrace *mst = NULL;
+    npy_intp array_dims[1] = {0};
+    npy_intp size_bytes;
+    PyObject *array = NULL;
+    PyObject *out_traces = NULL;
+    PyObject *out_trace = NULL;
+    int numpytype;
+
     /* check that there is data in the traces */
-    if (unpackdata == Py_True)
+    if (unpackdata)
     {
         mst = mstg->traces;
         while (mst)
@@ -167,7 +299,6 @@ mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
             if (mst->datasamples == NULL)
             {
                 PyErr_SetString(st->error, "Error reading file - datasamples is NULL");
-                mst_freegroup(&mstg);
                 return NULL;
             }
             mst = mst->next;
@@ -176,16 +307,13 @@ mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
 
     out_traces = Py_BuildValue("[]");
     if (out_traces == NULL)
-    {
-        mst_freegroup(&mstg);
         return NULL;
-    }
 
     mst = mstg->traces;
     while (mst)
     {
 
-        if (unpackdata == Py_True)
+        if (unpackdata)
         {
             array_dims[0] = mst->numsamples;
             switch (mst->sampletype)
@@ -209,7 +337,6 @@ mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
             default:
                 PyErr_Format(st->error, "Unknown sampletype %c\n", mst->sampletype);
                 Py_XDECREF(out_traces);
-                mst_freegroup(&mstg);
                 return NULL;
             }
             array = PyArray_SimpleNew(1, array_dims, numpytype);
@@ -233,12 +360,11 @@ mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
         out_trace = Py_BuildValue("(c,s,s,s,s,L,L,d,N,L,O)",
                                   mst->dataquality, mst->network, mst->station, mst->location, mst->channel,
                                   mst->starttime, mst->endtime, mst->samprate, array,
-                                  (long long)offset, (retcode == MS_ENDOFFILE) ? Py_True : Py_False);
+                                  (long long)offset, last ? Py_True : Py_False);
 
         if (out_trace == NULL)
         {
             Py_XDECREF(out_traces);
-            mst_freegroup(&mstg);
             return NULL;
         }
 
@@ -247,6 +373,152 @@ mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
         mst = mst->next;
     }
 
+    return out_traces;
+}
+
+static PyObject *
+mseed_get_traces(PyObject *m, PyObject *args, PyObject *kwds)
+{
+    char *filename;
+    MSTraceGroup *mstg = NULL;
+    int retcode;
+    PyObject *out_traces = NULL;
+    PyObject *unpackdata = NULL;
+
+    off_t offset = 0;
+    off_t segment_size = 0;
+    long long offset_temp = 0;
+    long long segment_size_temp = 0;
+
+    struct module_state *st = GETSTATE(m);
+    (void)m;
+
+    static char *kwlist[] = {"filename", "dataflag", "offset", "segment_size", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s|OLi", kwlist, &filename, &unpackdata, &offset_temp, &segment_size_temp))
+        return NULL;
+
+    if (offset_temp > OFF_MAX || offset_temp < OFF_MIN)
+    {
+        PyErr_SetString(st->error, "invalid value: offset_temp");
+        return NULL;
+    }
+
+    offset = (off_t)offset_temp;
+
+    if (segment_size_temp > OFF_MAX || segment_size_temp < OFF_MIN)
+    {
+        PyErr_SetString(st->error, "invalid value: segment_size");
+        return NULL;
+    }
+
+    segment_size = (off_t)segment_size_temp;
+
+    if (!PyBool_Check(unpackdata))
+    {
+        PyErr_SetString(st->error, "dataflag argument must be a boolean");
+        return NULL;
+    }
+    if (segment_size < 0)
+    {
+        PyErr_SetString(st->error, "segment_size must be positive");
+        return NULL;
+    }
+
+    /* get data from mseed file */
+    Py_BEGIN_ALLOW_THREADS
+    retcode = pyrocko_ms_readtraces(&mstg, filename, (unpackdata == Py_True), &offset, segment_size);
+    Py_END_ALLOW_THREADS
+
+        if (retcode < 0)
+    {
+        PyErr_Format(st->error, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        if (mstg != NULL)
+            mst_freegroup(&mstg);
+        return NULL;
+    }
+
+    if (mstg == NULL)
+    {
+        PyErr_SetString(st->error, "Error reading file");
+        return NULL;
+    }
+
+    out_traces = traces_to_list(st, mstg, unpackdata == Py_True, offset, retcode == MS_ENDOFFILE);
+    mst_freegroup(&mstg);
+    return out_traces;
+}
+
+static PyObject *
+mseed_get_traces_buffer(PyObject *m, PyObject *args, PyObject *kwds)
+{
+    Py_buffer buffer;
+    MSTraceGroup *mstg = NULL;
+    int retcode;
+    int last = 0;
+    PyObject *out_traces = NULL;
+    PyObject *unpackdata = Py_True;
+
+    off_t offset = 0;
+    off_t segment_size = 0;
+    long long offset_temp = 0;
+    long long segment_size_temp = 0;
+
+    struct module_state *st = GETSTATE(m);
+
+    int nthreads = 1;
+
+    static char *kwlist[] = {"buffer", "dataflag", "offset", "segment_size", "nthreads", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "y*|OLLi", kwlist, &buffer, &unpackdata, &offset_temp, &segment_size_temp, &nthreads))
+        return NULL;
+
+    if (nthreads < 0)
+    {
+        PyErr_SetString(st->error, "nthreads must not be negative");
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if (!PyBool_Check(unpackdata))
+    {
+        PyErr_SetString(st->error, "dataflag argument must be a boolean");
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if (offset_temp < 0 || offset_temp > buffer.len || offset_temp > OFF_MAX)
+    {
+        PyErr_SetString(st->error, "invalid value: offset");
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if (segment_size_temp < 0 || segment_size_temp > OFF_MAX)
+    {
+        PyErr_SetString(st->error, "segment_size must be positive");
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    offset = (off_t)offset_temp;
+    segment_size = (off_t)segment_size_temp;
+
+    Py_BEGIN_ALLOW_THREADS
+    retcode = pyrocko_ms_parsetraces(&mstg, (char *)buffer.buf, (off_t)buffer.len, (unpackdata == Py_True), &offset, segment_size, &last, nthreads);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+
+    if (retcode < 0)
+    {
+        PyErr_Format(st->error, "Cannot parse buffer: %s", ms_errorstr(retcode));
+        if (mstg != NULL)
+            mst_freegroup(&mstg);
+        return NULL;
+    }
+
+    out_traces = traces_to_list(st, mstg, unpackdata == Py_True, offset, last);
     mst_freegroup(&mstg);
     return out_traces;
 }
@@ -446,11 +718,17 @@ typedef struct MemoryInfo_t
     void *head;
     size_t capacity;
     size_t nbytes_written;
+    int overflow;
 } MemoryInfo;
 
 static void copy_memory(char *record, int reclen, void *mem)
 {
     MemoryInfo *info = (MemoryInfo *)mem;
+    if (info->nbytes_written + (size_t)reclen > info->capacity)
+    {
+        info->overflow = 1;
+        return;
+    }
     if (memcpy(info->head, record, reclen) == NULL)
         fprintf(stderr, "Could not write to memory\n");
     info->head = (void *)((char *)info->head + reclen);
@@ -475,9 +753,9 @@ mseed_bytes(PyObject *m, PyObject *args, PyObject *kwds)
 
     MemoryInfo mem_info;
 
-    static char *kwlist[] = {"traces", "nbytes", "record_length", "steim", NULL};
+    struct module_state *st = GETSTATE(m);
 
-    (void) m;
+    static char *kwlist[] = {"traces", "nbytes", "record_length", "steim", NULL};
 
     if (!PyArg_ParseTupleAndKeywords(args, kwds, "On|ni", kwlist, &in_traces, &nbytes, &record_length, &steim))
         return NULL;
@@ -509,6 +787,7 @@ mseed_bytes(PyObject *m, PyObject *args, PyObject *kwds)
     mem_info.head = buffer.buf;
     mem_info.capacity = nbytes;
     mem_info.nbytes_written = 0;
+    mem_info.overflow = 0;
 
     msr = msr_init(NULL);
     msr->sequence_number = 0;
@@ -537,6 +816,13 @@ mseed_bytes(PyObject *m, PyObject *args, PyObject *kwds)
     PyBuffer_Release(&buffer);
     msr_free(&msr);
 
+    if (mem_info.overflow)
+    {
+        Py_DECREF(mseed_data);
+        PyErr_SetString(st->error, "Packed records exceed output buffer size.");
+        return NULL;
+    }
+
     if (_PyBytes_Resize(&mseed_data, (Py_ssize_t)mem_info.nbytes_written) == -1)
     {
         PyErr_SetString(PyExc_BufferError, "could not resize bytes object");
@@ -557,6 +843,13 @@ static PyMethodDef mseed_ext_methods[] = {
                "in libmseed. If dataflag is True, `data` is a numpy array containing the\n"
                "data. If dataflag is False, the data is not unpacked and `data` is None.\n")},
 
+    {"get_traces_buffer", (PyCFunction)(void(*)(void))mseed_get_traces_buffer, METH_VARARGS | METH_KEYWORDS,
+     PyDoc_STR("get_traces_buffer(buffer, dataflag=True, offset=0, segment_size=0, nthreads=1)\n"
+               "Get all traces stored in an mseed memory buffer.\n\n"
+               "Like get_traces but reads from any object supporting the buffer\n"
+               "protocol (bytes, bytearray, memoryview, mmap, ...). With nthreads != 1,\n"
+               "records are decoded in parallel, 0 means all available processors.\n")},
+
     {"store_traces", (PyCFunction)(void(*)(void))mseed_store_traces, METH_VARARGS | METH_KEYWORDS,
      PyDoc_STR("store_traces(traces, filename, record_length=4096)\n")},
 
@@ -9,11 +9,12 @@ Read/write MiniSEED files (wraps `libmseed
 '''
 
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from struct import unpack
 import os
 import re
 import math
+import mmap
 import logging
 
 from pyrocko import trace
@@ -30,15 +31,17 @@ class CodeTooLong(FileSaveError):
     pass
 
 
-def iload(filename, load_data=True, offset=0, segment_size=0, nsegments=0):
+def _iload(get_traces, source, source_desc, load_data, offset, segment_size,
+           nsegments, **kwargs):
+
     from pyrocko import mseed_ext
 
     have_zero_rate_traces = False
     try:
         isegment = 0
         while isegment < nsegments or nsegments == 0:
-            tr_tuples = mseed_ext.get_traces(
-                filename, load_data, offset, segment_size)
+            tr_tuples = get_traces(
+                source, load_data, offset, segment_size, **kwargs)
 
             if not tr_tuples:
                 break
@@ -81,12 +84,105 @@ def iload(filename, load_data=True, offset=0, segment_size=0, nsegments=0):
             isegment += 1
 
     except (OSError, mseed_ext.MSeedError) as e:
-        raise FileLoadError(str(e)+' (file: %s)' % filename)
+        raise FileLoadError(str(e)+' (%s)' % source_desc)
 
     if have_zero_rate_traces:
         logger.warning(
-            'Ignoring traces with sampling rate of zero in file %s '
-            '(maybe LOG traces)' % filename)
+            'Ignoring traces with sampling rate of zero in %s '
+            '(maybe LOG traces)' % source_desc)
+
+
+def _iload_mmap(filename, load_data, offset, segment_size, nsegments,
+                nthreads):
+
+    from pyrocko import mseed_ext
+
+    try:
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                buffer = None
+            else:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except OSError as e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+    if buffer is None:
+        # let the file reader complain about the empty file
+        yield from _iload(
+            mseed_ext.get_traces, filename, 'file: %s' % filename,
+            load_data, offset, segment_size, nsegments)
+
+        return
+
+    try:
+        yield from _iload(
+            mseed_ext.get_traces_buffer, buffer, 'file: %s' % filename,
+            load_data, offset, segment_size, nsegments, nthreads=nthreads)
+
+    finally:
+        buffer.close()
+
+
+def iload(filename, load_data=True, offset=0, segment_size=0, nsegments=0,
+          nthreads=1):
+
+    '''
+    Read traces from MiniSEED file (iterator version).
+
+    :param filename: path to the file
+    :param load_data: whether to unpack the sample data
+    :param offset: start position in the file [bytes]
+    :param segment_size: if non-zero, read the file in segments of this
+        size [bytes]
+    :param nsegments: if non-zero, stop after this number of segments
+    :param nthreads: number of threads to use for decoding the records, 0
+        for all available processors. With ``nthreads != 1``, the file is
+        memory-mapped and its records are decoded in parallel (see
+        :py:func:`iload_buffer`).
+    '''
+
+    from pyrocko import mseed_ext
+
+    if nthreads != 1:
+        return _iload_mmap(
+            filename, load_data, offset, segment_size, nsegments, nthreads)
+
+    return _iload(
+        mseed_ext.get_traces, filename, 'file: %s' % filename,
+        load_data, offset, segment_size, nsegments)
+
+
+def iload_buffer(
+        buffer, load_data=True, offset=0, segment_size=0, nsegments=0,
+        nthreads=1):
+
+    '''
+    Read traces from MiniSEED data in memory.
+
+    Works like :py:func:`iload` but takes the data from an object supporting
+    the buffer protocol, e.g. :py:class:`bytes`, :py:class:`bytearray`,
+    :py:class:`memoryview` or :py:class:`mmap.mmap`, so that data received
+    over the network does not have to be written to a file first. The buffer
+    must not be modified while the returned iterator is in use.
+
+    :param buffer: MiniSEED records
+    :param load_data: whether to unpack the sample data
+    :param offset: start position in the buffer [bytes]
+    :param segment_size: if non-zero, parse the buffer in segments of this
+        size [bytes]
+    :param nsegments: if non-zero, stop after this number of segments
+    :param nthreads: number of threads to use for decoding the records, 0
+        for all available processors. Records are located sequentially and
+        then decoded in parallel batches. The result does not depend on
+        ``nthreads``.
+    '''
+
+    from pyrocko import mseed_ext
+
+    return _iload(
+        mseed_ext.get_traces_buffer, buffer, 'buffer',
+        load_data, offset, segment_size, nsegments, nthreads=nthreads)
 
 
 def as_tuple(tr, dataquality='D'):
@@ -98,6 +194,18 @@ def as_tuple(tr, dataquality='D'):
             itmin, itmax, srate, dataquality, tr.get_ydata())
 
 
+def _check_codes(tr):
+    for code, maxlen, val in zip(
+            ['network', 'station', 'location', 'channel'],
+            [2, 5, 2, 3],
+            tr.nslc_id):
+
+        if len(val) > maxlen:
+            raise CodeTooLong(
+                '%s code too long to be stored in MSeed file: %s' %
+                (code, val))
+
+
 def save(
         traces,
         filename_template,
@@ -135,15 +243,7 @@ def save(
 
     fn_tr = defaultdict(list)
     for tr in traces:
-        for code, maxlen, val in zip(
-                ['network', 'station', 'location', 'channel'],
-                [2, 5, 2, 3],
-                tr.nslc_id):
-
-            if len(val) > maxlen:
-                raise CodeTooLong(
-                    '%s code too long to be stored in MSeed file: %s' %
-                    (code, val))
+        _check_codes(tr)
 
         fn = tr.fill_template(filename_template, **additional)
         if os.path.exists(fn):
@@ -216,6 +316,256 @@ def save(
     return list(fn_tr.keys())
 
 
+class MSeedWriter(object):
+    '''
+    Streaming MiniSEED writer keeping output files open between calls.
+
+    Drop-in replacement for repeated calls to :py:func:`save`, e.g. when
+    converting data window by window into files collecting several windows.
+    Output files are held in a pool of at most ``max_open_files`` open files
+    with least-recently-used eviction. Packed records are buffered per open
+    file and written when the buffer exceeds ``buffer_size`` bytes, when the
+    file is evicted from the pool, and on :py:meth:`flush` or
+    :py:meth:`close`. The time spans of the traces stored in open files are
+    remembered, so that ``check_append`` does not have to re-read them.
+
+    Files created, truncated or appended to by the writer are considered to
+    be owned by it: further calls append to them without consulting
+    ``check_append_hook``.
+
+    Use as a context manager or call :py:meth:`close` when done.
+
+    :param max_open_files: maximum number of simultaneously open files
+    :param buffer_size: write buffer size per open file [bytes]
+    '''
+
+    def __init__(self, max_open_files=64, buffer_size=256*1024):
+        assert max_open_files >= 1
+        self._max_open_files = max_open_files
+        self._buffer_size = buffer_size
+        self._open = OrderedDict()
+        self._contents = {}
+        self._owned = set()
+        self._stats = dict(nopen=0, nwrite=0, nevict=0, nreread=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def save(
+            self,
+            traces,
+            filename_template,
+            additional={},
+            overwrite=True,
+            dataquality='D',
+            record_length=4096,
+            append=False,
+            check_append=False,
+            check_append_merge=False,
+            check_append_hook=None,
+            check_overlaps=True,
+            steim=1):
+
+        '''
+        Save traces to file(s).
+
+        Arguments are the same as for :py:func:`save`.
+
+        :returns: list of generated filenames
+        '''
+
+        from pyrocko import mseed_ext
+
+        assert record_length in VALID_RECORD_LENGTHS
+        assert dataquality in ('D', 'E', 'C', 'O', 'T', 'L'), \
+            'invalid dataquality'
+
+        if not append:
+            check_append = False
+            check_append_hook = None
+
+        fn_tr = defaultdict(list)
+        for tr in traces:
+            _check_codes(tr)
+            fn = tr.fill_template(filename_template, **additional)
+            if fn not in fn_tr:
+                self._prepare(fn, overwrite, append, check_append_hook)
+
+            fn_tr[fn].append(tr)
+
+        for fn, traces_thisfile in fn_tr.items():
+            if check_overlaps:
+                try:
+                    trace.check_overlaps(
+                        traces_thisfile,
+                        message='Traces to be stored have overlaps.\n  '
+                                'File: %s' % fn)
+
+                except trace.OverlappingTraces as e:
+                    raise FileSaveError(str(e)) from e
+
+            if check_append:
+                traces_infile = self._get_contents(fn)
+                try:
+                    trace.check_overlaps(
+                        traces_thisfile,
+                        traces_infile,
+                        message='Trace to be stored would overlap with '
+                                'trace already stored in file.\n  File: %s'
+                        % fn)
+
+                except trace.OverlappingTraces as e:
+                    if check_append_merge:
+                        self._close_file(fn)
+                        traces_thisfile_merge = list(iload(fn, load_data=True))
+                        traces_thisfile_merge.extend(
+                            tr.copy() for tr in traces_thisfile)
+                        traces_thisfile = trace.degapper(
+                            sorted(
+                                traces_thisfile_merge,
+                                key=lambda tr: tr.full_id))
+
+                        self._truncate(fn)
+
+                    else:
+                        raise FileSaveError(str(e)) from e
+
+            traces_thisfile.sort(key=lambda a: a.full_id)
+            try:
+                data = get_bytes(
+                    traces_thisfile, dataquality, record_length, steim)
+            except mseed_ext.MSeedError as e:
+                raise FileSaveError(
+                    str(e) + " (while storing traces to file '%s')" % fn)
+
+            self._write(fn, data, traces_thisfile)
+
+        return list(fn_tr.keys())
+
+    def flush(self):
+        '''
+        Write all buffered records to the open files.
+        '''
+
+        for fn in self._open:
+            self._flush_file(fn)
+
+    def close(self):
+        '''
+        Write all buffered records and close all open files.
+        '''
+
+        while self._open:
+            self._close_file(next(iter(self._open)))
+
+    def get_stats(self):
+        '''
+        Get file handling statistics.
+
+        :returns: dict with number of file opens (``'nopen'``), write calls
+            (``'nwrite'``), evictions from the pool of open files
+            (``'nevict'``) and file re-reads for ``check_append``
+            (``'nreread'``).
+        '''
+
+        return dict(self._stats)
+
+    def _prepare(self, fn, overwrite, append, check_append_hook):
+        if fn in self._owned:
+            if append:
+                return
+
+            if not overwrite:
+                raise FileSaveError('File exists: %s' % fn)
+
+            self._truncate(fn)
+
+        elif os.path.exists(fn):
+            if not append or (
+                    append and check_append_hook
+                    and not check_append_hook(fn)):
+
+                if not overwrite:
+                    raise FileSaveError('File exists: %s' % fn)
+
+                self._truncate(fn)
+
+        else:
+            self._contents[fn] = []
+
+        self._owned.add(fn)
+
+    def _truncate(self, fn):
+        if fn in self._open:
+            self._open.pop(fn)[0].close()
+
+        if os.path.exists(fn):
+            os.unlink(fn)
+
+        self._contents[fn] = []
+
+    def _get_contents(self, fn):
+        if fn not in self._contents:
+            self._flush_file(fn)
+            if os.path.exists(fn):
+                self._stats['nreread'] += 1
+                self._contents[fn] = list(iload(fn, load_data=False))
+            else:
+                self._contents[fn] = []
+
+        return self._contents[fn]
+
+    def _get_open(self, fn):
+        if fn in self._open:
+            self._open.move_to_end(fn)
+        else:
+            while len(self._open) >= self._max_open_files:
+                self._stats['nevict'] += 1
+                self._close_file(next(iter(self._open)))
+
+            ensuredirs(fn)
+            try:
+                f = open(fn, 'ab')
+            except OSError as e:
+                raise FileSaveError(
+                    'Cannot open file for writing: %s (%s)' % (fn, e))
+
+            self._stats['nopen'] += 1
+            self._open[fn] = (f, bytearray())
+
+        return self._open[fn]
+
+    def _write(self, fn, data, traces):
+        f, buf = self._get_open(fn)
+        buf.extend(data)
+        if fn in self._contents:
+            self._contents[fn].extend(
+                trace.Trace(
+                    *tr.nslc_id, tmin=tr.tmin, tmax=tr.tmax, deltat=tr.deltat)
+                for tr in traces)
+
+        if len(buf) >= self._buffer_size:
+            self._flush_file(fn)
+
+    def _flush_file(self, fn):
+        if fn in self._open:
+            f, buf = self._open[fn]
+            if buf:
+                f.write(buf)
+                self._stats['nwrite'] += 1
+                del buf[:]
+
+    def _close_file(self, fn):
+        if fn in self._open:
+            self._flush_file(fn)
+            f, _ = self._open.pop(fn)
+            f.close()
+            self._contents.pop(fn, None)
+
+
 tcs = {}
 
 
@@ -225,25 +575,25 @@ def get_bytes(traces, dataquality='D', record_length=4096, steim=1):
     assert record_length in VALID_RECORD_LENGTHS
     assert dataquality in ('D', 'E', 'C', 'O', 'T', 'L'), 'invalid dataquality'
 
-    nbytes_approx = 0
+    nbytes_max = 0
     rl = record_length
     trtups = []
     for tr in traces:
-        for code, maxlen, val in zip(
-                ['network', 'station', 'location', 'channel'],
-                [2, 5, 2, 3],
-                tr.nslc_id):
-
-            if len(val) > maxlen:
-                raise CodeTooLong(
-                    '%s code too long to be stored in MSeed file: %s' %
-                    (code, val))
-
-        nbytes_approx += math.ceil(
-            tr.ydata.nbytes / (rl-MSEED_HEADER_BYTES)) * rl
+        _check_codes(tr)
+
+        ydata = tr.get_ydata()
+        if ydata.dtype.kind == 'i' and ydata.itemsize == 4:
+            # Steim: in the worst case, each sample takes a full 32-bit word
+            # and every 64 byte frame carries a control word; the first
+            # frame additionally holds the integration constants.
+            nsamples_record = ((rl-MSEED_HEADER_BYTES) // 64) * 15 - 2
+        else:
+            nsamples_record = (rl-MSEED_HEADER_BYTES) // ydata.itemsize
+
+        nbytes_max += math.ceil(ydata.size / nsamples_record) * rl
         trtups.append(as_tuple(tr, dataquality))
 
-    return mseed_ext.mseed_bytes(trtups, nbytes_approx, record_length, steim)
+    return mseed_ext.mseed_bytes(trtups, nbytes_max, record_length, steim)
 
 
 def detect(first512):
@@ -8,13 +8,48 @@ Multi-component waveform data model.
 '''
 
 
+import os
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as num
+from scipy import signal
 
-from . import trace
+from . import trace, util
 from .guts import Object, Float, Timestamp, List
 from .guts_array import Array
 from .squirrel.model import CodesNSLCE
 
+logger = logging.getLogger('pyrocko.multitrace')
+
+
+def _map_row_blocks(func, data, nthreads):
+    '''
+    Apply function to blocks of rows of a 2D array, optionally in threads.
+
+    :param func: function taking and returning a 2D array
+    :param data: input array
+    :param nthreads: number of threads, ``0`` for number of processors
+
+    :returns: results of ``func`` concatenated along the first axis
+    '''
+
+    if nthreads == 0:
+        nthreads = os.cpu_count() or 1
+
+    nthreads = max(1, min(nthreads, data.shape[0]))
+    if nthreads == 1:
+        return func(data)
+
+    bounds = num.linspace(0, data.shape[0], nthreads+1).astype(int)
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        blocks = list(executor.map(
+            lambda i: func(data[bounds[i]:bounds[i+1]]),
+            range(nthreads)))
+
+    return num.concatenate(blocks, axis=0)
+
 
 class MultiTrace(Object):
     '''
@@ -134,3 +169,263 @@ class MultiTrace(Object):
         Show in Snuffler.
         '''
         trace.snuffle(list(self))
+
+    def nyquist_check(self, frequency, intro='Corner frequency', warn=True,
+                      raise_exception=False):
+
+        '''
+        Check if a given frequency is above the Nyquist frequency.
+
+        :param intro: string used to introduce the warning/error message
+        :param warn: whether to emit a warning
+        :param raise_exception: whether to raise an
+            :py:exc:`~pyrocko.trace.AboveNyquist` exception.
+        '''
+
+        if frequency >= 0.5/self.deltat:
+            message = '%s (%g Hz) is equal to or higher than nyquist ' \
+                      'frequency (%g Hz). (MultiTrace with %i components)' \
+                % (intro, frequency, 0.5/self.deltat, self.ntraces)
+            if warn:
+                logger.warning(message)
+            if raise_exception:
+                raise trace.AboveNyquist(message)
+
+    def _set_data(self, data):
+        self.data = data
+        self.ntraces, self.nsamples = data.shape
+
+    def demean(self):
+        '''
+        Remove mean of each component.
+        '''
+
+        data = self.data.astype(num.float64)
+        if data.size != 0:
+            data -= num.mean(data, axis=1)[:, num.newaxis]
+
+        self._set_data(data)
+
+    def taper(self, taperer):
+        '''
+        Apply a :py:class:`~pyrocko.trace.Taper` to all components.
+
+        The taper window is evaluated once and applied to the data array.
+
+        :param taperer: instance of :py:class:`~pyrocko.trace.Taper` subclass
+        '''
+
+        window = num.ones(self.nsamples)
+        taperer(window, self.tmin, self.deltat)
+        self._set_data(self.data * window[num.newaxis, :])
+
+    def _filter(self, order, corners, btype, demean, nthreads):
+        b, a = trace._get_cached_filter_coeffs(
+            order, [corner*2.0*self.deltat for corner in corners],
+            btype=btype)
+
+        if btype in ('low', 'high') and (
+                len(a) != order+1 or len(b) != order+1):
+
+            logger.warning(
+                'Erroneous filter coefficients returned by '
+                'scipy.signal.butter(). You may need to downsample the '
+                'signal before filtering.')
+
+        def filter_block(data):
+            data = data.astype(num.float64)
+            if demean and data.size != 0:
+                data -= num.mean(data, axis=1)[:, num.newaxis]
+
+            return signal.lfilter(b, a, data, axis=1)
+
+        self._set_data(_map_row_blocks(filter_block, self.data, nthreads))
+
+    def lowpass(self, order, corner, nyquist_warn=True,
+                nyquist_exception=False, demean=True, nthreads=1):
+
+        '''
+        Apply Butterworth lowpass to all components.
+
+        The filter is designed once and applied along the time axis of the
+        data array. Mean is removed before filtering.
+
+        :param order: order of the filter
+        :param corner: corner frequency of the filter
+        :param nthreads: number of threads to use, each processing a block
+            of components (``0`` for number of processors)
+        '''
+
+        self.nyquist_check(
+            corner, 'Corner frequency of lowpass', nyquist_warn,
+            nyquist_exception)
+
+        self._filter(order, [corner], 'low', demean, nthreads)
+
+    def highpass(self, order, corner, nyquist_warn=True,
+                 nyquist_exception=False, demean=True, nthreads=1):
+
+        '''
+        Apply Butterworth highpass to all components.
+
+        See :py:meth:`lowpass` for details.
+
+        :param order: order of the filter
+        :param corner: corner frequency of the filter
+        :param nthreads: number of threads to use
+        '''
+
+        self.nyquist_check(
+            corner, 'Corner frequency of highpass', nyquist_warn,
+            nyquist_exception)
+
+        self._filter(order, [corner], 'high', demean, nthreads)
+
+    def bandpass(self, order, corner_hp, corner_lp, demean=True, nthreads=1):
+        '''
+        Apply Butterworth bandpass to all components.
+
+        See :py:meth:`lowpass` for details.
+
+        :param order: order of the filter
+        :param corner_hp: lower corner frequency of the filter
+        :param corner_lp: upper corner frequency of the filter
+        :param nthreads: number of threads to use
+        '''
+
+        self.nyquist_check(corner_hp, 'Lower corner frequency of bandpass')
+        self.nyquist_check(corner_lp, 'Higher corner frequency of bandpass')
+        self._filter(order, [corner_hp, corner_lp], 'band', demean, nthreads)
+
+    def bandstop(self, order, corner_hp, corner_lp, demean=True, nthreads=1):
+        '''
+        Apply bandstop (attenuates frequencies in band) to all components.
+
+        See :py:meth:`lowpass` for details.
+
+        :param order: order of the filter
+        :param corner_hp: lower corner frequency of the filter
+        :param corner_lp: upper corner frequency of the filter
+        :param nthreads: number of threads to use
+        '''
+
+        self.nyquist_check(corner_hp, 'Lower corner frequency of bandstop')
+        self.nyquist_check(corner_lp, 'Higher corner frequency of bandstop')
+        self._filter(
+            order, [corner_hp, corner_lp], 'bandstop', demean, nthreads)
+
+    def downsample(
+            self, ndecimate, snap=False, demean=False, ftype='fir-remez',
+            cut=False, nthreads=1):
+
+        '''
+        Downsample (decimate) all components by a given integer factor.
+
+        Same as :py:meth:`pyrocko.trace.Trace.downsample` but applied to the
+        whole data array at once.
+
+        :param ndecimate:
+            Decimation factor, avoid values larger than 8.
+        :type ndecimate:
+            int
+
+        :param snap:
+            Whether to put the new sampling instants closest to multiples of
+            the sampling rate (according to absolute time).
+        :type snap:
+            bool
+
+        :param demean:
+            Whether to demean the signal before filtering.
+        :type demean:
+            bool
+
+        :param ftype:
+            Which FIR filter to use, choose from ``'iir'``, ``'fir'``,
+            ``'fir-remez'``. Default is ``'fir-remez'``.
+
+        :param cut:
+            Whether to cut off samples in the beginning of the trace which
+            are polluted by artifacts of the anti-aliasing filter.
+        :type cut:
+            bool
+
+        :param nthreads:
+            Number of threads to use, each processing a block of components
+            (``0`` for number of processors).
+        :type nthreads:
+            int
+        '''
+
+        newdeltat = self.deltat*ndecimate
+        b, a, n = util.decimate_coeffs(ndecimate, None, ftype)
+        if snap:
+            ilag = int(round((math.ceil(
+                (self.tmin+(n//2 if cut else 0)*self.deltat) /
+                newdeltat) * newdeltat - self.tmin) / self.deltat))
+        else:
+            ilag = (n//2 if cut else 0)
+
+        def downsample_block(data):
+            data = data.astype(num.float64)
+            if data.size != 0:
+                if demean:
+                    data -= num.mean(data, axis=1)[:, num.newaxis]
+
+                y = signal.lfilter(b, a, data, axis=1)
+                return y[:, n//2+ilag::ndecimate].copy()
+            else:
+                return data
+
+        self._set_data(_map_row_blocks(downsample_block, self.data, nthreads))
+        self.tmin += ilag * self.deltat
+        self.deltat = util.reuse(self.deltat*ndecimate)
+
+    def downsample_to(
+            self, deltat, snap=False, allow_upsample_max=1, demean=False,
+            ftype='fir-remez', cut=False, nthreads=1):
+
+        '''
+        Downsample all components to given sampling rate.
+
+        Same as :py:meth:`pyrocko.trace.Trace.downsample_to` but applied to
+        the whole data array at once.
+
+        :param deltat:
+            Desired sampling interval in [s].
+        :type deltat:
+            float
+
+        :param nthreads:
+            Number of threads to use, each processing a block of components
+            (``0`` for number of processors).
+        :type nthreads:
+            int
+
+        See :py:meth:`downsample` for the other arguments.
+        '''
+
+        upsratio, deci_seq = trace._configure_downsampling(
+            self.deltat, deltat, allow_upsample_max)
+
+        if demean:
+            self.demean()
+
+        if upsratio > 1:
+            ydata = self.data
+            data = num.zeros(
+                (self.ntraces, self.nsamples*upsratio-(upsratio-1)),
+                ydata.dtype)
+            data[:, ::upsratio] = ydata
+            for i in range(1, upsratio):
+                data[:, i::upsratio] = \
+                    float(i)/upsratio * ydata[:, :-1] \
+                    + float(upsratio-i)/upsratio * ydata[:, 1:]
+
+            self._set_data(data)
+            self.deltat = self.deltat/upsratio
+
+        for ndecimate in deci_seq:
+            self.downsample(
+                ndecimate, snap=snap, demean=False, ftype=ftype, cut=cut,
+                nthreads=nthreads)
@@ -1248,7 +1248,7 @@ class Pile(TracesGroup):
             want_incomplete=True, degap=True, maxgap=5, maxlap=None,
             keep_current_files_open=False, accessor_id=None,
             snap=(round, round), include_last=False, load_data=True,
-            style=None):
+            style=None, filters=None):
 
         '''
         Get iterator for shifting window wise data extraction from waveform
@@ -1287,9 +1287,18 @@ class Pile(TracesGroup):
         :param style: set to ``'batch'`` to yield waveforms and information
             about the chopper state as :py:class:`Batch` objects. By default
             lists of :py:class:`pyrocko.trace.Trace` objects are yielded.
+        :param filters: list of :py:class:`pyrocko.trace.StatefulFilter`
+            objects through which the traces of each window are passed. The
+            filter states are carried over from one window to the next for
+            each channel, so that no padding is needed. Filter states are
+            reset at gaps. Cannot be combined with ``tpad``.
         :returns: iterator providing extracted waveforms for each extracted
             window. See ``style`` argument for details.
         '''
+        if filters and tpad != 0.:
+            raise ValueError(
+                'Stateful filters cannot be used with padded windows (tpad).')
+
         if tmin is None:
             if self.tmin is None:
                 logger.warning("Pile's tmin is not set - pile may be empty.")
@@ -1337,6 +1346,11 @@ class Pile(TracesGroup):
                 chopped, degap, maxgap, maxlap, want_incomplete, wmax, wmin,
                 tpad)
 
+            if filters:
+                for tr in processed:
+                    for filter in filters:
+                        filter.apply(tr)
+
             if style == 'batch':
                 yield Batch(
                     tmin=wmin,
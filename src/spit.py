@@ -9,8 +9,13 @@ N-dimensional space partitioning multi-linear interpolator.
 
 import struct
 import logging
+import itertools
+import multiprocessing
 import numpy as num
 
+from pyrocko import spit_ext
+from pyrocko.parimap import parimap
+
 try:
     range = xrange
 except NameError:
@@ -40,13 +45,7 @@ class Cell(object):
         self.depths = num.log2(index).astype(int)
         self.bad = False
         self.children = []
-        n = 2**self.depths
-        i = self.index - n
-        delta = (self.tree.xbounds[:, 1] - self.tree.xbounds[:, 0])/n
-        xmin = self.tree.xbounds[:, 0]
-        self.xbounds = self.tree.xbounds.copy()
-        self.xbounds[:, 0] = xmin + i * delta
-        self.xbounds[:, 1] = xmin + (i+1) * delta
+        self.xbounds = cell_xbounds(self.tree.xbounds, index)
         self.a = self.xbounds[:, ::-1].copy()
         self.b = self.a.copy()
         self.b[:, 1] = self.xbounds[:, 1] - self.xbounds[:, 0]
@@ -226,11 +225,105 @@ class Cell(object):
             c.dump(file)
 
 
+def cell_xbounds(xbounds, index):
+    depths = num.log2(index).astype(int)
+    n = 2**depths
+    i = index - n
+    delta = (xbounds[:, 1] - xbounds[:, 0])/n
+    xmin = xbounds[:, 0]
+    cxbounds = xbounds.copy()
+    cxbounds[:, 0] = xmin + i * delta
+    cxbounds[:, 1] = xmin + (i+1) * delta
+    return cxbounds
+
+
 def bread(f, fmt):
     s = f.read(struct.calcsize(fmt))
     return struct.unpack(fmt, s)
 
 
+def cell_record_dtype(ndim):
+    return num.dtype([('index', '<i4', (ndim,)), ('f', '<f8', (2**ndim,))])
+
+
+class FlatTree(object):
+    '''
+    Array-backed representation of a :py:class:`SPTree`.
+
+    Cells are stored in depth-first order, the first cell being the root
+    cell.
+
+    :param xbounds: bounds of the tree, shape ``(ndim, 2)``
+    :param index: cell indices, shape ``(ncells, ndim)``
+    :param f: function values at the cell corners, shape
+        ``(ncells, 2**ndim)``
+    :param parents: index of the parent of each cell, ``-1`` for the root
+        cell, shape ``(ncells,)``
+    '''
+
+    def __init__(self, xbounds, index, f, parents):
+        ncells, ndim = index.shape
+        self.ndim = ndim
+        self.ncells = ncells
+        self.index = num.ascontiguousarray(index, dtype=num.int32)
+        self.f = num.ascontiguousarray(f, dtype=float)
+
+        depths = num.log2(self.index).astype(int)
+        n = 2**depths
+        i = self.index - n
+        delta = (xbounds[:, 1] - xbounds[:, 0])/n
+        xmin = xbounds[:, 0]
+        self.xmin = xmin + i * delta
+        self.xmax = xmin + (i+1) * delta
+
+        parents = num.asarray(parents, dtype=num.int64)
+        nchildren = num.bincount(parents[1:], minlength=ncells)
+        self.child_offsets = num.zeros(ncells+1, dtype=num.int64)
+        num.cumsum(nchildren, out=self.child_offsets[1:])
+        self.child_indices = num.argsort(
+            parents[1:], kind='stable').astype(num.int64) + 1
+
+        self.parents = parents
+
+    @classmethod
+    def from_records(cls, xbounds, records):
+        '''
+        Create from cell records as stored in SPTree files.
+        '''
+        index = num.ascontiguousarray(records['index'], dtype=num.int32)
+        return cls(
+            xbounds, index, records['f'], spit_ext.find_parents(index))
+
+    def to_records(self):
+        records = num.empty(self.ncells, dtype=cell_record_dtype(self.ndim))
+        records['index'] = self.index
+        records['f'] = self.f
+        return records
+
+    def get_children(self, icell):
+        return self.child_indices[
+            self.child_offsets[icell]:self.child_offsets[icell+1]]
+
+    def is_leaf(self):
+        return self.child_offsets[1:] == self.child_offsets[:-1]
+
+    def check_holes(self):
+        return bool(num.any(num.isnan(self.f[self.is_leaf()])))
+
+    def interpolate_many(self, x, nthreads=1):
+        '''
+        Interpolate at many points.
+
+        :param x: points, shape ``(npoints, ndim)``
+        :param nthreads: number of threads to use, 0 for all
+        :returns: interpolated values, NaN outside of the defined region
+        '''
+        x = num.ascontiguousarray(x, dtype=float).reshape(-1, self.ndim)
+        return spit_ext.interpolate_many(
+            self.xmin, self.xmax, self.f, self.child_offsets,
+            self.child_indices, x, nthreads)
+
+
 class SPTree(object):
     '''
     N-dimensional space partitioning interpolator.
@@ -240,10 +333,21 @@ class SPTree(object):
     :param xbounds: bounds of ``x``, shape ``(n, 2)``
     :param xtols: target coarsenesses in ``x``, vector of size ``n``
     :param addargs: additional arguments to pass to ``f``
+    :param nprocs: number of processes to use for the evaluation of ``f``
+        during construction of the tree, ``None`` for all available CPUs.
+        When run in parallel, ``f`` and ``addargs`` should be picklable.
+
+    Function values are evaluated in batches, level by level. Each batch is
+    checked against a node cache, shared by all cells of the tree, so that
+    ``f`` is evaluated at most once per node. The resulting tree does not
+    depend on ``nprocs``.
     '''
 
     def __init__(self, f=None, ftol=None, xbounds=None, xtols=None,
-                 filename=None, addargs=()):
+                 filename=None, addargs=(), nprocs=1):
+
+        self._root = None
+        self._flat = None
 
         if filename is None:
             assert all(v is not None for v in (f, ftol, xbounds, xtols))
@@ -282,7 +386,9 @@ class SPTree(object):
             self.pointmaker_masked = w[self.pointmaker_mask]
 
             self.nothing_found_yet = True
+            self.nprocs = nprocs
 
+            self._prefetch(self._cell_points(self.ones_int))
             self.root = Cell(self, self.ones_int)
             self.ncells += 1
 
@@ -293,7 +399,7 @@ class SPTree(object):
                 self.clipdepth = clipdepth
                 self.tested = 0
                 if self.clipdepth == 0:
-                    self._fill(self.root)
+                    self._grow(self._fill(self.root))
                 else:
                     self._continue_fill()
 
@@ -317,6 +423,56 @@ class SPTree(object):
         logger.info('at level %2i: %s covered, %6i cell%s' % (
             self.clipdepth, s, self.ncells, ['s', ''][self.ncells == 1]))
 
+    @property
+    def root(self):
+        if self._root is None and self._flat is not None:
+            self._root = self._make_cells()
+
+        return self._root
+
+    @root.setter
+    def root(self, cell):
+        self._root = cell
+        self._flat = None
+
+    def get_flat(self):
+        '''
+        Get array-backed representation of the tree.
+
+        :returns: :py:class:`FlatTree` object
+        '''
+        if self._flat is None:
+            self._flat = self._flatten()
+
+        return self._flat
+
+    def _flatten(self):
+        cells = list(self._root)
+        icells = dict((id(cell), icell) for (icell, cell) in enumerate(cells))
+        parents = num.full(len(cells), -1, dtype=num.int64)
+        for icell, cell in enumerate(cells):
+            for child in cell.children:
+                parents[icells[id(child)]] = icell
+
+        return FlatTree(
+            self.xbounds,
+            num.array([cell.index for cell in cells], dtype=num.int32),
+            num.array([cell.f.ravel() for cell in cells], dtype=float),
+            parents)
+
+    def _make_cells(self):
+        flat = self._flat
+        cells = [
+            Cell(self, flat.index[icell].astype(int),
+                 flat.f[icell].reshape([2]*self.ndim))
+            for icell in range(flat.ncells)]
+
+        for icell, iparent in enumerate(flat.parents):
+            if iparent >= 0:
+                cells[iparent].children.append(cells[icell])
+
+        return cells[0]
+
     def __iter__(self):
         return iter(self.root)
 
@@ -331,7 +487,7 @@ class SPTree(object):
                 '<QQQd', version, self.ndim, self.ncells, self.ftol))
             self.xbounds.astype('<f8').tofile(file)
             self.xtols.astype('<f8').tofile(file)
-            self.root.dump(file)
+            self.get_flat().to_records().tofile(file)
 
     def _load(self, filename):
         with open(filename, 'rb') as file:
@@ -344,25 +500,13 @@ class SPTree(object):
             self.xtols = num.fromfile(
                 file, dtype='<f8', count=self.ndim)
 
-            path = []
-            for icell in range(self.ncells):
-                index = num.fromfile(
-                    file, dtype='<i4', count=self.ndim)
-                f = num.fromfile(
-                    file, dtype='<f8', count=2**self.ndim).reshape(
-                        [2]*self.ndim)
-
-                cell = Cell(self, index, f)
-                if not path:
-                    self.root = cell
-                    path.append(cell)
+            records = num.fromfile(
+                file, dtype=cell_record_dtype(self.ndim), count=self.ncells)
 
-                else:
-                    while not any_(path[-1].index == (cell.index >> 1)):
-                        path.pop()
+            if records.size != self.ncells:
+                raise EOFError('SPTree file is truncated: %s' % filename)
 
-                    path[-1].children.append(cell)
-                    path.append(cell)
+        self._flat = FlatTree.from_records(self.xbounds, records)
 
     def _f_cached(self, x):
         return getset(
@@ -374,18 +518,91 @@ class SPTree(object):
         if not all_(and_(self.xbounds[:, 0] <= x, x <= self.xbounds[:, 1])):
             raise OutOfBounds()
 
-        return self.root.interpolate(x)
+        v = self.get_flat().interpolate_many(x)[0]
+        if num.isnan(v):
+            return None
+
+        return v
 
     def __call__(self, x):
         return self.interpolate(x)
 
-    def interpolate_many(self, x):
-        return self.root.interpolate_many(x)
+    def interpolate_many(self, x, nthreads=1):
+        '''
+        Interpolate at many points.
+
+        :param x: points, shape ``(npoints, ndim)``
+        :param nthreads: number of threads to use, 0 for all
+        :returns: interpolated values, NaN where ``x`` is out of bounds or
+            the function is undefined
+        '''
+        return self.get_flat().interpolate_many(x, nthreads=nthreads)
+
+    def _cell_points(self, index):
+        xbounds = cell_xbounds(self.xbounds, index)
+        return list(itertools.product(*xbounds)) \
+            + list(num.sum(xbounds * self.pointmaker_masked, axis=-1))
+
+    def _prefetch(self, points):
+        keys = []
+        seen = set()
+        for x in points:
+            k = tuple(float(xx) for xx in x)
+            if k not in self.f_values and k not in seen:
+                seen.add(k)
+                keys.append(k)
+
+        nprocs = self.nprocs
+        if nprocs is None:
+            nprocs = multiprocessing.cpu_count()
+
+        if nprocs == 1 or len(keys) < 2 * nprocs:
+            for k in keys:
+                self.f_values[k] = self.f(k, *self.addargs)
+
+            return
+
+        nchunk = max(1, len(keys) // (4 * nprocs))
+        chunks = [keys[i:i+nchunk] for i in range(0, len(keys), nchunk)]
+        for chunk, values in zip(chunks, parimap(
+                _evaluate_chunk, chunks,
+                nprocs=nprocs,
+                startup=_set_worker_function,
+                startup_args=(self.f, self.addargs))):
+
+            self.f_values.update(zip(chunk, values))
+
+    def _grow(self, pending):
+        # Cells are filled in batches of all pending cells, for which the
+        # function values are prefetched at once. As long as nothing has
+        # been found yet, the outcome of _fill depends on the order in which
+        # cells are visited, so cells are then processed one by one, in
+        # depth-first order.
+        while pending:
+            if self.nothing_found_yet:
+                batch, rest = pending[:1], pending[1:]
+            else:
+                batch, rest = pending, []
+
+            self._prefetch(itertools.chain.from_iterable(
+                self._cell_points(index) for (_, index) in batch))
+
+            new = []
+            for parent, index in batch:
+                child = Cell(self, index)
+                self.ncells += 1
+                parent.children.append(child)
+                new.extend(self._fill(child))
+
+            pending = new + rest
 
     def _continue_fill(self):
         cells_to_continue, self.cells_to_continue = self.cells_to_continue, []
+        pending = []
         for cell in cells_to_continue:
-            self._deepen_cell(cell)
+            pending.extend(self._deepen_cell(cell))
+
+        self._grow(pending)
 
     def _fill(self, cell):
 
@@ -431,7 +648,7 @@ class SPTree(object):
             cell.deepen = deepen
 
             if any_(deepen) and all_(cell.depths + deepen <= self.clipdepth):
-                self._deepen_cell(cell)
+                return self._deepen_cell(cell)
             else:
                 if any_(deepen):
                     self.cells_to_continue.append(cell)
@@ -440,24 +657,23 @@ class SPTree(object):
                 self.fraction_bad += num.prod(1.0/2**cell.depths)
                 self.nbad += 1
 
+        return []
+
     def _deepen_cell(self, cell):
         if cell.bad:
             self.fraction_bad -= num.prod(1.0/2**cell.depths)
             self.nbad -= 1
             cell.bad = False
 
-        for iadd in num.ndindex(*(cell.deepen+1)):
-            index_child = (cell.index << cell.deepen) + iadd
-            child = Cell(self, index_child)
-            self.ncells += 1
-            cell.children.append(child)
-            self._fill(child)
+        return [
+            (cell, (cell.index << cell.deepen) + iadd)
+            for iadd in num.ndindex(*(cell.deepen+1))]
 
     def check_holes(self):
         '''
         Check for NaNs in :py:class:`SPTree`
         '''
-        return self.root.check_holes()
+        return self.get_flat().check_holes()
 
     def plot_2d(self, axes=None, x=None, dims=None):
         assert self.ndim >= 2
@@ -510,6 +726,19 @@ class SPTree(object):
             plt.show()
 
 
+_worker_function = None
+
+
+def _set_worker_function(f, addargs):
+    global _worker_function
+    _worker_function = f, addargs
+
+
+def _evaluate_chunk(keys):
+    f, addargs = _worker_function
+    return [f(k, *addargs) for k in keys]
+
+
 def getset(d, k, f, addargs):
     try:
         return d[k]
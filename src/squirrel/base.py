@@ -17,12 +17,15 @@ import threading
 import queue
 from collections import defaultdict
 
-from pyrocko.guts import Object, Int, List, Tuple, String, Timestamp, Dict
+import numpy as num
+
+from pyrocko.guts import Object, Int, List, Tuple, String, Timestamp, Dict, \
+    Bool
 from pyrocko import util, trace
 from pyrocko import progress
 from pyrocko.plot import nice_time_tick_inc_approx_secs
 
-from . import model, io, cache, dataset
+from . import model, io, cache, dataset, watch
 
 from .model import to_kind_id, WaveformOrder, to_kind, to_codes, \
     STATION, CHANNEL, RESPONSE, EVENT, WAVEFORM, codes_patterns_list, \
@@ -38,6 +41,11 @@ logger = logging.getLogger('psq.base')
 guts_prefix = 'squirrel'
 
 
+def _rtree_clip(t):
+    # to the coordinate range of the R*-tree time index (rtree_i32)
+    return min(max(t, -2**31), 2**31 - 1)
+
+
 def nonef(f, xs):
     xs_ = [x for x in xs if x is not None]
     if xs_:
@@ -206,6 +214,37 @@ class Squirrel(Selection):
     :type persistent:
         :py:class:`str`
 
+    :param time_index:
+        Indexing scheme used to speed up time range queries on the selection:
+        ``'kscale'`` (default) uses B-tree indices on start times, bucketed by
+        the duration of the indexed content pieces. ``'rtree'`` additionally
+        maintains an SQLite R*-tree over the time spans of the content pieces
+        of each kind. The latter performs better for selections mixing very
+        long and very short content pieces.
+    :type time_index:
+        str
+
+    :param decoded_cache:
+        If ``True``, decoded waveform file segments are additionally stored
+        in a persistent on-disk cache in the ``'decoded'`` subdirectory of
+        the cache directory, shared between processes using the same
+        environment (see :py:class:`~pyrocko.squirrel.cache.DecodedCache`).
+    :type decoded_cache:
+        bool
+
+    :param read_only:
+        If ``True``, attach to an existing persistent selection (see
+        ``persistent``) without modifying it, opening the database in
+        read-only mode. Attaching is cheap, as no tables or indices have to be
+        built, and any number of processes can do so concurrently. Files,
+        sources and volatile content cannot be added to or removed from a
+        read-only Squirrel and downloads are disabled. Usually, a read-only
+        Squirrel is obtained in a worker process with
+        :py:meth:`SharedSquirrel.attach` from the handle returned by
+        :py:meth:`share` in the parent process.
+    :type read_only:
+        bool
+
     This is the central class of the Squirrel framework. It provides a unified
     interface to query and access seismic waveforms, station meta-data and
     event information from local file collections and remote data sources. For
@@ -242,10 +281,14 @@ class Squirrel(Selection):
         ~Squirrel.add_catalog
         ~Squirrel.add_dataset
         ~Squirrel.add_virtual
+        ~Squirrel.watch
         ~Squirrel.update
         ~Squirrel.update_waveform_promises
         ~Squirrel.advance_accessor
         ~Squirrel.clear_accessor
+        ~Squirrel.set_cache_max_bytes
+        ~Squirrel.get_cache_stats
+        ~Squirrel.get_decoded_cache_stats
         ~Squirrel.reload
         ~pyrocko.squirrel.selection.Selection.iter_paths
         ~Squirrel.iter_nuts
@@ -271,8 +314,10 @@ class Squirrel(Selection):
         ~Squirrel.get_events
         ~Squirrel.get_waveform_nuts
         ~Squirrel.get_waveforms
+        ~Squirrel.get_waveform_array
         ~Squirrel.chopper_waveforms
         ~Squirrel.get_coverage
+        ~Squirrel.share
         ~Squirrel.pile
         ~Squirrel.snuffle
         ~Squirrel.glob_codes
@@ -281,7 +326,12 @@ class Squirrel(Selection):
     '''
 
     def __init__(
-            self, env=None, database=None, cache_path=None, persistent=None):
+            self, env=None, database=None, cache_path=None, persistent=None,
+            time_index='kscale', decoded_cache=False, read_only=False):
+
+        if time_index not in ('kscale', 'rtree'):
+            raise error.SquirrelError(
+                'Invalid time index scheme: %s' % time_index)
 
         if not isinstance(env, environment.Environment):
             env = environment.get_environment(env)
@@ -296,8 +346,10 @@ class Squirrel(Selection):
             persistent = env.persistent
 
         Selection.__init__(
-            self, database=database, persistent=persistent)
+            self, database=database, persistent=persistent,
+            read_only=read_only)
 
+        self._env = env
         self.get_database().set_basepath(os.path.dirname(env.get_basepath()))
 
         self._content_caches = {
@@ -306,6 +358,12 @@ class Squirrel(Selection):
 
         self._cache_path = cache_path
 
+        if decoded_cache:
+            self._decoded_cache = cache.DecodedCache(
+                os.path.join(cache_path, 'decoded'))
+        else:
+            self._decoded_cache = None
+
         self._sources = []
         self._operators = []
         self._operator_registry = {}
@@ -314,16 +372,39 @@ class Squirrel(Selection):
 
         self._pile = None
         self._n_choppers_active = 0
+        self._prefetchers = []
 
-        self.downloads_enabled = True
+        self.downloads_enabled = not read_only
 
         self._names.update({
             'nuts': self.name + '_nuts',
+            'nuts_rtree': self.name + '_nuts_rtree',
             'kind_codes_count': self.name + '_kind_codes_count',
             'coverage': self.name + '_coverage'})
 
+        self._time_index = time_index
+
+        if read_only:
+            if self._time_index == 'rtree' and not self._have_table(
+                    self._names['nuts_rtree']):
+
+                raise error.SquirrelError(
+                    'Persistent selection "%s" has no R*-tree time index.'
+                    % persistent)
+
+            return
+
         with self.transaction('create tables') as cursor:
             self._create_tables_squirrel(cursor)
+            if self._time_index == 'rtree':
+                self._create_rtree_squirrel(cursor)
+
+    def _have_table(self, name, cursor=None):
+        return bool(list((cursor or self._conn).execute(
+            '''
+                SELECT name FROM %s.sqlite_master
+                WHERE type == 'table' AND name == ?
+            ''' % self._names['db'], (name,))))
 
     def _create_tables_squirrel(self, cursor):
 
@@ -526,11 +607,79 @@ class Squirrel(Selection):
                 END
             '''))
 
+    def _create_rtree_squirrel(self, cursor):
+        if self._have_table(self._names['nuts_rtree'], cursor):
+            sql, = cursor.execute(
+                '''
+                    SELECT sql FROM %s.sqlite_master
+                    WHERE type == 'table' AND name == ?
+                ''' % self._names['db'],
+                (self._names['nuts_rtree'],)).fetchone()
+
+            if 'rtree_i32' in sql:
+                return
+
+            # float R*-tree of earlier versions, rebuild
+            for s in '''
+                    DROP TRIGGER IF EXISTS %(db)s.%(nuts)s_add_rtree;
+                    DROP TRIGGER IF EXISTS %(db)s.%(nuts)s_remove_rtree;
+                    DROP TABLE %(db)s.%(nuts_rtree)s;
+                    '''.strip().splitlines():
+
+                cursor.execute(self._sql(s))
+
+        cursor.execute(self._sql(
+            '''
+                CREATE VIRTUAL TABLE %(db)s.%(nuts_rtree)s USING rtree_i32 (
+                    nut_id,
+                    tmin_seconds, tmax_seconds)
+            '''))
+
+        # The R*-tree is only used as a pre-filter. Time spans are widened to
+        # full seconds and clipped to the 32-bit integer coordinate range,
+        # which affects only open or far out of range time spans. Kind is not
+        # used as an additional dimension, because degenerate dimensions spoil
+        # the R*-tree node splitting.
+        cursor.execute(self._sql(
+            '''
+                INSERT INTO %(db)s.%(nuts_rtree)s
+                SELECT nut_id,
+                    max(-2147483648, min(2147483647, tmin_seconds)),
+                    max(-2147483648, min(2147483647, tmax_seconds + 1))
+                FROM %(db)s.%(nuts)s
+            '''))
+
+        cursor.execute(self._sql(
+            '''
+                CREATE TRIGGER IF NOT EXISTS %(db)s.%(nuts)s_add_rtree
+                AFTER INSERT ON %(nuts)s FOR EACH ROW
+                BEGIN
+                    INSERT INTO %(nuts_rtree)s VALUES (
+                        new.nut_id,
+                        max(-2147483648, min(2147483647,
+                            new.tmin_seconds)),
+                        max(-2147483648, min(2147483647,
+                            new.tmax_seconds + 1)));
+                END
+            '''))
+
+        cursor.execute(self._sql(
+            '''
+                CREATE TRIGGER IF NOT EXISTS %(db)s.%(nuts)s_remove_rtree
+                BEFORE DELETE ON %(nuts)s FOR EACH ROW
+                BEGIN
+                    DELETE FROM %(nuts_rtree)s WHERE nut_id == old.nut_id;
+                END
+            '''))
+
     def _delete(self):
         '''Delete database tables associated with this Squirrel.'''
 
         with self.transaction('delete tables') as cursor:
             for s in '''
+                    DROP TRIGGER IF EXISTS %(db)s.%(nuts)s_add_rtree;
+                    DROP TRIGGER IF EXISTS %(db)s.%(nuts)s_remove_rtree;
+                    DROP TABLE IF EXISTS %(db)s.%(nuts_rtree)s;
                     DROP TRIGGER %(db)s.%(nuts)s_delete_nuts;
                     DROP TRIGGER %(db)s.%(nuts)s_delete_nuts2;
                     DROP TRIGGER %(db)s.%(file_states)s_delete_files;
@@ -554,7 +703,8 @@ class Squirrel(Selection):
             format='detect',
             include=None,
             exclude=None,
-            check=True):
+            check=True,
+            nprocs=1):
 
         '''
         Add files to the selection.
@@ -600,6 +750,12 @@ class Squirrel(Selection):
         :type check:
             bool
 
+        :param nprocs:
+            Number of worker processes to use for indexing new and modified
+            files. If ``None``, one worker per CPU core is used.
+        :type nprocs:
+            int
+
         :Complexity:
             O(log N)
         '''
@@ -621,7 +777,7 @@ class Squirrel(Selection):
                 pass_through=lambda path: path.startswith('virtual:')
             ), kind_mask, format)
 
-        self._load(check)
+        self._load(check, nprocs=nprocs)
         self._update_nuts()
 
     def reload(self):
@@ -635,6 +791,89 @@ class Squirrel(Selection):
         self._load(check=True)
         self._update_nuts()
 
+    @filldocs
+    def watch(self,
+              paths,
+              kinds=None,
+              format='detect',
+              include=None,
+              exclude=None,
+              method='auto',
+              poll_interval=1.0):
+
+        '''
+        Add files to the selection and keep track of subsequent changes.
+
+        Like :py:meth:`add`, but additionally starts watching the given
+        directories and files for modifications. Call
+        :py:meth:`~pyrocko.squirrel.watch.Watcher.update` on the returned
+        object to incrementally index new and modified files and to prune
+        removed files from the selection, e.g. in a real-time processing
+        loop. Watching starts before the initial scan, so that no change is
+        missed.
+
+        :param paths:
+            Directories (watched recursively) and files to be added.
+        :type paths:
+            :py:class:`list` of :py:class:`str`
+
+        :param kinds:
+            Content types to be made available through the Squirrel selection.
+            By default, all known content types are accepted.
+        :type kinds:
+            :py:class:`list` of :py:class:`str`
+
+        :param format:
+            File format identifier or ``'detect'`` to enable auto-detection
+            (available: %(file_formats)s).
+        :type format:
+            str
+
+        :param include:
+            If not ``None``, files are only included if their paths match the
+            given regular expression pattern.
+        :type include:
+            str
+
+        :param exclude:
+            If not ``None``, files are only included if their paths do not
+            match the given regular expression pattern.
+        :type exclude:
+            str
+
+        :param method:
+            Change detection method: ``'inotify'`` (Linux only), ``'poll'``
+            (periodic rescans) or ``'auto'`` (inotify if available).
+        :type method:
+            str
+
+        :param poll_interval:
+            Time [s] between rescans when polling.
+        :type poll_interval:
+            float
+
+        :returns:
+            :py:class:`~pyrocko.squirrel.watch.Watcher` object.
+        '''
+
+        watcher = watch.Watcher(
+            self, paths,
+            kinds=kinds,
+            format=format,
+            include=include,
+            exclude=exclude,
+            method=method,
+            poll_interval=poll_interval)
+
+        self.add(
+            paths,
+            kinds=kinds,
+            format=format,
+            include=include,
+            exclude=exclude)
+
+        return watcher
+
     def add_virtual(self, nuts, virtual_paths=None):
         '''
         Add content which is not backed by files.
@@ -708,12 +947,13 @@ class Squirrel(Selection):
         self.add_volatile(nuts)
         return path
 
-    def _load(self, check):
+    def _load(self, check, nprocs=1):
         for _ in io.iload(
                 self,
                 content=[],
                 skip_unchanged=True,
-                check=check):
+                check=check,
+                nprocs=nprocs):
             pass
 
     def _update_nuts(self, transaction=None):
@@ -837,13 +1077,30 @@ class Squirrel(Selection):
 
         return dict(obj=obj, tmin=tmin, tmax=tmax, time=time, codes=codes)
 
-    def _timerange_sql(self, tmin, tmax, kind, cond, args, naiv):
+    def _timerange_sql(
+            self, tmin, tmax, kind, cond, args, naiv, rtree=False):
 
         tmin_seconds, tmin_offset = model.tsplit(tmin)
         tmax_seconds, tmax_offset = model.tsplit(tmax)
         if naiv:
             cond.append('%(db)s.%(nuts)s.tmin_seconds <= ?')
             args.append(tmax_seconds)
+        elif rtree:
+            cond.append('''
+                %(db)s.%(nuts)s.nut_id IN (
+                    SELECT nut_id FROM %(db)s.%(nuts_rtree)s
+                    WHERE tmin_seconds <= ? AND tmax_seconds >= ?)
+            ''')
+            args.extend((
+                _rtree_clip(tmax_seconds + 1), _rtree_clip(tmin_seconds)))
+
+            # unary plus prevents the planner from preferring the B-tree
+            # indices over the primary key lookup driven by the R*-tree
+            cond.append('+%(db)s.%(nuts)s.tmin_seconds <= ?')
+            args.append(tmax_seconds + 1)
+            cond.append('+%(db)s.%(nuts)s.tmax_seconds >= ?')
+            args.append(tmin_seconds)
+            return
         else:
             tscale_edges = model.tscale_edges
             tmin_cond = []
@@ -981,7 +1238,9 @@ class Squirrel(Selection):
             if tmax is None:
                 tmax = self.get_time_span()[1] + 1.0
 
-            self._timerange_sql(tmin, tmax, kind, cond, args, naiv)
+            self._timerange_sql(
+                tmin, tmax, kind, cond, args, naiv,
+                rtree=self._time_index == 'rtree')
 
         cond.append('kind_codes.kind_id == ?')
         args.append(kind_id)
@@ -1695,14 +1954,38 @@ class Squirrel(Selection):
         content_cache = self._content_caches[cache_id]
         if not content_cache.has(nut):
 
-            for nut_loaded in io.iload(
+            use_decoded_cache = self._use_decoded_cache(nut)
+
+            nuts_loaded = None
+            if cache_id == 'waveform':
+                for prefetcher in self._prefetchers:
+                    nuts_loaded = prefetcher.take(nut)
+                    if nuts_loaded is not None:
+                        break
+
+            if nuts_loaded is None and self._read_only:
+                nuts_loaded = self._load_segment_detached(nut)
+                if nuts_loaded is None:
+                    raise error.NotAvailable(
+                        'File has been modified since it was indexed: %s'
+                        % nut.file_path)
+
+            if nuts_loaded is None and use_decoded_cache:
+                nuts_loaded = self._decoded_cache.get(nut)
+
+            if nuts_loaded is None:
+                nuts_loaded = list(io.iload(
                     nut.file_path,
                     segment=nut.file_segment,
                     format=nut.file_format,
                     database=self._database,
                     update_selection=self,
-                    show_progress=show_progress):
+                    show_progress=show_progress))
 
+                if use_decoded_cache:
+                    self._put_decoded(nuts_loaded)
+
+            for nut_loaded in nuts_loaded:
                 content_cache.put(nut_loaded)
 
         try:
@@ -1712,6 +1995,53 @@ class Squirrel(Selection):
             raise error.NotAvailable(
                 'Unable to retrieve content: %s, %s, %s, %s' % nut.key)
 
+    def _use_decoded_cache(self, nut):
+        return self._decoded_cache is not None \
+            and nut.kind_id == WAVEFORM \
+            and nut.file_segment is not None \
+            and not nut.file_path.startswith('virtual:')
+
+    def _put_decoded(self, nuts):
+        if nuts and all(
+                nut.kind_id == WAVEFORM and nut.content is not None
+                for nut in nuts):
+
+            self._decoded_cache.put(nuts)
+
+    def _load_segment_detached(self, nut):
+        # Loads content without touching database or memory caches. Used in
+        # prefetcher threads and in read-only mode.
+
+        use_decoded_cache = self._use_decoded_cache(nut)
+        if use_decoded_cache:
+            nuts_loaded = self._decoded_cache.get(nut)
+            if nuts_loaded is not None:
+                return nuts_loaded
+
+        backend = nut.get_io_backend()
+        mtime, size = backend.get_stats(nut.file_path)
+        if (mtime, size) != (nut.file_mtime, nut.file_size):
+            return None
+
+        nuts_loaded = []
+        for nut_loaded in backend.iload(
+                nut.file_format, nut.file_path, nut.file_segment,
+                io.base.g_content_kinds):
+
+            nut_loaded.file_path = nut.file_path
+            nut_loaded.file_format = nut.file_format
+            nut_loaded.file_mtime = mtime
+            nut_loaded.file_size = size
+            if nut_loaded.content is not None:
+                nut_loaded.content._squirrel_key = nut_loaded.key
+
+            nuts_loaded.append(nut_loaded)
+
+        if use_decoded_cache:
+            self._put_decoded(nuts_loaded)
+
+        return nuts_loaded
+
     def advance_accessor(self, accessor_id='default', cache_id=None):
         '''
         Notify memory caches about consumer moving to a new data batch.
@@ -1774,7 +2104,54 @@ class Squirrel(Selection):
 
             self._content_caches[cache_].clear_accessor(accessor_id)
 
-    def get_cache_stats(self, cache_id):
+    def set_cache_max_bytes(self, max_bytes, cache_id='waveform'):
+        '''
+        Set memory budget of a content cache.
+
+        :param max_bytes:
+            Memory budget [bytes] for the sample data held by the cache or
+            ``None`` to disable the budget.
+        :type max_bytes:
+            int
+
+        :param cache_id:
+            Name of the cache to be configured. By default, two caches named
+            ``'default'`` and ``'waveform'`` are available.
+        :type cache_id:
+            str
+
+        When the budget is exceeded, least recently used content is released
+        from the cache, independent of any accessors holding references to
+        it. See :py:class:`~pyrocko.squirrel.cache.ContentCache`.
+        '''
+        self._content_caches[cache_id].set_max_bytes(max_bytes)
+
+    def get_decoded_cache_stats(self):
+        '''
+        Get information about usage of the on-disk decoded segment cache.
+
+        :returns:
+            :py:class:`~pyrocko.squirrel.cache.DecodedCacheStats` object or
+            ``None`` if the decoded segment cache is not enabled.
+        '''
+        if self._decoded_cache is None:
+            return None
+
+        return self._decoded_cache.get_stats()
+
+    def get_cache_stats(self, cache_id='waveform'):
+        '''
+        Get information about the state of a content cache.
+
+        :param cache_id:
+            Name of the cache. By default, two caches named ``'default'`` and
+            ``'waveform'`` are available.
+        :type cache_id:
+            str
+
+        :returns:
+            :py:class:`~pyrocko.squirrel.cache.ContentCacheStats` object.
+        '''
         return self._content_caches[cache_id].get_stats()
 
     @filldocs
@@ -2487,6 +2864,135 @@ class Squirrel(Selection):
 
         return processed
 
+    @filldocs
+    def get_waveform_array(
+            self, obj=None, tmin=None, tmax=None, time=None, codes=None,
+            codes_exclude=None, sample_rate_min=None, sample_rate_max=None,
+            deltat=None, dtype=num.float64, out=None,
+            accessor_id='default'):
+
+        '''
+        Get waveforms matching given constraints as a single 2D array.
+
+        Sample data is copied from the decoded file segments directly into a
+        ``(nchannels, nsamples)`` array, without creating intermediate
+        :py:class:`~pyrocko.trace.Trace` objects. Sample ``i`` of each row
+        corresponds to time ``tmin + i * deltat`` and ``nsamples =
+        round((tmax - tmin) / deltat)``. Sample positions of the stored
+        traces are rounded to the nearest sample of this grid. Gaps are
+        reported in a boolean mask, where data is overlapping, later segments
+        overwrite earlier ones. Operators (virtual channels) are not
+        supported by this method.
+
+        %(query_args)s
+
+        :param sample_rate_min:
+            Consider only waveforms with a sampling rate equal to or greater
+            than the given value [Hz].
+        :type sample_rate_min:
+            float
+
+        :param sample_rate_max:
+            Consider only waveforms with a sampling rate equal to or less than
+            the given value [Hz].
+        :type sample_rate_max:
+            float
+
+        :param deltat:
+            Sampling interval [s]. Waveforms with a different sampling
+            interval are ignored. If not given, all matching waveforms must
+            share the same sampling interval.
+        :type deltat:
+            float
+
+        :param dtype:
+            Data type of the output array.
+        :type dtype:
+            :py:class:`numpy.dtype`
+
+        :param out:
+            Preallocated output array of shape ``(nchannels, nsamples)``. Its
+            contents are overwritten and zero-filled at gaps.
+        :type out:
+            :py:class:`numpy.ndarray`
+
+        :param accessor_id:
+            Name of consumer on who's behalf data is accessed. See
+            :py:meth:`get_waveforms`.
+        :type accessor_id:
+            str
+
+        :returns:
+            Tuple ``(codes, data, mask)`` where ``codes`` is the sorted list of
+            :py:class:`~pyrocko.squirrel.model.CodesNSLCE` objects labeling the
+            rows, ``data`` is the 2D array with the sample data and ``mask`` is
+            a boolean array of the same shape, ``True`` where data is
+            available.
+
+        See :py:meth:`iter_nuts` for details on time span matching.
+        '''
+
+        tmin, tmax, codes = self._get_selection_args(
+            WAVEFORM, obj, tmin, tmax, time, codes)
+
+        if None in (tmin, tmax):
+            raise error.SquirrelError(
+                'Time span must be given when extracting waveform arrays.')
+
+        nuts = self.get_waveform_nuts(
+            obj, tmin, tmax, time, codes, codes_exclude, sample_rate_min,
+            sample_rate_max)
+
+        if deltat is None:
+            deltats = set(nut.deltat for nut in nuts)
+            if len(deltats) > 1:
+                raise error.SquirrelError(
+                    'Matching waveforms have different sampling intervals: '
+                    '%s. Use the deltat argument to select one of them.'
+                    % ', '.join('%g' % x for x in sorted(deltats)))
+
+            if not deltats:
+                raise error.NotAvailable(
+                    'No waveforms available and no sampling interval given.')
+
+            deltat = deltats.pop()
+        else:
+            nuts = [
+                nut for nut in nuts
+                if abs(nut.deltat - deltat) <= 1e-6 * deltat]
+
+        row_codes = sorted(set(nut.codes for nut in nuts))
+        irows = dict((c, irow) for (irow, c) in enumerate(row_codes))
+
+        nsamples = int(round((tmax - tmin) / deltat))
+        shape = (len(row_codes), nsamples)
+        if out is None:
+            data = num.zeros(shape, dtype=dtype)
+        else:
+            if out.shape != shape:
+                raise error.SquirrelError(
+                    'Shape of output array %s does not match shape of result '
+                    '%s.' % (out.shape, shape))
+
+            data = out
+            data[...] = 0
+
+        mask = num.zeros(shape, dtype=bool)
+
+        for nut in nuts:
+            tr = self.get_content(nut, 'waveform', accessor_id)
+            ioff = int(round((tr.tmin - tmin) / deltat))
+            ia = max(0, ioff)
+            ib = min(nsamples, ioff + tr.ydata.size)
+            if ia >= ib:
+                continue
+
+            irow = irows[nut.codes]
+            data[irow, ia:ib] = tr.ydata[ia-ioff:ib-ioff]
+            mask[irow, ia:ib] = True
+
+        return row_codes, data, mask
+
     def _get_waveforms_prioritized(
             self, tmin=None, tmax=None, codes=None, codes_exclude=None,
             channel_priorities=None, **kwargs):
@@ -2545,7 +3051,8 @@ class Squirrel(Selection):
             degap=True, maxgap=5, maxlap=None,
             snap=None, include_last=False, load_data=True,
             accessor_id=None, clear_accessor=True, operator_params=None,
-            grouping=None, channel_priorities=None):
+            grouping=None, channel_priorities=None, prefetch=0,
+            filters=None):
 
         '''
         Iterate window-wise over waveform archive.
@@ -2637,6 +3144,25 @@ class Squirrel(Selection):
         :type grouping:
             :py:class:`~pyrocko.squirrel.operators.base.Grouping`
 
+        :param prefetch:
+            Number of windows to read ahead. If larger than zero, the file
+            segments needed for the next ``prefetch`` windows are loaded in a
+            background thread while the current batch is being processed by
+            the consumer. Downloads of waveform promises are not
+            prefetched. Prefetching considers all channels matching the query,
+            it is therefore disabled when ``channel_priorities`` is set.
+        :type prefetch:
+            int
+
+        :param filters:
+            Stateful filters through which the traces of each window are
+            passed, in the given order. The filter states are carried over
+            from one window to the next for each channel, so that no
+            padding is needed. Filter states are reset at gaps. Cannot be
+            combined with ``tpad``.
+        :type filters:
+            :py:class:`list` of :py:class:`~pyrocko.trace.StatefulFilter`
+
         :yields:
             For each extracted time window or waveform group a
             :py:class:`Batch` object is yielded.
@@ -2644,6 +3170,11 @@ class Squirrel(Selection):
         See :py:meth:`iter_nuts` for details on time span matching.
         '''
 
+        if filters and tpad != 0.:
+            raise error.SquirrelError(
+                'Stateful filters cannot be used with padded windows '
+                '(tpad).')
+
         tmin, tmax, codes = self._get_selection_args(
             WAVEFORM, obj, tmin, tmax, time, codes)
 
@@ -2677,6 +3208,7 @@ class Squirrel(Selection):
             eps = 1e-6
             nwin = max(1, int((tmax - tmin) / tinc - eps) + 1)
 
+        prefetcher = None
         try:
             if accessor_id is None:
                 accessor_id = 'chopper%i' % self._n_choppers_active
@@ -2700,44 +3232,95 @@ class Squirrel(Selection):
                     for scl in operator.iter_in_codes()]
 
             ngroups = len(codes_list)
-            for igroup, scl in enumerate(codes_list):
-                for iwin in range(nwin):
-                    wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
-
-                    chopped = self.get_waveforms(
-                        tmin=wmin-tpad,
-                        tmax=wmax+tpad,
-                        codes=scl,
-                        codes_exclude=codes_exclude,
-                        sample_rate_min=sample_rate_min,
-                        sample_rate_max=sample_rate_max,
-                        snap=snap,
-                        include_last=include_last,
-                        load_data=load_data,
-                        want_incomplete=want_incomplete,
-                        degap=degap,
-                        maxgap=maxgap,
-                        maxlap=maxlap,
-                        accessor_id=accessor_id,
-                        operator_params=operator_params,
-                        channel_priorities=channel_priorities)
-
-                    self.advance_accessor(accessor_id)
-
-                    yield Batch(
-                        tmin=wmin,
-                        tmax=wmax,
-                        i=iwin,
-                        n=nwin,
-                        igroup=igroup,
-                        ngroups=ngroups,
-                        traces=chopped)
+            windows = [
+                (igroup, scl, iwin,
+                 tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax))
+                for igroup, scl in enumerate(codes_list)
+                for iwin in range(nwin)]
+
+            if prefetch > 0 and load_data and channel_priorities is None:
+                prefetcher = cache.Prefetcher(self._load_segment_detached)
+                self._prefetchers.append(prefetcher)
+
+            iwindow_requested = 0
+            for iwindow, (igroup, scl, iwin, wmin, wmax) in enumerate(windows):
+                if prefetcher is not None:
+                    for iwindow_ahead in range(
+                            max(iwindow_requested, iwindow + 1),
+                            min(len(windows), iwindow + 1 + prefetch)):
+
+                        self._prefetch_window(
+                            prefetcher, iwindow_ahead,
+                            windows[iwindow_ahead], tpad, codes_exclude,
+                            sample_rate_min, sample_rate_max)
+
+                        iwindow_requested = iwindow_ahead + 1
+
+                chopped = self.get_waveforms(
+                    tmin=wmin-tpad,
+                    tmax=wmax+tpad,
+                    codes=scl,
+                    codes_exclude=codes_exclude,
+                    sample_rate_min=sample_rate_min,
+                    sample_rate_max=sample_rate_max,
+                    snap=snap,
+                    include_last=include_last,
+                    load_data=load_data,
+                    want_incomplete=want_incomplete,
+                    degap=degap,
+                    maxgap=maxgap,
+                    maxlap=maxlap,
+                    accessor_id=accessor_id,
+                    operator_params=operator_params,
+                    channel_priorities=channel_priorities)
+
+                if prefetcher is not None:
+                    prefetcher.discard(iwindow)
+
+                self.advance_accessor(accessor_id)
+
+                if filters:
+                    for tr in chopped:
+                        for filter in filters:
+                            filter.apply(tr)
+
+                yield Batch(
+                    tmin=wmin,
+                    tmax=wmax,
+                    i=iwin,
+                    n=nwin,
+                    igroup=igroup,
+                    ngroups=ngroups,
+                    traces=chopped)
 
         finally:
             self._n_choppers_active -= 1
+            if prefetcher is not None:
+                self._prefetchers.remove(prefetcher)
+                prefetcher.close()
+
             if clear_accessor:
                 self.clear_accessor(accessor_id, 'waveform')
 
+    def _prefetch_window(
+            self, prefetcher, iwindow, window, tpad, codes_exclude,
+            sample_rate_min, sample_rate_max):
+
+        _, scl, _, wmin, wmax = window
+        content_cache = self._content_caches['waveform']
+        for nut in self.iter_nuts(
+                'waveform',
+                *self._get_selection_args(
+                    WAVEFORM, None, wmin-tpad, wmax+tpad, None, scl),
+                codes_exclude=codes_exclude,
+                sample_rate_min=sample_rate_min,
+                sample_rate_max=sample_rate_max):
+
+            if not nut.file_path.startswith('virtual:') \
+                    and not content_cache.contains(nut):
+
+                prefetcher.request(nut, iwindow)
+
     def _process_chopped(
             self, chopped, degap, maxgap, maxlap, want_incomplete, tmin, tmax):
 
@@ -3215,6 +3798,36 @@ class Squirrel(Selection):
     def get_sources(self):
         return self._sources
 
+    def share(self):
+        '''
+        Get handle to attach to this selection from other processes.
+
+        The selection must be persistent and backed by a database file. It is
+        not copied, workers attaching to it see its current state. Changes
+        should therefore be finished before the handle is passed to the
+        workers.
+
+        :returns: :py:class:`SharedSquirrel` object.
+        '''
+
+        if self._persistent is None:
+            raise error.SquirrelError(
+                'Only persistent selections can be shared. Use '
+                '`Squirrel(..., persistent=NAME)`.')
+
+        database_path = self._database._database_path
+        if database_path == ':memory:':
+            raise error.SquirrelError(
+                'Selections in in-memory databases cannot be shared.')
+
+        return SharedSquirrel(
+            squirrel_path=self._env.get_basepath(),
+            database_path=os.path.abspath(database_path),
+            cache_path=os.path.abspath(self._cache_path),
+            persistent=self._persistent,
+            time_index=self._time_index,
+            decoded_cache=self._decoded_cache is not None)
+
     def print_tables(self, table_names=None, stream=None):
         '''
         Dump raw database tables in textual form (for debugging purposes).
@@ -3337,7 +3950,52 @@ Operators:                     %s''' % (
         return s.lstrip()
 
 
+class SharedSquirrel(Object):
+    '''
+    Handle to attach to a persistent Squirrel selection from other processes.
+
+    Obtained with :py:meth:`Squirrel.share`. The handle is small and can be
+    pickled, e.g. to be passed to the workers of a process pool, where
+    :py:meth:`attach` gives quick read-only access to the shared selection.
+    '''
+
+    squirrel_path = String.T(
+        help='Base path of the Squirrel environment.')
+    database_path = String.T(
+        help='Absolute path to the database file.')
+    cache_path = String.T(
+        help='Absolute path to the cache directory.')
+    persistent = String.T(
+        help='Name of the persistent selection.')
+    time_index = String.T(
+        default='kscale',
+        help='Time indexing scheme of the selection.')
+    decoded_cache = Bool.T(
+        default=False,
+        help='Whether to use the on-disk cache for decoded waveforms.')
+
+    def attach(self):
+        '''
+        Open the shared selection in read-only mode.
+
+        :returns: :py:class:`Squirrel` object.
+        '''
+        env = environment.Environment(
+            database_path=self.database_path,
+            cache_path=self.cache_path,
+            persistent=self.persistent)
+
+        env.set_basepath(self.squirrel_path)
+
+        return Squirrel(
+            env=env,
+            time_index=self.time_index,
+            decoded_cache=self.decoded_cache,
+            read_only=True)
+
+
 __all__ = [
     'Squirrel',
     'SquirrelStats',
+    'SharedSquirrel',
 ]
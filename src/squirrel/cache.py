@@ -4,12 +4,23 @@
 # ---|P------/S----------~Lg----------
 
 '''
-Squirrel memory cacheing.
+Squirrel memory and disk cacheing.
 '''
 
+import os
+import shutil
+import pickle
+import tempfile
 import logging
+import threading
+import queue
+from collections import OrderedDict
+
+import numpy as num
 
 from pyrocko.guts import Object, Int
+from pyrocko import util
+from .model import Nut, ehash
 
 logger = logging.getLogger('psq.cache')
 
@@ -23,6 +34,37 @@ class ContentCacheStats(Object):
     naccessors = Int.T(
         help='Number of accessors currently holding references to cache '
              'items.')
+    nbytes = Int.T(
+        default=0,
+        help='Estimated memory [bytes] used by the sample data of the cached '
+             'items.')
+    max_bytes = Int.T(
+        optional=True,
+        help='Memory budget [bytes] of the cache, if any.')
+    nhits = Int.T(
+        default=0,
+        help='Number of content requests served from the cache.')
+    nmisses = Int.T(
+        default=0,
+        help='Number of content requests which required loading.')
+    nevictions = Int.T(
+        default=0,
+        help='Number of items forcibly released to stay within the memory '
+             'budget.')
+
+
+def content_nbytes(nut):
+    '''
+    Estimate memory used by the sample data attached to a nut.
+
+    Only waveform data arrays are accounted for. Meta-data content is
+    considered to be negligible in size.
+    '''
+    ydata = getattr(nut.content, 'ydata', None)
+    if ydata is not None:
+        return ydata.nbytes
+    else:
+        return 0
 
 
 class ContentCache(object):
@@ -71,11 +113,36 @@ class ContentCache(object):
     event. For a process requiring data from two independent positions of
     extraction, e.g. for cross-correlations between all possible pairs of a set
     of events, two separate accessor names could be used.
+
+    **Memory budget**
+
+    Optionally, a memory budget can be set with the ``max_bytes`` argument or
+    with :py:meth:`set_max_bytes`. If the total size of the sample data held
+    by the cache exceeds the budget, the least recently used items are
+    released, regardless of the accessors holding references to them. This
+    puts an upper bound to the memory consumption of long running services,
+    even if an accessor is never advanced or cleared.
+
+    :param max_bytes:
+        Memory budget [bytes] for the sample data held by the cache or
+        ``None`` to rely on accessor bookkeeping only.
+    :type max_bytes:
+        int
     '''
 
-    def __init__(self):
-        self._entries = {}
+    def __init__(self, max_bytes=None):
+        self._entries = OrderedDict()
+        self._entry_nbytes = {}
         self._accessor_ticks = {}
+        self._nbytes = 0
+        self._max_bytes = max_bytes
+        self._nhits = 0
+        self._nmisses = 0
+        self._nevictions = 0
+
+    def _remove(self, path_segment):
+        del self._entries[path_segment]
+        self._nbytes -= self._entry_nbytes.pop(path_segment, 0)
 
     def _prune_outdated(self, path, segment, nut_mtime):
         try:
@@ -85,7 +152,31 @@ class ContentCache(object):
 
         if cache_mtime != nut_mtime:
             logger.debug('Forgetting (outdated): %s %s' % (path, segment))
-            del self._entries[path, segment]
+            self._remove((path, segment))
+
+    def _evict(self):
+        if self._max_bytes is None:
+            return
+
+        # the most recently used entry is always kept
+        while self._nbytes > self._max_bytes and len(self._entries) > 1:
+            path_segment = next(iter(self._entries))
+            logger.debug('Forgetting (budget): %s %s' % path_segment)
+            self._remove(path_segment)
+            self._nevictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        '''
+        Set memory budget of the cache.
+
+        :param max_bytes:
+            Memory budget [bytes] for the sample data held by the cache or
+            ``None`` to disable the budget.
+        :type max_bytes:
+            int
+        '''
+        self._max_bytes = max_bytes
+        self._evict()
 
     def put(self, nut):
         '''
@@ -101,8 +192,19 @@ class ContentCache(object):
 
         if (path, segment) not in self._entries:
             self._entries[path, segment] = nut.file_mtime, {}, {}
+            self._entry_nbytes[path, segment] = 0
+
+        elements = self._entries[path, segment][1]
+        nbytes = content_nbytes(nut)
+        if element in elements:
+            nbytes -= content_nbytes(elements[element])
 
-        self._entries[path, segment][1][element] = nut
+        elements[element] = nut
+        self._entry_nbytes[path, segment] += nbytes
+        self._nbytes += nbytes
+
+        self._entries.move_to_end((path, segment))
+        self._evict()
 
     def get(self, nut, accessor='default', model='squirrel'):
         '''
@@ -124,6 +226,7 @@ class ContentCache(object):
         '''
         path, segment, element, mtime = nut.key
         entry = self._entries[path, segment]
+        self._entries.move_to_end((path, segment))
 
         if accessor not in self._accessor_ticks:
             self._accessor_ticks[accessor] = 0
@@ -150,6 +253,19 @@ class ContentCache(object):
         :returns:
             :py:class:`bool`
 
+        '''
+        if self.contains(nut):
+            self._nhits += 1
+            return True
+        else:
+            self._nmisses += 1
+            return False
+
+    def contains(self, nut):
+        '''
+        Check if item's content is currently in cache.
+
+        Same as :py:meth:`has` but does not affect the hit/miss statistics.
         '''
         path, segment, element, nut_mtime = nut.key
 
@@ -187,7 +303,7 @@ class ContentCache(object):
 
         for path_segment in delete:
             logger.debug('Forgetting (advance): %s %s' % path_segment)
-            del self._entries[path_segment]
+            self._remove(path_segment)
 
         self._accessor_ticks[accessor] += 1
 
@@ -208,7 +324,7 @@ class ContentCache(object):
 
         for path_segment in delete:
             logger.debug('Forgetting (clear): %s %s' % path_segment)
-            del self._entries[path_segment]
+            self._remove(path_segment)
 
         try:
             del self._accessor_ticks[accessor]
@@ -222,8 +338,10 @@ class ContentCache(object):
         for accessor in list(self._accessor_ticks.keys()):
             self.clear_accessor(accessor)
 
-        self._entries = {}
+        self._entries = OrderedDict()
+        self._entry_nbytes = {}
         self._accessor_ticks = {}
+        self._nbytes = 0
 
     def get_stats(self):
         '''
@@ -233,4 +351,368 @@ class ContentCache(object):
         '''
         return ContentCacheStats(
             nentries=len(self._entries),
-            naccessors=len(self._accessor_ticks))
+            naccessors=len(self._accessor_ticks),
+            nbytes=self._nbytes,
+            max_bytes=self._max_bytes,
+            nhits=self._nhits,
+            nmisses=self._nmisses,
+            nevictions=self._nevictions)
+
+
+class DecodedCacheStats(Object):
+    '''
+    Information about decoded segment cache usage.
+    '''
+    nhits = Int.T(
+        default=0,
+        help='Number of file segments served from the cache.')
+    nmisses = Int.T(
+        default=0,
+        help='Number of file segments not found in the cache.')
+    nstores = Int.T(
+        default=0,
+        help='Number of file segments written to the cache.')
+    ninvalidated = Int.T(
+        default=0,
+        help='Number of outdated file segments removed from the cache.')
+
+
+class DecodedCache(object):
+    '''
+    Persistent on-disk cache for decoded waveform file segments.
+
+    Decoding compressed waveform formats (e.g. Steim compressed miniSEED) is
+    expensive. This cache stores the decoded sample arrays of complete file
+    segments in NumPy's ``.npy`` format, so that they can be memory mapped
+    on subsequent accesses. The cache directory can be shared by many
+    processes working on the same Squirrel environment, entries are written
+    atomically.
+
+    Entries are keyed by file path and segment. Modification time and size of
+    the original file are remembered with each entry. If they differ from the
+    ones found on disk or the one registered in the database (the same check
+    :py:class:`ContentCache` uses), the entry is discarded.
+
+    Sample arrays are mapped copy-on-write: modifications of the returned
+    traces are never written back to the cache.
+
+    :param path:
+        Directory to hold the cache entries.
+    :type path:
+        str
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._nhits = 0
+        self._nmisses = 0
+        self._nstores = 0
+        self._ninvalidated = 0
+
+    def _entry_path(self, path, segment):
+        h = ehash('%s:%s' % (path, segment))
+        return os.path.join(self._path, h[:2], h[2:])
+
+    def _invalidate(self, entry_path):
+        logger.debug('Forgetting (outdated): %s' % entry_path)
+        shutil.rmtree(entry_path, ignore_errors=True)
+        self._ninvalidated += 1
+
+    def get(self, nut):
+        '''
+        Get decoded content of the file segment a given nut belongs to.
+
+        :param nut:
+            Content item.
+        :type nut:
+            :py:class:`~pyrocko.squirrel.model.Nut`
+
+        :returns:
+            List of :py:class:`~pyrocko.squirrel.model.Nut` objects with
+            attached content or ``None`` if no valid entry exists.
+        '''
+        entry_path = self._entry_path(nut.file_path, nut.file_segment)
+        try:
+            with open(os.path.join(entry_path, 'index.pickle'), 'rb') as f:
+                mtime, size, elements = pickle.load(f)
+
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._nmisses += 1
+            return None
+
+        try:
+            stats = nut.get_io_backend().get_stats(nut.file_path)
+        except Exception:
+            stats = None
+
+        if (mtime, size) != stats or mtime != nut.file_mtime:
+            self._invalidate(entry_path)
+            self._nmisses += 1
+            return None
+
+        nuts = []
+        try:
+            for values, tr, fn in elements:
+                tr.set_ydata(
+                    num.load(os.path.join(entry_path, fn), mmap_mode='c'))
+
+                nut_loaded = Nut(values_nocheck=values)
+                nut_loaded.content = tr
+                tr._squirrel_key = nut_loaded.key
+                nuts.append(nut_loaded)
+
+        except (OSError, ValueError):
+            self._invalidate(entry_path)
+            self._nmisses += 1
+            return None
+
+        self._nhits += 1
+        return nuts
+
+    def put(self, nuts):
+        '''
+        Store decoded content of a complete file segment.
+
+        :param nuts:
+            Content items of a single file segment with attached
+            :py:class:`~pyrocko.trace.Trace` content.
+        :type nuts:
+            :py:class:`list` of :py:class:`~pyrocko.squirrel.model.Nut`
+        '''
+
+        if not nuts:
+            return
+
+        nut0 = nuts[0]
+        entry_path = self._entry_path(nut0.file_path, nut0.file_segment)
+        if os.path.exists(entry_path):
+            return
+
+        util.ensuredir(os.path.dirname(entry_path))
+        temp_path = tempfile.mkdtemp(
+            prefix='.tmp-', dir=os.path.dirname(entry_path))
+
+        try:
+            elements = []
+            for ielement, nut in enumerate(nuts):
+                tr = nut.content
+                fn = '%i.npy' % ielement
+                num.save(os.path.join(temp_path, fn), tr.ydata)
+
+                header = tr.copy(data=False)
+                header.ydata = None
+                values = (
+                    nut.file_path, nut.file_format, nut.file_mtime,
+                    nut.file_size,
+                    nut.file_segment, nut.file_element,
+                    nut.kind_id, nut.codes.safe_str,
+                    nut.tmin_seconds, nut.tmin_offset,
+                    nut.tmax_seconds, nut.tmax_offset,
+                    nut.deltat)
+
+                elements.append((values, header, fn))
+
+            with open(os.path.join(temp_path, 'index.pickle'), 'wb') as f:
+                pickle.dump(
+                    (nut0.file_mtime, nut0.file_size, elements), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.rename(temp_path, entry_path)
+            self._nstores += 1
+
+        except OSError as e:
+            # another process may have been faster
+            logger.debug(
+                'Could not store decoded segment in cache: %s' % str(e))
+
+        finally:
+            if os.path.exists(temp_path):
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+    def clear(self):
+        '''
+        Remove all entries from the cache.
+        '''
+        shutil.rmtree(self._path, ignore_errors=True)
+
+    def get_stats(self):
+        '''
+        Get information about cache usage.
+
+        :returns: :py:class:`DecodedCacheStats` object.
+        '''
+        return DecodedCacheStats(
+            nhits=self._nhits,
+            nmisses=self._nmisses,
+            nstores=self._nstores,
+            ninvalidated=self._ninvalidated)
+
+
+class PrefetcherStats(Object):
+    '''
+    Information about background prefetching.
+    '''
+    nrequested = Int.T(
+        default=0,
+        help='Number of file segments queued for background loading.')
+    nused = Int.T(
+        default=0,
+        help='Number of prefetched file segments which have been consumed.')
+    ndiscarded = Int.T(
+        default=0,
+        help='Number of prefetched file segments which have been dropped '
+             'without being used.')
+
+
+class Prefetcher(object):
+    '''
+    Background loader for file segments.
+
+    File segments are loaded in a worker thread by calling the ``load``
+    function given at initialization. The loaded content is kept until it is
+    claimed with :py:meth:`take` or dropped with :py:meth:`discard`. The
+    prefetcher does not touch any of the Squirrel's caches or its database,
+    so these stay under exclusive control of the consuming thread.
+
+    :param load:
+        Function taking a :py:class:`~pyrocko.squirrel.model.Nut` and
+        returning the list of nuts with content of the file segment the given
+        nut belongs to (or ``None`` if it cannot be loaded).
+    :type load:
+        callable
+
+    :param nthreads:
+        Number of worker threads.
+    :type nthreads:
+        int
+    '''
+
+    def __init__(self, load, nthreads=1):
+        self._load = load
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._nrequested = 0
+        self._nused = 0
+        self._ndiscarded = 0
+        self._threads = []
+        for _ in range(nthreads):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _key(self, nut):
+        return nut.file_path, nut.file_segment
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            nut, done, result = item
+            with self._lock:
+                wanted = self._pending.get(self._key(nut)) is not None
+
+            if wanted:
+                try:
+                    result.append(self._load(nut))
+                except Exception as e:
+                    logger.debug(
+                        'Prefetching of file segment failed: %s' % str(e))
+
+            done.set()
+
+    def request(self, nut, tag=0):
+        '''
+        Queue the file segment of a content item for background loading.
+
+        :param nut:
+            Content item.
+        :type nut:
+            :py:class:`~pyrocko.squirrel.model.Nut`
+
+        :param tag:
+            Arbitrary number used to select entries in :py:meth:`discard`.
+            Usually the index of the processing step, the content is needed
+            for.
+        :type tag:
+            int
+        '''
+        key = self._key(nut)
+        with self._lock:
+            if key in self._pending:
+                self._pending[key][0] = max(self._pending[key][0], tag)
+                return
+
+            done = threading.Event()
+            result = []
+            self._pending[key] = [tag, done, result]
+            self._nrequested += 1
+
+        self._queue.put((nut, done, result))
+
+    def take(self, nut):
+        '''
+        Claim prefetched content of the file segment a given nut belongs to.
+
+        Waits for the background load to finish if necessary.
+
+        :returns:
+            List of :py:class:`~pyrocko.squirrel.model.Nut` objects with
+            attached content or ``None`` if the segment has not been requested
+            or could not be loaded.
+        '''
+        with self._lock:
+            entry = self._pending.pop(self._key(nut), None)
+
+        if entry is None:
+            return None
+
+        _, done, result = entry
+        done.wait()
+        if not result or result[0] is None:
+            return None
+
+        self._nused += 1
+        return result[0]
+
+    def discard(self, tag_max=None):
+        '''
+        Drop prefetched content which has not been claimed.
+
+        :param tag_max:
+            If given, only drop entries with a tag less than or equal to this
+            value.
+        :type tag_max:
+            int
+        '''
+        with self._lock:
+            for key in list(self._pending.keys()):
+                if tag_max is None or self._pending[key][0] <= tag_max:
+                    del self._pending[key]
+                    self._ndiscarded += 1
+
+    def close(self):
+        '''
+        Drop pending entries and stop the worker threads.
+        '''
+        self.discard()
+        for _ in self._threads:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+    def get_stats(self):
+        '''
+        Get information about prefetcher usage.
+
+        :returns: :py:class:`PrefetcherStats` object.
+        '''
+        return PrefetcherStats(
+            nrequested=self._nrequested,
+            nused=self._nused,
+            ndiscarded=self._ndiscarded)
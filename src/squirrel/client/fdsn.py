@@ -11,7 +11,7 @@ import time
 import os
 import copy
 import logging
-import tempfile
+import threading
 import importlib.util
 from collections import defaultdict
 try:
@@ -28,9 +28,9 @@ from ..database import ExecuteGet1Error
 from pyrocko.squirrel.error import SquirrelError
 from pyrocko.client import fdsn
 
-from pyrocko import util, trace, io
+from pyrocko import util, trace
 from pyrocko.io.io_common import FileLoadError
-from pyrocko.io import stationxml
+from pyrocko.io import stationxml, mseed
 from pyrocko import progress
 from pyrocko import has_paths
 
@@ -46,6 +46,25 @@ g_sites_not_supporting = {
     'startbefore': ['geonet'],
     'includerestricted': ['geonet', 'ncedc', 'scedc']}
 
+g_site_semaphores = {}
+g_site_semaphores_lock = threading.Lock()
+
+
+def get_site_semaphore(site, max_connections):
+    '''
+    Get semaphore limiting the number of concurrent requests to a site.
+
+    The semaphore is shared among all :py:class:`FDSNSource` objects accessing
+    the same site within the process. The limit is set on first use.
+    '''
+    with g_site_semaphores_lock:
+        if site not in g_site_semaphores:
+            g_site_semaphores[site] = threading.BoundedSemaphore(
+                max_connections)
+
+        return g_site_semaphores[site]
+
+
 g_keys_conflicting_post_codes = {
     'network', 'station', 'location', 'channel', 'minlatitude', 'maxlatitude',
     'minlongitude', 'maxlongitude', 'latitude', 'longitude', 'minradius',
@@ -286,6 +305,22 @@ class FDSNSource(Source, has_paths.HasPaths):
         optional=True,
         help='Path to Python module to locally patch metadata errors.')
 
+    max_connections = Int.T(
+        default=4,
+        help='Maximum number of concurrent waveform download requests to the '
+             'site. The limit is shared among all sources accessing the same '
+             'site.')
+
+    max_retries = Int.T(
+        default=3,
+        help='Number of times a waveform request is retried after a timeout '
+             'or when the server is temporarily unavailable.')
+
+    retry_wait = Duration.T(
+        default=2.0,
+        help='Time [s] to wait before the first retry. The waiting time is '
+             'doubled for each subsequent retry.')
+
     def __init__(self, site, query_args=None, codes=None, **kwargs):
         if codes:
             codes = [CodesNSLCE(codes_) for codes_ in codes]
@@ -711,152 +746,229 @@ class FDSNSource(Source, has_paths.HasPaths):
 
         return d
 
+    def _download_retry(self, selection, session, nbytes_max, aborted):
+        semaphore = get_site_semaphore(self.site, self.max_connections)
+        itry = 0
+        while True:
+            try:
+                with semaphore:
+                    data = fdsn.dataselect(
+                        site=self.site, selection=selection,
+                        session=session,
+                        **self._get_user_credentials())
+
+                    received = bytearray()
+                    while True:
+                        buf = data.read(65536)
+                        if not buf:
+                            break
+
+                        received.extend(buf)
+
+                        # abort if we get way more data than expected
+                        if len(received) > nbytes_max:
+                            data.close()
+                            raise Aborted('Too much data received.')
+
+                return received
+
+            except (fdsn.Timeout, fdsn.ServerUnavailable) as e:
+                if itry >= self.max_retries or aborted():
+                    raise
+
+                twait = self.retry_wait * 2**itry
+                itry += 1
+                self._log_info_data(
+                    'retrying (%i/%i) in %g s after error: %s' % (
+                        itry, self.max_retries, twait, str(e)))
+
+                tend = time.time() + twait
+                while time.time() < tend:
+                    if aborted():
+                        raise
+
+                    time.sleep(min(0.1, max(0., tend - time.time())))
+
     def download_waveforms(
             self, orders, success, batch_add, error_permanent,
             error_temporary, aborted):
 
+        import requests
+
         elog = ErrorLog(site=self.site)
         orders.sort(key=orders_sort_key)
         neach = 20
-        i = 0
+        chunks = [orders[i:i+neach] for i in range(0, len(orders), neach)]
+        chunks.reverse()
         task = make_task(
             'FDSN "%s" waveforms: downloading' % self.site, len(orders))
 
-        while i < len(orders) and not aborted():
-            orders_now = orders[i:i+neach]
+        lock = threading.Lock()
+        ndone = [0]
+
+        def download_chunk(orders_now, session):
             selection_now = orders_to_selection(orders_now)
             nsamples_estimate = sum(
                 order.estimate_nsamples() for order in orders_now)
 
-            nsuccess = 0
-            elog.append_checkpoint()
-            self._log_info_data(
-                'downloading, %s' % order_summary(orders_now))
+            with lock:
+                self._log_info_data(
+                    'downloading, %s' % order_summary(orders_now))
 
-            all_paths = []
-            with tempfile.TemporaryDirectory() as tmpdir:
-                try:
-                    data = fdsn.dataselect(
-                        site=self.site, selection=selection_now,
-                        **self._get_user_credentials())
+            trs = None
+            try:
+                received = self._download_retry(
+                    selection_now, session,
+                    max(1024 * 1000, nsamples_estimate * 4 * 10),
+                    aborted)
 
-                    now = time.time()
+                trs = list(mseed.iload_buffer(received))
+                exc = None
 
-                    path = op.join(tmpdir, 'tmp.mseed')
-                    with open(path, 'wb') as f:
-                        nread = 0
-                        while True:
-                            buf = data.read(1024)
-                            nread += len(buf)
-                            if not buf:
+            except (fdsn.EmptyResult, Aborted, util.HTTPError,
+                    fdsn.DownloadError) as e:
+                exc = e
+
+            with lock:
+                self._handle_downloaded(
+                    orders_now, trs, exc, elog, success, batch_add,
+                    error_permanent, error_temporary)
+
+                ndone[0] += len(orders_now)
+                task.update(ndone[0])
+
+        exceptions = []
+
+        def worker():
+            try:
+                with requests.Session() as session:
+                    while not aborted() and not exceptions:
+                        with lock:
+                            if not chunks:
                                 break
-                            f.write(buf)
-
-                            # abort if we get way more data than expected
-                            if nread > max(
-                                    1024 * 1000,
-                                    nsamples_estimate * 4 * 10):
-
-                                raise Aborted('Too much data received.')
-
-                    trs = io.load(path)
-
-                    by_nslc = defaultdict(list)
-                    for tr in trs:
-                        by_nslc[tr.nslc_id].append(tr)
-
-                    for order in orders_now:
-                        trs_order = []
-                        err_this = None
-                        for tr in by_nslc[order.codes.nslc]:
-                            try:
-                                order.validate(tr)
-                                trs_order.append(tr.chop(
-                                    order.tmin, order.tmax, inplace=False))
-
-                            except trace.NoData:
-                                err_this = (
-                                    'empty result', 'empty sub-interval')
-
-                            except InvalidWaveform as e:
-                                err_this = ('invalid waveform', str(e))
-
-                        if len(trs_order) == 0:
-                            if err_this is None:
-                                err_this = ('empty result', '')
-
-                            elog.append(now, order, *err_this)
-                            if order.is_near_real_time():
-                                error_temporary(order)
-                            else:
-                                error_permanent(order)
-                        else:
-                            def tsame(ta, tb):
-                                return abs(tb - ta) < 2 * order.deltat
-
-                            if len(trs_order) != 1 \
-                                    or not tsame(
-                                        trs_order[0].tmin, order.tmin) \
-                                    or not tsame(
-                                        trs_order[0].tmax, order.tmax):
-
-                                if err_this:
-                                    elog.append(
-                                        now, order,
-                                        'partial result, %s' % err_this[0],
-                                        err_this[1])
-                                else:
-                                    elog.append(now, order, 'partial result')
-
-                            paths = self._archive.save(
-                                trs_order,
-                                check_append_merge=True)
-                            all_paths.extend(paths)
-
-                            nsuccess += 1
-                            success(order, trs_order)
-
-                except fdsn.EmptyResult:
-                    now = time.time()
-                    for order in orders_now:
-                        elog.append(now, order, 'empty result')
-                        if order.is_near_real_time():
-                            error_temporary(order)
-                        else:
-                            error_permanent(order)
 
-                except Aborted as e:
-                    now = time.time()
-                    for order in orders_now:
-                        elog.append(now, order, 'aborted', str(e))
-                        error_permanent(order)
+                            orders_now = chunks.pop()
 
-                except (util.HTTPError, fdsn.DownloadError) as e:
-                    now = time.time()
-                    for order in orders_now:
-                        elog.append(now, order, 'http error', str(e))
-                        error_temporary(order)
+                        download_chunk(orders_now, session)
+
+            except Exception as e:
+                exceptions.append(e)
 
-            emessage = elog.summarize_recent()
+        nthreads = max(1, min(self.max_connections, len(chunks)))
+        threads = []
+        for _ in range(nthreads - 1):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            threads.append(thread)
 
-            self._log_info_data(
-                '%i download%s %ssuccessful' % (
-                    nsuccess,
-                    util.plural_s(nsuccess),
-                    '(partially) ' if emessage else '')
-                + (', %s' % emessage if emessage else ''))
+        worker()
 
-            if all_paths:
-                batch_add(all_paths)
+        for thread in threads:
+            thread.join()
 
-            i += neach
-            task.update(i)
+        if exceptions:
+            raise exceptions[0]
 
         for agg in elog.iter_aggregates():
             logger.warning(str(agg))
 
         task.done()
 
+    def _handle_downloaded(
+            self, orders_now, trs, exc, elog, success, batch_add,
+            error_permanent, error_temporary):
+
+        nsuccess = 0
+        elog.append_checkpoint()
+        all_paths = []
+        now = time.time()
+
+        if exc is None:
+            by_nslc = defaultdict(list)
+            for tr in trs:
+                by_nslc[tr.nslc_id].append(tr)
+
+            for order in orders_now:
+                trs_order = []
+                err_this = None
+                for tr in by_nslc[order.codes.nslc]:
+                    try:
+                        order.validate(tr)
+                        trs_order.append(tr.chop(
+                            order.tmin, order.tmax, inplace=False))
+
+                    except trace.NoData:
+                        err_this = (
+                            'empty result', 'empty sub-interval')
+
+                    except InvalidWaveform as e:
+                        err_this = ('invalid waveform', str(e))
+
+                if len(trs_order) == 0:
+                    if err_this is None:
+                        err_this = ('empty result', '')
+
+                    elog.append(now, order, *err_this)
+                    if order.is_near_real_time():
+                        error_temporary(order)
+                    else:
+                        error_permanent(order)
+                else:
+                    def tsame(ta, tb):
+                        return abs(tb - ta) < 2 * order.deltat
+
+                    if len(trs_order) != 1 \
+                            or not tsame(
+                                trs_order[0].tmin, order.tmin) \
+                            or not tsame(
+                                trs_order[0].tmax, order.tmax):
+
+                        if err_this:
+                            elog.append(
+                                now, order,
+                                'partial result, %s' % err_this[0],
+                                err_this[1])
+                        else:
+                            elog.append(now, order, 'partial result')
+
+                    paths = self._archive.save(
+                        trs_order,
+                        check_append_merge=True)
+                    all_paths.extend(paths)
+
+                    nsuccess += 1
+                    success(order, trs_order)
+
+        elif isinstance(exc, fdsn.EmptyResult):
+            for order in orders_now:
+                elog.append(now, order, 'empty result')
+                if order.is_near_real_time():
+                    error_temporary(order)
+                else:
+                    error_permanent(order)
+
+        elif isinstance(exc, Aborted):
+            for order in orders_now:
+                elog.append(now, order, 'aborted', str(exc))
+                error_permanent(order)
+
+        else:
+            for order in orders_now:
+                elog.append(now, order, 'http error', str(exc))
+                error_temporary(order)
+
+        emessage = elog.summarize_recent()
+
+        self._log_info_data(
+            '%i download%s %ssuccessful' % (
+                nsuccess,
+                util.plural_s(nsuccess),
+                '(partially) ' if emessage else '')
+            + (', %s' % emessage if emessage else ''))
+
+        if all_paths:
+            batch_add(all_paths)
+
     def _do_response_query(self, selection):
         extra_args = {}
 
@@ -13,6 +13,7 @@ import logging
 import sqlite3
 import re
 import time
+from urllib.request import pathname2url
 
 from pyrocko.io.io_common import FileLoadError
 from pyrocko import util
@@ -55,20 +56,38 @@ def execute_get1(connection, sql, args=()):
 
 g_databases = {}
 
+g_sql_create_trigger_increment_kind_codes = '''
+    CREATE TRIGGER IF NOT EXISTS increment_kind_codes
+    BEFORE INSERT ON nuts FOR EACH ROW
+    BEGIN
+        INSERT OR IGNORE INTO kind_codes_count
+        VALUES (new.kind_codes_id, 0);
+        UPDATE kind_codes_count
+        SET count = count + 1
+        WHERE new.kind_codes_id == kind_codes_id;
+    END
+'''
+
+# Number of nuts in a single call to Database.dig above which the per-row
+# kind_codes_count trigger is replaced by a single aggregated update.
+g_dig_bulk_threshold = 10000
+
 
-def get_database(path):
+def get_database(path, read_only=False):
     path = os.path.abspath(path)
-    if path not in g_databases:
-        g_databases[path] = Database(path)
+    key = (path, read_only)
+    if key not in g_databases:
+        g_databases[key] = Database(path, read_only=read_only)
 
-    return g_databases[path]
+    return g_databases[key]
 
 
 def close_database(database):
     path = os.path.abspath(database._database_path)
     database._conn.close()
-    if path in g_databases:
-        del g_databases[path]
+    key = (path, database.read_only)
+    if key in g_databases:
+        del g_databases[key]
 
 
 class Transaction(object):
@@ -194,21 +213,42 @@ class Database(object):
     Shared meta-information database used by Squirrel.
     '''
 
-    def __init__(self, database_path=':memory:', log_statements=False):
+    def __init__(
+            self, database_path=':memory:', log_statements=False,
+            read_only=False):
+
         self._database_path = database_path
-        if database_path != ':memory:':
-            util.ensuredirs(database_path)
+        self.read_only = read_only
+
+        if read_only:
+            if database_path == ':memory:':
+                raise error.SquirrelError(
+                    'In-memory database cannot be opened read-only.')
+
+            connect_args = (
+                'file:%s?mode=ro' % pathname2url(
+                    os.path.abspath(database_path)), )
+            connect_kwargs = dict(uri=True)
+
+        else:
+            if database_path != ':memory:':
+                util.ensuredirs(database_path)
+
+            connect_args = (database_path, )
+            connect_kwargs = {}
 
         try:
             logger.debug(
-                'Opening connection to database (threadsafety: %i): %s',
+                'Opening connection to database (threadsafety: %i%s): %s',
                 sqlite3.threadsafety,
+                ', read-only' if read_only else '',
                 database_path)
 
             self._conn = sqlite3.connect(
-                database_path,
+                *connect_args,
                 isolation_level=None,
-                check_same_thread=False if sqlite3.threadsafety else True)
+                check_same_thread=False if sqlite3.threadsafety else True,
+                **connect_kwargs)
 
         except sqlite3.OperationalError:
             raise error.SquirrelError(
@@ -254,6 +294,11 @@ class Database(object):
         return self._conn
 
     def transaction(self, label='', mode='immediate'):
+        if self.read_only:
+            raise error.SquirrelError(
+                'Cannot modify database opened in read-only mode (%s): %s'
+                % (label, self._database_path))
+
         return Transaction(
             self._conn,
             label=label,
@@ -293,6 +338,10 @@ class Database(object):
         return s
 
     def _initialize_db(self):
+        if self.read_only:
+            self._check_db_read_only()
+            return
+
         with self.transaction('initialize') as cursor:
             cursor.execute(
                 '''PRAGMA recursive_triggers = true''')
@@ -430,18 +479,7 @@ class Database(object):
                     END
                 ''')
 
-            cursor.execute(
-                '''
-                    CREATE TRIGGER IF NOT EXISTS increment_kind_codes
-                    BEFORE INSERT ON nuts FOR EACH ROW
-                    BEGIN
-                        INSERT OR IGNORE INTO kind_codes_count
-                        VALUES (new.kind_codes_id, 0);
-                        UPDATE kind_codes_count
-                        SET count = count + 1
-                        WHERE new.kind_codes_id == kind_codes_id;
-                    END
-                ''')
+            cursor.execute(g_sql_create_trigger_increment_kind_codes)
 
             cursor.execute(
                 '''
@@ -460,6 +498,33 @@ class Database(object):
                         name text UNIQUE)
                 '''))
 
+    def _check_db_read_only(self):
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(
+                '''PRAGMA busy_timeout = 30000''')
+
+            self.version = versiontuple(execute_get1(
+                cursor,
+                '''
+                SELECT value FROM settings
+                    WHERE key == "version"
+                ''')[0])
+
+        except (sqlite3.OperationalError, ExecuteGet1Error):
+            raise error.SquirrelError(
+                'Not a valid Squirrel database: %s' % self._database_path)
+
+        finally:
+            cursor.close()
+
+        if self.version >= (1, 1, 0):
+            raise error.SquirrelError(
+                'Squirrel database "%s" is of version %i.%i.%i which '
+                'is not supported by this version of Pyrocko. Please '
+                'upgrade the Pyrocko library.'
+                % ((self._database_path, ) + self.version))
+
     def dig(self, nuts, transaction=None):
         '''
         Store or update content meta-information.
@@ -490,6 +555,8 @@ class Database(object):
             kind_codes.add(
                 (nut.kind_id, nut.codes.safe_str, nut.deltat or 0.0))
 
+        bulk = len(nuts) >= g_dig_bulk_threshold
+
         with (transaction or self.transaction('dig')) as c:
 
             c.executemany(
@@ -506,25 +573,65 @@ class Database(object):
                 'INSERT OR IGNORE INTO kind_codes VALUES (NULL,?,?,?)',
                 kind_codes)
 
+            # Resolve ids once per file and per kind_codes entry instead of
+            # using correlated subqueries for every inserted nut.
+
+            file_ids = {}
+            for (path, _, _, _) in files:
+                file_ids[path] = execute_get1(
+                    c, 'SELECT file_id FROM files WHERE path == ?',
+                    (path,))[0]
+
+            kind_codes_ids = {}
+            for kc in kind_codes:
+                kind_codes_ids[kc] = execute_get1(
+                    c,
+                    '''
+                        SELECT kind_codes_id FROM kind_codes
+                        WHERE kind_id == ? AND codes == ? AND deltat == ?
+                    ''',
+                    kc)[0]
+
+            rows = []
+            counts = {}
+            for nut in nuts:
+                kind_codes_id = kind_codes_ids[
+                    nut.kind_id, nut.codes.safe_str, nut.deltat or 0.0]
+
+                rows.append((
+                    file_ids[self.relpath(nut.file_path)],
+                    nut.file_segment, nut.file_element,
+                    nut.kind_id, kind_codes_id,
+                    nut.tmin_seconds, nut.tmin_offset,
+                    nut.tmax_seconds, nut.tmax_offset,
+                    nut.kscale))
+
+                counts[kind_codes_id] = counts.get(kind_codes_id, 0) + 1
+
+            if bulk:
+                # Defer kind_codes_count maintenance for large imports. The
+                # trigger is restored within the same transaction, so other
+                # connections never see it missing.
+                c.execute('DROP TRIGGER increment_kind_codes')
+
             c.executemany(
-                '''
-                    INSERT INTO nuts VALUES
-                        (NULL, (
-                            SELECT file_id FROM files
-                            WHERE path == ?
-                         ),?,?,?,
-                         (
-                            SELECT kind_codes_id FROM kind_codes
-                            WHERE kind_id == ? AND codes == ? AND deltat == ?
-                         ), ?,?,?,?,?)
-                ''',
-                ((self.relpath(nut.file_path),
-                  nut.file_segment, nut.file_element,
-                  nut.kind_id,
-                  nut.kind_id, nut.codes.safe_str, nut.deltat or 0.0,
-                  nut.tmin_seconds, nut.tmin_offset,
-                  nut.tmax_seconds, nut.tmax_offset,
-                  nut.kscale) for nut in nuts))
+                'INSERT INTO nuts VALUES (NULL,?,?,?,?,?,?,?,?,?,?)', rows)
+
+            if bulk:
+                c.executemany(
+                    'INSERT OR IGNORE INTO kind_codes_count VALUES (?, 0)',
+                    ((kind_codes_id,) for kind_codes_id in counts))
+
+                c.executemany(
+                    '''
+                        UPDATE kind_codes_count
+                        SET count = count + ?
+                        WHERE kind_codes_id == ?
+                    ''',
+                    ((count, kind_codes_id)
+                     for (kind_codes_id, count) in counts.items()))
+
+                c.execute(g_sql_create_trigger_increment_kind_codes)
 
     def undig(self, path):
 
@@ -8,6 +8,7 @@ Squirrel IO adaptor to :py:mod:`pyrocko.io.mseed`.
 '''
 
 from pyrocko.io.io_common import get_stats, touch  # noqa
+from pyrocko import config
 from ... import model
 
 SEGMENT_SIZE = 1024*1024
@@ -43,7 +44,8 @@ def iload(format, file_path, segment, content):
     itr = 0
     for tr in mseed.iload(
             file_path, load_data=load_data,
-            offset=offset, segment_size=SEGMENT_SIZE, nsegments=nsegments):
+            offset=offset, segment_size=SEGMENT_SIZE, nsegments=nsegments,
+            nthreads=config.config().mseed_decode_nthreads):
 
         if file_segment != tr.meta['offset_start']:
             itr = 0
@@ -9,10 +9,12 @@ Squirrel core file reading and indexing.
 
 import time
 import logging
+import collections
 
 from pyrocko import util
 from pyrocko.io.io_common import FileLoadError
 from pyrocko import progress
+from pyrocko.parimap import parimap
 
 from .backends import \
     mseed, sac, hdf5_optodas, datacube, stationxml, textfiles, virtual, yaml, \
@@ -26,6 +28,9 @@ backend_modules = [
 
 logger = logging.getLogger('psq.io')
 
+# maximum number of already indexed files to read ahead in parallel mode
+_iload_lookahead = 1000
+
 
 def make_task(*args):
     return progress.task(*args, logger=logger)
@@ -130,6 +135,58 @@ def supported_content_kinds():
     return g_content_kinds + ['waveform_promise']
 
 
+def index_file(job):
+    '''
+    Detect format and extract index information from a single file.
+
+    Worker function used by :py:func:`iload` in parallel indexing mode. It
+    runs in a child process and does not touch the database.
+
+    :param job:
+        Tuple ``(format, path)`` with the file format (or ``'detect'``) and
+        the path of the file to index or ``None`` for a no-op job.
+    :type job:
+        tuple
+
+    :returns:
+        Tuple ``(path, values, error)`` where ``values`` is a list of tuples
+        suitable for the ``values_nocheck`` argument of
+        :py:class:`~pyrocko.squirrel.model.Nut` and ``error`` is ``None`` or
+        the error message if the file could not be read. ``None`` for no-op
+        jobs.
+    '''
+
+    if job is None:
+        return None
+
+    format, path = job
+    try:
+        if format == 'detect':
+            format = detect_format(path)
+
+        mod = get_backend(format)
+        mtime, size = mod.get_stats(path)
+
+        nuts = list(mod.iload(format, path, None, []))
+        if not nuts:
+            nuts.append(Nut(kind_id=EMPTY))
+
+        values = []
+        for nut in nuts:
+            values.append((
+                path, format, mtime, size,
+                nut.file_segment, nut.file_element,
+                nut.kind_id, nut.codes.safe_str,
+                nut.tmin_seconds, nut.tmin_offset,
+                nut.tmax_seconds, nut.tmax_offset,
+                nut.deltat))
+
+        return path, values, None
+
+    except FileLoadError as e:
+        return path, None, str(e)
+
+
 def iload(
         paths,
         segment=None,
@@ -139,7 +196,8 @@ def iload(
         skip_unchanged=False,
         content=g_content_kinds,
         show_progress=True,
-        update_selection=None):
+        update_selection=None,
+        nprocs=1):
 
     '''
     Iteratively load content or index/reindex meta-information from files.
@@ -188,6 +246,16 @@ def iload(
     :type content:
         :py:class:`list` of :py:class:`str`
 
+    :param nprocs:
+        Number of worker processes to use for format detection and header
+        parsing of new and modified files. Parallel indexing is only available
+        in index-only mode (empty ``content``) and without ``segment``. Nuts
+        extracted by the workers are written to the database in batches by
+        the calling process. ``None`` means to use as many workers as there
+        are CPU cores.
+    :type nprocs:
+        int
+
     This generator yields :py:class:`~pyrocko.squirrel.model.Nut` objects for
     individual pieces of information found when reading the given files. Such a
     nut may represent a waveform, a station, a channel, an event or other data
@@ -296,132 +364,251 @@ def iload(
 
     clean = False
     try:
-        for (format, path), old_nuts in it:
-            if task is not None:
-                condition = '(nuts: %i from file, %i from cache)\n  %s' % (
-                    n_load, n_db, path)
-                task.update(n_files, condition)
-
-            n_files += 1
-            # cannot release when iterating a selection (see above)
-            if database and transaction and not selection:
-                tnow = time.time()
-                if tnow - tcommit > 20. or n_files % 1000 == 0:
-                    transaction.commit()
-                    tcommit = tnow
-                    transaction.begin()
+        if nprocs != 1 and not kind_ids and segment is None:
+            # Files are passed through in order: entries which need no
+            # indexing in a worker are queued in `pending`, together with a
+            # marker (None) for each job handed to parimap. After a run of
+            # `_iload_lookahead` such entries, a no-op job is inserted, so that
+            # they are released before the input is read any further.
+            pending = collections.deque()
+
+            def jobs():
+                n = 0
+                for (format, path), old_nuts in it:
+                    if check and old_nuts and old_nuts[0].file_modified():
+                        old_nuts = []
+
+                    if old_nuts or path.startswith('virtual:'):
+                        pending.append((format, path, old_nuts))
+                        n += 1
+                        if n >= _iload_lookahead:
+                            pending.append(None)
+                            n = 0
+                            yield None
+                    else:
+                        pending.append(None)
+                        n = 0
+                        yield format, path
 
-            try:
-                if check and old_nuts and old_nuts[0].file_modified():
-                    old_nuts = []
-                    modified = True
-                else:
-                    modified = False
+            batch_nuts = []
+            batch_paths = []
+            failed_paths = []
 
-                if segment is not None:
-                    old_nuts = [
-                        nut for nut in old_nuts if nut.file_segment == segment]
+            def flush():
+                nonlocal transaction, tcommit
 
-                if old_nuts:
-                    db_only_operation = not kind_ids or all(
-                        nut.kind_id in kind_ids and nut.content_in_db
-                        for nut in old_nuts)
+                if not database or not (batch_paths or failed_paths):
+                    return
 
-                    if db_only_operation:
-                        # logger.debug('using cached information for file %s, '
-                        #              % path)
+                if not transaction:
+                    transaction = database.transaction(
+                        'update content index')
+                    transaction.begin()
 
-                        for nut in old_nuts:
-                            if nut.kind_id in kind_ids:
-                                database.undig_content(nut)
+                database.dig(batch_nuts, transaction=transaction)
+                for path in failed_paths:
+                    database.reset(path, transaction=transaction)
+
+                if update_selection is not None:
+                    update_selection._set_file_states_force_check(
+                        batch_paths + failed_paths, transaction=transaction)
+                    update_selection._update_nuts(transaction=transaction)
+
+                del batch_nuts[:]
+                del batch_paths[:]
+                del failed_paths[:]
+
+                # cannot release when iterating a selection (see above)
+                if not selection:
+                    tnow = time.time()
+                    if tnow - tcommit > 20.:
+                        transaction.commit()
+                        tcommit = tnow
+                        transaction.begin()
 
+            def process_pending():
+                # up to the marker of the next job
+                nonlocal n_files, n_db
+                while pending:
+                    entry = pending.popleft()
+                    if entry is None:
+                        return
+
+                    format, path, old_nuts = entry
+                    n_files += 1
+                    if old_nuts:
+                        for nut in old_nuts:
                             n_db += 1
                             yield nut
-
-                        continue
-
-                if format == 'detect':
-                    if old_nuts and not old_nuts[0].file_modified():
-                        format_this = old_nuts[0].file_format
                     else:
-                        format_this = detect_format(path)
+                        yield from process_result(index_file((format, path)))
+
+            def process_result(result):
+                nonlocal n_load
+                path, values, message = result
+                if message is not None:
+                    logger.error('Cannot read file: %s' % path)
+                    failed_paths.append(path)
                 else:
-                    format_this = format
+                    logger.debug('Indexed file "%s".' % path)
+                    nuts = [Nut(values_nocheck=v) for v in values]
+                    for nut in nuts:
+                        if nut.kind_id != EMPTY:
+                            n_load += 1
+                            yield nut
 
-                mod = get_backend(format_this)
-                mtime, size = mod.get_stats(path)
+                    batch_nuts.extend(nuts)
+                    batch_paths.append(path)
 
-                if segment is not None:
-                    logger.debug(
-                        'Reading file "%s", segment "%s".' % (path, segment))
-                else:
-                    logger.debug(
-                        'Reading file "%s".' % path)
-
-                nuts = []
-                for nut in mod.iload(format_this, path, segment, content):
-                    nut.file_path = path
-                    nut.file_format = format_this
-                    nut.file_mtime = mtime
-                    nut.file_size = size
-                    if nut.content is not None:
-                        nut.content._squirrel_key = nut.key
-
-                    nuts.append(nut)
-                    n_load += 1
-                    yield nut
-
-                if segment is None and len(nuts) == 0:
-                    nuts.append(
-                        Nut(
-                            file_path=path,
-                            file_format=format_this,
-                            file_mtime=mtime,
-                            file_size=size,
-                            kind_id=EMPTY))
-
-                if database and nuts != old_nuts:
-                    if old_nuts or modified:
-                        logger.debug(
-                            'File has been modified since last access: %s'
-                            % path)
+                if task is not None:
+                    condition = '(nuts: %i from file, %i from cache)\n  %s' % (
+                        n_load, n_db, path)
+                    task.update(n_files, condition)
 
-                    if segment is not None:
-                        nuts = list(mod.iload(format_this, path, None, []))
-                        for nut in nuts:
-                            nut.file_path = path
-                            nut.file_format = format_this
-                            nut.file_mtime = mtime
-                            nut.file_size = size
-
-                        if len(nuts) == 0:
-                            nuts.append(
-                                Nut(
-                                    file_path=path,
-                                    file_format=format_this,
-                                    file_mtime=mtime,
-                                    file_size=size,
-                                    kind_id=EMPTY))
-
-                    if not transaction:
-                        transaction = database.transaction(
-                            'update content index')
-                        transaction.begin()
+                if len(batch_paths) + len(failed_paths) >= 100 \
+                        or len(batch_nuts) >= 100000:
+                    flush()
+
+            for result in parimap(index_file, jobs(), nprocs=nprocs):
+                yield from process_pending()
+                if result is not None:
+                    n_files += 1
+                    yield from process_result(result)
 
-                    database.dig(nuts, transaction=transaction)
-                    if update_selection is not None:
-                        update_selection._set_file_states_force_check(
-                            [path], transaction=transaction)
-                        update_selection._update_nuts(transaction=transaction)
-
-            except FileLoadError:
-                logger.error('Cannot read file: %s' % path)
-                if database:
-                    if not transaction:
-                        transaction = database.transaction(
-                            'update content index')
+            yield from process_pending()
+            flush()
+
+        else:
+            for (format, path), old_nuts in it:
+                if task is not None:
+                    condition = '(nuts: %i from file, %i from cache)\n  %s' % (
+                        n_load, n_db, path)
+                    task.update(n_files, condition)
+
+                n_files += 1
+                # cannot release when iterating a selection (see above)
+                if database and transaction and not selection:
+                    tnow = time.time()
+                    if tnow - tcommit > 20. or n_files % 1000 == 0:
+                        transaction.commit()
+                        tcommit = tnow
                         transaction.begin()
-                    database.reset(path, transaction=transaction)
+
+                try:
+                    if check and old_nuts and old_nuts[0].file_modified():
+                        old_nuts = []
+                        modified = True
+                    else:
+                        modified = False
+
+                    if segment is not None:
+                        old_nuts = [
+                            nut for nut in old_nuts
+                            if nut.file_segment == segment]
+
+                    if old_nuts:
+                        db_only_operation = not kind_ids or all(
+                            nut.kind_id in kind_ids and nut.content_in_db
+                            for nut in old_nuts)
+
+                        if db_only_operation:
+                            # logger.debug(
+                            #     'using cached information for file %s, '
+                            #     % path)
+
+                            for nut in old_nuts:
+                                if nut.kind_id in kind_ids:
+                                    database.undig_content(nut)
+
+                                n_db += 1
+                                yield nut
+
+                            continue
+
+                    if format == 'detect':
+                        if old_nuts and not old_nuts[0].file_modified():
+                            format_this = old_nuts[0].file_format
+                        else:
+                            format_this = detect_format(path)
+                    else:
+                        format_this = format
+
+                    mod = get_backend(format_this)
+                    mtime, size = mod.get_stats(path)
+
+                    if segment is not None:
+                        logger.debug(
+                            'Reading file "%s", segment "%s".'
+                            % (path, segment))
+                    else:
+                        logger.debug(
+                            'Reading file "%s".' % path)
+
+                    nuts = []
+                    for nut in mod.iload(format_this, path, segment, content):
+                        nut.file_path = path
+                        nut.file_format = format_this
+                        nut.file_mtime = mtime
+                        nut.file_size = size
+                        if nut.content is not None:
+                            nut.content._squirrel_key = nut.key
+
+                        nuts.append(nut)
+                        n_load += 1
+                        yield nut
+
+                    if segment is None and len(nuts) == 0:
+                        nuts.append(
+                            Nut(
+                                file_path=path,
+                                file_format=format_this,
+                                file_mtime=mtime,
+                                file_size=size,
+                                kind_id=EMPTY))
+
+                    if database and nuts != old_nuts:
+                        if old_nuts or modified:
+                            logger.debug(
+                                'File has been modified since last access: %s'
+                                % path)
+
+                        if segment is not None:
+                            nuts = list(mod.iload(format_this, path, None, []))
+                            for nut in nuts:
+                                nut.file_path = path
+                                nut.file_format = format_this
+                                nut.file_mtime = mtime
+                                nut.file_size = size
+
+                            if len(nuts) == 0:
+                                nuts.append(
+                                    Nut(
+                                        file_path=path,
+                                        file_format=format_this,
+                                        file_mtime=mtime,
+                                        file_size=size,
+                                        kind_id=EMPTY))
+
+                        if not transaction:
+                            transaction = database.transaction(
+                                'update content index')
+                            transaction.begin()
+
+                        database.dig(nuts, transaction=transaction)
+                        if update_selection is not None:
+                            update_selection._set_file_states_force_check(
+                                [path], transaction=transaction)
+                            update_selection._update_nuts(
+                                transaction=transaction)
+
+                except FileLoadError:
+                    logger.error('Cannot read file: %s' % path)
+                    if database:
+                        if not transaction:
+                            transaction = database.transaction(
+                                'update content index')
+                            transaction.begin()
+                        database.reset(path, transaction=transaction)
 
         clean = True
 
@@ -444,6 +631,7 @@ def iload(
 
 __all__ = [
     'iload',
+    'index_file',
     'detect_format',
     'supported_formats',
     'supported_content_kinds',
@@ -232,7 +232,7 @@ class Pile(object):
             want_incomplete=True, degap=True, maxgap=5, maxlap=None,
             keep_current_files_open=False, accessor_id='default',
             snap=(round, round), include_last=False, load_data=True,
-            style=None):
+            style=None, filters=None):
 
         '''
         Get iterator for shifting window wise data extraction from waveform
@@ -270,10 +270,19 @@ class Pile(object):
             about the chopper state as :py:class:`pyrocko.pile.Batch` objects.
             By default lists of :py:class:`pyrocko.trace.Trace` objects are
             yielded.
+        :param filters: list of :py:class:`pyrocko.trace.StatefulFilter`
+            objects through which the traces of each window are passed. The
+            filter states are carried over from one window to the next for
+            each channel, so that no padding is needed. Filter states are
+            reset at gaps. Cannot be combined with ``tpad``.
         :returns: iterator providing extracted waveforms for each extracted
             window. See ``style`` argument for details.
         '''
 
+        if filters and tpad != 0.:
+            raise ValueError(
+                'Stateful filters cannot be used with padded windows (tpad).')
+
         if tmin is None:
             if self.tmin is None:
                 logger.warning("Pile's tmin is not set - pile may be empty.")
@@ -311,6 +320,11 @@ class Pile(object):
                 chopped, degap, maxgap, maxlap, want_incomplete, wmax, wmin,
                 tpad)
 
+            if filters:
+                for tr in processed:
+                    for filter in filters:
+                        filter.apply(tr)
+
             if style == 'batch':
                 yield classic_pile.Batch(
                     tmin=wmin,
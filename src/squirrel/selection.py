@@ -109,6 +109,12 @@ class Selection(object):
     :type persistent:
         :py:class:`str`
 
+    :param read_only:
+        If ``True``, attach to an existing persistent selection without
+        modifying it. The database is opened in read-only mode.
+    :type read_only:
+        bool
+
     A selection in this context represents the list of files available to the
     application. Instead of using :py:class:`Selection` directly, user
     applications should usually use its subclass
@@ -132,11 +138,15 @@ class Selection(object):
     used to iterate over all content known to the selection.
     '''
 
-    def __init__(self, database, persistent=None):
+    def __init__(self, database, persistent=None, read_only=False):
         self._conn = None
 
+        if read_only and persistent is None:
+            raise error.SquirrelError(
+                'Only persistent selections can be opened read-only.')
+
         if not isinstance(database, Database):
-            database = get_database(database)
+            database = get_database(database, read_only=read_only)
 
         if persistent is not None:
             assert isinstance(persistent, str)
@@ -149,12 +159,26 @@ class Selection(object):
             self.name = 'sel_' + make_unique_name()
 
         self._persistent = persistent
+        self._read_only = read_only
         self._database = database
         self._conn = self._database.get_connection()
         self._sources = []
         self._is_new = True
         self._volatile_paths = []
 
+        self._names = {
+            'db': 'main' if self._persistent else 'temp',
+            'file_states': self.name + '_file_states',
+            'bulkinsert': self.name + '_bulkinsert'}
+
+        if read_only:
+            if persistent not in self._database.get_persistent_names():
+                raise error.SquirrelError(
+                    'No such persistent selection: %s' % persistent)
+
+            self._is_new = False
+            return
+
         with self.transaction('init selection') as cursor:
 
             if persistent is not None:
@@ -163,11 +187,6 @@ class Selection(object):
                         INSERT OR IGNORE INTO persistent VALUES (?)
                     ''', (persistent,)).rowcount
 
-            self._names = {
-                'db': 'main' if self._persistent else 'temp',
-                'file_states': self.name + '_file_states',
-                'bulkinsert': self.name + '_bulkinsert'}
-
             cursor.execute(self._register_table(self._sql(
                 '''
                     CREATE TABLE IF NOT EXISTS %(db)s.%(file_states)s (
@@ -185,7 +204,7 @@ class Selection(object):
                 '''))
 
     def __del__(self):
-        if hasattr(self, '_conn') and self._conn:
+        if hasattr(self, '_conn') and self._conn and not self._read_only:
             self._cleanup()
             if not self._persistent:
                 self._delete()
@@ -199,6 +218,12 @@ class Selection(object):
     def transaction(self, label='', mode='immediate'):
         return self._database.transaction(label, mode)
 
+    def is_read_only(self):
+        '''
+        Is this selection opened in read-only mode?
+        '''
+        return self._read_only
+
     def is_new(self):
         '''
         Is this a new selection?
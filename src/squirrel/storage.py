@@ -157,7 +157,19 @@ class StorageScheme(guts.Object):
 
         return layout
 
-    def save(self, traces, **save_kwargs):
+    def save(self, traces, writer=None, **save_kwargs):
+        '''
+        Save traces into the storage.
+
+        :param traces: traces to be stored
+        :param writer: optional :py:class:`~pyrocko.io.mseed.MSeedWriter`
+            to keep output files open between calls, see
+            :py:func:`pyrocko.io.save`
+        :param save_kwargs: further arguments passed to
+            :py:func:`pyrocko.io.save`
+
+        :returns: sorted list of names of files written to
+        '''
 
         assert save_kwargs.get('append', True)
         assert save_kwargs.get('check_append', True)
@@ -200,6 +212,7 @@ class StorageScheme(guts.Object):
                     if self._base_path is None
                     else os.path.join(self._base_path, layout.path_template),
                     additional=additional,
+                    writer=writer,
                     **save_kwargs))
 
         return sorted(file_names)
@@ -678,135 +678,152 @@ replacements. Examples: Direct replacement: ```XX``` - set all network codes to
                 tpad += frequency_taper_tpad
 
             task = None
-            rename_rules = self.get_effective_rename_rules(chain)
-            for batch in sq.chopper_waveforms(
-                    tmin=tmin, tmax=tmax, tpad=tpad, tinc=tinc,
-                    codes=codes,
-                    snap_window=True,
-                    grouping=grouping):
+            writer = None
+            if storage_scheme is not None and out_format == 'mseed':
+                writer = io.mseed.MSeedWriter()
 
-                if task is None:
-                    task = make_task(
-                        'Jackseis blocks', batch.n * batch.ngroups)
-
-                tlabel = '%s%s - %s' % (
-                    'groups %i / %i: ' % (batch.igroup, batch.ngroups)
-                    if batch.ngroups > 1 else '',
-                    util.time_to_str(batch.tmin),
-                    util.time_to_str(batch.tmax))
-
-                task.update(batch.i + batch.igroup * batch.n, tlabel)
-
-                twmin = batch.tmin
-                twmax = batch.tmax
-
-                traces = batch.traces
+            try:
+                rename_rules = self.get_effective_rename_rules(chain)
+                for batch in sq.chopper_waveforms(
+                        tmin=tmin, tmax=tmax, tpad=tpad, tinc=tinc,
+                        codes=codes,
+                        snap_window=True,
+                        grouping=grouping):
+
+                    if task is None:
+                        task = make_task(
+                            'Jackseis blocks', batch.n * batch.ngroups)
+
+                    tlabel = '%s%s - %s' % (
+                        'groups %i / %i: ' % (batch.igroup, batch.ngroups)
+                        if batch.ngroups > 1 else '',
+                        util.time_to_str(batch.tmin),
+                        util.time_to_str(batch.tmax))
+
+                    task.update(batch.i + batch.igroup * batch.n, tlabel)
+
+                    twmin = batch.tmin
+                    twmax = batch.tmax
+
+                    traces = batch.traces
+
+                    if target_deltat is not None:
+                        downsampled_traces = []
+                        for tr in traces:
+                            try:
+                                tr.downsample_to(
+                                    target_deltat, snap=True, demean=False,
+                                    allow_upsample_max=4)
+
+                                downsampled_traces.append(tr)
+
+                            except (trace.TraceTooShort, trace.NoData) as e:
+                                logger.warning(str(e))
+
+                        traces = downsampled_traces
+
+                    if do_transfer:
+                        restituted_traces = []
+                        for tr in traces:
+                            try:
+                                if quantity is not None:
+                                    resp = sq.get_response(tr).get_effective(
+                                        input_quantity=quantity,
+                                        mode=ic_mode,
+                                        gain_frequency=frequency_taper[1])
+                                else:
+                                    resp = None
+
+                                restituted_traces.append(tr.transfer(
+                                    frequency_taper_tpad,
+                                    frequency_taper,
+                                    transfer_function=resp,
+                                    invert=True))
+
+                            except (trace.NoData, trace.TraceTooShort,
+                                    SquirrelError) as e:
+                                logger.warning(str(e))
+
+                        traces = restituted_traces
+
+                    if rotate_to_enz:
+                        sensors = sq.get_sensors(
+                            tmin=twmin,
+                            tmax=twmax,
+                            codes=list(set(tr.codes for tr in traces)))
+
+                        rotated_traces = []
+                        for sensor in sensors:
+                            sensor_traces = [
+                                tr for tr in traces
+                                if tr.codes.matches(sensor.codes)]
+
+                            rotated_traces.extend(
+                                sensor.project_to_enz(sensor_traces))
+
+                        traces = rotated_traces
 
-                if target_deltat is not None:
-                    downsampled_traces = []
                     for tr in traces:
-                        try:
-                            tr.downsample_to(
-                                target_deltat, snap=True, demean=False,
-                                allow_upsample_max=4)
-
-                            downsampled_traces.append(tr)
+                        self.do_rename(rename_rules, tr)
 
-                        except (trace.TraceTooShort, trace.NoData) as e:
-                            logger.warning(str(e))
+                    if out_data_type:
+                        for tr in traces:
+                            tr.ydata = tr.ydata.astype(
+                                OutputDataTypeChoice.name_to_dtype[
+                                    out_data_type])
 
-                    traces = downsampled_traces
-
-                if do_transfer:
-                    restituted_traces = []
+                    chopped_traces = []
                     for tr in traces:
                         try:
-                            if quantity is not None:
-                                resp = sq.get_response(tr).get_effective(
-                                    input_quantity=quantity,
-                                    mode=ic_mode,
-                                    gain_frequency=frequency_taper[1])
-                            else:
-                                resp = None
-
-                            restituted_traces.append(tr.transfer(
-                                frequency_taper_tpad,
-                                frequency_taper,
-                                transfer_function=resp,
-                                invert=True))
-
-                        except (trace.NoData, trace.TraceTooShort,
-                                SquirrelError) as e:
-                            logger.warning(str(e))
-
-                    traces = restituted_traces
-
-                if rotate_to_enz:
-                    sensors = sq.get_sensors(
-                        tmin=twmin,
-                        tmax=twmax,
-                        codes=list(set(tr.codes for tr in traces)))
-
-                    rotated_traces = []
-                    for sensor in sensors:
-                        sensor_traces = [
-                            tr for tr in traces
-                            if tr.codes.matches(sensor.codes)]
-
-                        rotated_traces.extend(
-                            sensor.project_to_enz(sensor_traces))
-
-                    traces = rotated_traces
-
-                for tr in traces:
-                    self.do_rename(rename_rules, tr)
-
-                if out_data_type:
-                    for tr in traces:
-                        tr.ydata = tr.ydata.astype(
-                            OutputDataTypeChoice.name_to_dtype[out_data_type])
+                            otr = tr.chop(twmin, twmax, inplace=False)
+                            chopped_traces.append(otr)
+                        except trace.NoData:
+                            pass
 
-                chopped_traces = []
-                for tr in traces:
-                    try:
-                        otr = tr.chop(twmin, twmax, inplace=False)
-                        chopped_traces.append(otr)
-                    except trace.NoData:
-                        pass
-
-                traces = chopped_traces
-                if storage_scheme is not None:
-                    try:
-                        g_filenames_all.update(storage_scheme.save(
-                            traces,
-                            format=out_format,
-                            overwrite=force,
-                            append=True,
-                            check_append=True,
-                            check_append_hook=check_append_hook
-                            if not append else None,
-                            additional=dict(
-                                wmin_year=tts(twmin, format='%Y'),
-                                wmin_month=tts(twmin, format='%m'),
-                                wmin_day=tts(twmin, format='%d'),
-                                wmin_jday=tts(twmin, format='%j'),
-                                wmin=tts(twmin, format='%Y-%m-%d_%H-%M-%S'),
-                                wmax_year=tts(twmax, format='%Y'),
-                                wmax_month=tts(twmax, format='%m'),
-                                wmax_day=tts(twmax, format='%d'),
-                                wmax_jday=tts(twmax, format='%j'),
-                                wmax=tts(twmax, format='%Y-%m-%d_%H-%M-%S')),
-                            **save_kwargs))
-
-                    except io.FileSaveError as e:
-                        raise JackseisError(str(e))
-
-                else:
-                    for tr in traces:
-                        print(tr.summary_stats)
-
-            if task:
-                task.done()
+                    traces = chopped_traces
+                    if storage_scheme is not None:
+                        try:
+                            g_filenames_all.update(storage_scheme.save(
+                                traces,
+                                format=out_format,
+                                overwrite=force,
+                                append=True,
+                                check_append=True,
+                                check_append_hook=check_append_hook
+                                if not append else None,
+                                writer=writer,
+                                additional=dict(
+                                    wmin_year=tts(twmin, format='%Y'),
+                                    wmin_month=tts(twmin, format='%m'),
+                                    wmin_day=tts(twmin, format='%d'),
+                                    wmin_jday=tts(twmin, format='%j'),
+                                    wmin=tts(
+                                        twmin, format='%Y-%m-%d_%H-%M-%S'),
+                                    wmax_year=tts(twmax, format='%Y'),
+                                    wmax_month=tts(twmax, format='%m'),
+                                    wmax_day=tts(twmax, format='%d'),
+                                    wmax_jday=tts(twmax, format='%j'),
+                                    wmax=tts(
+                                        twmax, format='%Y-%m-%d_%H-%M-%S')),
+                                **save_kwargs))
+
+                            if writer is not None:
+                                # files stay open, data is on disk after
+                                # each window
+                                writer.flush()
+
+                        except io.FileSaveError as e:
+                            raise JackseisError(str(e))
+
+                    else:
+                        for tr in traces:
+                            print(tr.summary_stats)
+
+                if task:
+                    task.done()
+            finally:
+                if writer is not None:
+                    writer.close()
 
 
 g_defaults = Converter(
@@ -24,6 +24,8 @@ and re-indexed as needed. To speed up scanning, these checks can be disabled
 with the ``--optimistic`` option. With this option, only new files are indexed
 during scanning and modifications are handled "last minute" (i.e. just before
 the actual data (e.g. waveform samples) are requested by the application).
+Indexing of new and modified files can be distributed over several worker
+processes with the ``--nprocs`` option.
 
 Usually, the contents of files given to Squirrel are made available within the
 application through a runtime selection which is discarded again when the
@@ -319,8 +319,8 @@ Examples: https://pyrocko.org/docs/current/apps/squirrel/manual.html#examples
         :py:class:`~pyrocko.squirrel.base.Squirrel` instance.
 
         This will  optional arguments ``--add``, ``--include``, ``--exclude``,
-        ``--optimistic``, ``--format``, ``--add-only``, ``--persistent``, and
-        ``--dataset``.
+        ``--optimistic``, ``--nprocs``, ``--format``, ``--add-only``,
+        ``--persistent``, and ``--dataset``.
 
         Call ``args.make_squirrel()`` on the arguments returned from
         :py:meth:`parse_args` to finally instantiate and configure the
@@ -416,8 +416,8 @@ def add_squirrel_selection_arguments(parser):
     :py:class:`~pyrocko.squirrel.base.Squirrel` instance.
 
     This will  optional arguments ``--add``, ``--include``, ``--exclude``,
-    ``--optimistic``, ``--format``, ``--add-only``, ``--persistent``,
-    and ``--dataset`` to a given argument parser.
+    ``--optimistic``, ``--nprocs``, ``--format``, ``--add-only``,
+    ``--persistent``, and ``--dataset`` to a given argument parser.
 
     Once finished with parsing, call
     :py:func:`squirrel_from_selection_arguments` to finally instantiate and
@@ -468,6 +468,15 @@ def add_squirrel_selection_arguments(parser):
         default=True,
         help='Disable checking file modification times for faster startup.')
 
+    group.add_argument(
+        '--nprocs',
+        dest='nprocs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Use ``N`` worker processes to index new and modified files. '
+             'Default: 1.')
+
     group.add_argument(
         '--format', '-f',
         dest='format',
@@ -545,7 +554,8 @@ def squirrel_from_selection_arguments(args):
                 format=args.format,
                 kinds=args.kinds_add or None,
                 include=args.include,
-                exclude=args.exclude)
+                exclude=args.exclude,
+                nprocs=args.nprocs)
 
         with progress.task('add datasets', logger=logger) as task:
             for dataset_path in task(args.datasets):
@@ -0,0 +1,629 @@
+# http://pyrocko.org - GPLv3
+#
+# The Pyrocko Developers, 21st Century
+# ---|P------/S----------~Lg----------
+
+'''
+Incremental updates of Squirrel selections from file system changes.
+
+A :py:class:`Watcher` keeps a :py:class:`~pyrocko.squirrel.base.Squirrel`
+selection in sync with a set of directories, e.g. a real-time archive
+receiving new files every few seconds. Only the files which have been
+created, modified or removed since the last update are (re)indexed or pruned.
+On Linux, file system events are received through *inotify*. On other systems
+or when *inotify* is not available, the watched directories are periodically
+rescanned, comparing modification times and sizes of the files.
+'''
+
+import os
+import re
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import os.path as op
+
+from pyrocko.guts import Object, Int, String, List
+
+from . import error
+
+logger = logging.getLogger('psq.watch')
+
+guts_prefix = 'squirrel'
+
+
+def make_path_filter(include=None, exclude=None):
+    '''
+    Get function to check file paths against include/exclude patterns.
+
+    Same semantics as in :py:func:`pyrocko.util.iter_select_files`.
+    '''
+    rinclude = re.compile(include) if include is not None else None
+    rexclude = re.compile(exclude) if exclude is not None else None
+
+    def check(path):
+        if rinclude is not None and not rinclude.search(path):
+            return False
+
+        if rexclude is not None and rexclude.search(path):
+            return False
+
+        return True
+
+    return check
+
+
+class FileChanges(object):
+    '''
+    File system changes detected by a watcher backend.
+
+    .. py:attribute:: changed
+
+        Set of paths of files which have been created or modified.
+
+    .. py:attribute:: removed
+
+        Set of paths of files which have been removed.
+
+    .. py:attribute:: removed_dirs
+
+        Set of paths of directories which have been removed. Files below
+        these directories must be considered removed.
+
+    .. py:attribute:: rescan
+
+        ``True`` if events have been lost and a full rescan is needed.
+    '''
+
+    def __init__(self):
+        self.changed = set()
+        self.removed = set()
+        self.removed_dirs = set()
+        self.rescan = False
+
+    def add_changed(self, path):
+        self.removed.discard(path)
+        self.changed.add(path)
+
+    def add_removed(self, path):
+        self.changed.discard(path)
+        self.removed.add(path)
+
+    def __bool__(self):
+        return bool(
+            self.changed or self.removed or self.removed_dirs or self.rescan)
+
+
+class WatchedPaths(object):
+    '''
+    Watched directories and files.
+
+    Directories are watched recursively. Explicitly given files are watched
+    individually.
+    '''
+
+    def __init__(self, paths, include=None, exclude=None):
+        if isinstance(paths, str):
+            paths = [paths]
+
+        self.dirs = []
+        self.files = set()
+        for path in paths:
+            path = op.abspath(path)
+            if op.isdir(path):
+                self.dirs.append(path)
+            else:
+                self.files.add(path)
+
+        self._check = make_path_filter(include, exclude)
+
+    def in_tree(self, path):
+        return any(
+            path == dir or path.startswith(dir + os.sep)
+            for dir in self.dirs)
+
+    def is_watched(self, path):
+        return (path in self.files or self.in_tree(path)) \
+            and self._check(path)
+
+    def iter_files(self, dir=None):
+        '''
+        Iterate over the watched files currently existing on disk.
+
+        :param dir:
+            Restrict to files below given directory.
+        '''
+        if dir is None:
+            for path in sorted(self.files):
+                if op.isfile(path) and self._check(path):
+                    yield path
+
+            dirs = self.dirs
+        else:
+            dirs = [dir]
+
+        for dir in dirs:
+            for (dirpath, dirnames, filenames) in os.walk(dir):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    path = op.join(dirpath, filename)
+                    if self._check(path):
+                        yield path
+
+
+class PollingBackend(object):
+    '''
+    Detect file changes by periodically rescanning the watched paths.
+
+    :param watched:
+        Paths to be watched.
+    :type watched:
+        :py:class:`WatchedPaths`
+
+    :param interval:
+        Time [s] between subsequent scans when waiting for changes.
+    :type interval:
+        float
+    '''
+
+    name = 'poll'
+
+    def __init__(self, watched, interval=1.0):
+        self._watched = watched
+        self._interval = interval
+        self._state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for path in self._watched.iter_files():
+            try:
+                st = os.stat(path)
+                state[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+
+        return state
+
+    def poll(self, timeout=0.):
+        '''
+        Get changes since last call.
+
+        :param timeout:
+            Maximum time [s] to wait for changes.
+        :type timeout:
+            float
+
+        :returns:
+            :py:class:`FileChanges` object.
+        '''
+        tend = time.time() + timeout
+        while True:
+            changes = FileChanges()
+            state = self._scan()
+            for path, stats in state.items():
+                if self._state.get(path) != stats:
+                    changes.add_changed(path)
+
+            for path in self._state:
+                if path not in state:
+                    changes.add_removed(path)
+
+            self._state = state
+
+            tnow = time.time()
+            if changes or tnow >= tend:
+                return changes
+
+            time.sleep(min(self._interval, tend - tnow))
+
+    def close(self):
+        pass
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+g_inotify_event_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM \
+    | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+g_inotify_event_header = struct.Struct('iIII')
+
+
+class InotifyUnavailable(error.SquirrelError):
+    '''
+    Raised when inotify cannot be used on this system.
+    '''
+    pass
+
+
+def get_libc_inotify():
+    if not sys.platform.startswith('linux'):
+        raise InotifyUnavailable('inotify is only available on Linux.')
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+    except (OSError, AttributeError) as e:
+        raise InotifyUnavailable('Cannot access inotify: %s' % str(e))
+
+    return libc
+
+
+class InotifyBackend(object):
+    '''
+    Detect file changes through Linux inotify events.
+
+    :param watched:
+        Paths to be watched.
+    :type watched:
+        :py:class:`WatchedPaths`
+    '''
+
+    name = 'inotify'
+
+    def __init__(self, watched):
+        self._watched = watched
+        self._libc = get_libc_inotify()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise InotifyUnavailable(
+                'inotify_init1 failed: %s' % os.strerror(ctypes.get_errno()))
+
+        self._wd_to_dir = {}
+        self._dir_to_wd = {}
+        self._pending = FileChanges()
+
+        try:
+            for dir in watched.dirs:
+                self._add_tree(dir)
+
+            for dir in sorted(set(op.dirname(path) for path in watched.files)):
+                self._add_watch(dir)
+
+        except Exception:
+            self.close()
+            raise
+
+    def _add_watch(self, dir):
+        if dir in self._dir_to_wd:
+            return
+
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(dir), g_inotify_event_mask | IN_ONLYDIR)
+
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                return
+
+            raise InotifyUnavailable(
+                'Cannot watch directory "%s": %s' % (dir, os.strerror(e)))
+
+        self._wd_to_dir[wd] = dir
+        self._dir_to_wd[dir] = wd
+
+    def _add_tree(self, dir):
+        for (dirpath, dirnames, _) in os.walk(dir):
+            self._add_watch(dirpath)
+
+    def _remove_tree(self, dir):
+        for dir_watched in list(self._dir_to_wd.keys()):
+            if dir_watched == dir or dir_watched.startswith(dir + os.sep):
+                wd = self._dir_to_wd.pop(dir_watched)
+                del self._wd_to_dir[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self):
+        data = []
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+
+            if not buf:
+                break
+
+            data.append(buf)
+
+        buf = b''.join(data)
+        pos = 0
+        while pos < len(buf):
+            wd, mask, _, length = g_inotify_event_header.unpack_from(buf, pos)
+            pos += g_inotify_event_header.size
+            name = buf[pos:pos+length].rstrip(b'\0')
+            pos += length
+            yield wd, mask, os.fsdecode(name)
+
+    def _handle_event(self, wd, mask, name, changes):
+        if mask & IN_Q_OVERFLOW:
+            changes.rescan = True
+            return
+
+        dir = self._wd_to_dir.get(wd)
+        if dir is None:
+            return
+
+        if mask & IN_IGNORED:
+            del self._wd_to_dir[wd]
+            del self._dir_to_wd[dir]
+            return
+
+        if not name:
+            # events on the watched directory itself
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) \
+                    and dir in self._watched.dirs:
+
+                changes.removed_dirs.add(dir)
+
+            return
+
+        path = op.join(dir, name)
+
+        if mask & IN_ISDIR:
+            if not self._watched.in_tree(path):
+                return
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+                # files may have been created before the watch was in place
+                for path_file in self._watched.iter_files(path):
+                    changes.add_changed(path_file)
+
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove_tree(path)
+                changes.removed_dirs.add(path)
+
+            return
+
+        if not self._watched.is_watched(path):
+            return
+
+        if mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO):
+            changes.add_changed(path)
+
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            changes.add_removed(path)
+
+    def poll(self, timeout=0.):
+        '''
+        Get changes since last call.
+
+        :param timeout:
+            Maximum time [s] to wait for changes.
+        :type timeout:
+            float
+
+        :returns:
+            :py:class:`FileChanges` object.
+        '''
+        changes = self._pending
+        self._pending = FileChanges()
+
+        tend = time.time() + timeout
+        while True:
+            tnow = time.time()
+            readable, _, _ = select.select(
+                [self._fd], [], [], 0. if changes else max(0., tend - tnow))
+
+            if readable:
+                for wd, mask, name in self._read_events():
+                    self._handle_event(wd, mask, name, changes)
+
+            if changes or time.time() >= tend:
+                return changes
+
+    def close(self):
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+
+        self._fd = None
+
+
+class WatchUpdate(Object):
+    '''
+    Summary of changes applied by :py:meth:`Watcher.update`.
+    '''
+
+    backend = String.T(
+        help='Change detection method in use.')
+    nchanged = Int.T(
+        default=0,
+        help='Number of created or modified files (re)indexed.')
+    nremoved = Int.T(
+        default=0,
+        help='Number of removed files pruned from the selection.')
+    changed = List.T(
+        String.T(),
+        help='Paths of created or modified files.')
+    removed = List.T(
+        String.T(),
+        help='Paths of removed files.')
+
+
+class Watcher(object):
+    '''
+    Keep a Squirrel selection in sync with changing files and directories.
+
+    Usually created with :py:meth:`~pyrocko.squirrel.base.Squirrel.watch`.
+    Changes are detected in the background by the operating system (inotify)
+    or are found by rescanning the watched paths (polling). They are applied
+    to the database and the live selection of the Squirrel only when
+    :py:meth:`update` is called.
+
+    :param squirrel:
+        Squirrel instance to be updated.
+    :type squirrel:
+        :py:class:`~pyrocko.squirrel.base.Squirrel`
+
+    :param paths:
+        Directories (watched recursively) and files to be watched.
+    :type paths:
+        :py:class:`list` of :py:class:`str`
+
+    :param kinds:
+        Content types to be made available through the Squirrel selection.
+        By default, all known content types are considered.
+    :type kinds:
+        :py:class:`list` of :py:class:`str`
+
+    :param format:
+        File format identifier or ``'detect'`` to enable auto-detection.
+    :type format:
+        str
+
+    :param include:
+        If not ``None``, files are only included if their paths match the
+        given regular expression pattern.
+    :type include:
+        str
+
+    :param exclude:
+        If not ``None``, files are only included if their paths do not match
+        the given regular expression pattern.
+    :type exclude:
+        str
+
+    :param method:
+        Change detection method: ``'inotify'``, ``'poll'`` or ``'auto'``
+        (use inotify where available, fall back to polling otherwise).
+    :type method:
+        str
+
+    :param poll_interval:
+        Time [s] between rescans when polling.
+    :type poll_interval:
+        float
+    '''
+
+    def __init__(
+            self, squirrel, paths, kinds=None, format='detect',
+            include=None, exclude=None, method='auto', poll_interval=1.0):
+
+        if method not in ('auto', 'inotify', 'poll'):
+            raise error.SquirrelError(
+                'Invalid file watching method: %s' % method)
+
+        self._squirrel = squirrel
+        self._watched = WatchedPaths(paths, include, exclude)
+        self._kinds = kinds
+        self._format = format
+
+        self._backend = None
+        if method in ('auto', 'inotify'):
+            try:
+                self._backend = InotifyBackend(self._watched)
+            except InotifyUnavailable as e:
+                if method == 'inotify':
+                    raise
+
+                logger.info(
+                    'Cannot use inotify, falling back to polling: %s' % str(e))
+
+        if self._backend is None:
+            self._backend = PollingBackend(
+                self._watched, interval=poll_interval)
+
+    def get_method(self):
+        '''
+        Get name of the change detection method in use.
+        '''
+        return self._backend.name
+
+    def _selection_paths_below(self, dir):
+        prefix = dir + os.sep
+        return [
+            path for path in self._squirrel.iter_paths()
+            if path.startswith(prefix)]
+
+    def update(self, timeout=0.):
+        '''
+        Apply file changes to the database and the live selection.
+
+        New and modified files are (re)indexed, removed files are pruned from
+        the selection and their index entries are reset in the database.
+
+        :param timeout:
+            Maximum time [s] to wait for changes to appear.
+        :type timeout:
+            float
+
+        :returns:
+            :py:class:`WatchUpdate` object summarizing the applied changes.
+        '''
+
+        changes = self._backend.poll(timeout)
+
+        changed = changes.changed
+        removed = changes.removed
+
+        for dir in changes.removed_dirs:
+            removed.update(self._selection_paths_below(dir))
+
+        if changes.rescan:
+            logger.warning(
+                'File system events have been lost. Rescanning watched '
+                'directories.')
+
+            existing = set(self._watched.iter_files())
+            changed = existing
+            removed = set(
+                path for path in self._squirrel.iter_paths()
+                if self._watched.is_watched(path) and path not in existing)
+
+        removed -= changed
+
+        if changed:
+            self._squirrel.add(
+                sorted(changed), kinds=self._kinds, format=self._format,
+                check=True)
+
+        if removed:
+            db = self._squirrel.get_database()
+            transaction = db.transaction('reset removed files')
+            with transaction:
+                for path in removed:
+                    db.reset(path, transaction=transaction)
+
+            self._squirrel.remove(sorted(removed))
+
+        return WatchUpdate(
+            backend=self._backend.name,
+            nchanged=len(changed),
+            nremoved=len(removed),
+            changed=sorted(changed),
+            removed=sorted(removed))
+
+    def close(self):
+        '''
+        Stop watching.
+        '''
+        self._backend.close()
+
+    def __del__(self):
+        if hasattr(self, '_backend') and self._backend is not None:
+            self._backend.close()
+
+
+__all__ = [
+    'Watcher',
+    'WatchUpdate',
+]
@@ -14,7 +14,6 @@ import os
 import signal
 import select
 import logging
-import tempfile
 
 from pyrocko.io import mseed
 
@@ -120,15 +119,11 @@ class SlowSlink(object):
 
             line = self.slink.stdout.read(RECORD_LENGTH)
 
-            with tempfile.NamedTemporaryFile(prefix='slink-stream') as f:
-                f.write(line)
-                f.flush()
+            traces = mseed.iload_buffer(line)
+            for tr in traces:
+                self.got_trace(tr)
 
-                traces = mseed.iload(f.name)
-                for tr in traces:
-                    self.got_trace(tr)
-
-                return True
+            return True
 
         except Exception as e:
             logger.debug(e)
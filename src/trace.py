@@ -3773,6 +3773,102 @@ def co_lfilter(target, b, a):
         target.close()
 
 
+class StatefulFilter(object):
+    '''
+    Base class for filters keeping state between successive traces.
+
+    Filter states are kept *per channel*, as with :py:func:`co_lfilter`, so
+    that a long continuous time series, split into successive traces (e.g.
+    the windows of a chopper), can be filtered without padding and without
+    artifacts at the trace boundaries. Filter state is reset, when gaps
+    occur.
+
+    Subclasses must implement :py:meth:`get_coeffs`.
+    '''
+
+    def __init__(self):
+        self._states = States()
+
+    def get_coeffs(self, tr):
+        '''
+        Get filter coefficients ``(b, a)`` to be applied to a trace.
+        '''
+        raise NotImplementedError
+
+    def apply(self, tr):
+        '''
+        Filter trace data in place, continuing from the channel's state.
+
+        :param tr: trace to be filtered
+        :type tr: :py:class:`Trace`
+        '''
+
+        b, a = self.get_coeffs(tr)
+        zi = self._states.get(tr)
+        if zi is None:
+            zi = num.zeros(max(len(a), len(b))-1, dtype=float)
+
+        ydata, zf = signal.lfilter(
+            b, a, tr.get_ydata().astype(num.float64), zi=zi)
+
+        self._states.set(tr, zf)
+        tr.drop_growbuffer()
+        tr.set_ydata(ydata)
+
+    def reset(self):
+        '''
+        Forget the filter states of all channels.
+        '''
+        self._states = States()
+
+
+class ButterworthFilter(StatefulFilter):
+    '''
+    Stateful Butterworth lowpass, highpass, bandpass or bandstop filter.
+
+    The filter type is chosen from the corners given: lowpass if only
+    ``corner_lp`` is given, highpass if only ``corner_hp`` is given and
+    bandpass (or bandstop) if both are given. Filter coefficients are
+    designed per sampling interval and cached. Unlike
+    :py:meth:`Trace.bandpass` and friends, the data is not demeaned.
+
+    See :py:class:`StatefulFilter`.
+
+    :param order: order of the filter
+    :param corner_hp: lower corner frequency of the filter
+    :param corner_lp: upper corner frequency of the filter
+    :param bandstop: create bandstop instead of bandpass filter
+    '''
+
+    def __init__(self, order, corner_hp=None, corner_lp=None, bandstop=False):
+        StatefulFilter.__init__(self)
+
+        if corner_hp is None and corner_lp is None:
+            raise ValueError(
+                'ButterworthFilter: at least one corner frequency is needed.')
+
+        if corner_hp is not None and corner_lp is not None:
+            self._corners = [corner_hp, corner_lp]
+            self._btype = 'bandstop' if bandstop else 'band'
+        elif corner_hp is not None:
+            self._corners = [corner_hp]
+            self._btype = 'high'
+        else:
+            self._corners = [corner_lp]
+            self._btype = 'low'
+
+        self._order = order
+
+    def get_coeffs(self, tr):
+        for corner in self._corners:
+            tr.nyquist_check(corner, 'Corner frequency of filter')
+
+        return _get_cached_filter_coeffs(
+            self._order,
+            [corner*2.0*tr.deltat for corner in self._corners],
+            btype=self._btype)
+
+
 def co_antialias(target, q, n=None, ftype='fir'):
     b, a, n = util.decimate_coeffs(q, n, ftype)
     anti = co_lfilter(target, b, a)
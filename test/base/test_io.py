@@ -263,6 +263,80 @@ class IOTestCase(unittest.TestCase):
             with self.assertRaises(io_common.FileSaveError):
                 io.save([trb], fn, append=True, check_append=True)
 
+    def testMSeedBytesIncompressible(self):
+        from pyrocko.io.mseed import get_bytes
+        for record_length in (256, 512, 4096):
+            for steim in (1, 2):
+                tr = trace.Trace(ydata=num.random.randint(
+                    -2**28, 2**28, size=10000).astype(num.int32))
+
+                fn = os.path.join(self.tmpdir, 'mseed_incompressible')
+                with open(fn, 'wb') as f:
+                    f.write(get_bytes(
+                        [tr], record_length=record_length, steim=steim))
+
+                ltr = io.load(fn, format='mseed')[0]
+                num.testing.assert_equal(tr.ydata, ltr.ydata)
+
+    def testMSeedWriter(self):
+        from pyrocko.io.mseed import MSeedWriter
+
+        nsample = 1000
+        deltat = 0.01
+        tpl = os.path.join(self.tmpdir, 'writer', '%(station)s_%(wmin)s')
+        tpl_ref = os.path.join(self.tmpdir, 'ref', '%(station)s_%(wmin)s')
+
+        def windows():
+            for iwin in range(8):
+                tmin = iwin * nsample * deltat
+                trs = [
+                    trace.Trace(
+                        '', sta, '', 'BHZ', tmin=tmin, deltat=deltat,
+                        ydata=num.random.randint(
+                            -1000, 1000, size=nsample).astype(num.int32))
+                    for sta in ('STA1', 'STA2', 'STA3')]
+
+                yield trs, dict(wmin='%i' % (iwin // 4))
+
+        with MSeedWriter(max_open_files=3, buffer_size=4096) as writer:
+            for trs, additional in windows():
+                fns = io.save(
+                    trs, tpl, additional=additional, append=True,
+                    check_append=True, writer=writer)
+                fns_ref = io.save(
+                    trs, tpl_ref, additional=additional, append=True,
+                    check_append=True)
+
+                assert len(fns) == len(fns_ref) == 3
+
+                with self.assertRaises(io_common.FileSaveError):
+                    io.save(
+                        trs[:1], tpl, additional=additional, append=True,
+                        check_append=True, writer=writer)
+
+        stats = writer.get_stats()
+        assert stats['nopen'] == 6
+        assert stats['nevict'] == 3
+        assert stats['nreread'] == 0
+
+        for fn in os.listdir(os.path.join(self.tmpdir, 'ref')):
+            with open(os.path.join(self.tmpdir, 'ref', fn), 'rb') as f:
+                data_ref = f.read()
+            with open(os.path.join(self.tmpdir, 'writer', fn), 'rb') as f:
+                assert f.read() == data_ref
+
+        with MSeedWriter() as writer:
+            trs, additional = next(windows())
+            fns = io.save(trs, tpl, additional=additional, writer=writer)
+            io.save(trs, tpl, additional=additional, writer=writer)
+            with self.assertRaises(io_common.FileSaveError):
+                io.save(
+                    trs, tpl, additional=additional, overwrite=False,
+                    writer=writer)
+
+        for fn in fns:
+            assert len(io.load(fn)) == 1
+
     def testMSeedOffset(self):
         from pyrocko.io.mseed import iload
         c = '12'
@@ -294,6 +368,96 @@ class IOTestCase(unittest.TestCase):
         assert len(trs) == 1
         assert trs[0].tmin != 0.
 
+    def testMSeedBuffer(self):
+        import mmap
+        from pyrocko.io.mseed import get_bytes, iload, iload_buffer
+
+        nsample = 5000
+        trs = [
+            trace.Trace(
+                '', 'STA', '', cha, tmin=0., deltat=0.01,
+                ydata=num.random.randint(
+                    -1000, 1000, size=nsample).astype(num.int32))
+            for cha in ('BHZ', 'BHN', 'BHE')]
+
+        data = get_bytes(trs, record_length=512)
+        fn = os.path.join(self.tmpdir, 'mseed_buffer')
+        with open(fn, 'wb') as f:
+            f.write(data)
+
+        trs_file = list(iload(fn))
+
+        with open(fn, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for buffer in (data, bytearray(data), memoryview(data), mm):
+                    trs_buffer = list(iload_buffer(buffer))
+                    assert len(trs_buffer) == len(trs_file)
+                    for tra, trb in zip(trs_buffer, trs_file):
+                        assert tra.nslc_id == trb.nslc_id
+                        assert tra.tmin == trb.tmin
+                        assert tra.tmax == trb.tmax
+                        num.testing.assert_equal(tra.ydata, trb.ydata)
+            finally:
+                mm.close()
+
+        trs_nodata = list(iload_buffer(data, load_data=False))
+        assert all(tr.ydata is None for tr in trs_nodata)
+        assert [tr.tmax for tr in trs_nodata] == [tr.tmax for tr in trs_file]
+
+        trs_segments = list(iload_buffer(data, segment_size=512))
+        assert len(trs_segments) == len(data) // 512
+        assert sum(tr.ydata.size for tr in trs_segments) == 3 * nsample
+
+        # non-data before records, truncated record at end
+        trs_dirty = list(iload_buffer(b' ' * 512 + data[:-100]))
+        assert sum(tr.ydata.size for tr in trs_dirty) \
+            == sum(tr.ydata.size for tr in trs_segments[:-1])
+
+        assert list(iload_buffer(b'')) == []
+
+        with self.assertRaises(FileLoadError):
+            list(iload_buffer(b'x' * 2048))
+
+    def testMSeedParallel(self):
+        from pyrocko.io.mseed import get_bytes, iload, iload_buffer
+
+        trs = [
+            trace.Trace(
+                '', 'STA', '', cha, tmin=0., deltat=0.01,
+                ydata=num.random.randint(
+                    -1000, 1000, size=100000).astype(num.int32))
+            for cha in ('BHZ', 'BHN', 'BHE')]
+
+        data = get_bytes(trs, record_length=512, steim=2)
+        fn = os.path.join(self.tmpdir, 'mseed_parallel')
+        with open(fn, 'wb') as f:
+            f.write(data)
+
+        for kwargs in [
+                dict(),
+                dict(segment_size=65536),
+                dict(segment_size=65536, load_data=False),
+                dict(offset=65536, segment_size=65536, nsegments=2)]:
+
+            trs_serial = list(iload(fn, **kwargs))
+            for nthreads in (0, 2):
+                for trs_parallel in [
+                        list(iload(fn, nthreads=nthreads, **kwargs)),
+                        list(iload_buffer(data, nthreads=nthreads, **kwargs))]:
+
+                    assert len(trs_parallel) == len(trs_serial)
+                    for tra, trb in zip(trs_parallel, trs_serial):
+                        assert tra.nslc_id == trb.nslc_id
+                        assert tra.tmin == trb.tmin
+                        assert tra.tmax == trb.tmax
+                        assert tra.meta['offset_start'] \
+                            == trb.meta['offset_start']
+                        if trb.ydata is None:
+                            assert tra.ydata is None
+                        else:
+                            num.testing.assert_equal(tra.ydata, trb.ydata)
+
     def testReadSEGY(self):
         fpath = common.test_data_file('test2.segy')
         i = 0
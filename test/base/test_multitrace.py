@@ -62,3 +62,56 @@ class MultiTraceTestCase(unittest.TestCase):
             tr.downsample_to(2., cut=True, snap=True)
             assert tr.tmin <= tr_orig.tmin + tpad
             assert tr_orig.tmax - tpad <= tr.tmax
+
+    def test_filtering(self):
+        traces = trace.make_traces_compatible(self.random_traces(n=20))
+
+        def check(mt, trs):
+            assert mt.nsamples == trs[0].ydata.size
+            assert abs(mt.tmin - trs[0].tmin) < 1e-6 * mt.deltat
+            assert mt.deltat == trs[0].deltat
+            num.testing.assert_allclose(
+                mt.data, num.array([tr.ydata for tr in trs]),
+                rtol=1e-12, atol=1e-9)
+
+        for method, args in [
+                ('lowpass', (4, 0.1)),
+                ('highpass', (4, 0.01)),
+                ('bandpass', (4, 0.01, 0.1)),
+                ('bandstop', (2, 0.01, 0.1))]:
+
+            for nthreads in (1, 3):
+                trs = [tr.copy() for tr in traces]
+                mt = multitrace.MultiTrace(trs)
+                for tr in trs:
+                    getattr(tr, method)(*args)
+
+                getattr(mt, method)(*args, nthreads=nthreads)
+                check(mt, trs)
+
+        for nthreads in (1, 3):
+            trs = [tr.copy() for tr in traces]
+            mt = multitrace.MultiTrace(trs)
+            for tr in trs:
+                tr.downsample_to(
+                    4.0, snap=True, cut=True, demean=True,
+                    allow_upsample_max=5)
+
+            mt.downsample_to(
+                4.0, snap=True, cut=True, demean=True, allow_upsample_max=5,
+                nthreads=nthreads)
+
+            check(mt, trs)
+
+        trs = [tr.copy() for tr in traces]
+        mt = multitrace.MultiTrace(trs)
+        taperer = trace.CosFader(xfrac=0.1)
+        for tr in trs:
+            tr.ydata = tr.ydata.astype(float)
+            tr.taper(taperer)
+
+        mt.taper(taperer)
+        check(mt, trs)
+
+        mt.demean()
+        num.testing.assert_allclose(num.mean(mt.data, axis=1), 0., atol=1e-9)
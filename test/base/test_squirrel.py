@@ -1,4 +1,5 @@
 
+import sys
 import time
 import math
 import os
@@ -9,6 +10,8 @@ import tempfile
 import shutil
 import os.path as op
 import logging
+import threading
+import http.server
 from collections import defaultdict
 
 import numpy as num
@@ -276,6 +279,141 @@ class SquirrelTestCase(unittest.TestCase):
             path = 'virtual:' + path
             self.assertEqual([0, 1], sorted(data[path]))
 
+    def test_dig_bulk(self):
+        from pyrocko.squirrel import database as dbm
+
+        def make_nuts(path, n):
+            return [
+                squirrel.Nut(
+                    file_path=path,
+                    file_format='virtual',
+                    file_segment=0,
+                    file_element=i,
+                    kind_id=squirrel.to_kind_id('waveform'),
+                    codes=squirrel.CodesNSLCE('a.b.c.d%i' % (i % 3)),
+                    tmin=float(i),
+                    tmax=float(i+1),
+                    deltat=1.0)
+                for i in range(n)]
+
+        threshold = dbm.g_dig_bulk_threshold
+        counts = []
+        try:
+            for bulk_threshold in [10, 10000000]:
+                dbm.g_dig_bulk_threshold = bulk_threshold
+                database = squirrel.Database()
+                database.dig(make_nuts('virtual:a', 1000))
+                database.dig(make_nuts('virtual:b', 5))
+                database.dig(make_nuts('virtual:a', 500))
+                assert database.get_nnuts() == 505
+                counts.append(database.get_counts('waveform'))
+
+                nuts = database.undig('virtual:a')
+                assert sorted(nut.file_element for nut in nuts) \
+                    == list(range(500))
+
+                database.remove('virtual:a')
+                assert database.get_nnuts() == 5
+                assert sum(database.get_counts('waveform').values()) == 5
+
+        finally:
+            dbm.g_dig_bulk_threshold = threshold
+
+        assert counts[0] == counts[1]
+        assert sum(counts[0].values()) == 505
+
+    def test_time_index(self):
+        benchmark = common.Benchmark('time index')
+
+        nnuts = 20000
+        nfiles = 20
+        rstate = num.random.RandomState(123)
+        tmin_all = util.stt('2020-01-01 00:00:00')
+        tmins = tmin_all + rstate.uniform(0., 365.*86400., nnuts)
+        # mix of very short and very long content pieces
+        durations = 10**rstate.uniform(0., 8., nnuts)
+
+        nuts = []
+        for i in range(nnuts):
+            nuts.append(squirrel.Nut(
+                file_path='virtual:time_index_%i' % (i % nfiles),
+                file_format='virtual',
+                file_segment=0,
+                file_element=i // nfiles,
+                kind_id=squirrel.to_kind_id('waveform'),
+                codes=squirrel.CodesNSLCE('xx.S%03i..HHZ' % (i % 100)),
+                tmin=tmins[i],
+                tmax=tmins[i] + durations[i],
+                deltat=0.01))
+
+        # open and far out of range time spans, beyond the 32-bit integer
+        # coordinates of the R*-tree
+        tfar = util.stt('2100-01-01 00:00:00')
+        for i, (tmin, tmax) in enumerate([
+                (squirrel.model.g_tmin, tmin_all + 10.),
+                (tmin_all + 20., squirrel.model.g_tmax),
+                (tfar, tfar + 10.)]):
+
+            nuts.append(squirrel.Nut(
+                file_path='virtual:time_index_0',
+                file_format='virtual',
+                file_segment=1,
+                file_element=i,
+                kind_id=squirrel.to_kind_id('waveform'),
+                codes=squirrel.CodesNSLCE('xx.OPEN..HHZ'),
+                tmin=tmin,
+                tmax=tmax,
+                deltat=0.01))
+
+        paths = ['virtual:time_index_%i' % i for i in range(nfiles)]
+
+        database = squirrel.Database()
+        results = {}
+        for time_index in ['kscale', 'rtree']:
+            sq = squirrel.Squirrel(database=database, time_index=time_index)
+            sq.add_virtual(nuts, paths)
+
+            keys = []
+            with benchmark.run(time_index):
+                for i in range(50):
+                    tmin = tmin_all + i * 7 * 86400.
+                    for tmax in [tmin, tmin + 10., tmin + 86400.]:
+                        keys.append(sorted(
+                            nut.key for nut in sq.iter_nuts(
+                                'waveform', tmin=tmin, tmax=tmax)))
+
+            for tmin, tmax in [
+                    (util.stt('1800-01-01 00:00:00'),
+                     util.stt('1800-01-02 00:00:00')),
+                    (tfar - 86400., tfar - 1.),
+                    (tfar + 5., tfar + 6.),
+                    (tfar + 11., tfar + 12.)]:
+
+                keys.append(sorted(
+                    nut.key for nut in sq.iter_nuts(
+                        'waveform', tmin=tmin, tmax=tmax)))
+
+            assert [len(k) for k in keys[-4:]] == [1, 1, 2, 1]
+
+            results[time_index] = keys
+
+            # removal must be reflected in the R*-tree
+            sq.remove(paths[0])
+            assert len(sq.get_nuts(
+                'waveform', tmin=tmin_all, tmax=tmin_all + 365.*86400.)) \
+                < nnuts
+
+            sq.add_virtual(nuts, paths)
+            del sq
+
+        assert results['kscale'] == results['rtree']
+        assert any(results['rtree'])
+
+        with self.assertRaises(squirrel.SquirrelError):
+            squirrel.Squirrel(database=database, time_index='nonexist')
+
+        logger.info(str(benchmark))
+
     def test_add_update(self):
 
         tempdir = os.path.join(self.tempdir, 'test_add_update')
@@ -959,6 +1097,74 @@ class SquirrelTestCase(unittest.TestCase):
         finally:
             shutil.rmtree(tempdir)
 
+    def test_fdsn_download_concurrent(self):
+        from pyrocko.squirrel.model import WaveformOrder
+
+        server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), FakeFDSNHandler)
+        server.stats = dict(
+            nrequests=0, nactive=0, nactive_max=0, connections=set(),
+            nfail=2)
+        server.lock = threading.Lock()
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+
+        tempdir = os.path.join(self.tempdir, 'test_fdsn_download_concurrent')
+        try:
+            sq = squirrel.Squirrel()
+            site = 'http://127.0.0.1:%i' % server.server_address[1]
+            sq.add_fdsn(
+                site, cache_path=tempdir, max_connections=3,
+                retry_wait=0.01)
+
+            source = sq._sources[0]
+
+            tmin = util.str_to_time('2020-01-01 00:00:00')
+            now = time.time()
+            orders = []
+            for ista in range(10):
+                for iblock in range(10):
+                    orders.append(WaveformOrder(
+                        source_id=source._source_id,
+                        codes=squirrel.CodesNSLCE(
+                            'XX', 'S%02i' % ista, '', 'HHZ'),
+                        deltat=1.0,
+                        tmin=tmin + iblock * 100.,
+                        tmax=tmin + (iblock+1) * 100.,
+                        gaps=[],
+                        time_created=now))
+
+            succeeded = []
+            failed = []
+            paths = []
+            source.download_waveforms(
+                orders,
+                success=lambda order, trs: succeeded.append(order),
+                batch_add=paths.extend,
+                error_permanent=failed.append,
+                error_temporary=failed.append,
+                aborted=lambda: False)
+
+            stats = server.stats
+            assert not failed
+            assert len(succeeded) == len(orders)
+            assert stats['nrequests'] == 5 + 2
+            assert 1 < stats['nactive_max'] <= 3
+            assert len(stats['connections']) < stats['nrequests']
+
+            sq.add(paths)
+            trs = sq.get_waveforms(tmin=tmin, tmax=tmin + 1000.)
+            assert len(trs) == 10
+            for tr in trs:
+                assert tr.tmin == tmin
+                assert num.all(tr.ydata == 1)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+            server_thread.join()
+            shutil.rmtree(tempdir)
+
     @common.require_internet
     def test_promises(self):
         # 1994 Bolivia earthquake
@@ -1203,6 +1409,480 @@ class SquirrelTestCase(unittest.TestCase):
         finally:
             shutil.rmtree(datadir)
 
+    def test_add_parallel(self):
+        nfiles = 300
+        nsamples = 100
+
+        stations = ['S%02i' % i for i in range(10)]
+        channels = ['C%01i' % i for i in range(3)]
+        networks = ['xx']
+
+        tmin = 1234567890.
+        datadir = self.make_many_files(
+            nfiles, nsamples, networks, stations, channels, tmin)
+
+        with open(os.path.join(datadir, 'data', 'garbage.mseed'), 'wb') as f:
+            f.write(b'\0' * 1024)
+
+        try:
+            sq_serial = squirrel.Squirrel(database=squirrel.Database())
+            sq_serial.add(os.path.join(datadir, 'data'))
+
+            for nprocs in [2, None]:
+                database = squirrel.Database()
+                sq = squirrel.Squirrel(database=database)
+                sq.add(os.path.join(datadir, 'data'), nprocs=nprocs)
+
+                assert sq.get_nfiles() == sq_serial.get_nfiles() == nfiles + 1
+                assert sq.get_nnuts() == sq_serial.get_nnuts() == nfiles
+                assert sorted(sq.get_codes()) \
+                    == sorted(sq_serial.get_codes())
+                assert sq.get_time_span() == sq_serial.get_time_span()
+
+                # all known, nothing to do for the workers
+                sq.add(os.path.join(datadir, 'data'), nprocs=nprocs)
+                assert sq.get_nnuts() == nfiles
+
+                ntr = 0
+                for tr in sq.get_waveforms(uncut=True):
+                    ntr += 1
+                    assert tr.data_len() == nsamples
+
+                assert ntr == nfiles
+
+        finally:
+            shutil.rmtree(datadir)
+
+    def test_add_parallel_order(self):
+        from pyrocko.squirrel.io import base as iobase
+
+        nfiles = 40
+        datadir = self.make_many_files(
+            nfiles, 100, ['xx'], ['S%02i' % i for i in range(10)], ['C0'],
+            1234567890.)
+
+        lookahead = iobase._iload_lookahead
+        try:
+            paths = sorted(
+                op.join(dirpath, fn)
+                for (dirpath, _, fns) in os.walk(datadir)
+                for fn in fns)
+
+            assert len(paths) == nfiles
+
+            database = squirrel.Database()
+            for nut in squirrel.iload(
+                    paths[::3], database=database, content=[]):
+                pass
+
+            iobase._iload_lookahead = 3
+            for _ in range(2):
+                # first partially, then fully indexed
+                file_paths = [
+                    nut.file_path for nut in squirrel.iload(
+                        paths, database=database, content=[], nprocs=2)]
+
+                assert file_paths == paths
+
+        finally:
+            iobase._iload_lookahead = lookahead
+            shutil.rmtree(datadir)
+
+    def test_cache_budget(self):
+        nfiles = 30
+        nsamples = 1000
+
+        stations = ['S%02i' % i for i in range(10)]
+        channels = ['C%01i' % i for i in range(3)]
+        networks = ['xx']
+
+        tmin = 1234567890.
+        datadir = self.make_many_files(
+            nfiles, nsamples, networks, stations, channels, tmin)
+
+        try:
+            sq = squirrel.Squirrel(database=squirrel.Database())
+            sq.add(os.path.join(datadir, 'data'))
+
+            nbytes_trace = nsamples * 8
+            sq.set_cache_max_bytes(5 * nbytes_trace)
+
+            trs = sq.get_waveforms(uncut=True)
+            assert len(trs) == nfiles
+
+            stats = sq.get_cache_stats()
+            assert stats.nbytes <= 5 * nbytes_trace
+            assert stats.nentries == 5
+            assert stats.nmisses == nfiles
+            assert stats.nevictions == nfiles - 5
+
+            # most recently used items are still available
+            trs_recent = sq.get_waveforms(uncut=True, codes=trs[-1].codes)
+            stats = sq.get_cache_stats()
+            assert stats.nhits == len(trs_recent)
+            assert stats.nmisses == nfiles
+
+            sq.set_cache_max_bytes(None)
+            sq.get_waveforms(uncut=True)
+            stats = sq.get_cache_stats()
+            assert stats.nentries == nfiles
+            assert stats.nbytes == nfiles * nbytes_trace
+
+            sq.clear_accessor('default')
+            stats = sq.get_cache_stats()
+            assert stats.nentries == 0
+            assert stats.nbytes == 0
+
+        finally:
+            shutil.rmtree(datadir)
+
+    def test_waveform_array(self):
+        deltat = 0.5
+        tmin = 1234567890.
+        traces = []
+        for sta, toff, n in [
+                ('A', 0., 100),
+                ('A', 60., 100),
+                ('B', 10., 50),
+                ('C', 2.1, 40)]:
+
+            traces.append(trace.Trace(
+                'N', sta, '', 'Z',
+                tmin=tmin + toff, deltat=deltat,
+                ydata=num.arange(n, dtype=num.int32) + 1))
+
+        sq = squirrel.Squirrel()
+        sq.add_volatile_waveforms(traces)
+
+        codes, data, mask = sq.get_waveform_array(
+            tmin=tmin + 5., tmax=tmin + 105., dtype=num.float32)
+
+        assert [c.station for c in codes] == ['A', 'B', 'C']
+        assert data.shape == mask.shape == (3, 200)
+        assert data.dtype == num.float32
+
+        for irow, c in enumerate(codes):
+            trs = sq.get_waveforms(
+                tmin=tmin + 5., tmax=tmin + 105., codes=c, degap=False)
+
+            mask_expect = num.zeros(200, dtype=bool)
+            for tr in trs:
+                i = int(round((tr.tmin - tmin - 5.) / deltat))
+                assert num.all(data[irow, i:i+tr.ydata.size] == tr.ydata)
+                mask_expect[i:i+tr.ydata.size] = True
+
+            assert num.all(mask[irow] == mask_expect)
+            assert num.all(data[irow, ~mask_expect] == 0.)
+
+        # gap between the two A segments
+        assert not num.any(mask[0, 90:110])
+        assert num.all(mask[0, 110:])
+
+        out = num.ones((3, 200))
+        _, data2, _ = sq.get_waveform_array(
+            tmin=tmin + 5., tmax=tmin + 105., out=out)
+
+        assert data2 is out
+        assert num.all(data2 == data)
+
+        with self.assertRaises(squirrel.SquirrelError):
+            sq.get_waveform_array(
+                tmin=tmin + 5., tmax=tmin + 105., out=num.zeros((3, 10)))
+
+        sq.add_volatile_waveforms([trace.Trace(
+            'N', 'D', '', 'Z', tmin=tmin, deltat=1.0,
+            ydata=num.ones(100))])
+
+        with self.assertRaises(squirrel.SquirrelError):
+            sq.get_waveform_array(tmin=tmin, tmax=tmin + 100.)
+
+        codes, data, mask = sq.get_waveform_array(
+            tmin=tmin, tmax=tmin + 100., deltat=1.0)
+
+        assert [c.station for c in codes] == ['D']
+        assert data.shape == (1, 100)
+        assert num.all(mask)
+
+    def test_chopper_filters(self):
+        tmin = util.str_to_time('2020-01-01 00:00:00')
+        deltat = 0.5
+        traces = [
+            trace.Trace(
+                'N', sta, '', 'Z', tmin=tmin, deltat=deltat,
+                ydata=num.random.normal(size=1000))
+            for sta in ('A', 'B')]
+
+        sq = squirrel.Squirrel()
+        sq.add_volatile_waveforms(traces)
+
+        filter = trace.ButterworthFilter(4, corner_hp=0.01, corner_lp=0.1)
+        chopped = defaultdict(list)
+        for batch in sq.chopper_waveforms(
+                tinc=55., filters=[filter]):
+
+            for tr in batch.traces:
+                chopped[tr.station].append(tr)
+
+        for tr in traces:
+            tr = tr.copy()
+            trace.ButterworthFilter(
+                4, corner_hp=0.01, corner_lp=0.1).apply(tr)
+
+            trs = chopped[tr.station]
+            assert len(trs) == 10
+            num.testing.assert_allclose(
+                num.concatenate([tr_.ydata for tr_ in trs]), tr.ydata,
+                atol=1e-12)
+
+        with self.assertRaises(squirrel.SquirrelError):
+            list(sq.chopper_waveforms(
+                tinc=55., tpad=5., filters=[filter]))
+
+        filter.reset()
+        trs = [
+            tr
+            for trs_ in sq.pile.chopper(tinc=55., filters=[filter])
+            for tr in trs_ if tr.station == 'A']
+
+        num.testing.assert_allclose(
+            num.concatenate([tr.ydata for tr in trs]),
+            num.concatenate([tr.ydata for tr in chopped['A']]),
+            atol=1e-12)
+
+    def test_shared(self):
+        nfiles = 20
+        nsamples = 1000
+
+        stations = ['S%02i' % i for i in range(5)]
+        channels = ['C%01i' % i for i in range(3)]
+        networks = ['xx']
+
+        tmin = 1234567890.
+        datadir = self.make_many_files(
+            nfiles, nsamples, networks, stations, channels, tmin)
+
+        database_path = os.path.join(datadir, 'db.squirrel')
+        try:
+            sq = squirrel.Squirrel(database=database_path)
+            with self.assertRaises(squirrel.SquirrelError):
+                sq.share()
+
+            sq = squirrel.Squirrel(
+                database=database_path, persistent='shared')
+            sq.add(os.path.join(datadir, 'data'))
+
+            shared = pickle.loads(pickle.dumps(sq.share()))
+
+            sq_ro = shared.attach()
+            assert sq_ro.is_read_only()
+            assert sq_ro.get_nnuts() == sq.get_nnuts()
+            with self.assertRaises(squirrel.SquirrelError):
+                sq_ro.add(os.path.join(datadir, 'data'))
+
+            del sq_ro
+
+            work = [
+                (shared, tmin + i * 100., tmin + (i+1) * 100.)
+                for i in range(8)]
+
+            results = list(parimap(do_shared, work, nprocs=4))
+            for (_, wmin, wmax), result in zip(work, results):
+                assert result == [
+                    (tr.codes, tr.tmin, tr.ydata.size)
+                    for tr in sq.get_waveforms(tmin=wmin, tmax=wmax)]
+
+            # selection is still intact and usable for writing
+            sq2 = squirrel.Squirrel(
+                database=database_path, persistent='shared')
+            assert not sq2.is_new()
+            assert sq2.get_nnuts() == sq.get_nnuts()
+
+        finally:
+            shutil.rmtree(datadir)
+
+    def test_watch(self):
+        methods = ['poll']
+        if sys.platform.startswith('linux'):
+            methods.append('inotify')
+
+        def make_trace(sta, nsamples):
+            return trace.Trace(
+                'xx', sta, '', 'Z', tmin=1234567890., deltat=1.0,
+                ydata=num.ones(nsamples, dtype=num.int32))
+
+        for method in methods:
+            datadir = tempfile.mkdtemp()
+            try:
+                os.mkdir(op.join(datadir, 'a'))
+                fn_a = op.join(datadir, 'a', 'A.mseed')
+                fn_b = op.join(datadir, 'a', 'B.mseed')
+                io.save([make_trace('A', 100)], fn_a)
+
+                database_path = op.join(datadir, 'db.squirrel')
+                sq = squirrel.Squirrel(database=database_path)
+                watcher = sq.watch(
+                    datadir, exclude=r'\.squirrel', method=method,
+                    poll_interval=0.1)
+
+                assert watcher.get_method() == method
+                assert sq.get_nfiles() == 1
+                assert watcher.update().nchanged == 0
+
+                # new file
+                io.save([make_trace('B', 100)], fn_b)
+                stats = watcher.update(timeout=5.)
+                assert stats.changed == [fn_b]
+                assert sq.get_nfiles() == 2
+                assert sorted(sq.get_codes(kind='waveform')) == [
+                    squirrel.CodesNSLCE('xx', sta, '', 'Z')
+                    for sta in 'AB']
+
+                # modified file
+                time.sleep(0.01)
+                io.save([make_trace('A', 200)], fn_a)
+                stats = watcher.update(timeout=5.)
+                assert stats.changed == [fn_a]
+                trs = sq.get_waveforms(codes='*.A.*.*')
+                assert len(trs) == 1 and trs[0].ydata.size == 200
+
+                # removed file
+                os.unlink(fn_b)
+                stats = watcher.update(timeout=5.)
+                assert stats.removed == [fn_b]
+                assert sq.get_nfiles() == 1
+                assert sq.get_waveforms(codes='*.B.*.*') == []
+
+                # new subdirectory, then removed directory
+                os.mkdir(op.join(datadir, 'b'))
+                fn_c = op.join(datadir, 'b', 'C.mseed')
+                io.save([make_trace('C', 100)], fn_c)
+                watcher.update(timeout=5.)
+                assert sq.get_nfiles() == 2
+
+                shutil.rmtree(op.join(datadir, 'b'))
+                stats = watcher.update(timeout=5.)
+                assert stats.removed == [fn_c]
+                assert sq.get_nfiles() == 1
+
+                watcher.close()
+
+            finally:
+                shutil.rmtree(datadir)
+
+    def test_chopper_prefetch(self):
+        nfiles = 20
+        nsamples = 1000
+
+        stations = ['S%02i' % i for i in range(5)]
+        channels = ['C%01i' % i for i in range(3)]
+        networks = ['xx']
+
+        tmin = 1234567890.
+        datadir = self.make_many_files(
+            nfiles, nsamples, networks, stations, channels, tmin)
+
+        try:
+            sq = squirrel.Squirrel(datadir)
+            sq.add(os.path.join(datadir, 'data'))
+
+            def chop(prefetch, grouping=None):
+                batches = []
+                for batch in sq.chopper_waveforms(
+                        tinc=123., tpad=10., prefetch=prefetch,
+                        grouping=grouping):
+
+                    batches.append([
+                        (tr.codes, tr.tmin, tr.ydata.copy())
+                        for tr in batch.traces])
+
+                return batches
+
+            for grouping in [None, squirrel.StationGrouping()]:
+                batches0 = chop(0, grouping)
+                batches2 = chop(2, grouping)
+                assert len(batches0) == len(batches2)
+                for trs0, trs2 in zip(batches0, batches2):
+                    assert len(trs0) == len(trs2)
+                    for (codes0, tmin0, ydata0), (codes2, tmin2, ydata2) \
+                            in zip(trs0, trs2):
+
+                        assert codes0 == codes2
+                        assert tmin0 == tmin2
+                        assert num.all(ydata0 == ydata2)
+
+            assert not sq._prefetchers
+
+            # consumer stops early
+            for batch in sq.chopper_waveforms(tinc=123., prefetch=3):
+                break
+
+            del batch
+            assert not sq._prefetchers
+
+        finally:
+            shutil.rmtree(datadir)
+
+    def test_decoded_cache(self):
+        nfiles = 10
+        nsamples = 1000
+
+        stations = ['S%02i' % i for i in range(10)]
+        channels = ['C%01i' % i for i in range(3)]
+        networks = ['xx']
+
+        tmin = 1234567890.
+        datadir = self.make_many_files(
+            nfiles, nsamples, networks, stations, channels, tmin)
+
+        cache_path = os.path.join(datadir, 'cache')
+        database_path = os.path.join(datadir, 'db.squirrel')
+
+        def get_waveforms():
+            sq = squirrel.Squirrel(
+                database=database_path,
+                cache_path=cache_path,
+                decoded_cache=True)
+
+            sq.add(os.path.join(datadir, 'data'))
+            trs = sq.get_waveforms(uncut=True)
+            return trs, sq.get_decoded_cache_stats()
+
+        try:
+            trs1, stats = get_waveforms()
+            assert stats.nmisses == nfiles
+            assert stats.nstores == nfiles
+
+            trs2, stats = get_waveforms()
+            assert stats.nhits == nfiles
+            assert stats.nstores == 0
+
+            assert len(trs1) == len(trs2) == nfiles
+            for tr1, tr2 in zip(trs1, trs2):
+                assert tr1.codes == tr2.codes
+                assert tr1.tmin == tr2.tmin
+                assert num.all(tr1.ydata == tr2.ydata)
+
+            # cached arrays are copy-on-write
+            trs2[0].ydata[:] = 0
+
+            time.sleep(1.1)  # make sure modification time is different
+            path = sorted(
+                os.path.join(datadir, 'data', fn)
+                for fn in os.listdir(os.path.join(datadir, 'data')))[0]
+
+            tr = io.load(path)[0]
+            tr.set_ydata(tr.ydata * 2)
+            io.save([tr], path)
+
+            trs3, stats = get_waveforms()
+            assert stats.ninvalidated == 1
+            assert stats.nhits == nfiles - 1
+            assert sum(num.all(tr.ydata == 2) for tr in trs3) == 1
+            assert sum(num.all(tr.ydata == 1) for tr in trs3) == nfiles - 1
+
+        finally:
+            shutil.rmtree(datadir)
+
     def test_add_waveforms(self):
         traces = []
 
@@ -1230,6 +1910,85 @@ class SquirrelTestCase(unittest.TestCase):
         assert len(sq.get_waveforms(tmin=tmin, tmax=tmax)) == 0
 
 
+class FakeFDSNHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Local stand-in for an FDSN dataselect service.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_empty(404)
+
+    def do_POST(self):
+        post = self.rfile.read(
+            int(self.headers['Content-Length'])).decode('utf8')
+
+        stats = self.server.stats
+        with self.server.lock:
+            stats['nrequests'] += 1
+            stats['connections'].add(self.client_address)
+            if stats['nfail'] > 0:
+                stats['nfail'] -= 1
+                fail = True
+            else:
+                fail = False
+                stats['nactive'] += 1
+                stats['nactive_max'] = max(
+                    stats['nactive_max'], stats['nactive'])
+
+        if fail:
+            self.send_empty(503)
+            return
+
+        try:
+            time.sleep(0.2)
+            traces = []
+            for line in post.splitlines():
+                if '=' in line:
+                    continue
+
+                net, sta, loc, cha, ts1, ts2 = line.split()
+                tmin = util.str_to_time(ts1, format='%Y-%m-%dT%H:%M:%S')
+                tmax = util.str_to_time(ts2, format='%Y-%m-%dT%H:%M:%S')
+                traces.append(trace.Trace(
+                    net, sta, '' if loc == '--' else loc, cha,
+                    tmin=tmin, deltat=1.0,
+                    ydata=num.ones(int(round(tmax - tmin)), dtype=num.int32)))
+
+            with tempfile.TemporaryDirectory() as tempdir:
+                fn = os.path.join(tempdir, 'data.mseed')
+                io.save(traces, fn, format='mseed')
+                with open(fn, 'rb') as f:
+                    data = f.read()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.fdsn.mseed')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        finally:
+            with self.server.lock:
+                stats['nactive'] -= 1
+
+
+def do_shared(params):
+    shared, tmin, tmax = params
+    sq = shared.attach()
+    return [
+        (tr.codes, tr.tmin, tr.ydata.size)
+        for tr in sq.get_waveforms(tmin=tmin, tmax=tmax)]
+
+
 def do_chopper(params):
     ijob, datadir, nfiles, nsamples, tmin, (grouping, mult) = params
 
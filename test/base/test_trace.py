@@ -635,6 +635,48 @@ class TraceTestCase(unittest.TestCase):
             raise unittest.SkipTest(
                 'not supported on installed scipy version')
 
+    def testStatefulFilter(self):
+        y = num.random.normal(size=1000)
+        deltat = 0.1
+
+        def pieces(tmin=sometime):
+            return [trace.Trace(
+                tmin=tmin+i*deltat*100,
+                deltat=deltat,
+                ydata=y[i*100:(i+1)*100]) for i in range(10)]
+
+        a = trace.Trace(tmin=sometime, deltat=deltat, ydata=y)
+        a.lowpass(4, 1.0, demean=False)
+        filter = trace.ButterworthFilter(4, corner_lp=1.0)
+        bs = pieces()
+        for b in bs:
+            filter.apply(b)
+
+        num.testing.assert_allclose(
+            num.concatenate([b.ydata for b in bs]), a.ydata, atol=1e-12)
+
+        for kwargs in [
+                dict(corner_hp=0.1),
+                dict(corner_hp=0.1, corner_lp=1.0),
+                dict(corner_hp=0.1, corner_lp=1.0, bandstop=True)]:
+
+            a = trace.Trace(tmin=sometime, deltat=deltat, ydata=y)
+            trace.ButterworthFilter(4, **kwargs).apply(a)
+
+            filter = trace.ButterworthFilter(4, **kwargs)
+            bs = pieces()
+            for b in bs:
+                filter.apply(b)
+
+            num.testing.assert_allclose(
+                num.concatenate([b.ydata for b in bs]), a.ydata, atol=1e-12)
+
+            # state is reset at gaps
+            cs = pieces(tmin=sometime+deltat*1200)
+            filter.apply(cs[0])
+            num.testing.assert_allclose(
+                cs[0].ydata, a.ydata[:100], atol=1e-12)
+
     def testEqualizeSamplingRates(self):
         y = num.random.random(1000)
         t1 = trace.Trace(tmin=0, ydata=y, deltat=0.01)
@@ -1,6 +1,7 @@
 
 import time
 import sys
+import os
 import random
 import math
 import unittest
@@ -400,6 +401,153 @@ class GFTestCase(unittest.TestCase):
 
         store.close()
 
+    def test_record_cache(self):
+        store_dir = self.get_pulse_store_dir()
+        store_mm = gf.Store(store_dir)
+        cache_max_bytes = 200000
+        store = gf.Store(
+            store_dir, use_memmap=False, cache_max_bytes=cache_max_bytes)
+
+        nodes = list(store.config.iter_nodes())[::7]
+        for repeat in range(2):
+            for args in nodes:
+                tra = store_mm.get(args)
+                trb = store.get(args)
+                self.assertEqual(tra.itmin, trb.itmin)
+                assert_ae(tra.data, trb.data)
+
+        assert store_mm.stats()['cache'] is None
+
+        stats = store.stats()['cache']
+        assert stats['size_max'] == cache_max_bytes
+        assert 0 < stats['size'] <= cache_max_bytes
+        assert stats['evictions'] > 0
+
+        store.get(nodes[-1])
+        assert store.stats()['cache']['hits'] == stats['hits'] + 1
+
+        dsource = gf.DiscretizedExplosionSource(
+            times=num.array([0.0, 0.01]),
+            north_shifts=num.array([0., 10.]),
+            east_shifts=num.array([0., 0.]),
+            depths=num.array([300., 310.]),
+            m0s=num.array([1., 2.]))
+
+        receivers = [
+            gf.Receiver(north_shift=float(d), east_shift=0., depth=0.)
+            for d in range(50, 950, 30)]
+
+        components = store.get_provided_components()
+        for interpolation in ('nearest_neighbor', 'multilinear'):
+            res_a = store_mm.calc_seismograms(
+                dsource, receivers, components,
+                interpolation=interpolation)
+
+            res_b = store.calc_seismograms(
+                dsource, receivers, components,
+                interpolation=interpolation, nthreads=0)
+
+            for a, b in zip(res_a, res_b):
+                for component in components:
+                    self.assertEqual(a[component].itmin, b[component].itmin)
+                    assert_ae(a[component].data, b[component].data)
+
+        assert store.stats()['cache']['size'] <= cache_max_bytes
+
+        store.set_cache_max_bytes(1000)
+        assert store.stats()['cache']['size'] <= 1000
+
+        store.close()
+        store_mm.close()
+
+    def test_compressed_store(self):
+        store_dir = self.get_pulse_store_dir()
+        store = gf.Store(store_dir)
+        nodes = list(store.config.iter_nodes())[::37]
+        components = store.get_provided_components()
+
+        dsource = gf.DiscretizedExplosionSource(
+            times=num.array([0.0, 0.01]),
+            north_shifts=num.array([0., 10.]),
+            east_shifts=num.array([0., 0.]),
+            depths=num.array([300., 310.]),
+            m0s=num.array([1., 2.]))
+
+        receivers = [
+            gf.Receiver(north_shift=float(d), east_shift=0., depth=0.)
+            for d in range(50, 950, 30)]
+
+        res_ref = store.calc_seismograms(dsource, receivers, components)
+
+        for compression, max_error in [
+                ('lossless', None), ('lossy', 1e-4), (None, None)]:
+
+            tempdir = mkdtemp(prefix='gfstore_f')
+            self.tempdirs.append(tempdir)
+            store_dir_c = os.path.join(tempdir, 'store')
+            store.make_compressed(
+                store_dir_c, compression=compression, max_error=max_error)
+
+            for use_memmap in (True, False):
+                store_c = gf.Store(store_dir_c, use_memmap=use_memmap)
+                assert store_c.compression == compression
+                if compression == 'lossy':
+                    assert store_c.size_data < store.size_data
+
+                for args in nodes:
+                    tra = store.get(args)
+                    for implementation in ('c', 'python'):
+                        trb = store_c.get(args, implementation=implementation)
+                        self.assertEqual(tra.itmin, trb.itmin)
+                        self.assertEqual(tra.data.size, trb.data.size)
+                        if compression == 'lossy':
+                            amax = num.max(num.abs(tra.data), initial=0.)
+                            assert num.all(
+                                num.abs(tra.data - trb.data)
+                                <= max_error * amax * 1.001)
+
+                            if trb.data.size:
+                                assert trb.begin_value == trb.data[0]
+                                assert trb.end_value == trb.data[-1]
+                        else:
+                            assert_ae(tra.data, trb.data)
+
+                res = store_c.calc_seismograms(dsource, receivers, components)
+                for a, b in zip(res_ref, res):
+                    for component in components:
+                        self.assertEqual(
+                            a[component].itmin, b[component].itmin)
+
+                        if compression == 'lossy':
+                            assert num.allclose(
+                                a[component].data, b[component].data,
+                                rtol=0., atol=1e-3 * num.max(
+                                    num.abs(a[component].data)))
+                        else:
+                            assert_ae(a[component].data, b[component].data)
+
+                stats = store_c.get_cache_stats()
+                if compression is not None:
+                    assert stats['size_max'] \
+                        == gf.store.gf_compressed_cache_max_bytes_default
+
+                    store_c.set_cache_max_bytes(0)
+                    assert store_c.get_cache_stats()['size_max'] == 0
+                    store_c.set_cache_max_bytes(None)
+                    assert store_c.get_cache_stats()['size_max'] \
+                        == gf.store.gf_compressed_cache_max_bytes_default
+
+                elif not use_memmap:
+                    assert stats['size_max'] == 0
+
+                store_c.close()
+
+            if compression is not None:
+                store_c = gf.Store(store_dir_c, cache_max_bytes=100000)
+                store_c.get(nodes[0])
+                assert store_c.get_cache_stats()['size_max'] == 100000
+                store_c.close()
+
     def test_sum(self):
 
         nrecords = 8
@@ -489,6 +637,62 @@ class GFTestCase(unittest.TestCase):
 
         store.close()
 
+    def test_calc_timeseries_source_offsets_errors(self):
+
+        nrecords = 8
+        store = gf.BaseStore(self.create(nrecords=nrecords))
+
+        from pyrocko.gf import store_ext
+        store.open()
+
+        store_ext.store_mapping_init(
+            store.cstore, 'type_0',
+            arr([0]), arr([nrecords-1]), arr([1]),
+            num.array([nrecords], dtype=num.uint64),
+            1)
+
+        n = 3
+        source_coords = num.zeros((n, 5))
+        source_coords[:, 4] = num.arange(n)
+        receiver_coords = num.zeros((1, 5))
+        source_terms = num.ones((n, 1))
+        shifts = num.zeros(n)
+
+        def calc(source_offsets):
+            return store_ext.store_calc_timeseries(
+                store.cstore,
+                source_coords,
+                source_terms,
+                shifts,
+                receiver_coords,
+                'dummy',
+                'nearest_neighbor',
+                num.zeros(2, dtype=num.int32),
+                num.full(2, -1, dtype=num.int32),
+                1,
+                source_offsets)
+
+        results = calc(num.array([0, 1, n], dtype=num.uint64))
+        assert len(results) == 2
+
+        for source_offsets, message in [
+                (num.array([0, n], dtype=num.int64),
+                 'unhealthy source_offsets array'),
+                (num.array([], dtype=num.uint64),
+                 'must not be empty'),
+                (num.array([0, n-1], dtype=num.uint64),
+                 'must start with 0 and end with the number of sources'),
+                (num.array([0, 2, 1, n], dtype=num.uint64),
+                 'must be non-decreasing')]:
+
+            with self.assertRaises(store_ext.StoreExtError) as cm:
+                calc(source_offsets)
+
+            assert str(cm.exception).startswith('w_store_calc_timeseries: ')
+            assert message in str(cm.exception)
+
+        store.close()
+
     def _test_sum_statics(self):
 
         nrecords = 20
@@ -993,6 +1197,109 @@ class GFTestCase(unittest.TestCase):
             ph = store.get_stored_phase(phase_id + '.lsd')
             assert not ph.check_holes()
 
+    def test_stored_table_incremental(self):
+        def make_store(tabulated_phases):
+            conf = gf.ConfigTypeA(
+                id='empty_ttt',
+                source_depth_min=0.,
+                source_depth_max=20*km,
+                source_depth_delta=10*km,
+                distance_min=10*km,
+                distance_max=500*km,
+                distance_delta=10*km,
+                sample_rate=2.0,
+                ncomponents=10,
+                earthmodel_1d=cake.load_model(),
+                tabulated_phases=[
+                    gf.TPDef(id=id, definition=defi)
+                    for (id, defi) in tabulated_phases])
+
+            store_dir = mkdtemp(prefix='gfstore_c')
+            self.tempdirs.append(store_dir)
+            gf.Store.create(store_dir, config=conf)
+            return store_dir
+
+        def read(store, phase_id):
+            with open(store.phase_filename(phase_id), 'rb') as f:
+                return f.read()
+
+        store_dir_ref = make_store([('P', 'P')])
+        store_ref = gf.Store(store_dir_ref)
+        store_ref.make_travel_time_tables(nprocs=1)
+
+        store_dir = make_store([('P', 'P')])
+        store = gf.Store(store_dir)
+        store.make_travel_time_tables(nprocs=2)
+        assert read(store, 'P') == read(store_ref, 'P')
+
+        fn_p = store.phase_filename('P')
+        mtime_p = os.stat(fn_p).st_mtime_ns
+
+        store.config.tabulated_phases.append(gf.TPDef(id='S', definition='S'))
+        store.save_config(make_backup=True)
+        store = gf.Store(store_dir)
+        store.make_travel_time_tables(nprocs=2)
+        assert os.stat(fn_p).st_mtime_ns == mtime_p
+        assert store.get_stored_phase('S')(
+            (10*km, 100*km)) > store.get_stored_phase('P')((10*km, 100*km))
+
+        t_p = store.t('{stored:P}', (10*km, 100*km))
+        store.config.tabulated_phases[0].definition = 'S'
+        store.save_config(make_backup=True)
+        store = gf.Store(store_dir)
+        store.make_travel_time_tables(nprocs=2)
+        assert os.stat(fn_p).st_mtime_ns != mtime_p
+        assert read(store, 'P') == read(store, 'S')
+        assert store.t('{stored:P}', (10*km, 100*km)) > t_p
+
+    def test_sptree_flat(self):
+        from pyrocko import spit
+
+        def f(x):
+            x = num.asarray(x)
+            if num.sum((x - 0.5)**2) < 0.25:
+                return x[2]**4 + x[1]
+
+            return None
+
+        tree = spit.SPTree(
+            f, 0.01, [[0., 1.], [0., 1.], [0., 1.]], [0.05, 0.1, 0.2])
+
+        xs = num.random.random((5000, 3))
+        vs_cells = tree.root.interpolate_many(xs)
+        vs = tree.interpolate_many(xs)
+        assert num.all(num.isnan(vs) == num.isnan(vs_cells))
+        ok = num.isfinite(vs)
+        assert num.any(ok)
+        num.testing.assert_allclose(vs[ok], vs_cells[ok], rtol=1e-12)
+
+        for x in xs[:100]:
+            v = tree.interpolate(x)
+            v_cells = tree.root.interpolate(x)
+            if v_cells is None:
+                assert v is None
+            else:
+                assert abs(v - v_cells) < 1e-12
+
+        assert num.all(num.isnan(tree.interpolate_many(xs + 2.0)))
+
+        d = mkdtemp(prefix='pyrocko')
+        self.tempdirs.append(d)
+        fn = os.path.join(d, 'tree')
+        tree.dump(fn)
+
+        tree2 = spit.SPTree(filename=fn)
+        assert tree2.check_holes() == tree.root.check_holes()
+        assert num.array_equal(tree2.interpolate_many(xs), vs, equal_nan=True)
+        assert len(list(tree2)) == len(tree)
+        num.testing.assert_equal(
+            tree2.root.interpolate_many(xs), vs_cells)
+
+        fn2 = os.path.join(d, 'tree2')
+        tree2.dump(fn2)
+        with open(fn, 'rb') as f1, open(fn2, 'rb') as f2:
+            assert f1.read() == f2.read()
+
     def test_interpolated_attribute(self):
         from time import time
         attribute = 'takeoff_angle'
@@ -1384,6 +1691,154 @@ class GFTestCase(unittest.TestCase):
 
             num.testing.assert_equal(disp1, disp2)
 
+    def test_process_timeseries_many_sources(self):
+        store_dir = self.get_pulse_store_dir()
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+
+        sources = [
+            gf.ExplosionSource(
+                time=time,
+                depth=depth,
+                moment=moment,
+                stf=gf.BoxcarSTF(duration=0.05))
+
+            for time in (0.0, 0.23, 1.7)
+            for depth in (150., 300.)
+            for moment in (1., 2.)
+        ]
+
+        targets = [
+            gf.Target(
+                codes=('', 'ST%i' % ista, '', component),
+                north_shift=north_shift,
+                east_shift=200.,
+                interpolation=interpolation,
+                tmin=tmin,
+                tmax=None if tmin is None else tmin + 0.5)
+
+            for component in 'ZNE'
+            for ista, north_shift in enumerate((300., 700.))
+            for interpolation in ('nearest_neighbor', 'multilinear')
+            for tmin in (None, 0.4)
+        ]
+
+        response = engine.process(
+            sources=sources, targets=targets, nthreads=0)
+
+        response_sum = engine.process(
+            sources=sources, targets=targets, calc_timeseries=False,
+            nthreads=0)
+
+        for (_, _, tr), (_, _, tr_sum) in zip(
+                response.iter_results(), response_sum.iter_results()):
+
+            self.assertEqual(tr.tmin, tr_sum.tmin)
+            num.testing.assert_equal(tr.get_ydata(), tr_sum.get_ydata())
+
+        for isource, source in enumerate(sources):
+            response_single = engine.process(
+                sources=[source], targets=targets, nthreads=0)
+
+            for result, result_s in zip(
+                    response.results_list[isource],
+                    response_single.results_list[0]):
+
+                tr = result.trace.pyrocko_trace()
+                tr_s = result_s.trace.pyrocko_trace()
+                self.assertEqual(tr.tmin, tr_s.tmin)
+                num.testing.assert_equal(tr.get_ydata(), tr_s.get_ydata())
+
+    def test_dsource_cache(self):
+        store_dir = self.get_pulse_store_dir()
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+
+        def make_sources():
+            return [
+                gf.ExplosionSource(
+                    time=0.1,
+                    depth=depth,
+                    moment=1.0,
+                    stf=gf.HalfSinusoidSTF(duration=0.1))
+                for depth in (100., 200., 300.)]
+
+        targets = [
+            gf.Target(
+                codes=('', 'STA', '', component),
+                north_shift=500.,
+                east_shift=100.)
+            for component in 'ZNE']
+
+        response1 = engine.process(make_sources(), targets)
+        self.assertEqual(response1.stats.n_discretize_source, 3)
+        self.assertEqual(response1.stats.n_discretize_source_cached, 0)
+
+        response2 = engine.process(make_sources(), targets)
+        self.assertEqual(response2.stats.n_discretize_source, 0)
+        self.assertEqual(response2.stats.n_discretize_source_cached, 3)
+
+        for tr1, tr2 in zip(
+                response1.pyrocko_traces(), response2.pyrocko_traces()):
+            num.testing.assert_equal(tr1.ydata, tr2.ydata)
+
+        sources = make_sources()
+        sources[0].depth = 150.
+        sources[1].stf.duration = 0.2
+        response3 = engine.process(sources, targets)
+        self.assertEqual(response3.stats.n_discretize_source, 2)
+        self.assertEqual(response3.stats.n_discretize_source_cached, 1)
+
+        stats = engine.get_dsource_cache_stats()
+        self.assertEqual(stats['entries'], 5)
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 5)
+
+        engine.dsource_cache_max_bytes = 1
+        response4 = engine.process(make_sources(), targets)
+        self.assertEqual(response4.stats.n_discretize_source, 3)
+        stats = engine.get_dsource_cache_stats()
+        self.assertEqual(stats['entries'], 1)
+        assert stats['evictions'] > 0
+
+        engine.dsource_cache_max_bytes = 0
+        engine.process(make_sources(), targets)
+        self.assertEqual(engine.get_dsource_cache_stats()['entries'], 0)
+
+    def test_dsource_cache_rupture(self):
+        from pyrocko.gf.seismosizer import DiscretizedSourceCache, \
+            DiscretizedSourceRequestCache
+
+        store_dir = self.get_regional_ttt_store_dir()
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+        store = engine.get_store('empty_regional')
+        target = gf.Target(north_shift=100*km, east_shift=10*km)
+
+        source = gf.PseudoDynamicRupture(
+            depth=10*km, length=4*km, width=2*km, slip=1.0,
+            strike=0., dip=90., rake=0., nx=2, ny=2,
+            anchor='top', decimation_factor=1)
+
+        shared = DiscretizedSourceCache()
+
+        def request(source):
+            cache = DiscretizedSourceRequestCache(shared=shared)
+            cache.get(source, store, target)
+            return cache.n_discretize, cache.n_discretize_cached
+
+        self.assertEqual(request(source), (1, 0))
+
+        # discretization has filled in derived attributes of the source,
+        # which must not change its cache key
+        assert source.patches is not None
+        assert source.coef_mat is not None
+
+        self.assertEqual(request(source), (0, 1))
+        self.assertEqual(request(source.clone(nthreads=2)), (0, 1))
+        self.assertEqual(request(source.clone(slip=2.0)), (1, 0))
+
+        stats = shared.get_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+
     def _test_homogeneous_scenario(
             self,
             config_type_class,
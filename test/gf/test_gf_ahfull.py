@@ -1,4 +1,6 @@
 import sys
+import os
+import time
 import random  # noqa
 import math
 import unittest
@@ -61,6 +63,66 @@ class GFAhfullTestCase(unittest.TestCase):
         store.make_travel_time_tables()
         ahfullgreen.build(d)
 
+    def test_build_queue(self):
+        d_ref = mkdtemp(prefix='gfstore')
+        d = mkdtemp(prefix='gfstore')
+        self.tempdirs.extend([d_ref, d])
+
+        config_params = dict(source_depth_max=5*km, distance_max=10*km)
+        for d_ in (d_ref, d):
+            ahfullgreen.init(d_, None, config_params=config_params)
+
+        ahfullgreen.build(d_ref)
+
+        # simulate two workers, which claimed some blocks and died
+        def new_queue():
+            return gf.BuildQueue(d, lease_timeout=1.0, poll_interval=0.1)
+
+        q0 = new_queue()
+        assert q0.create()
+        gf.Store.create_dependants(d)
+        builder = ahfullgreen.AhfullGFBuilder(d, 0, {})
+        nblocks = builder.nblocks
+        q0.setup([nblocks])
+        assert not new_queue().create()
+
+        q1 = new_queue()
+        ib0 = next(q0.iter_claims(0, nblocks))
+        ib1 = next(q1.iter_claims(0, nblocks))
+        assert ib0 != ib1
+        builder.work_block(ib0)
+        builder.cleanup()
+        q0.complete(0, ib0)
+
+        progress = q0.get_progress()
+        assert progress[0]['ndone'] == 1
+        assert progress[0]['nleased'] == 1
+
+        t = time.time() - 10.
+        os.utime(q1._lease_path(0, ib1), (t, t))
+        progress = q0.get_progress()
+        assert progress[0]['nleased'] == 0
+        assert progress[0]['nstale'] == 1
+
+        # stale lease taken over, the slow worker must not release it
+        q2 = new_queue()
+        assert q2._claim(0, ib1)
+        q1.release(0, ib1)
+        assert q0.get_leases(0)[ib1][0] == q2.worker_id
+        q2.release(0, ib1)
+        assert ib1 not in q0.get_leases(0)
+
+        ahfullgreen.build(d, nworkers=1, queue=new_queue())
+        assert not os.path.exists(q0.queue_dir)
+
+        store_ref = gf.Store(d_ref)
+        store = gf.Store(d)
+        for args in list(store.config.iter_nodes())[::7]:
+            tr_ref = store_ref.get(args)
+            tr = store.get(args)
+            assert tr.itmin == tr_ref.itmin
+            num.testing.assert_equal(tr.data, tr_ref.data)
+
 
 if __name__ == '__main__':
     util.setup_logging('test_gf_ahfull', 'warning')
@@ -186,6 +186,29 @@ class GFBenchmarkTest(unittest.TestCase):
                 for nt in ntargets:
                     test_weights_bench(store, d, nt, interpolation)
 
+    def test_stf_convolution_benchmark(self):
+        from pyrocko.gf.seismosizer import convolve_stf
+        benchmark.show_factor = True
+
+        nrepeat = 5
+        for ndata in [1000, 10000]:
+            data = random.random(ndata)
+            for namp in [10, 100, 1000, 5000]:
+                amplitudes = random.random(namp)
+                for method in ['direct', 'fft', 'auto']:
+                    label = 'convolve_stf_nd%05d_na%04d_%s' % (
+                        ndata, namp, method)
+
+                    @benchmark.labeled(label)
+                    def run():
+                        for _ in range(nrepeat):
+                            convolve_stf(amplitudes, data, method=method)
+
+                    run()
+
+                print(benchmark.__str__(header=False))
+                benchmark.clear()
+
 
 if __name__ == '__main__':
     util.setup_logging('test_gf', 'warning')
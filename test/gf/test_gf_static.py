@@ -486,6 +486,86 @@ mantle
         for static in statics:
             assert len(static.campaign.stations) == nstations
 
+    def test_static_gf_matrix(self):
+        engine = gf.LocalEngine(store_dirs=[self.get_store_dir('pscmp')])
+        store = engine.get_store('psgrn_pscmp_test')
+
+        rupture = gf.PseudoDynamicRupture(
+            lat=0., lon=0.,
+            north_shift=1.*km, east_shift=-2.*km, depth=3.*km,
+            length=6.*km, width=3.*km,
+            strike=30., dip=60., rake=0.,
+            slip=1., nx=4, ny=3,
+            anchor='top')
+
+        rupture.discretize_patches(store)
+        patches = rupture.patches
+
+        north_shifts, east_shifts = [
+            a.ravel() for a in num.meshgrid(
+                num.linspace(-15.*km, 15.*km, 7),
+                num.linspace(-15.*km, 15.*km, 6))]
+
+        nlocations = north_shifts.size
+        coords = dict(
+            lats=num.zeros(nlocations),
+            lons=num.zeros(nlocations),
+            north_shifts=north_shifts,
+            east_shifts=east_shifts)
+
+        targets = [
+            gf.StaticTarget(**coords),
+            gf.SatelliteTarget(
+                theta=num.full(nlocations, 0.3),
+                phi=num.full(nlocations, 1.2),
+                interpolation='multilinear',
+                **coords),
+            gf.GNSSCampaignTarget(**coords)]
+
+        slip_components = ('strike', 'dip', 'tensile')
+
+        fn = os.path.join(mkdtemp(prefix='gfmatrix'), 'g.npy')
+        self.tempdirs.append(os.path.dirname(fn))
+
+        gf_matrix = engine.make_static_gf_matrix(
+            patches, targets, slip_components=slip_components,
+            nthreads=0, filename=fn)
+
+        assert gf_matrix.shape == (7 * nlocations, 3 * len(patches))
+        num.testing.assert_equal(num.load(fn), gf_matrix)
+
+        slip_params = [
+            dict(rake=0.), dict(rake=90.),
+            dict(rake=0., opening_fraction=1.)]
+
+        icol = 0
+        for params in slip_params:
+            for patch in patches:
+                source = gf.RectangularSource(
+                    lat=patch.lat, lon=patch.lon,
+                    north_shift=patch.north_shift,
+                    east_shift=patch.east_shift,
+                    depth=patch.depth,
+                    strike=patch.strike, dip=patch.dip,
+                    length=patch.length, width=patch.width,
+                    anchor='center', slip=1., **params)
+
+                res_static, res_sat, res_gnss = \
+                    engine.process(source, targets).static_results()
+
+                col = num.concatenate(
+                    [res_static.result['displacement.%s' % c]
+                     for c in 'ned']
+                    + [res_sat.result['displacement.los']]
+                    + [res_gnss.result['displacement.n'],
+                       res_gnss.result['displacement.e'],
+                       -res_gnss.result['displacement.d']])
+
+                num.testing.assert_allclose(
+                    gf_matrix[:, icol], col, rtol=1e-6, atol=0.)
+
+                icol += 1
+
     def test_new_static(self):
         from pyrocko.gf import store_ext
         benchmark.show_factor = True
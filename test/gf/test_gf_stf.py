@@ -105,6 +105,31 @@ class GFSTFTestCase(unittest.TestCase):
             edur = num.sqrt(num.sum((t-t0)**2 * a)) * 2. * num.sqrt(3.)
             assert abs(edur - stf.effective_duration) < 1e-3
 
+    def test_convolve_stf(self):
+        from pyrocko.gf.seismosizer import convolve_stf
+
+        deltat = 0.1
+        data = num.random.random(3000)
+        for stf in [
+                gf.STF(),
+                gf.BoxcarSTF(duration=1.0),
+                gf.BoxcarSTF(duration=200.0),
+                gf.TremorSTF(duration=300.0, frequency=0.5)]:
+
+            _, amplitudes = stf.discretize_t(deltat, 0.0)
+            d_direct = convolve_stf(amplitudes, data, method='direct')
+            d_fft = convolve_stf(amplitudes, data, method='fft')
+            d_auto = convolve_stf(amplitudes, data)
+
+            assert d_direct.size == data.size + amplitudes.size - 1
+            num.testing.assert_allclose(
+                d_fft, d_direct, rtol=0., atol=1e-9 * num.abs(d_direct).max())
+            num.testing.assert_equal(
+                d_auto, d_fft if amplitudes.size > 1000 else d_direct)
+
+        with self.assertRaises(ValueError):
+            convolve_stf(amplitudes, data, method='spectral')
+
     def test_objects(self):
         for stf_class in gf.seismosizer.stf_classes:
             if stf_class in (
@@ -2,19 +2,25 @@ import unittest
 import shutil
 import os
 import sys
+import time
+import socket
 import threading
 import logging
 import tempfile
+import subprocess
 
-from pyrocko.gf import LocalEngine, store, ws
-from pyrocko import util
+import numpy as num
+import requests
+
+from pyrocko.gf import LocalEngine, RemoteEngine, store, ws
+from pyrocko import gf, util
 from pyrocko.fomosto import ahfullgreen
 
 op = os.path
+km = 1e3
 logger = logging.getLogger('pyrocko.test.test_gf_ws')
 
 
-@unittest.skipIf(sys.version_info[:2] >= (3, 12), 'requires Python < 3.12')
 class GFWSTestCase(unittest.TestCase):
 
     @classmethod
@@ -38,37 +44,182 @@ class GFWSTestCase(unittest.TestCase):
         shutil.rmtree(cls.serve_dir)
         shutil.rmtree(cls.dl_dir)
 
-    def test_local_server(self):
+    def start_server(self, engine=None, **kwargs):
         from pyrocko.gf import server
 
-        class ServerThread(threading.Thread):
-            def __init__(self, serve_dir):
-                threading.Thread.__init__(self)
-                self.engine = LocalEngine(
-                    store_dirs=[serve_dir])
-                self.s = server.Server(
-                    'localhost', 32483, server.SeismosizerHandler, self.engine)
+        if engine is None:
+            engine = LocalEngine(store_dirs=[self.serve_dir])
 
-            def run(self):
-                import asyncore
-                asyncore.loop(1., use_poll=True)
+        s = server.Server(
+            'localhost', 0, server.SeismosizerHandler, engine, **kwargs)
 
-        t_ws = ServerThread(self.serve_dir)
+        t_ws = threading.Thread(target=s.run)
         t_ws.start()
+        return s, t_ws, 'http://localhost:%i' % s.port
+
+    def stop_server(self, s, t_ws):
+        s.close()
+        t_ws.join(5.)
+        assert not t_ws.is_alive()
+
+    def test_local_server(self):
+        s, t_ws, site = self.start_server()
 
         try:
             ws.download_gf_store(
-                site='http://localhost:32483',
+                site=site,
                 store_id=self.store_id,
                 quiet=False)
             gfstore = store.Store(self.store_id)
             gfstore.check()
 
         finally:
-            # import time
-            # time.sleep(100)
-            t_ws.s.close()
-            t_ws.join(1.)
+            self.stop_server(s, t_ws)
+
+    def test_remote_engine(self):
+        s, t_ws, site = self.start_server(nworkers=2)
+
+        try:
+            source = gf.DCSource(
+                lat=0., lon=0., depth=5*km, strike=30., dip=60., rake=-20.)
+
+            targets = [
+                gf.Target(
+                    quantity='displacement',
+                    codes=('', 'S%i' % i, '', c),
+                    north_shift=i*3*km,
+                    east_shift=2*km,
+                    store_id=self.store_id)
+                for i in range(1, 4) for c in 'NEZ']
+
+            engine_remote = RemoteEngine(site=site)
+            engine_local = LocalEngine(store_dirs=[self.serve_dir])
+
+            responses = []
+            threads = [
+                threading.Thread(
+                    target=lambda: responses.append(engine_remote.process(
+                        sources=[source], targets=targets)))
+                for _ in range(3)]
+
+            for t in threads:
+                t.start()
+
+            for t in threads:
+                t.join()
+
+            resp_local = engine_local.process(
+                sources=[source], targets=targets)
+            assert len(responses) == 3
+            for resp_remote in responses:
+                for tr_r, tr_l in zip(
+                        resp_remote.pyrocko_traces(),
+                        resp_local.pyrocko_traces()):
+
+                    assert tr_r.nslc_id == tr_l.nslc_id
+                    assert abs(tr_r.tmin - tr_l.tmin) < tr_l.deltat * 1e-3
+                    num.testing.assert_equal(tr_r.ydata, tr_l.ydata)
+
+            url = ws.fillurl(ws.g_url, site, 'seismosizer', 1)
+            r = requests.post(url, data={'request': 'garbage'})
+            assert r.status_code == 400
+
+            target_far = gf.Target(
+                north_shift=100*km, store_id=self.store_id)
+            r = requests.post(url, data={'request': gf.Request(
+                sources=[source], targets=[target_far]).dump()})
+            assert r.status_code == 400
+
+        finally:
+            self.stop_server(s, t_ws)
+
+    def test_server_busy(self):
+
+        class BlockingEngine(LocalEngine):
+            def __init__(self, *args, **kwargs):
+                LocalEngine.__init__(self, *args, **kwargs)
+                self.started = threading.Event()
+                self.unblock = threading.Event()
+
+            def process(self, *args, **kwargs):
+                self.started.set()
+                self.unblock.wait(10.)
+                return LocalEngine.process(self, *args, **kwargs)
+
+        engine = BlockingEngine(store_dirs=[self.serve_dir])
+        s, t_ws, site = self.start_server(
+            engine=engine, nworkers=1, max_queued=0)
+
+        try:
+            source = gf.ExplosionSource(depth=5*km)
+            target = gf.Target(
+                north_shift=3*km, east_shift=2*km, store_id=self.store_id)
+            data = {'request': gf.Request(
+                sources=[source], targets=[target]).dump()}
+
+            url = ws.fillurl(ws.g_url, site, 'seismosizer', 1)
+
+            results = []
+            t = threading.Thread(
+                target=lambda: results.append(requests.post(url, data=data)))
+            t.start()
+
+            assert engine.started.wait(10.)
+
+            # the only worker is busy and no queueing is allowed
+            r = requests.post(url, data=data)
+            assert r.status_code == 503
+
+            engine.unblock.set()
+            t.join()
+            assert results[0].status_code == 200
+
+            # capacity is available again
+            r = requests.post(url, data=data)
+            assert r.status_code == 200
+
+        finally:
+            engine.unblock.set()
+            self.stop_server(s, t_ws)
+
+    def test_server_command(self):
+        superdir = tempfile.mkdtemp(prefix='pyrocko')
+        os.symlink(self.serve_dir, op.join(superdir, self.store_id))
+
+        with socket.socket() as sock:
+            sock.bind(('localhost', 0))
+            port = sock.getsockname()[1]
+
+        proc = subprocess.Popen([
+            sys.executable, '-c',
+            'from pyrocko.apps.fomosto import main; main()',
+            'server', '--ip=localhost', '--port=%i' % port,
+            '--nworkers=1', '--max-queued=0', superdir])
+
+        try:
+            site = 'http://localhost:%i' % port
+            url = ws.fillurl(ws.g_url, site, 'seismosizer', 1)
+            data = {'request': gf.Request(
+                sources=[gf.ExplosionSource(depth=5*km)],
+                targets=[gf.Target(
+                    north_shift=3*km, store_id=self.store_id)]).dump()}
+
+            tstart = time.time()
+            while True:
+                try:
+                    r = requests.post(url, data=data)
+                    break
+                except requests.ConnectionError:
+                    assert proc.poll() is None
+                    assert time.time() - tstart < 30.
+                    time.sleep(0.1)
+
+            assert r.status_code == 200
+
+        finally:
+            proc.terminate()
+            proc.wait(10.)
+            shutil.rmtree(superdir)
 
 
 if __name__ == '__main__':